@@ -21,14 +21,28 @@ const validateWebhookSecret = (req, res, next) => {
 // Webhook 接口，用于接收来自 Python 服务器的地锁状态更新
 router.post('/webhook/status-update', validateWebhookSecret, async (req, res) => {
   try {
-    const deviceStatus = req.body;
-    console.log('[Webhook] 收到地锁状态更新:', deviceStatus.serialNumber);
-    
+    // Python 端开启批量投递时请求体是心跳数组，否则是单个心跳对象
+    const deviceStatuses = Array.isArray(req.body) ? req.body : [req.body];
+    if (deviceStatuses.length === 1) {
+      console.log('[Webhook] 收到地锁状态更新:', deviceStatuses[0].serialNumber);
+    } else {
+      console.log(`[Webhook] 收到批量地锁状态更新: ${deviceStatuses.length} 条`);
+    }
+
     // 使用 setImmediate 异步处理，立即响应Webhook请求方
-    setImmediate(() => {
-      lockStatusSyncService.handleHeartbeatUpdate(deviceStatus).catch(err => {
-        console.error('[Webhook] 异步处理心跳更新失败:', err);
-      });
+    setImmediate(async () => {
+      for (const deviceStatus of deviceStatuses) {
+        // 离线事件（event: 'offline'）与心跳消息混在同一批次中
+        if (deviceStatus && deviceStatus.event === 'offline') {
+          await lockStatusSyncService.handleDeviceOffline(deviceStatus).catch(err => {
+            console.error('[Webhook] 异步处理离线事件失败:', err);
+          });
+          continue;
+        }
+        await lockStatusSyncService.handleHeartbeatUpdate(deviceStatus).catch(err => {
+          console.error('[Webhook] 异步处理心跳更新失败:', err);
+        });
+      }
     });
 
     res.status(202).json({ success: true, message: 'Accepted' });
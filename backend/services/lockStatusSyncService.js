@@ -77,6 +77,24 @@ class LockStatusSyncService {
     }
   }
 
+  /**
+   * 处理来自Webhook的设备离线事件（连接断开或心跳超时）
+   * 离线只影响地锁控制，不修改停车位占用状态，也不查询数据库，只记录日志；设备重新登录后会继续推送心跳
+   */
+  async handleDeviceOffline(event) {
+    try {
+      if (!event || !event.serialNumber) {
+        console.warn('[Webhook] 收到了无效的离线事件', event);
+        return;
+      }
+
+      const lastHeartbeat = event.lastHeartbeat ? new Date(event.lastHeartbeat * 1000).toISOString() : 'unknown';
+      console.warn(`[Webhook] 地锁 ${event.serialNumber} 离线 (${event.reason})，最后心跳 ${lastHeartbeat}`);
+    } catch (error) {
+      console.error(`[Webhook] 处理地锁 ${event && event.serialNumber} 离线事件失败:`, error);
+    }
+  }
+
   /**
    * 检查特定停车位的地锁状态
    */
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""REST API 负载测试：Flask 开发服务器与 aiohttp 异步 API 对比
+
+对每种 API 实现在子进程中启动车位锁服务器（默认 async 模式）和 API，用模拟器接入一批设备
+持续发送心跳作为背景流量，再用多个 HTTP/1.1 keep-alive 连接按固定比例并发请求:
+  device_status     GET  /api/device_status/<serial>
+  device_statuses   GET  /api/device_statuses
+  devices           GET  /api/devices
+  open_lock         POST /api/open_lock（wait=true，等待设备确认）
+统计固定时长内的每秒请求数和每种请求的 p50 / p99 延迟。日志和历史数据库写在临时目录中，
+Webhook 推送被关闭。负载生成器与被测进程共用 CPU，结果适合横向比较，不代表绝对容量。
+
+用法:
+    python benchmarks/bench_api.py [--api flask aiohttp] [--connections 32] [--devices 200] [--seconds 10]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 请求组合：(名称, 方法, 权重)
+REQUEST_MIX = (("device_status", "GET", 50), ("device_statuses", "GET", 10), ("devices", "GET", 20),
+               ("open_lock", "POST", 20))
+
+
+def serve(api, mode, lock_port, api_port):
+    """子进程入口：启动车位锁服务器和指定实现的 API"""
+    os.environ['LOCK_SERVER_MODE'] = mode
+    import logging
+    from parking_lock_logging import configure_logging
+    configure_logging("parking_lock_bench_api.log", level=logging.WARNING, force=True)
+    if api == "aiohttp":
+        from parking_lock_async_api import run
+        run('127.0.0.1', lock_port, '127.0.0.1', api_port)
+        return
+
+    import parking_lock_api
+    from parking_lock_server import create_lock_server
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # 不记录每个请求的访问日志
+    parking_lock_api.lock_server = create_lock_server('127.0.0.1', lock_port, mode)
+    if not parking_lock_api.lock_server.start():
+        sys.exit(1)
+    parking_lock_api.app.run(host='127.0.0.1', port=api_port, debug=False, threaded=True)
+
+
+async def request(reader, writer, method, path, body=None):
+    """发送一个请求并读取响应，返回 (状态码, 响应体, 服务器是否关闭连接)"""
+    data = json.dumps(body).encode() if body is not None else b""
+    head = f"{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Length: {len(data)}\r\n"
+    if body is not None:
+        head += "Content-Type: application/json\r\n"
+    writer.write(head.encode() + b"\r\n" + data)
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    length = 0
+    close = False
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode('latin-1').partition(":")
+        name = name.strip().lower()
+        if name == "content-length":
+            length = int(value)
+        elif name == "connection" and value.strip().lower() == "close":
+            close = True
+    payload = await reader.readexactly(length)
+    return int(status_line.split()[1]), payload, close
+
+
+async def client(port, serials, deadline, warmup_until, samples, errors, seed):
+    rng = random.Random(seed)
+    names = [name for name, _, weight in REQUEST_MIX for _ in range(weight)]
+    methods = {name: method for name, method, _ in REQUEST_MIX}
+    connection = None
+    while time.perf_counter() < deadline:
+        name = rng.choice(names)
+        serial = rng.choice(serials)
+        if name == "device_status":
+            path, body = f"/api/device_status/{serial}", None
+        elif name == "open_lock":
+            path, body = "/api/open_lock", {"deviceSerial": serial, "wait": True}
+        else:
+            path, body = f"/api/{name}", None
+        # Flask 开发服务器每个响应后都关闭连接，建立连接的时间计入该请求的延迟
+        started = time.perf_counter()
+        try:
+            if connection is None:
+                connection = await asyncio.open_connection('127.0.0.1', port)
+            status, payload, close = await request(*connection, methods[name], path, body)
+            ok = status == 200 and (name == "device_statuses" or json.loads(payload).get("success"))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            close, ok = True, False
+        if close and connection is not None:
+            connection[1].close()
+            connection = None
+        if started >= warmup_until:
+            samples.setdefault(name, []).append(time.perf_counter() - started)
+            if not ok:
+                errors[name] = errors.get(name, 0) + 1
+    if connection is not None:
+        connection[1].close()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def load(port, serials, connections, seconds, warmup):
+    samples, errors = {}, {}
+    warmup_until = time.perf_counter() + warmup
+    deadline = warmup_until + seconds
+    await asyncio.gather(*(client(port, serials, deadline, warmup_until, samples, errors, seed)
+                           for seed in range(connections)))
+    return samples, errors
+
+
+def wait_for_devices(port, count, timeout=60):
+    """等待模拟设备登录完成，返回已连接设备的序列号"""
+    import requests
+    deadline = time.time() + timeout
+    serials = []
+    while time.time() < deadline:
+        try:
+            devices = requests.get(f"http://127.0.0.1:{port}/api/devices", timeout=5).json().get("devices", [])
+            serials = [device["serial"] for device in devices]
+            if len(serials) >= count:
+                break
+        except (OSError, ValueError):
+            pass
+        time.sleep(0.5)
+    return serials
+
+
+def run_api(api, args, lock_port, api_port):
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve-child", api, "--mode", args.mode,
+                               "--lock-port", str(lock_port), "--api-port", str(api_port)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    simulator = None
+    try:
+        time.sleep(1)
+        simulator = subprocess.Popen([sys.executable, os.path.join(ROOT, "parking_lock_simulator.py"),
+                                      "--port", str(lock_port), "--devices", str(args.devices),
+                                      "--heartbeat-interval", str(args.heartbeat_interval),
+                                      "--action-time", "0", "--duration", str(args.seconds + 120)],
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        serials = wait_for_devices(api_port, args.devices)
+        if not serials:
+            raise RuntimeError(f"{api}: no devices connected, see parking_lock_bench_api.log")
+        time.sleep(args.heartbeat_interval)  # 等每台设备至少上报一次心跳，device_status 才有数据
+        samples, errors = asyncio.run(load(api_port, serials, args.connections, args.seconds, args.warmup))
+    finally:
+        for process in (simulator, server):
+            if process is not None:
+                process.terminate()
+                process.wait(timeout=30)
+
+    total = sum(len(values) for values in samples.values())
+    every = [value for values in samples.values() for value in values]
+    print(f"{api:<8} {total / args.seconds:8.0f} req/s  p50 {percentile(every, 0.5) * 1e3:7.2f} ms  "
+          f"p99 {percentile(every, 0.99) * 1e3:7.2f} ms  ({len(serials)} devices, {args.connections} connections)")
+    for name, _, _ in REQUEST_MIX:
+        values = samples.get(name, [])
+        if values:
+            print(f"  {name:<16}{len(values) / args.seconds:8.0f} req/s  p50 {percentile(values, 0.5) * 1e3:7.2f} ms  "
+                  f"p99 {percentile(values, 0.99) * 1e3:7.2f} ms  errors {errors.get(name, 0)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api", nargs="+", default=["flask", "aiohttp"], choices=("flask", "aiohttp"))
+    parser.add_argument("--mode", default="async", choices=("thread", "async", "cluster"), help="车位锁服务器模式")
+    parser.add_argument("--connections", type=int, default=32, help="并发 HTTP 连接数")
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--heartbeat-interval", type=float, default=5)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--lock-port", type=int, default=21457)
+    parser.add_argument("--api-port", type=int, default=25000)
+    parser.add_argument("--serve-child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    os.environ['NODE_WEBHOOK_URL'] = ''
+    os.chdir(tempfile.mkdtemp(prefix="lock-api-bench-"))  # 日志和心跳历史数据库放到临时目录
+    if args.serve_child:
+        serve(args.serve_child, args.mode, args.lock_port, args.api_port)
+        return
+
+    for offset, api in enumerate(args.api):
+        # 每种实现使用不同端口，避免上一轮的连接处于 TIME_WAIT
+        run_api(api, args, args.lock_port + offset, args.api_port + offset)
+
+
+if __name__ == "__main__":
+    main()
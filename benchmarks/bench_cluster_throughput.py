@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""多进程模式负载测试：心跳吞吐量随 worker 进程数的变化
+
+对每个 worker 数启动一个 ClusterLockServer（worker 为 async 模式），由多个
+客户端进程模拟设备：每个设备登录后连续发送心跳 (0x81) 并等待服务器应答，
+统计固定时长内服务器处理的心跳总数。服务器的 CRC 校验、解析、日志都计入成本，
+日志写在临时目录中。Webhook 推送被关闭，避免测到 Node 端。
+
+注意：吞吐量只能随 CPU 核数扩展，worker 数超过可用核数后不会再提升。
+
+用法:
+    python benchmarks/bench_cluster_throughput.py [--workers 1 2 4] [--clients 4] [--devices 200] [--seconds 5]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import struct
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ['NODE_WEBHOOK_URL'] = ''  # 在导入服务器模块之前关闭 Webhook，worker 进程继承该环境变量
+
+
+def heartbeat_payload(serial, flow):
+    return (serial + bytes([0, 0, 37, 20]) + struct.pack("<I", flow) + bytes([1, 120, 1, 2])
+            + struct.pack("<HIIIHH", 0, 50000, 45000, 55000, 100, 200) + b'\x00')
+
+
+async def read_frame(reader):
+    header = await reader.readexactly(4)
+    length = header[2] + (header[3] << 8)
+    return header + await reader.readexactly(length - 4)
+
+
+async def run_device(port, serial, deadline, counts):
+    from parking_lock_server import ParkingLockProtocol
+    for attempt in range(20):
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            break
+        except OSError:
+            await asyncio.sleep(0.05 * (attempt + 1))
+    else:
+        return
+
+    writer.write(bytes(ParkingLockProtocol.build_frame(0x80, serial)))
+    await read_frame(reader)
+    flow = 0
+    try:
+        while time.time() < deadline:
+            writer.write(bytes(ParkingLockProtocol.build_frame(0x81, heartbeat_payload(serial, flow))))
+            await read_frame(reader)
+            flow += 1
+    except (OSError, asyncio.IncompleteReadError):
+        pass
+    counts.append(flow)
+    writer.close()
+
+
+def client_main(index, port, devices, start_at, seconds, results):
+    """客户端进程入口：模拟一批设备持续发送心跳"""
+    async def run():
+        counts = []
+        while time.time() < start_at:
+            await asyncio.sleep(0.01)
+        deadline = start_at + seconds
+        await asyncio.gather(*(run_device(port, struct.pack("<Q", 0x2000000000 + index * 100000 + i), deadline, counts)
+                               for i in range(devices)))
+        return sum(counts)
+
+    results.put(asyncio.run(run()))
+
+
+def measure(workers, port, clients, devices, seconds):
+    import logging
+    from parking_lock_cluster import ClusterLockServer
+
+    logging.getLogger().setLevel(logging.WARNING)
+    server = ClusterLockServer('127.0.0.1', port, workers=workers, worker_mode='async')
+    if not server.start():
+        raise RuntimeError(f"Failed to start cluster with {workers} workers")
+
+    try:
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        start_at = time.time() + 2  # 等所有客户端进程就绪后同时开始
+        processes = [context.Process(target=client_main,
+                                     args=(i, port, devices // clients, start_at, seconds, results))
+                     for i in range(clients)]
+        for process in processes:
+            process.start()
+        # 运行中途统计各 worker 分到的设备数，检查 SO_REUSEPORT 的连接分布
+        time.sleep(max(0, start_at + seconds / 2 - time.time()))
+        per_worker = dict(server.broadcast("device_count"))
+        total = sum(results.get() for _ in processes)
+        for process in processes:
+            process.join()
+    finally:
+        server.stop()
+    return total / seconds, per_worker
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=4, help="负载生成进程数")
+    parser.add_argument("--devices", type=int, default=200, help="模拟设备总数")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--port", type=int, default=21457)
+    args = parser.parse_args()
+
+    # 服务器日志写到临时目录，spawn 出的 worker 进程继承工作目录
+    os.chdir(tempfile.mkdtemp(prefix="lock-cluster-bench-"))
+    print(f"{args.devices} devices from {args.clients} client processes, {args.seconds}s per run, "
+          f"{os.cpu_count()} CPUs, logs in {os.getcwd()}")
+    print(f"{'workers':<9}{'hb/s':>10}{'speedup':>9}  devices per worker")
+    baseline = None
+    for workers in args.workers:
+        rate, per_worker = measure(workers, args.port, args.clients, args.devices, args.seconds)
+        baseline = baseline or rate
+        distribution = " ".join(str(per_worker[index]) for index in sorted(per_worker))
+        print(f"{workers:<9}{rate:>10.0f}{rate / baseline:>8.2f}x  {distribution}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""连接引擎基准测试：对比 thread / async 模式在大量并发连接下的内存与延迟
+
+用法:
+    python benchmarks/bench_connections.py --connections 10000 --modes thread async
+
+服务器在子进程中运行，统计其 RSS 与线程数；客户端使用 asyncio 模拟设备，
+每个设备先登录 (0x80)，然后抽样发送重复登录帧测量请求-响应往返延迟。
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import struct
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def raise_fd_limit():
+    """提高文件描述符上限，10k 连接需要两端各 10k 个描述符"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+def serve(mode, port):
+    """子进程入口：启动服务器并等待标准输入关闭"""
+    import logging
+    raise_fd_limit()
+    from parking_lock_server import create_lock_server
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("ParkingLockServer").setLevel(logging.WARNING)
+
+    server = create_lock_server('127.0.0.1', port, mode)
+    if not server.start():
+        sys.exit(1)
+    print("READY", flush=True)
+    sys.stdin.read()
+    server.stop()
+
+
+def read_proc_status(pid):
+    """读取 /proc/<pid>/status 中的内存与线程信息"""
+    info = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmSize", "Threads"):
+                info[key] = int(value.split()[0])
+    return info
+
+
+def login_frame(serial):
+    from parking_lock_server import ParkingLockProtocol
+    return bytes(ParkingLockProtocol.build_frame(0x80, serial))
+
+
+async def read_frame(reader):
+    header = await reader.readexactly(4)
+    length = header[2] + (header[3] << 8)
+    return header + await reader.readexactly(length - 4)
+
+
+async def open_device(port, index, semaphore, retries):
+    serial = struct.pack("<Q", 0x1000000000 + index)
+    frame = login_frame(serial)
+    async with semaphore:
+        # 监听队列溢出时连接会被重置，像真实设备一样退避后重连
+        for attempt in range(20):
+            try:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                writer.write(frame)
+                await read_frame(reader)
+                return reader, writer, frame
+            except (ConnectionError, asyncio.IncompleteReadError):
+                retries[0] += 1
+                await asyncio.sleep(0.05 * (attempt + 1))
+    raise RuntimeError(f"device {index} failed to log in")
+
+
+async def run_clients(port, connections, samples, pid):
+    semaphore = asyncio.Semaphore(500)
+    retries = [0]
+    started = time.perf_counter()
+    devices = await asyncio.gather(*(open_device(port, i, semaphore, retries) for i in range(connections)))
+    connect_seconds = time.perf_counter() - started
+
+    # 等待服务器处理完登录后的日志/线程创建，再采集内存
+    await asyncio.sleep(1)
+    status = read_proc_status(pid)
+
+    # 抽样测量往返延迟（重复登录帧会得到一个时间戳响应）
+    step = max(1, connections // samples)
+    latencies = []
+    for reader, writer, frame in devices[::step][:samples]:
+        t0 = time.perf_counter()
+        writer.write(frame)
+        await read_frame(reader)
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+    for _, writer, _ in devices:
+        writer.close()
+    return connect_seconds, retries[0], status, sorted(latencies)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def bench_mode(mode, connections, samples, port):
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", mode, "--port", str(port)],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, cwd=ROOT)
+    try:
+        if proc.stdout.readline().strip() != "READY":
+            raise RuntimeError(f"{mode} server failed to start")
+        idle = read_proc_status(proc.pid)
+        connect_seconds, retries, status, latencies = asyncio.run(run_clients(port, connections, samples, proc.pid))
+    finally:
+        proc.stdin.close()
+        proc.wait(timeout=30)
+
+    return {
+        "mode": mode,
+        "connections": connections,
+        "connect_seconds": connect_seconds,
+        "reconnects": retries,
+        "idle_rss_mb": idle["VmRSS"] / 1024.0,
+        "rss_mb": status["VmRSS"] / 1024.0,
+        "vm_mb": status["VmSize"] / 1024.0,
+        "threads": status["Threads"],
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": latencies[-1] if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--samples", type=int, default=1000)
+    parser.add_argument("--modes", nargs="+", default=["thread", "async"])
+    parser.add_argument("--port", type=int, default=21457)
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port)
+        return
+
+    limit = raise_fd_limit()
+    if limit < args.connections + 100:
+        print(f"warning: RLIMIT_NOFILE={limit} is below the requested connection count", file=sys.stderr)
+
+    print(f"{'mode':<8}{'conns':>8}{'connect s':>11}{'retries':>9}{'idle MB':>10}{'RSS MB':>9}{'VM MB':>10}"
+          f"{'threads':>9}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for offset, mode in enumerate(args.modes):
+        r = bench_mode(mode, args.connections, args.samples, args.port + offset)
+        print(f"{r['mode']:<8}{r['connections']:>8}{r['connect_seconds']:>11.2f}{r['reconnects']:>9}"
+              f"{r['idle_rss_mb']:>10.1f}"
+              f"{r['rss_mb']:>9.1f}{r['vm_mb']:>10.0f}{r['threads']:>9}{r['p50_ms']:>9.2f}"
+              f"{r['p99_ms']:>9.2f}{r['max_ms']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""CRC16 基准测试：逐位实现 vs 查表实现 vs 批量校验
+
+分别测量单帧计算与 crc16_many 批量校验的吞吐。
+查表法与逐位实现的等价性由 tests/test_crc16.py 检查（python -m pytest tests）。
+
+用法:
+    python benchmarks/bench_crc16.py [--frames 10000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from parking_lock_server import ParkingLockProtocol
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=10000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    # 心跳帧: 9 字节帧结构 + 39 字节载荷
+    frames = [bytes(ParkingLockProtocol.build_frame(0x81, bytes(rng.getrandbits(8) for _ in range(39))))
+              for _ in range(args.frames)]
+    bodies = [f[:-3] for f in frames]
+
+    def bitwise():
+        for body in bodies:
+            ParkingLockProtocol.calculate_crc16_bitwise(body)
+
+    def table():
+        for body in bodies:
+            ParkingLockProtocol.calculate_crc16(body)
+
+    def batch():
+        ParkingLockProtocol.crc16_many(frames)
+
+    print(f"{'implementation':<16}{'frames/s':>14}{'us/frame':>11}{'speedup':>9}")
+    baseline = None
+    for name, fn in (("bitwise", bitwise), ("table", table), ("crc16_many", batch)):
+        seconds = min(timeit.repeat(fn, number=1, repeat=5))
+        rate = args.frames / seconds
+        baseline = baseline or rate
+        print(f"{name:<16}{rate:>14,.0f}{seconds / args.frames * 1e6:>11.2f}{rate / baseline:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
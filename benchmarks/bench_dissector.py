@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""协议分析工具（parking_lock_dissector.py）吞吐量与内存基准
+
+生成一个合成的以太网 pcap 抓包：一批设备各自建立 TCP 连接、登录，然后轮流发送心跳，
+服务器逐帧应答；按比例加入 TCP 重传和跨两个报文的帧，最后所有连接以 FIN 结束。
+用分析工具的生成器流水线（读取 -> 解码 -> 写时间线和心跳 CSV）处理，输出每秒处理的
+MB 数和帧数，以及处理前后的进程峰值 RSS。抓包大小翻倍时峰值 RSS 应基本不变。
+
+用法:
+    python benchmarks/bench_dissector.py [--megabytes 50] [--devices 500] [--keep capture.pcap]
+"""
+
+import argparse
+import os
+import random
+import resource
+import struct
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from parking_lock_logging import configure_logging
+configure_logging(os.path.join(tempfile.gettempdir(), "parking_lock_bench_dissector.log"))
+
+from parking_lock_server import ParkingLockProtocol
+import parking_lock_dissector as dissector
+
+SERVER = (bytes([10, 0, 0, 1]), 11457)
+ETHERNET = b'\x00\x00\x00\x00\x00\x01' + b'\x00\x00\x00\x00\x00\x02' + b'\x08\x00'
+
+
+def tcp_packet(source, destination, sequence, flags, data=b''):
+    """以太网 + IPv4 + TCP 报文（校验和不填，分析工具不检查）"""
+    tcp = struct.pack('>HHIIBBHHH', source[1], destination[1], sequence, 0, 5 << 4, flags, 65535, 0, 0) + data
+    ip = struct.pack('>BBHHHBBH4s4s', 0x45, 0, 20 + len(tcp), 0, 0x4000, 64, 6, 0, source[0], destination[0])
+    return ETHERNET + ip + tcp
+
+
+class CaptureWriter:
+    """按 TCP 序号写出设备连接的报文"""
+
+    def __init__(self, f, rng, retransmit_rate, split_rate):
+        self.f = f
+        self.rng = rng
+        self.retransmit_rate = retransmit_rate
+        self.split_rate = split_rate
+        self.ts = 1_700_000_000.0
+        self.sequences = {}
+        self.frames = 0
+        f.write(struct.pack('<IHHiIII', 0xA1B2C3D4, 2, 4, 0, 0, 65535, 1))
+
+    def packet(self, source, destination, flags, data=b'', sequence=None):
+        key = (source, destination)
+        if sequence is None:
+            sequence = self.sequences.get(key, 0)
+            self.sequences[key] = (sequence + len(data) + (1 if flags & 0x03 else 0)) & 0xFFFFFFFF
+        packet = tcp_packet(source, destination, sequence, flags, data)
+        seconds = int(self.ts)
+        self.f.write(struct.pack('<IIII', seconds, int((self.ts - seconds) * 1e6), len(packet), len(packet)))
+        self.f.write(packet)
+        return sequence
+
+    def send(self, source, destination, frame):
+        self.frames += 1
+        if self.rng.random() < self.split_rate:
+            cut = self.rng.randint(1, len(frame) - 1)
+            self.packet(source, destination, 0x18, frame[:cut])
+            self.packet(source, destination, 0x18, frame[cut:])
+            return
+        sequence = self.packet(source, destination, 0x18, frame)
+        if self.rng.random() < self.retransmit_rate:
+            self.packet(source, destination, 0x18, frame, sequence)
+
+    def open(self, device):
+        self.packet(device, SERVER, 0x02)
+        self.packet(SERVER, device, 0x12)
+
+    def close(self, device):
+        self.packet(device, SERVER, 0x11)
+        self.packet(SERVER, device, 0x11)
+
+
+def heartbeat_payload(rng, serial):
+    return (serial + bytes([0, 0, rng.randint(80, 100), rng.randint(15, 31)])
+            + struct.pack('<I', rng.getrandbits(32)) + bytes([1, 125, rng.choice((1, 2)), rng.choice((1, 2))])
+            + struct.pack('<HIIIHH', 0, 40000, 45000, 55000, 2500, 9800) + b'\x00')
+
+
+def write_capture(path, megabytes, devices, seed=1, retransmit_rate=0.01, split_rate=0.05):
+    """写出约 megabytes MB 的合成抓包，返回其中的设备帧数"""
+    rng = random.Random(seed)
+    endpoints = [(bytes([10, 1, index >> 8, index & 0xFF]), 40000 + index % 20000) for index in range(devices)]
+    serials = [struct.pack('<Q', 0x5000000000 + index) for index in range(devices)]
+    limit = megabytes * 1_000_000
+    with open(path, 'wb') as f:
+        writer = CaptureWriter(f, rng, retransmit_rate, split_rate)
+        for endpoint, serial in zip(endpoints, serials):
+            writer.open(endpoint)
+            writer.send(endpoint, SERVER, ParkingLockProtocol.build_frame(0x80, serial))
+            writer.send(SERVER, endpoint, ParkingLockProtocol.build_frame(0x80, struct.pack('<I', int(writer.ts))))
+        while f.tell() < limit:
+            for endpoint, serial in zip(endpoints, serials):
+                writer.ts += 0.01
+                writer.send(endpoint, SERVER, ParkingLockProtocol.build_frame(0x81, heartbeat_payload(rng, serial)))
+                writer.send(SERVER, endpoint, ParkingLockProtocol.build_frame(0x81, struct.pack('<I', int(writer.ts))))
+        for endpoint in endpoints:
+            writer.close(endpoint)
+    return writer.frames
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megabytes", type=float, default=50, help="合成抓包的大小（MB）")
+    parser.add_argument("--devices", type=int, default=500)
+    parser.add_argument("--keep", help="保留生成的抓包到该路径")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="lock-dissector-bench-")
+    capture = args.keep or os.path.join(directory, "capture.pcap")
+    started = time.perf_counter()
+    expected = write_capture(capture, args.megabytes, args.devices)
+    size = os.path.getsize(capture)
+    print(f"capture: {size / 1e6:.1f} MB, {expected} frames, {args.devices} devices "
+          f"(generated in {time.perf_counter() - started:.1f}s)")
+
+    rss_before = peak_rss_mb()
+    stats = dissector.DissectorStats()
+    started = time.perf_counter()
+    frames = dissector.write_frames(
+        dissector.decode_frames(dissector.read_segments(capture, stats=stats), stats),
+        os.path.join(directory, "frames.csv"), os.path.join(directory, "heartbeats.csv"))
+    for _ in frames:
+        pass
+    elapsed = time.perf_counter() - started
+    decoded = stats.counters.get("frames", 0)
+    print(f"dissect: {size / 1e6 / elapsed:.1f} MB/s, {decoded / elapsed:.0f} frames/s "
+          f"({decoded} frames, {stats.counters.get('tcp_retransmissions', 0)} retransmissions dropped)")
+    print(f"peak RSS: {rss_before:.1f} MB before, {peak_rss_mb():.1f} MB after")
+    if decoded != expected:
+        print(f"WARNING: decoded {decoded} frames, expected {expected}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
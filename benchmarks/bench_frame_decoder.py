@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""帧提取基准测试：ParkingLockServer.extract_frames vs FrameDecoder
+
+测量两种实现在不同分片方式下的解码吞吐 (MB/s)；随机分片/垃圾数据下的正确性由
+tests/test_frame_decoder.py 检查（python -m pytest tests）。
+
+两种实现都经 feed() 式的复制写入缓冲区（服务器实际使用 recv_into + commit，没有这次复制）。
+FrameDecoder 的收益在一次收到多帧（recv(1024)）时：已解析的数据不会被重复扫描，也不用
+每次删除缓冲区开头。按 1~64 字节分片或每次正好一帧时，每次调用的 Python 固定开销占主导，
+两者基本持平（在本机的波动范围内为 0.8x~1.2x）；当前帧不完整时 FrameDecoder 记下还需要的字节数，
+数据不足时直接返回，不再重新解析（分片输入中约 1/5 的片段因此跳过解析）。
+
+用法:
+    python benchmarks/bench_frame_decoder.py [--frames 20000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from parking_lock_server import ParkingLockProtocol, ParkingLockServer, FrameDecoder
+
+
+def random_frame(rng):
+    command = rng.choice((0x80, 0x81, 0x60, 0x87, 0x88, 0x89))
+    length = {0x80: 8, 0x81: 39, 0x60: 10}.get(command, 1)
+    return bytes(ParkingLockProtocol.build_frame(command, bytes(rng.getrandbits(8) for _ in range(length))))
+
+
+def random_chunks(rng, data):
+    """把数据随机切成 1~64 字节的片段，模拟 TCP 分片与粘包"""
+    pos = 0
+    while pos < len(data):
+        size = rng.randint(1, 64)
+        yield data[pos:pos + size]
+        pos += size
+
+
+def legacy_decode(chunks):
+    server = ParkingLockServer('127.0.0.1', 0)
+    buffer = bytearray()
+    count = 0
+    for chunk in chunks:
+        buffer.extend(chunk)
+        count += len(server.extract_frames(buffer))
+    return count
+
+
+def decoder_decode(chunks):
+    decoder = FrameDecoder()
+    count = 0
+    for chunk in chunks:
+        count += len(decoder.feed(chunk))
+    return count
+
+
+def measure(fn, chunks, total_bytes, repeat=3):
+    best = float("inf")
+    count = 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        count = fn(chunks)
+        best = min(best, time.perf_counter() - t0)
+    return total_bytes / best / 1e6, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    stream = b"".join(random_frame(rng) for _ in range(args.frames))
+    layouts = {
+        "recv(1024)": [stream[i:i + 1024] for i in range(0, len(stream), 1024)],
+        "fragmented": list(random_chunks(rng, stream)),
+        "per-frame": [],
+    }
+    pos = 0
+    while pos < len(stream):
+        length = stream[pos + 2] + (stream[pos + 3] << 8)
+        layouts["per-frame"].append(stream[pos:pos + length])
+        pos += length
+
+    print(f"{'layout':<12}{'extract_frames MB/s':>21}{'FrameDecoder MB/s':>19}{'speedup':>9}")
+    for name, chunks in layouts.items():
+        legacy_rate, legacy_count = measure(legacy_decode, chunks, len(stream))
+        decoder_rate, decoder_count = measure(decoder_decode, chunks, len(stream))
+        if decoder_count != args.frames:
+            sys.exit(f"{name}: FrameDecoder found {decoder_count} of {args.frames} frames")
+        print(f"{name:<12}{legacy_rate:>21.2f}{decoder_rate:>19.2f}{decoder_rate / legacy_rate:>8.1f}x"
+              + ("" if legacy_count == args.frames else f"  (extract_frames found {legacy_count})"))
+
+
+if __name__ == "__main__":
+    main()
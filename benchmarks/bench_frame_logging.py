@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""帧日志开销基准测试：同步逐帧完整解析 vs 队列写入 vs 队列 + 采样
+
+模拟 N 台设备轮流发送心跳，对每帧调用 log_frame（RECV + SEND 响应），
+测量调用线程（即设备 I/O 线程）上每帧花费的时间：
+  sync-full     接近原实现：FileHandler 同步写盘，每帧输出 FULL FRAME 和帧结构
+  queue-full    QueueHandler/QueueListener 写盘，每帧仍输出完整解析（白名单设备的情况）
+  queue-sampled QueueHandler/QueueListener 写盘，INFO 级别按设备/命令字采样（默认配置）
+日志写在临时目录中。
+
+注意：队列只是把写盘（以及磁盘卡顿）移出 I/O 线程，格式化仍在 QueueHandler 中完成，
+单核机器上监听线程与 I/O 线程争用 GIL，queue-full 不一定比 sync-full 快；
+主要的节省来自采样。
+
+用法:
+    python benchmarks/bench_frame_logging.py [--devices 1000] [--rounds 20]
+"""
+
+import argparse
+import logging
+import os
+import struct
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.chdir(tempfile.mkdtemp(prefix="lock-log-bench-"))  # 服务器模块导入时创建的日志文件也放到临时目录
+
+import parking_lock_server
+from parking_lock_server import ParkingLockProtocol
+from parking_lock_logging import configure_logging, stop_logging, FrameLogSampler, TEXT_FORMAT
+
+
+def build_frames(devices):
+    frames = []
+    for i in range(devices):
+        serial = struct.pack("<Q", 0x3000000000 + i)
+        payload = (serial + bytes([0, 0, 37, 20]) + struct.pack("<I", i) + bytes([1, 120, 1, 2])
+                   + struct.pack("<HIIIHH", 0, 50000, 45000, 55000, 100, 200) + b'\x00')
+        frames.append((serial, ParkingLockProtocol.build_frame(0x81, payload)))
+    response = ParkingLockProtocol.build_frame(0x81, struct.pack("<I", int(time.time())))
+    return frames, response
+
+
+def run(frames, response, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for serial, frame in frames:
+            ParkingLockProtocol.log_frame(frame, "RECV", serial=serial)
+            ParkingLockProtocol.log_frame(response, "SEND", "心跳响应", serial)
+    return (time.perf_counter() - start) / (rounds * len(frames))
+
+
+def measure(name, frames, response, rounds):
+    root = logging.getLogger()
+    serials = frozenset(serial for serial, _ in frames)
+    parking_lock_server.frame_sampler = FrameLogSampler()
+
+    if name == "sync-full":
+        stop_logging()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        handler = logging.FileHandler(f"{name}.log")
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+    else:
+        configure_logging(f"{name}.log", level=logging.INFO, force=True)
+    parking_lock_server.LOCK_LOG_SERIALS = serials if name != "queue-sampled" else frozenset()
+
+    per_frame = run(frames, response, rounds)
+    started = time.perf_counter()
+    stop_logging()  # 等待监听线程把队列写完
+    drain = time.perf_counter() - started
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    size = os.path.getsize(f"{name}.log")
+    return per_frame, drain, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    # 基准只关心写盘成本，控制台日志丢弃（StreamHandler 在配置时绑定 sys.stderr）
+    sys.stderr = open(os.devnull, "w")
+
+    frames, response = build_frames(args.devices)
+    print(f"{args.devices} devices x {args.rounds} heartbeats, logs in {os.getcwd()}")
+    print(f"{'mode':<15}{'us/frame':>10}{'drain s':>9}{'log MB':>9}")
+    baseline = None
+    for name in ("sync-full", "queue-full", "queue-sampled"):
+        per_frame, drain, size = measure(name, frames, response, args.rounds)
+        baseline = baseline or per_frame
+        print(f"{name:<15}{per_frame * 1e6:>10.1f}{drain:>9.2f}{size / 1e6:>9.1f}  ({baseline / per_frame:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""心跳存储内存基准测试：旧版 21 键字典 vs Heartbeat (__slots__) 记录
+
+分别保存 N 条心跳（默认 50000，对应 5 万台设备各保留最新一条），
+用 tracemalloc 统计占用内存，并测量解析耗时。
+
+用法:
+    python benchmarks/bench_heartbeat_memory.py [--count 50000]
+"""
+
+import argparse
+import gc
+import os
+import random
+import struct
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from parking_lock_server import ParkingLockProtocol, Heartbeat
+
+
+def random_payload(rng, index):
+    """构造 39 字节的真实心跳载荷"""
+    return (struct.pack("<Q", 0x1000000000 + index)
+            + bytes([rng.randint(0, 9), rng.randint(0, 1), rng.randint(30, 42), rng.randint(0, 31)])
+            + struct.pack("<I", rng.randint(0, 100000))
+            + bytes([1, rng.randint(110, 130), rng.choice((1, 2, 5)), rng.choice((1, 2))])
+            + struct.pack("<HIIIHH", rng.choice((0, 0, 0, 0x0041)), rng.randint(40000, 60000),
+                          45000, 55000, rng.randint(0, 10000), rng.randint(0, 10000))
+            + bytes([rng.choice((0, 0, 1, 2))]))
+
+
+def measure(build, payloads):
+    gc.collect()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    store = {i: build(p) for i, p in enumerate(payloads)}
+    elapsed = time.perf_counter() - t0
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return store, current, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=50000)
+    args = parser.parse_args()
+
+    rng = random.Random(3)
+    payloads = [random_payload(rng, i) for i in range(args.count)]
+
+    # to_dict() 产生的正是旧版 parse_heartbeat_data 返回的 21 键字典
+    legacy_store, legacy_bytes, legacy_seconds = measure(
+        lambda p: ParkingLockProtocol.parse_heartbeat_data(p).to_dict(), payloads)
+    slots_store, slots_bytes, slots_seconds = measure(ParkingLockProtocol.parse_heartbeat_data, payloads)
+
+    for i in range(0, args.count, max(1, args.count // 100)):
+        assert slots_store[i].to_dict() == legacy_store[i]
+    assert all(isinstance(hb, Heartbeat) for hb in slots_store.values())
+
+    print(f"{'format':<12}{'total MB':>10}{'bytes/hb':>10}{'parse us/hb':>13}")
+    for name, total, seconds in (("dict", legacy_bytes, legacy_seconds), ("Heartbeat", slots_bytes, slots_seconds)):
+        print(f"{name:<12}{total / 1e6:>10.1f}{total / args.count:>10.0f}{seconds / args.count * 1e6:>13.2f}")
+    print(f"memory saved: {(1 - slots_bytes / legacy_bytes) * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""心跳历史存储基准测试
+
+向临时数据库写入 N 台设备 D 天的心跳（间隔 I 秒，时间戳回填到过去），测量:
+  record        心跳处理线程上每次 record() 的耗时（只入队）
+  write         写线程的持续写入速度（心跳/秒，含 1 分钟 / 1 小时聚合）
+  query         单台设备 1 小时原始数据 / 1 天 1 分钟聚合 / 全部时间 1 小时聚合的查询耗时
+查询按 (序列号, 时间) 主键读取覆盖的分区，耗时应只与返回的点数有关，不随设备数和总数据量增长。
+
+用法:
+    python benchmarks/bench_history.py [--devices 200] [--days 2] [--interval 30]
+"""
+
+import argparse
+import os
+import struct
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.chdir(tempfile.mkdtemp(prefix="lock-history-bench-"))  # 数据库和服务器模块的日志文件都放到临时目录
+
+from parking_lock_server import ParkingLockProtocol
+from parking_lock_history import HeartbeatHistory, DAY
+
+
+def heartbeat(serial, i):
+    payload = (serial + bytes([0, 0, 30 + i % 60, 20]) + struct.pack("<I", i) + bytes([1, 100 + i % 40, 1, 2])
+               + struct.pack("<HIIIHH", 0, 45000 + i % 1000, 45000, 55000, 100, 200) + b'\x00')
+    return ParkingLockProtocol.parse_heartbeat_data(payload)
+
+
+def timed_query(history, serial, start, end, resolution, rounds=20):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        _, points = history.query(serial, start, end, resolution=resolution)
+    return (time.perf_counter() - started) / rounds, len(points)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--days", type=float, default=2)
+    parser.add_argument("--interval", type=int, default=30, help="心跳间隔（秒）")
+    args = parser.parse_args()
+
+    serials = [struct.pack("<Q", 0x6000000000 + i) for i in range(args.devices)]
+    heartbeats = [heartbeat(serial, i) for i, serial in enumerate(serials)]
+    history = HeartbeatHistory("bench_history.db", queue_size=1000000, batch_size=5000, flush_interval=0.5)
+    history.start()
+
+    now = time.time()
+    first = now - args.days * DAY
+    steps = int(args.days * DAY // args.interval)
+    total = steps * args.devices
+    print(f"{args.devices} devices x {steps} heartbeats = {total} rows, database in {os.getcwd()}")
+
+    started = time.perf_counter()
+    record_time = 0.0
+    for step in range(steps):
+        ts = first + step * args.interval
+        before = time.perf_counter()
+        for serial, data in zip(serials, heartbeats):
+            history.record(serial, data, ts)
+        record_time += time.perf_counter() - before
+        while history.queue.qsize() > 200000:  # 不让队列溢出，写入速度由写线程决定
+            time.sleep(0.05)
+    history.stop(timeout=600)
+    elapsed = time.perf_counter() - started
+    stats = history.get_stats()
+    print(f"record  {record_time / total * 1e6:8.2f} us/heartbeat on the calling thread")
+    print(f"write   {stats['written'] / elapsed:8.0f} heartbeats/s  ({stats['batches']} batches, "
+          f"{stats['dropped']} dropped, {os.path.getsize('bench_history.db') / 1e6:.1f} MB)")
+
+    serial = serials[args.devices // 2]
+    for label, start, resolution in (("1 h raw", now - 3600, "raw"), ("1 day 1m", now - DAY, "1m"),
+                                     ("all 1h", first, "1h")):
+        seconds, count = timed_query(history, serial, start, now, resolution)
+        print(f"query   {label:<10}{seconds * 1e3:8.2f} ms  {count} points")
+
+
+if __name__ == "__main__":
+    main()
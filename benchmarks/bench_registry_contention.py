@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""设备登记表锁竞争基准测试：全局字典 + 单锁 vs 分片 DeviceRegistry
+
+模拟大量设备的心跳处理线程按固定速率更新设备状态，同时有若干 API 线程
+不停轮询设备列表。旧版实现中两者都串行在同一把 device_lock 上，
+API 遍历列表期间所有心跳更新都被阻塞；DeviceRegistry 的心跳更新和
+列表读取都不加锁。统计心跳更新延迟、API 轮询次数和单次轮询延迟。
+
+用法:
+    python benchmarks/bench_registry_contention.py [--devices 5000] [--writers 32] [--readers 4] [--rate 20000] [--seconds 3]
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from parking_lock_registry import DeviceRegistry
+
+
+class GlobalLockRegistry:
+    """旧版实现：模块级 connected_devices 字典 + 单个 device_lock"""
+
+    def __init__(self):
+        self.devices = {}
+        self.lock = threading.Lock()
+
+    def register(self, serial, connection, address):
+        with self.lock:
+            self.devices[serial] = {
+                'socket': connection,
+                'address': address,
+                'login_time': time.time(),
+                'last_heartbeat': time.time()
+            }
+
+    def heartbeat(self, serial, hb):
+        with self.lock:
+            if serial in self.devices:
+                self.devices[serial]['last_heartbeat'] = time.time()
+                self.devices[serial]['last_heartbeat_data'] = hb
+
+    def list_devices(self):
+        with self.lock:
+            return [{'serial': serial, 'address': info['address'], 'last_heartbeat': info['last_heartbeat']}
+                    for serial, info in self.devices.items()]
+
+
+class ShardedRegistry:
+    """新版实现：DeviceRegistry，心跳直接写登记项属性，列表读取无锁快照"""
+
+    def __init__(self):
+        self.registry = DeviceRegistry()
+
+    def register(self, serial, connection, address):
+        self.registry.register(serial, connection, address)
+
+    def heartbeat(self, serial, hb):
+        entry = self.registry.get(serial)
+        if entry is not None:
+            entry.last_heartbeat = time.time()
+            entry.heartbeat = hb
+
+    def list_devices(self):
+        return [{'serial': entry.serial, 'address': entry.address, 'last_heartbeat': entry.last_heartbeat}
+                for entry in self.registry.snapshot()]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def run(impl, serials, writers, readers, seconds, rate):
+    for i, serial in enumerate(serials):
+        impl.register(serial, None, ('10.0.0.1', 10000 + i))
+
+    stop = threading.Event()
+    heartbeats = [[] for _ in range(writers)]
+    polls = [[] for _ in range(readers)]
+
+    def writer(index):
+        rng = random.Random(index)
+        latencies = heartbeats[index]
+        interval = writers / rate
+        next_beat = time.perf_counter()
+        while not stop.is_set():
+            serial = serials[rng.randrange(len(serials))]
+            t0 = time.perf_counter()
+            impl.heartbeat(serial, t0)
+            latencies.append(time.perf_counter() - t0)
+            # 按设定速率发送心跳，模拟真实设备而不是空转抢占 GIL
+            next_beat += interval
+            delay = next_beat - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def reader(index):
+        latencies = polls[index]
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            devices = impl.list_devices()
+            latencies.append(time.perf_counter() - t0)
+            assert len(devices) == len(serials)
+
+    threads = ([threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+               + [threading.Thread(target=reader, args=(i,)) for i in range(readers)])
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    hb_latencies = sorted(latency for per_writer in heartbeats for latency in per_writer)
+    poll_latencies = sorted(latency for per_reader in polls for latency in per_reader)
+    return {
+        "heartbeats_per_s": len(hb_latencies) / seconds,
+        "hb_p99_us": percentile(hb_latencies, 0.99) * 1e6,
+        "hb_max_ms": (hb_latencies[-1] if hb_latencies else 0) * 1000,
+        "polls_per_s": len(poll_latencies) / seconds,
+        "poll_p50_ms": percentile(poll_latencies, 0.5) * 1000,
+        "poll_p99_ms": percentile(poll_latencies, 0.99) * 1000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=5000)
+    parser.add_argument("--writers", type=int, default=32, help="心跳处理线程数")
+    parser.add_argument("--readers", type=int, default=4, help="API 轮询线程数")
+    parser.add_argument("--rate", type=float, default=20000, help="心跳总速率（次/秒）")
+    parser.add_argument("--seconds", type=float, default=3)
+    args = parser.parse_args()
+
+    serials = [(0x1000000000 + i).to_bytes(8, 'little') for i in range(args.devices)]
+
+    print(f"{args.devices} devices, {args.writers} heartbeat threads, {args.readers} API pollers, "
+          f"{args.rate:.0f} hb/s target, {args.seconds}s")
+    print(f"{'registry':<14}{'hb/s':>9}{'hb p99 us':>11}{'hb max ms':>11}"
+          f"{'polls/s':>9}{'poll p50 ms':>13}{'poll p99 ms':>13}")
+    for name, impl in (("global-lock", GlobalLockRegistry()), ("sharded", ShardedRegistry())):
+        result = run(impl, serials, args.writers, args.readers, args.seconds, args.rate)
+        print(f"{name:<14}{result['heartbeats_per_s']:>9.0f}{result['hb_p99_us']:>11.1f}{result['hb_max_ms']:>11.2f}"
+              f"{result['polls_per_s']:>9.0f}{result['poll_p50_ms']:>13.2f}{result['poll_p99_ms']:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""协议与网关热路径基准测试套件
+
+每个用例测量一个热路径函数的单次调用耗时（timeit 自动确定循环次数，
+重复多次取最小值作为结果，同时记录中位数），覆盖:
+  calculate_crc16 / parse_frame / build_frame / parse_heartbeat_data
+  心跳应答帧：逐帧 build_frame、同一秒内命中缓存、每次换秒（模板续算 CRC）
+  process_frame：心跳帧查命令字表、应答并解析（设备未登记）
+  extract_frames 与 FrameDecoder：一次收到多帧（拼接）和按小块分片接收
+  build_webhook_payload（send_heartbeat_to_webhook 的载荷构建 + JSON 编码）
+  /api/device_statuses 快照序列化：100 / 1k / 10k 台设备，全部设备与 1% 设备有新心跳后重新生成
+
+共享/虚拟机上整机速度会随时间漂移，每个用例前后各测一次固定的纯 Python 校准负载，
+比较时使用 用例耗时 / 校准耗时 的相对值，抵消整体快慢变化；疑似回退的用例会重新测量
+（--confirm 次，取最好结果），只有持续变慢才报告 REGRESSION。
+
+结果可保存为 JSON；指定基线文件时逐项比较，相对耗时超过基线 (1 + threshold) 倍的
+用例标记为 REGRESSION，并以退出码 1 结束，便于在合并前拦截性能回退。
+基线与解释器版本相关，换环境后请用 --save-baseline 重新生成。
+
+用法:
+    python benchmarks/run_suite.py                       # 运行并与 benchmarks/baseline.json 比较
+    python benchmarks/run_suite.py --output results.json # 另存本次结果
+    python benchmarks/run_suite.py --save-baseline       # 用本次结果覆盖基线
+    python benchmarks/run_suite.py -k status --repeat 3  # 只运行名称包含 status 的用例
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ['NODE_WEBHOOK_URL'] = ''
+
+# 服务器模块导入时会配置日志文件，先把日志指向临时目录
+from parking_lock_logging import configure_logging
+configure_logging(os.path.join(tempfile.gettempdir(), "parking_lock_bench_suite.log"))
+
+from parking_lock_server import (ParkingLockProtocol, ParkingLockServer, FrameDecoder, DeviceStatusCache,
+                                 ResponseFrameCache, DeviceConnection)
+from parking_lock_webhook import build_webhook_payload
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+STATUS_DEVICE_COUNTS = (100, 1000, 10000)
+
+
+def heartbeat_payload(rng, serial=None):
+    serial = serial or struct.pack("<Q", rng.getrandbits(48))
+    return (serial + bytes([0, 0, rng.randint(80, 100), rng.randint(15, 31)])
+            + struct.pack("<I", rng.getrandbits(32)) + bytes([1, 125, 1, 2])
+            + struct.pack("<HIIIHH", 0, 45000, 45000, 55000, 100, 9900) + b'\x00')
+
+
+def stream_of(frames):
+    return b''.join(bytes(frame) for frame in frames)
+
+
+def chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def build_cases():
+    """返回 {用例名: 无参可调用对象}，准备工作在这里完成，不计入耗时"""
+    rng = random.Random(2024)
+    payload = heartbeat_payload(rng)
+    frame = bytes(ParkingLockProtocol.build_frame(0x81, payload))
+    heartbeat = ParkingLockProtocol.parse_heartbeat_data(payload)
+
+    cases = {
+        "crc16_heartbeat_frame": lambda: ParkingLockProtocol.calculate_crc16(frame[:-3]),
+        "parse_frame_heartbeat": lambda: ParkingLockProtocol.parse_frame(frame),
+        "build_frame_heartbeat": lambda: ParkingLockProtocol.build_frame(0x81, payload),
+        "parse_heartbeat_data": lambda: ParkingLockProtocol.parse_heartbeat_data(payload),
+        "webhook_payload_json": lambda: json.dumps(build_webhook_payload(heartbeat, 1700000000.0)),
+    }
+
+    # 心跳应答帧：process_frame 原来的逐帧构建、同一秒内的缓存命中、每次都换秒的模板构建
+    responses = ResponseFrameCache()
+    seconds = iter(range(1700000000, 1 << 32))
+    cases.update({
+        "heartbeat_response_build_frame": lambda: bytes(ParkingLockProtocol.build_frame(
+            0x81, struct.pack("<I", int(time.time())))),
+        "heartbeat_response_cached": lambda: responses.timestamped(0x81, int(time.time())),
+        "heartbeat_response_new_second": lambda: responses.timestamped(0x81, next(seconds)),
+    })
+
+    # 帧提取：100 个心跳帧，一次收到全部（拼接）或按 7 字节分片收到
+    stream = stream_of(ParkingLockProtocol.build_frame(0x81, heartbeat_payload(rng)) for _ in range(100))
+    fragments = chunks(stream, 7)
+    server = ParkingLockServer('127.0.0.1', 0)
+
+    def extract_concatenated():
+        return server.extract_frames(bytearray(stream))
+
+    def extract_fragmented():
+        buffer = bytearray()
+        count = 0
+        for piece in fragments:
+            buffer.extend(piece)
+            count += len(server.extract_frames(buffer))
+        return count
+
+    def decoder_concatenated():
+        return FrameDecoder().feed(stream)
+
+    def decoder_fragmented():
+        decoder = FrameDecoder()
+        count = 0
+        for piece in fragments:
+            count += len(decoder.feed(piece))
+        return count
+
+    # 命令字分发：心跳帧经 process_frame 查表、应答（写队列丢弃数据）并解析心跳，设备未登记所以不存储
+    class NullOutbound:
+        degraded = False
+
+        def write(self, data):
+            return True
+
+    connection = DeviceConnection(None, ('10.0.0.1', 40000), NullOutbound())
+    parsed = ParkingLockProtocol.parse_frame(frame)
+    cases["process_frame_heartbeat"] = lambda: server.process_frame(parsed, connection)
+
+    cases.update({
+        "extract_frames_concatenated_100": extract_concatenated,
+        "extract_frames_fragmented_100": extract_fragmented,
+        "frame_decoder_concatenated_100": decoder_concatenated,
+        "frame_decoder_fragmented_100": decoder_fragmented,
+    })
+
+    # /api/device_statuses 快照：全部设备或 1% 设备有新心跳后重新生成响应体
+    for count in STATUS_DEVICE_COUNTS:
+        serials = [struct.pack("<Q", 0x4000000000 + i) for i in range(count)]
+        heartbeats = {serial: ParkingLockProtocol.parse_heartbeat_data(heartbeat_payload(rng, serial))
+                      for serial in serials}
+        address = ('10.0.0.1', 40000)
+        changed = serials[:max(1, count // 100)]
+
+        def filled_cache(serials=serials, heartbeats=heartbeats, address=address):
+            cache = DeviceStatusCache()
+            for serial in serials:
+                cache.update(serial, heartbeats[serial], address, 1700000000.0)
+            return cache
+
+        def snapshot_full(filled_cache=filled_cache):
+            return filled_cache().snapshot()
+
+        warm = filled_cache()
+        warm.snapshot()
+
+        def snapshot_incremental(cache=warm, changed=changed, heartbeats=heartbeats, address=address):
+            for serial in changed:
+                cache.update(serial, heartbeats[serial], address, 1700000000.0)
+            return cache.snapshot()
+
+        cases[f"device_statuses_all_changed_{count}"] = snapshot_full
+        cases[f"device_statuses_1pct_changed_{count}"] = snapshot_incremental
+
+    return cases
+
+
+def calibration():
+    """校准负载：固定的整数运算、字节索引和字典操作"""
+    data = bytes(range(256))
+    table = {}
+    total = 0
+    for i in range(256):
+        total = (total + data[i] * 31) ^ (i << 3)
+        table[i & 63] = total
+    return len(table)
+
+
+def measure(function, repeat):
+    """返回 (最小单次耗时, 中位单次耗时, 每轮循环次数)，单位秒"""
+    timer = timeit.Timer(function)
+    loops, _ = timer.autorange()
+    runs = [total / loops for total in timer.repeat(repeat=repeat, number=loops)]
+    return min(runs), statistics.median(runs), loops
+
+
+def run_case(function, repeat):
+    """测量一个用例，前后各测一次校准负载，relative 为用例耗时相对校准耗时的倍数"""
+    calibration_before = measure(calibration, 3)[0]
+    best, median, loops = measure(function, repeat)
+    reference = min(calibration_before, measure(calibration, 3)[0])
+    return {"best_ns": round(best * 1e9, 1), "median_ns": round(median * 1e9, 1), "loops": loops,
+            "relative": round(best / reference, 4)}
+
+
+def machine_info():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "cpus": os.cpu_count(),
+        "commit": commit
+    }
+
+
+def compare(results, baseline, threshold):
+    """与基线比较，返回 [(用例名, 比值, 状态)]；基线中没有的用例状态为 new"""
+    rows = []
+    for name, result in results.items():
+        reference = baseline.get("results", {}).get(name)
+        if reference is None:
+            rows.append((name, None, "new"))
+            continue
+        ratio = result["relative"] / reference["relative"]
+        if ratio > 1 + threshold:
+            status = "REGRESSION"
+        elif ratio < 1 / (1 + threshold):
+            status = "faster"
+        else:
+            status = "ok"
+        rows.append((name, ratio, status))
+    return rows
+
+
+def format_ns(value):
+    if value >= 1e6:
+        return f"{value / 1e6:.2f} ms"
+    if value >= 1e3:
+        return f"{value / 1e3:.2f} us"
+    return f"{value:.0f} ns"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", dest="keyword", help="只运行名称包含该字符串的用例")
+    parser.add_argument("--repeat", type=int, default=5, help="每个用例的重复轮数")
+    parser.add_argument("--output", help="把本次结果保存为 JSON")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基线 JSON 文件")
+    parser.add_argument("--save-baseline", action="store_true", help="用本次结果覆盖基线文件")
+    parser.add_argument("--threshold", type=float, default=0.25, help="允许的相对变慢比例")
+    parser.add_argument("--confirm", type=int, default=2, help="疑似回退的用例最多重新测量的次数")
+    args = parser.parse_args()
+
+    cases = build_cases()
+    if args.keyword:
+        cases = {name: function for name, function in cases.items() if args.keyword in name}
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = {name: run_case(function, args.repeat) for name, function in cases.items()}
+    rows = compare(results, baseline, args.threshold) if baseline else [(name, None, "") for name in results]
+
+    # 疑似回退的用例重新测量，保留最好的一次
+    for _ in range(args.confirm):
+        suspects = [name for name, _, status in rows if status == "REGRESSION"]
+        if not suspects:
+            break
+        for name in suspects:
+            result = run_case(cases[name], args.repeat)
+            if result["relative"] < results[name]["relative"]:
+                results[name] = result
+        rows = compare(results, baseline, args.threshold)
+
+    report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "machine": machine_info(), "results": results}
+
+    print(f"{'benchmark':<34}{'best':>12}{'median':>12}{'vs baseline':>13}  status")
+    for name, ratio, status in rows:
+        result = results[name]
+        ratio_text = f"{ratio:.2f}x" if ratio is not None else "-"
+        print(f"{name:<34}{format_ns(result['best_ns']):>12}{format_ns(result['median_ns']):>12}"
+              f"{ratio_text:>13}  {status}")
+
+    if baseline:
+        reference = baseline.get("machine", {})
+        current = report["machine"]
+        if any(reference.get(key) != current[key] for key in ("python", "machine", "cpus")):
+            print(f"warning: baseline was recorded on a different machine/interpreter: {reference}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"baseline saved to {args.baseline}")
+
+    regressions = [name for name, _, status in rows if status == "REGRESSION"]
+    if regressions:
+        print(f"{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -30,6 +30,11 @@ module.exports = {
     autorestart: true,
     watch: false,
     max_memory_restart: '128M',
+    env: {
+      // 单事件循环复用所有设备连接，避免每连接一个线程撑爆内存上限
+      LOCK_SERVER_MODE: 'async'
+      // 在 venv 中安装 aiohttp 后可加 LOCK_API_SERVER: 'aiohttp'，API 与设备连接共用同一个事件循环
+    },
     error_file: './logs/lock-api-err.log',
     out_file: './logs/lock-api-out.log',
     log_date_format: 'YYYY-MM-DD HH:mm:ss'
@@ -1,29 +1,171 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
 import json
+import time
 import binascii
 import logging
-from flask import Flask, request, jsonify
-from parking_lock_server import ParkingLockServer
-
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("parking_lock_api.log"),
-        logging.StreamHandler()
-    ]
-)
+from datetime import datetime
+from flask import Flask, Response, request, jsonify
+from parking_lock_server import create_lock_server
+from parking_lock_commands import COMMAND_TIMEOUT, BATCH_MAX_SIZE
+from parking_lock_opcodes import OPCODES
+from parking_lock_logging import configure_logging
+from parking_lock_metrics import metrics, render_metrics
+from parking_lock_events import EVENT_TYPES, stream_events
+
+# 配置日志（若服务器模块已先配置则沿用其配置）
+configure_logging("parking_lock_api.log")
 logger = logging.getLogger("ParkingLockAPI")
 
+# API 服务实现：flask（默认，每请求一个线程）或 aiohttp（需要另行安装 aiohttp，与异步模式服务器共用事件循环）
+LOCK_API_SERVER = os.environ.get('LOCK_API_SERVER', 'flask')
+
 # 创建Flask应用
 app = Flask(__name__)
 
 # 车位锁服务器实例
 lock_server = None
 
+# 设置锁状态命令的状态名
+STATE_NAMES = {0: "normal", 1: "hold open", 2: "hold close"}
+
+def device_status_response(hb):
+    """构建 /api/device_status 的响应数据（Flask 与异步 API 共用）"""
+    return {
+        "success": True,
+        "serialNumber": binascii.hexlify(hb['serial_number']).decode('utf-8'),
+        "deviceStatus": {
+            "code": hb['device_status'],
+            "description": hb['device_status_description']
+        },
+        "carStatus": {
+            "code": hb['car_status'],
+            "description": hb['car_status_description']
+        },
+        "controlStatus": {
+            "code": hb['control_status'],
+            "description": hb['control_status_description']
+        },
+        "battery": {
+            "3.7v": hb['battery_3_7v'],
+            "12v": hb['battery_12v']
+        },
+        "signalStrength": hb['signal_strength'],
+        "flowNumber": hb['flow_number'],
+        "error": {
+            "code": hb['error_code'],
+            "descriptions": hb.get('error_descriptions', []),
+            "hasError": hb['error_code'] > 0
+        },
+        "groundSensor": {
+            "currentFrequency": hb['current_frequency'],
+            "noCarBase": hb['no_car_base'],
+            "carBase": hb['car_base'],
+            "carRatio": hb['car_ratio'],
+            "noCarRatio": hb['no_car_ratio']
+        },
+        "waterDetection": {
+            "code": hb['water_detection'],
+            "description": "有水" if hb['water_detection'] == 1 else "无水"
+        },
+        "stale": bool(hb.get('stale'))
+    }
+
+def command_response(result, sent_message, failed_message):
+    """由命令结果构建单设备命令接口的响应数据"""
+    if result["status"] == "queued":
+        message = "Device not connected, command queued until it logs in"
+    elif result["success"]:
+        message = sent_message
+    elif result["status"] in ("not_connected", "send_failed"):
+        message = failed_message
+    else:
+        # 命令已发出，但设备拒绝、超时或断开
+        message = f"{sent_message}, but device result is {result['status']}"
+    response = {"message": message}
+    response.update(result)
+    return response
+
+def parse_batch_commands(items):
+    """解析批量命令请求，返回 (逐条结果, [(序列号, 命令字, 状态参数)], 对应的请求下标)；无效条目直接填入结果"""
+    results = [None] * len(items)
+    commands = []
+    positions = []
+    for index, item in enumerate(items):
+        device_serial_hex = item.get('deviceSerial', '')
+        # 批量命令中的命令名为命令字表中的 api_name（与单设备接口同名）
+        opcode = OPCODES.named(item.get('command'))
+        command = opcode.code if opcode is not None else None
+        state = (item.get('args') or {}).get('state', 0) if opcode is not None and 'state' in opcode.fields else None
+        try:
+            device_serial = binascii.unhexlify(device_serial_hex)
+        except (binascii.Error, TypeError):
+            device_serial = None
+        if command is None or not device_serial:
+            results[index] = {"success": False, "status": "invalid",
+                              "message": f"Invalid command {item.get('command')!r} or device serial"}
+        else:
+            commands.append((device_serial, command, state))
+            positions.append(index)
+    return results, commands, positions
+
+def batch_response(items, results):
+    """构建批量命令的汇总响应"""
+    for item, result in zip(items, results):
+        result["deviceSerial"] = item.get('deviceSerial', '')
+    succeeded = sum(1 for result in results if result["success"])
+    queued = sum(1 for result in results if result.get("queued"))
+    return {
+        "success": succeeded == len(results),
+        "message": f"{succeeded}/{len(results)} commands succeeded" + (f", {queued} queued" if queued else ""),
+        "total": len(results),
+        "succeeded": succeeded,
+        "queued": queued,
+        "failed": len(results) - succeeded - queued,
+        "results": results
+    }
+
+def parse_event_filters(args):
+    """解析 /api/events 的 serials / types 查询参数，未知事件类型抛出 ValueError"""
+    serials = [bytes(binascii.unhexlify(serial.strip()))
+               for serial in args.get('serials', '').split(',') if serial.strip()]
+    types = [event_type.strip() for event_type in args.get('types', '').split(',') if event_type.strip()]
+    unknown = [event_type for event_type in types if event_type not in EVENT_TYPES]
+    if unknown:
+        raise ValueError(f"Unknown event types: {', '.join(unknown)}")
+    return serials or None, types or None
+
+def parse_time(value, default):
+    """解析查询参数中的时间：Unix 时间戳（秒）或 ISO 8601 字符串（不带时区时按本地时间）"""
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def parse_history_query(args):
+    """解析 /api/device_history 的查询参数，返回 (起始时间, 结束时间, 字段列表或 None, 精度)"""
+    end = parse_time(args.get('to'), time.time())
+    start = parse_time(args.get('from'), end - 3600)
+    if start > end:
+        raise ValueError("'from' must not be later than 'to'")
+    fields = [field.strip() for field in args.get('fields', '').split(',') if field.strip()]
+    return start, end, fields or None, args.get('resolution', 'auto')
+
+def history_response(device_serial_hex, start, end, resolution, points):
+    return {
+        "success": True,
+        "deviceSerial": device_serial_hex,
+        "from": start,
+        "to": end,
+        "resolution": resolution,
+        "count": len(points),
+        "points": points
+    }
+
 @app.route('/api/status', methods=['GET'])
 def get_status():
     """获取服务器状态"""
@@ -58,47 +200,7 @@ def get_device_status(device_serial_hex):
         hb = lock_server.get_device_status(device_serial)
         
         if hb:
-            # 构建响应数据
-            status_response = {
-                "success": True,
-                "serialNumber": binascii.hexlify(hb['serial_number']).decode('utf-8'),
-                "deviceStatus": {
-                    "code": hb['device_status'],
-                    "description": hb['device_status_description']
-                },
-                "carStatus": {
-                    "code": hb['car_status'],
-                    "description": hb['car_status_description']
-                },
-                "controlStatus": {
-                    "code": hb['control_status'],
-                    "description": hb['control_status_description']
-                },
-                "battery": {
-                    "3.7v": hb['battery_3_7v'],
-                    "12v": hb['battery_12v']
-                },
-                "signalStrength": hb['signal_strength'],
-                "flowNumber": hb['flow_number'],
-                "error": {
-                    "code": hb['error_code'],
-                    "descriptions": hb.get('error_descriptions', []),
-                    "hasError": hb['error_code'] > 0
-                },
-                "groundSensor": {
-                    "currentFrequency": hb['current_frequency'],
-                    "noCarBase": hb['no_car_base'],
-                    "carBase": hb['car_base'],
-                    "carRatio": hb['car_ratio'],
-                    "noCarRatio": hb['no_car_ratio']
-                },
-                "waterDetection": {
-                    "code": hb['water_detection'],
-                    "description": "有水" if hb['water_detection'] == 1 else "无水"
-                }
-            }
-            
-            return jsonify(status_response)
+            return jsonify(device_status_response(hb))
         else:
             return jsonify({
                 "success": False, 
@@ -108,71 +210,153 @@ def get_device_status(device_serial_hex):
         logger.error(f"Error in get_device_status: {e}")
         return jsonify({"success": False, "message": str(e)})
 
+@app.route('/api/events', methods=['GET'])
+def get_events():
+    """设备事件推送流（Server-Sent Events）
+    
+    事件类型: login / logout / car_status（0x60 车状态改变）/ heartbeat（心跳中变化的字段）。
+    查询参数 serials 为逗号分隔的设备序列号（十六进制），types 为逗号分隔的事件类型，缺省表示全部。
+    客户端处理不过来时事件会被丢弃，并收到 overflow 事件，此时应重新拉取 /api/device_statuses。
+    """
+    global lock_server
+    if not lock_server or not lock_server.is_running:
+        return jsonify({"success": False, "message": "Server not running"})
+    
+    try:
+        serials, types = parse_event_filters(request.args)
+        subscription = lock_server.subscribe_events(serials, types)
+    except Exception as e:
+        logger.error(f"Error in get_events: {e}")
+        return jsonify({"success": False, "message": str(e)})
+    
+    response = Response(stream_events(subscription, lock_server.unsubscribe_events), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # 经 nginx 代理时不缓冲
+    return response
+
+@app.route('/api/offline_devices', methods=['GET'])
+def get_offline_devices():
+    """获取离线设备列表（连接断开或存活检测超时后尚未重新登录的设备），最近离线的在前"""
+    global lock_server
+    if not lock_server or not lock_server.is_running:
+        return jsonify({"success": False, "message": "Server not running"})
+    
+    try:
+        devices = lock_server.get_offline_devices()
+        return jsonify({"success": True, "deviceCount": len(devices), "devices": devices})
+    except Exception as e:
+        logger.error(f"Error in get_offline_devices: {e}")
+        return jsonify({"success": False, "message": str(e)})
+
+@app.route('/api/outbox', methods=['GET'])
+def get_outbox():
+    """获取发件箱中等待设备登录后补发的命令（按入队顺序），查询参数 serial 可按设备过滤"""
+    global lock_server
+    if not lock_server or not lock_server.is_running:
+        return jsonify({"success": False, "message": "Server not running"})
+    
+    try:
+        serial = request.args.get('serial')
+        commands = lock_server.get_outbox(bytes(binascii.unhexlify(serial)) if serial else None)
+        return jsonify({"success": True, "count": len(commands), "commands": commands})
+    except Exception as e:
+        logger.error(f"Error in get_outbox: {e}")
+        return jsonify({"success": False, "message": str(e)})
+
+@app.route('/api/device_history/<device_serial_hex>', methods=['GET'])
+def get_device_history(device_serial_hex):
+    """获取设备心跳历史
+    
+    查询参数 from / to 为时间戳或 ISO 8601 时间（默认最近 1 小时），fields 为逗号分隔的字段名，
+    resolution 为 raw / 1m / 1h（默认按时间跨度自动选择：6 小时内原始数据，7 天内 1 分钟聚合，更长 1 小时聚合）。
+    """
+    global lock_server
+    if not lock_server or not lock_server.is_running:
+        return jsonify({"success": False, "message": "Server not running"})
+    
+    try:
+        device_serial = bytes(binascii.unhexlify(device_serial_hex))
+        start, end, fields, resolution = parse_history_query(request.args)
+        resolution, points = lock_server.get_device_history(device_serial, start, end, fields, resolution)
+        return jsonify(history_response(device_serial_hex, start, end, resolution, points))
+    except Exception as e:
+        logger.error(f"Error in get_device_history: {e}")
+        return jsonify({"success": False, "message": str(e)})
+
 @app.route('/api/device_statuses', methods=['GET'])
 def get_all_device_statuses():
-    """获取所有设备的详细状态信息"""
+    """获取所有设备的详细状态信息
+    
+    响应直接由服务器维护的快照缓存拼装，支持 ETag / If-None-Match：
+    设备状态没有变化时返回 304，不做任何加锁或逐设备处理。
+    """
     global lock_server
     if not lock_server or not lock_server.is_running:
         return jsonify({"success": False, "message": "Server not running"})
     
     try:
-        # 获取所有设备状态
-        device_status_list = lock_server.get_all_device_statuses()
-        
-        device_statuses = []
-        for hb in device_status_list:
-            # 构建设备状态对象
-            status = {
-                "serialNumber": binascii.hexlify(hb['serial_number']).decode('utf-8'),
-                "deviceStatus": {
-                    "code": hb['device_status'],
-                    "description": hb['device_status_description']
-                },
-                "carStatus": {
-                    "code": hb['car_status'],
-                    "description": hb['car_status_description']
-                },
-                "controlStatus": {
-                    "code": hb['control_status'],
-                    "description": hb['control_status_description']
-                },
-                "battery": {
-                    "3.7v": hb['battery_3_7v'],
-                    "12v": hb['battery_12v']
-                },
-                "signalStrength": hb['signal_strength'],
-                "flowNumber": hb['flow_number'],
-                "error": {
-                    "code": hb['error_code'],
-                    "descriptions": hb.get('error_descriptions', []),
-                    "hasError": hb['error_code'] > 0
-                },
-                "groundSensor": {
-                    "currentFrequency": hb['current_frequency'],
-                    "noCarBase": hb['no_car_base'],
-                    "carBase": hb['car_base'],
-                    "carRatio": hb['car_ratio'],
-                    "noCarRatio": hb['no_car_ratio']
-                },
-                "waterDetection": {
-                    "code": hb['water_detection'],
-                    "description": "有水" if hb['water_detection'] == 1 else "无水"
-                },
-                "lastHeartbeat": hb.get("last_heartbeat"),
-                "address": f"{hb['address'][0]}:{hb['address'][1]}" if 'address' in hb else "unknown"
-            }
-            
-            device_statuses.append(status)
+        etag = lock_server.get_status_etag()
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
         
-        return jsonify({
-            "success": True,
-            "deviceCount": len(device_statuses),
-            "devices": device_statuses
-        })
+        etag, body = lock_server.get_status_snapshot()
+        response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        return response
     except Exception as e:
         logger.error(f"Error in get_all_device_statuses: {e}")
         return jsonify({"success": False, "message": str(e)})
 
+@app.route('/api/webhook_stats', methods=['GET'])
+def get_webhook_stats():
+    """获取 Webhook 投递队列统计（队列深度、丢弃数、失败数等）"""
+    global lock_server
+    if not lock_server or not lock_server.is_running:
+        return jsonify({"success": False, "message": "Server not running"})
+    
+    return jsonify({"success": True, "stats": lock_server.get_webhook_stats()})
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus 文本格式的指标（帧数、解析错误、处理耗时、Webhook 与命令延迟、连接数、锁争用等）"""
+    global lock_server
+    if lock_server and lock_server.is_running:
+        families = lock_server.get_metrics()
+    else:
+        # 服务器未运行时只输出进程内已注册的指标
+        families = metrics.collect()
+    if request.args.get('format') == 'json':
+        # 原始指标族（直方图为各桶计数），供模拟器等工具计算增量和分位数
+        return jsonify(families)
+    return Response(render_metrics(families), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+def execute_lock_command(data, command, sent_message, failed_message, state=None):
+    """执行远程命令并构建响应
+    
+    请求体中 wait 为 true 时等待设备响应，最多 timeout 秒（默认 LOCK_COMMAND_TIMEOUT），
+    响应中的 status 表示设备是否确认/完成；否则发送成功即返回 status 为 sent。
+    设备未连接时返回 not_connected；请求中 ttl 为正数（或 LOCK_OUTBOX_TTL 设为正数）时命令进入发件箱，
+    返回 success 为 false、queued 为 true、status 为 queued，设备登录后补发。
+    """
+    device_serial = binascii.unhexlify(data.get('deviceSerial', ''))
+    wait = bool(data.get('wait', False))
+    timeout = data.get('timeout', COMMAND_TIMEOUT)
+    
+    result = lock_server.execute_command(device_serial, command, state, wait=wait, timeout=timeout,
+                                         ttl=data.get('ttl'))
+    return jsonify(command_response(result, sent_message, failed_message))
+
+@app.route('/api/command_stats', methods=['GET'])
+def get_command_stats():
+    """获取远程命令结果统计（确认、完成、超时、待响应数等）"""
+    global lock_server
+    if not lock_server or not lock_server.is_running:
+        return jsonify({"success": False, "message": "Server not running"})
+    
+    return jsonify({"success": True, "stats": lock_server.get_command_stats()})
+
 @app.route('/api/open_lock', methods=['POST'])
 def open_lock():
     """远程开锁"""
@@ -182,14 +366,7 @@ def open_lock():
     
     try:
         data = request.get_json()
-        device_serial_hex = data.get('deviceSerial', '')
-        device_serial = binascii.unhexlify(device_serial_hex)
-        
-        result = lock_server.remote_open_lock(device_serial)
-        return jsonify({
-            "success": result,
-            "message": "Open lock command sent" if result else "Failed to send open lock command"
-        })
+        return execute_lock_command(data, 0x70, "Open lock command sent", "Failed to send open lock command")
     except Exception as e:
         logger.error(f"Error in open_lock: {e}")
         return jsonify({"success": False, "message": str(e)})
@@ -203,14 +380,7 @@ def close_lock():
     
     try:
         data = request.get_json()
-        device_serial_hex = data.get('deviceSerial', '')
-        device_serial = binascii.unhexlify(device_serial_hex)
-        
-        result = lock_server.remote_close_lock(device_serial)
-        return jsonify({
-            "success": result,
-            "message": "Close lock command sent" if result else "Failed to send close lock command"
-        })
+        return execute_lock_command(data, 0x71, "Close lock command sent", "Failed to send close lock command")
     except Exception as e:
         logger.error(f"Error in close_lock: {e}")
         return jsonify({"success": False, "message": str(e)})
@@ -224,18 +394,11 @@ def set_state():
     
     try:
         data = request.get_json()
-        device_serial_hex = data.get('deviceSerial', '')
         state = data.get('state', 0)
-        device_serial = binascii.unhexlify(device_serial_hex)
+        state_name = STATE_NAMES.get(state, "unknown")
         
-        result = lock_server.set_lock_state(device_serial, state)
-        states = {0: "normal", 1: "hold open", 2: "hold close"}
-        state_name = states.get(state, "unknown")
-        
-        return jsonify({
-            "success": result,
-            "message": f"Set {state_name} state command sent" if result else f"Failed to send {state_name} state command"
-        })
+        return execute_lock_command(data, 0x8E, f"Set {state_name} state command sent",
+                                    f"Failed to send {state_name} state command", state)
     except Exception as e:
         logger.error(f"Error in set_state: {e}")
         return jsonify({"success": False, "message": str(e)})
@@ -249,14 +412,7 @@ def restart_device():
     
     try:
         data = request.get_json()
-        device_serial_hex = data.get('deviceSerial', '')
-        device_serial = binascii.unhexlify(device_serial_hex)
-        
-        result = lock_server.remote_restart(device_serial)
-        return jsonify({
-            "success": result,
-            "message": "Restart command sent" if result else "Failed to send restart command"
-        })
+        return execute_lock_command(data, 0x8F, "Restart command sent", "Failed to send restart command")
     except Exception as e:
         logger.error(f"Error in restart_device: {e}")
         return jsonify({"success": False, "message": str(e)})
@@ -270,18 +426,41 @@ def sync_time():
     
     try:
         data = request.get_json()
-        device_serial_hex = data.get('deviceSerial', '')
-        device_serial = binascii.unhexlify(device_serial_hex)
-        
-        result = lock_server.sync_time(device_serial)
-        return jsonify({
-            "success": result,
-            "message": "Sync time command sent" if result else "Failed to send sync time command"
-        })
+        return execute_lock_command(data, 0x86, "Sync time command sent", "Failed to send sync time command")
     except Exception as e:
         logger.error(f"Error in sync_time: {e}")
         return jsonify({"success": False, "message": str(e)})
 
+@app.route('/api/batch_commands', methods=['POST'])
+def batch_commands():
+    """批量发送远程命令
+    
+    请求体: {"commands": [{"deviceSerial": "...", "command": "open_lock", "args": {"state": 1}}, ...],
+            "wait": false, "timeout": 5, "ttl": 60}
+    所有帧一次构建、按连接并发写出并限速，返回汇总结果和逐条结果（与请求顺序一致）。
+    """
+    global lock_server
+    if not lock_server or not lock_server.is_running:
+        return jsonify({"success": False, "message": "Server not running"})
+    
+    try:
+        data = request.get_json()
+        items = data.get('commands') or []
+        if len(items) > BATCH_MAX_SIZE:
+            return jsonify({"success": False, "message": f"Too many commands in batch (max {BATCH_MAX_SIZE})"})
+        
+        results, commands, positions = parse_batch_commands(items)
+        if commands:
+            outcomes = lock_server.execute_batch(commands, wait=bool(data.get('wait', False)),
+                                                 timeout=data.get('timeout', COMMAND_TIMEOUT), ttl=data.get('ttl'))
+            for index, outcome in zip(positions, outcomes):
+                results[index] = outcome
+        
+        return jsonify(batch_response(items, results))
+    except Exception as e:
+        logger.error(f"Error in batch_commands: {e}")
+        return jsonify({"success": False, "message": str(e)})
+
 @app.route('/api/start_server', methods=['POST'])
 def start_server():
     """启动车位锁服务器"""
@@ -291,11 +470,12 @@ def start_server():
         data = request.get_json()
         host = data.get('host', '0.0.0.0')
         port = data.get('port', 11457)
+        mode = data.get('mode')  # thread / async / cluster，默认使用 LOCK_SERVER_MODE
         
         if lock_server and lock_server.is_running:
             return jsonify({"success": False, "message": "Server already running"})
         
-        lock_server = ParkingLockServer(host, port)
+        lock_server = create_lock_server(host, port, mode)
         success = lock_server.start()
         
         return jsonify({
@@ -332,9 +512,24 @@ def main():
     API_HOST = '0.0.0.0'  # 监听所有网络接口
     API_PORT = 5000  # API服务端口
     
+    if LOCK_API_SERVER == 'aiohttp':
+        try:
+            from parking_lock_async_api import run
+        except ImportError as e:
+            # 明确选择了 aiohttp 却没有安装时直接退出，不静默换成未经验证的 Flask + 异步服务器组合
+            logger.error(f"LOCK_API_SERVER=aiohttp but aiohttp is not installed ({e}); "
+                         "install it (pip install aiohttp) or unset LOCK_API_SERVER to use Flask")
+            raise SystemExit(1)
+        # 车位锁服务器与 API 运行在同一个事件循环上
+        run(HOST, PORT, API_HOST, API_PORT)
+        return
+    if LOCK_API_SERVER != 'flask':
+        logger.error(f"Unknown LOCK_API_SERVER: {LOCK_API_SERVER}")
+        raise SystemExit(1)
+    
     # 创建并启动车位锁服务器
     global lock_server
-    lock_server = ParkingLockServer(HOST, PORT)
+    lock_server = create_lock_server(HOST, PORT)
     if lock_server.start():
         logger.info(f"Parking lock server started on {HOST}:{PORT}")
     else:
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import signal
+import asyncio
+import binascii
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from parking_lock_server import create_lock_server
+from parking_lock_async_server import AsyncParkingLockServer
+from parking_lock_commands import COMMAND_TIMEOUT, BATCH_MAX_SIZE
+from parking_lock_metrics import metrics, render_metrics
+from parking_lock_events import stream_events_async
+from parking_lock_api import (STATE_NAMES, device_status_response, command_response, parse_batch_commands,
+                              batch_response, parse_event_filters, parse_history_query, history_response)
+
+logger = logging.getLogger("ParkingLockAPI")
+
+# 处理阻塞调用（历史查询、批量命令、线程/多进程模式的服务器方法）的线程数
+LOCK_API_EXECUTOR_THREADS = int(os.environ.get('LOCK_API_EXECUTOR_THREADS', '16'))
+
+NOT_RUNNING = {"success": False, "message": "Server not running"}
+
+LOCK_SERVER = web.AppKey("lock_server", object)
+
+
+def shares_loop(server):
+    """服务器是否运行在当前事件循环上（由 start_async 启动的异步模式服务器）"""
+    return isinstance(server, AsyncParkingLockServer) and server.loop is asyncio.get_running_loop()
+
+
+async def call_server(server, function, *args):
+    """调用服务器方法：共用事件循环时直接调用（读内存状态，不跨线程），否则放到线程池中执行"""
+    if shares_loop(server):
+        return function(*args)
+    return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+
+def running_server(request):
+    server = request.app[LOCK_SERVER]
+    if server and server.is_running:
+        return server
+    return None
+
+
+def json_error(name, e):
+    logger.error(f"Error in {name}: {e}")
+    return web.json_response({"success": False, "message": str(e)})
+
+
+async def get_status(request):
+    """获取服务器状态"""
+    return web.json_response({"status": "running" if running_server(request) else "stopped"})
+
+
+async def get_devices(request):
+    """获取连接的设备列表"""
+    server = running_server(request)
+    if not server:
+        return web.json_response(NOT_RUNNING)
+    devices = await call_server(server, server.get_connected_devices)
+    return web.json_response({"success": True, "devices": devices})
+
+
+async def get_device_status(request):
+    """获取设备的详细状态信息"""
+    server = running_server(request)
+    if not server:
+        return web.json_response(NOT_RUNNING)
+
+    device_serial_hex = request.match_info['device_serial_hex']
+    try:
+        device_serial = bytes(binascii.unhexlify(device_serial_hex))
+        hb = await call_server(server, server.get_device_status, device_serial)
+        if hb:
+            return web.json_response(device_status_response(hb))
+        return web.json_response({
+            "success": False,
+            "message": f"No heartbeat data available for device {device_serial_hex}"
+        })
+    except Exception as e:
+        return json_error("get_device_status", e)
+
+
+async def get_events(request):
+    """设备事件推送流（Server-Sent Events），参数与事件格式同 Flask 版本"""
+    server = running_server(request)
+    if not server:
+        return web.json_response(NOT_RUNNING)
+
+    try:
+        serials, types = parse_event_filters(request.query)
+        subscription = await call_server(server, server.subscribe_events, serials, types)
+    except Exception as e:
+        return json_error("get_events", e)
+
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # 经 nginx 代理时不缓冲
+    })
+    try:
+        await response.prepare(request)
+        async for chunk in stream_events_async(subscription):
+            await response.write(chunk)
+    except ConnectionResetError:
+        pass  # 客户端断开
+    finally:
+        await call_server(server, server.unsubscribe_events, subscription)
+    return response
+
+
+async def get_offline_devices(request):
+    """获取离线设备列表，最近离线的在前"""
+    server = running_server(request)
+    if not server:
+        return web.json_response(NOT_RUNNING)
+
+    try:
+        devices = await call_server(server, server.get_offline_devices)
+        return web.json_response({"success": True, "deviceCount": len(devices), "devices": devices})
+    except Exception as e:
+        return json_error("get_offline_devices", e)
+
+
+async def get_outbox(request):
+    """获取发件箱中等待设备登录后补发的命令（SQLite 查询在线程池中执行）"""
+    server = running_server(request)
+    if not server:
+        return web.json_response(NOT_RUNNING)
+
+    try:
+        serial = request.query.get('serial')
+        commands = await asyncio.get_running_loop().run_in_executor(
+            None, server.get_outbox, bytes(binascii.unhexlify(serial)) if serial else None)
+        return web.json_response({"success": True, "count": len(commands), "commands": commands})
+    except Exception as e:
+        return json_error("get_outbox", e)
+
+
+async def get_device_history(request):
+    """获取设备心跳历史（SQLite 查询在线程池中执行）"""
+    server = running_server(request)
+    if not server:
+        return web.json_response(NOT_RUNNING)
+
+    device_serial_hex = request.match_info['device_serial_hex']
+    try:
+        device_serial = bytes(binascii.unhexlify(device_serial_hex))
+        start, end, fields, resolution = parse_history_query(request.query)
+        resolution, points = await asyncio.get_running_loop().run_in_executor(
+            None, server.get_device_history, device_serial, start, end, fields, resolution)
+        return web.json_response(history_response(device_serial_hex, start, end, resolution, points))
+    except Exception as e:
+        return json_error("get_device_history", e)
+
+
+async def get_all_device_statuses(request):
+    """获取所有设备的详细状态信息，支持 ETag / If-None-Match"""
+    server = running_server(request)
+    if not server:
+        return web.json_response(NOT_RUNNING)
+
+    try:
+        etag = await call_server(server, server.get_status_etag)
+        if any(tag.value in (etag, "*") for tag in request.if_none_match or ()):
+            response = web.Response(status=304)
+            response.etag = etag
+            return response
+
+        etag, body = await call_server(server, server.get_status_snapshot)
+        response = web.Response(body=body, content_type='application/json')
+        response.etag = etag
+        return response
+    except Exception as e:
+        return json_error("get_all_device_statuses", e)
+
+
+async def get_webhook_stats(request):
+    """获取 Webhook 投递队列统计"""
+    server = running_server(request)
+    if not server:
+        return web.json_response(NOT_RUNNING)
+    stats = await call_server(server, server.get_webhook_stats)
+    return web.json_response({"success": True, "stats": stats})
+
+
+async def get_command_stats(request):
+    """获取远程命令结果统计"""
+    server = running_server(request)
+    if not server:
+        return web.json_response(NOT_RUNNING)
+    stats = await call_server(server, server.get_command_stats)
+    return web.json_response({"success": True, "stats": stats})
+
+
+async def get_metrics(request):
+    """Prometheus 文本格式的指标；format=json 时返回原始指标族"""
+    server = running_server(request)
+    if server:
+        families = await call_server(server, server.get_metrics)
+    else:
+        families = metrics.collect()
+    if request.query.get('format') == 'json':
+        return web.json_response(families)
+    return web.Response(text=render_metrics(families),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def execute_lock_command(server, data, command, sent_message, failed_message, state=None):
+    """执行远程命令并构建响应
+
+    共用事件循环时帧直接写入设备 Transport，wait=true 时 await 设备响应，不占用线程；
+    其他模式下在线程池中调用 execute_command。
+    """
+    device_serial = binascii.unhexlify(data.get('deviceSerial', ''))
+    wait = bool(data.get('wait', False))
+    timeout = data.get('timeout', COMMAND_TIMEOUT)
+    ttl = data.get('ttl')
+
+    if shares_loop(server):
+        result = await server.execute_command_async(device_serial, command, state, wait=wait, timeout=timeout,
+                                                    ttl=ttl)
+    else:
+        result = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: server.execute_command(device_serial, command, state, wait=wait, timeout=timeout, ttl=ttl))
+    return web.json_response(command_response(result, sent_message, failed_message))
+
+
+def lock_command_handler(name, command, action):
+    """生成单设备命令接口（open_lock / close_lock / restart_device / sync_time）"""
+    async def handler(request):
+        server = running_server(request)
+        if not server:
+            return web.json_response(NOT_RUNNING)
+        try:
+            data = await request.json()
+            return await execute_lock_command(server, data, command, f"{action} command sent",
+                                              f"Failed to send {action.lower()} command")
+        except Exception as e:
+            return json_error(name, e)
+    return handler
+
+
+async def set_state(request):
+    """设置锁状态（0:正常, 1:保持开, 2:保持关）"""
+    server = running_server(request)
+    if not server:
+        return web.json_response(NOT_RUNNING)
+
+    try:
+        data = await request.json()
+        state = data.get('state', 0)
+        state_name = STATE_NAMES.get(state, "unknown")
+        return await execute_lock_command(server, data, 0x8E, f"Set {state_name} state command sent",
+                                          f"Failed to send {state_name} state command", state)
+    except Exception as e:
+        return json_error("set_state", e)
+
+
+async def batch_commands(request):
+    """批量发送远程命令，请求体与响应同 Flask 版本（execute_batch 会等待写出，在线程池中执行）"""
+    server = running_server(request)
+    if not server:
+        return web.json_response(NOT_RUNNING)
+
+    try:
+        data = await request.json()
+        items = data.get('commands') or []
+        if len(items) > BATCH_MAX_SIZE:
+            return web.json_response({"success": False,
+                                      "message": f"Too many commands in batch (max {BATCH_MAX_SIZE})"})
+
+        results, commands, positions = parse_batch_commands(items)
+        if commands:
+            wait = bool(data.get('wait', False))
+            timeout = data.get('timeout', COMMAND_TIMEOUT)
+            ttl = data.get('ttl')
+            outcomes = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: server.execute_batch(commands, wait=wait, timeout=timeout, ttl=ttl))
+            for index, outcome in zip(positions, outcomes):
+                results[index] = outcome
+
+        return web.json_response(batch_response(items, results))
+    except Exception as e:
+        return json_error("batch_commands", e)
+
+
+async def start_lock_server(server):
+    """启动服务器：异步模式在当前事件循环上启动，其他模式在线程池中调用 start()"""
+    if isinstance(server, AsyncParkingLockServer):
+        return await server.start_async()
+    return await asyncio.get_running_loop().run_in_executor(None, server.start)
+
+
+async def stop_lock_server(server):
+    if shares_loop(server):
+        await server.stop_async()
+    else:
+        await asyncio.get_running_loop().run_in_executor(None, server.stop)
+
+
+async def start_server(request):
+    """启动车位锁服务器"""
+    try:
+        data = await request.json()
+        host = data.get('host', '0.0.0.0')
+        port = data.get('port', 11457)
+        mode = data.get('mode')  # thread / async / cluster，默认使用 LOCK_SERVER_MODE
+
+        if running_server(request):
+            return web.json_response({"success": False, "message": "Server already running"})
+
+        server = create_lock_server(host, port, mode)
+        request.app[LOCK_SERVER] = server
+        success = await start_lock_server(server)
+
+        return web.json_response({
+            "success": success,
+            "message": "Server started successfully" if success else "Failed to start server"
+        })
+    except Exception as e:
+        return json_error("start_server", e)
+
+
+async def stop_server(request):
+    """停止车位锁服务器"""
+    server = running_server(request)
+    if not server:
+        return web.json_response(NOT_RUNNING)
+
+    try:
+        await stop_lock_server(server)
+        return web.json_response({"success": True, "message": "Server stopped successfully"})
+    except Exception as e:
+        return json_error("stop_server", e)
+
+
+def create_app(lock_server=None):
+    """创建异步 API 应用，路由和 JSON 格式与 parking_lock_api.py（Flask）一致
+
+    lock_server 为已启动的服务器实例（可选）；与异步模式服务器共用事件循环时，
+    状态接口直接读取内存状态，命令接口直接写设备连接，不经过线程切换。
+    """
+    app = web.Application()
+    app[LOCK_SERVER] = lock_server
+    app.router.add_get('/api/status', get_status)
+    app.router.add_get('/api/devices', get_devices)
+    app.router.add_get('/api/device_status/{device_serial_hex}', get_device_status)
+    app.router.add_get('/api/events', get_events)
+    app.router.add_get('/api/offline_devices', get_offline_devices)
+    app.router.add_get('/api/outbox', get_outbox)
+    app.router.add_get('/api/device_history/{device_serial_hex}', get_device_history)
+    app.router.add_get('/api/device_statuses', get_all_device_statuses)
+    app.router.add_get('/api/webhook_stats', get_webhook_stats)
+    app.router.add_get('/metrics', get_metrics)
+    app.router.add_get('/api/command_stats', get_command_stats)
+    app.router.add_post('/api/open_lock', lock_command_handler("open_lock", 0x70, "Open lock"))
+    app.router.add_post('/api/close_lock', lock_command_handler("close_lock", 0x71, "Close lock"))
+    app.router.add_post('/api/set_state', set_state)
+    app.router.add_post('/api/restart_device', lock_command_handler("restart_device", 0x8F, "Restart"))
+    app.router.add_post('/api/sync_time', lock_command_handler("sync_time", 0x86, "Sync time"))
+    app.router.add_post('/api/batch_commands', batch_commands)
+    app.router.add_post('/api/start_server', start_server)
+    app.router.add_post('/api/stop_server', stop_server)
+
+    async def cleanup(app):
+        server = app[LOCK_SERVER]
+        if server and server.is_running:
+            await stop_lock_server(server)
+
+    app.on_cleanup.append(cleanup)
+    return app
+
+
+async def serve(host, port, api_host, api_port):
+    """在同一个事件循环上运行车位锁服务器和 API，直到收到 SIGTERM 或被取消"""
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(LOCK_API_EXECUTOR_THREADS, thread_name_prefix="api"))
+    stopping = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stopping.set)
+
+    lock_server = create_lock_server(host, port)
+    if await start_lock_server(lock_server):
+        logger.info(f"Parking lock server started on {host}:{port}")
+    else:
+        logger.error("Failed to start parking lock server")
+
+    runner = web.AppRunner(create_app(lock_server), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, api_host, api_port)
+    await site.start()
+    logger.info(f"Async API listening on {api_host}:{api_port}")
+    try:
+        await stopping.wait()
+    finally:
+        await runner.cleanup()
+
+
+def run(host, port, api_host, api_port):
+    """运行异步 API（阻塞直到 Ctrl+C / SIGTERM）"""
+    try:
+        asyncio.run(serve(host, port, api_host, api_port))
+    except KeyboardInterrupt:
+        pass
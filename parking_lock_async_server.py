@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import binascii
+import functools
+import threading
+import logging
+
+from parking_lock_server import ParkingLockServer, DeviceConnection, CONNECTIONS_ACCEPTED
+from parking_lock_liveness import configure_keepalive
+from parking_lock_outbound import OutboundQueue, WRITE_FRAMES
+from parking_lock_commands import unsent_result, COMMAND_TIMEOUT, COMMAND_MAX_TIMEOUT
+
+logger = logging.getLogger("ParkingLockServer")
+
+
+class TransportSocket(OutboundQueue):
+    """把 asyncio Transport 包装成设备连接的写队列
+
+    DeviceConnection 持有的是这个对象，因此 process_frame、
+    send_command_to_device 等方法无需区分线程模式和异步模式。
+    Transport 自身缓冲写不完的数据，在连接可写时由事件循环写出；高/低水位设置在 Transport 上，
+    由 pause_writing / resume_writing 通知。来自其他线程（例如 API 请求线程）的帧先放入队列，
+    每批只投递一次回调到事件循环，由它合并成一次写入。
+    """
+
+    def __init__(self, server, transport):
+        super().__init__(transport.get_extra_info('peername'))
+        self.server = server
+        self.loop = server.loop
+        self.transport = transport
+        transport.set_write_buffer_limits(high=self.high_water, low=self.low_water)
+        self.lock = threading.Lock()
+        self.frames = []        # 其他线程写入、等待事件循环写出的帧
+        self.frames_size = 0
+
+    def _in_loop_thread(self):
+        return self.server.loop_thread_id == threading.get_ident()
+
+    def pending(self):
+        return self.transport.get_write_buffer_size() + self.frames_size
+
+    def _schedule(self, delay, callback, *args):
+        return self.loop.call_later(delay, callback, *args)
+
+    def write(self, data):
+        """写入一帧或多帧；返回是否接受，连接已关闭时抛出 ConnectionError"""
+        if self.transport.is_closing():
+            raise ConnectionError("Transport is closing")
+        with self.lock:
+            if not self._admit(len(data)):
+                return False
+            self.accepted += len(data)
+            if self._in_loop_thread() and not self.frames:
+                self.transport.write(data)
+                WRITE_FRAMES.observe(1)
+                if self.transport.get_write_buffer_size():
+                    self._watch_stall()
+                return True
+            # 复制一份数据，避免调用方之后修改缓冲区；已有待写出的帧时只追加，不重复投递回调
+            self.frames.append(bytes(data))
+            self.frames_size += len(data)
+            if len(self.frames) > 1:
+                return True
+        self.loop.call_soon_threadsafe(self._write_frames)
+        return True
+
+    def _write_frames(self):
+        """事件循环中执行：把其他线程写入的帧合并成一次写入"""
+        with self.lock:
+            frames, self.frames = self.frames, []
+            self.frames_size = 0
+        if self.transport.is_closing() or not frames:
+            return
+        self.transport.write(frames[0] if len(frames) == 1 else b''.join(frames))
+        WRITE_FRAMES.observe(len(frames))
+        if self.transport.get_write_buffer_size():
+            self._watch_stall()
+
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+        self._recovered()
+
+    def close(self):
+        """关闭连接（连接断开时也会调用，停止写出进展检测）"""
+        self.closed = True
+        if self._in_loop_thread():
+            self._close()
+        else:
+            self.loop.call_soon_threadsafe(self._close)
+
+    def _close(self):
+        self._cancel_stall()
+        self.transport.close()
+
+
+class DeviceProtocol(asyncio.BufferedProtocol):
+    """单个设备连接的协议处理器
+
+    使用 BufferedProtocol，事件循环直接把数据读入 FrameDecoder 的缓冲区。
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.connection = None
+
+    def connection_made(self, transport):
+        address = transport.get_extra_info('peername')
+        configure_keepalive(transport.get_extra_info('socket'))
+        self.connection = DeviceConnection(TransportSocket(self.server, transport), address)
+        self.server.connections.add(self.connection)
+        self.server.liveness.watch(self.connection)
+        logger.info(f"New connection from {address}")
+        CONNECTIONS_ACCEPTED.inc()
+
+    def get_buffer(self, sizehint):
+        return self.connection.decoder.get_buffer(max(sizehint, 1024))
+
+    def buffer_updated(self, nbytes):
+        try:
+            for frame in self.connection.decoder.commit(nbytes):
+                self.server.handle_frame(frame, self.connection)
+        except Exception as e:
+            logger.error(f"Error handling client {self.connection.address}: {e}")
+            self.connection.close()
+
+    def pause_writing(self):
+        self.connection.sock.pause_writing()
+
+    def resume_writing(self):
+        self.connection.sock.resume_writing()
+
+    def connection_lost(self, exc):
+        self.connection.sock.close()
+        self.server.connections.discard(self.connection)
+        self.server.handle_disconnect(self.connection)
+
+
+class AsyncParkingLockServer(ParkingLockServer):
+    """基于 asyncio 的车位锁控制服务器
+
+    所有设备连接在一个事件循环线程中复用，不再为每个连接创建线程。
+    公共方法（remote_open_lock、get_all_device_statuses 等）与线程模式一致。
+    start() 创建自己的事件循环线程；start_async() 则在调用方的事件循环上运行，
+    供异步 API（parking_lock_async_api.py）与设备连接共用同一个事件循环。
+    """
+
+    # 登录风暴时大量设备会同时重连，需要比线程模式更大的监听队列
+    BACKLOG = 1024
+
+    def __init__(self, host, port):
+        """初始化服务器"""
+        super().__init__(host, port)
+        self.loop = None
+        self.loop_thread = None
+        self.loop_thread_id = None
+
+    def start(self):
+        """启动服务器"""
+        started = threading.Event()
+        result = {"success": False}
+
+        def run_loop():
+            self.loop_thread_id = threading.get_ident()
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            try:
+                self.server_socket = self.loop.run_until_complete(self.create_server())
+                self.is_running = True
+                self.start_services()
+                result["success"] = True
+                logger.info(f"Async server started on {self.host}:{self.port}")
+            except Exception as e:
+                logger.error(f"Failed to start server: {e}")
+                started.set()
+                self.loop.close()
+                return
+
+            started.set()
+            try:
+                self.loop.run_forever()
+            finally:
+                self.loop.close()
+
+        self.loop_thread = threading.Thread(target=run_loop)
+        self.loop_thread.daemon = True
+        self.loop_thread.start()
+        started.wait()
+        return result["success"]
+
+    def create_server(self):
+        return self.loop.create_server(lambda: DeviceProtocol(self), self.host, self.port,
+                                       reuse_address=True, reuse_port=self.reuse_port or None,
+                                       backlog=self.BACKLOG)
+
+    async def start_async(self):
+        """在当前运行的事件循环上启动服务器（不创建线程）"""
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        try:
+            self.server_socket = await self.create_server()
+        except Exception as e:
+            logger.error(f"Failed to start server: {e}")
+            return False
+        self.is_running = True
+        self.start_services()
+        logger.info(f"Async server started on {self.host}:{self.port} (shared event loop)")
+        return True
+
+    async def stop_async(self):
+        """在事件循环上停止由 start_async 启动的服务器"""
+        self.is_running = False
+        self.server_socket.close()
+        # 关闭连接会移除设备登记，先写出登记表快照
+        await self.loop.run_in_executor(None, self.snapshot.stop)
+        for connection in list(self.connections):
+            connection.close()
+        await asyncio.sleep(0)  # 让 connection_lost 回调先清理设备记录
+        # 停止后台线程需要 join，放到线程池中执行，不阻塞事件循环
+        await self.loop.run_in_executor(None, self.stop_services)
+        logger.info("Server stopped")
+
+    def flush_outbox(self, device_serial):
+        """在事件循环上调用时（设备登录），补发交给发件箱线程执行，不在事件循环上等待 SQLite"""
+        if not self.outbox.has_pending(device_serial):
+            return
+        if self.loop_thread_id == threading.get_ident():
+            self.outbox.executor.submit(self._replay_outbox, device_serial)
+        else:
+            self.replay_outbox(device_serial)
+
+    def _replay_outbox(self, device_serial):
+        try:
+            self.replay_outbox(device_serial)
+        except Exception as e:
+            logger.error(f"Error replaying queued commands to device {binascii.hexlify(device_serial)}: {e}")
+
+    async def queue_command_async(self, device_serial, command, state=None, ttl=None, timeout=COMMAND_TIMEOUT,
+                                  wait=False):
+        """queue_command 的协程版本：入队在发件箱线程中执行"""
+        if self.outbox.executor is None:
+            return None
+        return await self.loop.run_in_executor(self.outbox.executor, functools.partial(
+            self.queue_command, device_serial, command, state, ttl, timeout, wait))
+
+    async def execute_command_async(self, device_serial, command, state=None, wait=False, timeout=COMMAND_TIMEOUT,
+                                    ttl=None):
+        """execute_command 的协程版本，必须在服务器的事件循环上调用
+
+        帧直接写入设备连接的 Transport；wait=True 时 await 命令的 future，不占用线程。
+        等待超时不能取消命令的 future（它由 CommandTracker 完成），因此用 shield 包装。
+        """
+        timeout = min(max(float(timeout), 0.1), COMMAND_MAX_TIMEOUT)
+        pending = self.submit_command(device_serial, command, state, timeout)
+        if pending is None:
+            queued = await self.queue_command_async(device_serial, command, state, ttl, timeout, wait)
+            if queued is None:
+                logger.error(f"Device {binascii.hexlify(device_serial)} not connected, command 0x{command:02X} not sent")
+                return unsent_result(command, "not_connected")
+            if not wait:
+                return queued.result()
+            try:
+                return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(queued.future)), timeout)
+            except asyncio.TimeoutError:
+                return queued.result()
+            finally:
+                self.outbox.forget(queued)
+        if wait or pending.future.done():
+            try:
+                # 时间轮按 tick 回收超时命令，这里多留一点余量
+                return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(pending.future)), timeout + 1)
+            except asyncio.TimeoutError:
+                return pending.result("timeout", False)
+        return pending.result("sent", True)
+
+    def stop(self):
+        """停止服务器"""
+        if self.loop_thread is None and self.loop is not None and self.loop.is_running():
+            # 由 start_async 启动：在所属事件循环上停止
+            asyncio.run_coroutine_threadsafe(self.stop_async(), self.loop).result(timeout=10)
+            return
+        self.is_running = False
+        # 关闭连接会移除设备登记，先写出登记表快照
+        self.snapshot.stop()
+        if self.loop and self.loop.is_running():
+            def shutdown():
+                self.server_socket.close()
+                for connection in list(self.connections):
+                    connection.close()
+                # 排在 connection_lost 回调之后停止事件循环，确保设备记录被清理
+                self.loop.call_soon(self.loop.stop)
+            self.loop.call_soon_threadsafe(shutdown)
+            self.loop_thread.join(timeout=5)
+        self.stop_services()
+        logger.info("Server stopped")
@@ -0,0 +1,667 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import socket
+import hashlib
+import logging
+import binascii
+import tempfile
+import threading
+import socketserver
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+from parking_lock_server import create_lock_server
+from parking_lock_commands import TokenBucket, unsent_result, COMMAND_TIMEOUT, BATCH_RATE_LIMIT, BATCH_BURST
+from parking_lock_logging import configure_logging
+from parking_lock_metrics import metrics, merge_metrics, gauge_family
+from parking_lock_history import HeartbeatHistory
+from parking_lock_outbox import CommandOutbox, outbox_kind, queue_ttl
+from parking_lock_events import EventBroker, LOCK_EVENTS_KEEPALIVE
+
+logger = logging.getLogger("ParkingLockCluster")
+
+# 多进程模式配置
+LOCK_CLUSTER_WORKERS = int(os.environ.get('LOCK_CLUSTER_WORKERS', str(os.cpu_count() or 1)))  # worker 进程数
+LOCK_CLUSTER_WORKER_MODE = os.environ.get('LOCK_CLUSTER_WORKER_MODE', 'async')  # 每个 worker 内部的运行模式
+LOCK_CLUSTER_SOCKET_DIR = os.environ.get('LOCK_CLUSTER_SOCKET_DIR', tempfile.gettempdir())  # 控制通道 Unix socket 目录
+LOCK_CLUSTER_START_TIMEOUT = float(os.environ.get('LOCK_CLUSTER_START_TIMEOUT', '15'))
+LOCK_CLUSTER_RPC_TIMEOUT = float(os.environ.get('LOCK_CLUSTER_RPC_TIMEOUT', '10'))
+
+
+def _serial_hex(serial):
+    return binascii.hexlify(serial).decode('utf-8')
+
+
+def _status_from_wire(status):
+    """控制通道上序列号以十六进制传输，还原为 bytes 以保持与单进程模式相同的返回值"""
+    if status is not None:
+        status["serial_number"] = binascii.unhexlify(status["serial_number"])
+    return status
+
+
+class WorkerControlHandler(socketserver.StreamRequestHandler):
+    """worker 控制通道：每行一个 JSON 请求 {"method": ..., "args": [...]}，每行一个 JSON 响应
+
+    stream_events 请求例外：该连接此后持续输出本 worker 的设备事件（SSE 格式），直到主进程关闭连接。
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if request["method"] == "stream_events":
+                    self.stream_events()
+                    return
+                handler = self.server.handlers[request["method"]]
+                response = {"result": handler(*request.get("args", ()))}
+            except Exception as e:
+                response = {"error": f"{type(e).__name__}: {e}"}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+    def stream_events(self):
+        """把本 worker 的全部设备事件转发给主进程，由主进程按订阅者过滤；写失败即退订"""
+        server = self.server.lock_server
+        subscription = server.subscribe_events()
+        try:
+            while not subscription.closed and not self.server.stopped.is_set():
+                message = subscription.get(LOCK_EVENTS_KEEPALIVE)
+                self.wfile.write(message if message is not None else b": keepalive\n\n")
+                self.wfile.flush()
+        except OSError:
+            pass
+        finally:
+            server.unsubscribe_events(subscription)
+
+
+class WorkerControlServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """worker 进程内的控制通道服务，把主进程的请求转交给本进程的车位锁服务器"""
+
+    daemon_threads = True
+
+    def __init__(self, path, lock_server, stopped):
+        self.lock_server = lock_server
+        self.stopped = stopped
+        self.handlers = self.build_handlers(lock_server)
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, WorkerControlHandler)
+
+    def build_handlers(self, server):
+        """控制通道可调用的方法，序列号参数统一使用十六进制字符串"""
+        def status(serial):
+            hb = server.get_device_status(binascii.unhexlify(serial))
+            if hb is not None:
+                hb["serial_number"] = _serial_hex(hb["serial_number"])
+            return hb
+
+        def all_statuses():
+            statuses = server.get_all_device_statuses()
+            for hb in statuses:
+                hb["serial_number"] = _serial_hex(hb["serial_number"])
+            return statuses
+
+        def snapshot():
+            etag, body = server.get_status_snapshot()
+            return [etag, body.decode('utf-8')]
+
+        def stop():
+            self.stopped.set()
+            return True
+
+        return {
+            "ping": lambda: os.getpid(),
+            "has_device": lambda serial: binascii.unhexlify(serial) in server.registry,
+            "device_count": lambda: len(server.registry),
+            "send_command_to_device": lambda serial, command, payload: server.send_command_to_device(
+                binascii.unhexlify(serial), command, binascii.unhexlify(payload)),
+            "remote_open_lock": lambda serial: server.remote_open_lock(binascii.unhexlify(serial)),
+            "remote_close_lock": lambda serial: server.remote_close_lock(binascii.unhexlify(serial)),
+            "set_lock_state": lambda serial, state: server.set_lock_state(binascii.unhexlify(serial), state),
+            "sync_time": lambda serial: server.sync_time(binascii.unhexlify(serial)),
+            "remote_restart": lambda serial: server.remote_restart(binascii.unhexlify(serial)),
+            "get_connected_devices": server.get_connected_devices,
+            "get_offline_devices": server.get_offline_devices,
+            "get_device_status": status,
+            "get_all_device_statuses": all_statuses,
+            "get_status_etag": server.get_status_etag,
+            "get_status_snapshot": snapshot,
+            "get_webhook_stats": server.get_webhook_stats,
+            "get_command_stats": server.get_command_stats,
+            "get_metrics": server.get_metrics,
+            "execute_command": lambda serial, command, state, wait, timeout, ttl: server.execute_command(
+                binascii.unhexlify(serial), command, state, wait, timeout, ttl),
+            "execute_batch": lambda items, wait, timeout, ttl: server.execute_batch(
+                [(binascii.unhexlify(serial), command, state) for serial, command, state in items], wait, timeout, ttl),
+            "flush_outbox": lambda serial: server.flush_outbox(binascii.unhexlify(serial)) or True,
+            "locate_devices": lambda serials: [serial for serial in serials
+                                               if binascii.unhexlify(serial) in server.registry],
+            "stop": stop
+        }
+
+
+def _worker_main(index, workers, host, port, mode, control_path):
+    """worker 进程入口：以 SO_REUSEPORT 监听共享端口，并提供控制通道"""
+    parent_pid = os.getppid()
+    # 多个进程轮转同一个日志文件会互相覆盖，每个 worker 写自己的日志文件
+    configure_logging(f"parking_lock_server.worker{index}.log", force=True)
+    server = create_lock_server(host, port, mode)
+    server.reuse_port = True
+    # 每个 worker 只保存自己持有的设备，写各自的快照文件
+    if server.snapshot.enabled:
+        server.snapshot.path = f"{server.snapshot.path}.worker{index}"
+    # 发件箱由主进程入队，worker 登录时需要查询数据库
+    server.outbox.shared = True
+    # 所有 worker 共用同一上行链路，批量命令限速按 worker 数均分
+    server.batch_limiter = TokenBucket(BATCH_RATE_LIMIT / workers, max(1, BATCH_BURST // workers))
+    if not server.start():
+        sys.exit(1)
+
+    stopped = threading.Event()
+    control = WorkerControlServer(control_path, server, stopped)
+    control_thread = threading.Thread(target=control.serve_forever, name="cluster-control")
+    control_thread.daemon = True
+    control_thread.start()
+    logger.info(f"Cluster worker {index} (pid {os.getpid()}) serving {host}:{port}")
+
+    # 主进程退出（包括被强制杀死）后 worker 随之退出，避免遗留进程继续占用端口
+    while not stopped.wait(1):
+        if os.getppid() != parent_pid:
+            logger.warning(f"Cluster worker {index} lost its master, exiting")
+            break
+
+    control.shutdown()
+    control.server_close()
+    server.stop()
+    try:
+        os.unlink(control_path)
+    except OSError:
+        pass
+
+
+class WorkerClient:
+    """主进程到单个 worker 控制通道的连接池
+
+    每次调用借用一条空闲连接（没有则新建），用完归还；等待设备响应的命令
+    不会阻塞同一 worker 上的其他调用。出错的连接直接关闭，不再放回。
+    """
+
+    def __init__(self, index, path, timeout=LOCK_CLUSTER_RPC_TIMEOUT):
+        self.index = index
+        self.path = path
+        self.timeout = timeout
+        self.idle = []  # [(sock, reader)]
+        self.lock = threading.Lock()
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        return sock, sock.makefile('rb')
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for sock, reader in idle:
+            try:
+                reader.close()
+                sock.close()
+            except OSError:
+                pass
+
+    def call(self, method, *args, timeout=None):
+        """调用 worker 上的方法，失败时抛出 ConnectionError / RuntimeError"""
+        request = json.dumps({"method": method, "args": args}).encode('utf-8') + b'\n'
+        with self.lock:
+            channel = self.idle.pop() if self.idle else None
+        try:
+            sock, reader = channel or self.connect()
+        except OSError as e:
+            raise ConnectionError(f"Cluster worker {self.index} unreachable: {e}")
+
+        try:
+            sock.settimeout(timeout or self.timeout)
+            sock.sendall(request)
+            line = reader.readline()
+            if not line:
+                raise ConnectionError("control channel closed")
+        except OSError as e:
+            reader.close()
+            sock.close()
+            raise ConnectionError(f"Cluster worker {self.index} unreachable: {e}")
+        with self.lock:
+            self.idle.append((sock, reader))
+
+        response = json.loads(line)
+        if "error" in response:
+            raise RuntimeError(f"Cluster worker {self.index} {method} failed: {response['error']}")
+        return response["result"]
+
+
+class ClusterLockServer:
+    """多进程车位锁服务器
+
+    启动 N 个 worker 进程，通过 SO_REUSEPORT 共享同一监听端口，由内核把设备连接
+    分散到各个 worker；每个 worker 独立完成 CRC 校验、解析、日志和 Webhook 推送，
+    不再受单个 GIL 限制。主进程不处理设备连接，只通过各 worker 的 Unix socket
+    控制通道转发远程命令（优先发给缓存的所属 worker，找不到时广播定位）并合并
+    状态查询结果。公共方法与 ParkingLockServer 一致，API 层无需区分运行模式。
+    """
+
+    WEBHOOK_TOTAL_KEYS = ("enqueued", "dropped", "delivered", "failed", "requests", "queue_depth")
+
+    def __init__(self, host, port, workers=LOCK_CLUSTER_WORKERS, worker_mode=LOCK_CLUSTER_WORKER_MODE,
+                 socket_dir=LOCK_CLUSTER_SOCKET_DIR):
+        """初始化服务器"""
+        if workers < 1:
+            raise ValueError(f"Cluster worker count must be positive: {workers}")
+        self.host = host
+        self.port = port
+        self.worker_count = workers
+        self.worker_mode = worker_mode
+        self.socket_dir = socket_dir
+        self.is_running = False
+        self.processes = []
+        self.workers = []
+        self.owners = {}  # 序列号 -> worker 下标（设备重连后可能变化，命令失败时重新定位）
+        self.snapshot_lock = threading.Lock()
+        self.cached_snapshot = (None, b'')
+        # 各 worker 写入同一个历史数据库（SQLite WAL 支持多进程写入），主进程只读查询
+        self.history = HeartbeatHistory()
+        # 设备事件：有订阅者时才向各 worker 打开事件流，转发到主进程的事件代理
+        self.events = EventBroker()
+        self.event_lock = threading.Lock()
+        self.event_streams = []
+        # 离线设备命令由主进程写入共享的发件箱数据库，设备登录到哪个 worker 就由哪个 worker 补发
+        self.outbox = CommandOutbox(shared=True)
+
+    def control_path(self, index):
+        return os.path.join(self.socket_dir, f"parking_lock_{self.port}_{index}.sock")
+
+    def start(self):
+        """启动所有 worker 进程，等待它们的控制通道就绪"""
+        context = multiprocessing.get_context('spawn')
+        try:
+            for index in range(self.worker_count):
+                path = self.control_path(index)
+                process = context.Process(target=_worker_main, name=f"lock-worker-{index}",
+                                          args=(index, self.worker_count, self.host, self.port,
+                                                self.worker_mode, path))
+                process.daemon = True
+                process.start()
+                self.processes.append(process)
+                self.workers.append(WorkerClient(index, path))
+
+            deadline = time.monotonic() + LOCK_CLUSTER_START_TIMEOUT
+            for process, worker in zip(self.processes, self.workers):
+                while True:
+                    try:
+                        worker.call("ping")
+                        break
+                    except ConnectionError:
+                        if not process.is_alive() or time.monotonic() > deadline:
+                            raise RuntimeError(f"Cluster worker {worker.index} failed to start")
+                        time.sleep(0.05)
+        except Exception as e:
+            logger.error(f"Failed to start server: {e}")
+            self.stop()
+            return False
+
+        self.outbox.start()
+        self.is_running = True
+        logger.info(f"Cluster server started on {self.host}:{self.port} with {self.worker_count} "
+                    f"{self.worker_mode} workers")
+        return True
+
+    def stop(self):
+        """停止所有 worker 进程"""
+        self.is_running = False
+        with self.event_lock:
+            self._close_event_streams()
+        for worker in self.workers:
+            try:
+                worker.call("stop")
+            except (ConnectionError, RuntimeError):
+                pass
+            worker.close()
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+                process.join(timeout=1)
+        self.processes = []
+        self.workers = []
+        self.owners.clear()
+        self.outbox.stop()
+        self.history.stop()  # 主进程只查询历史，这里只关闭查询连接
+        logger.info("Cluster server stopped")
+
+    def broadcast(self, method, *args):
+        """在所有 worker 上调用方法，返回 [(worker 下标, 结果)]，不可达的 worker 被跳过"""
+        results = []
+        for worker in self.workers:
+            try:
+                results.append((worker.index, worker.call(method, *args)))
+            except (ConnectionError, RuntimeError) as e:
+                logger.error(str(e))
+        return results
+
+    def locate(self, device_serial):
+        """找到持有该设备连接的 worker 下标，设备未连接时返回 None"""
+        for index, present in self.broadcast("has_device", _serial_hex(device_serial)):
+            if present:
+                self.owners[device_serial] = index
+                return index
+        self.owners.pop(device_serial, None)
+        return None
+
+    @staticmethod
+    def is_miss(result):
+        """worker 上找不到设备时的返回值（False / None / not_connected 结果）"""
+        return not result or (isinstance(result, dict) and result.get("status") == "not_connected")
+
+    def call_owner(self, device_serial, method, *args, default=False, timeout=None, log_miss=True):
+        """把针对单个设备的调用转发给持有其连接的 worker（log_miss=False 时设备不在任何 worker 上不记录错误）"""
+        serial = _serial_hex(device_serial)
+        index = self.owners.get(device_serial)
+        if index is not None:
+            try:
+                result = self.workers[index].call(method, serial, *args, timeout=timeout)
+                if not self.is_miss(result):
+                    return result
+                # 调用失败可能是设备已经重连到其他 worker，重新定位后再试一次
+                if self.workers[index].call("has_device", serial):
+                    return result
+            except (ConnectionError, RuntimeError) as e:
+                logger.error(str(e))
+
+        owner = self.locate(device_serial)
+        if owner is None or owner == index:
+            if owner is None and log_miss:
+                logger.error(f"Device {binascii.hexlify(device_serial)} not connected to any worker")
+            return default
+        try:
+            return self.workers[owner].call(method, serial, *args, timeout=timeout)
+        except (ConnectionError, RuntimeError) as e:
+            logger.error(str(e))
+            return default
+
+    def send_command_to_device(self, device_serial, command, payload=b''):
+        """向特定设备发送命令"""
+        return self.call_owner(device_serial, "send_command_to_device", command, _serial_hex(payload))
+
+    def execute_command(self, device_serial, command, state=None, wait=False, timeout=COMMAND_TIMEOUT, ttl=None):
+        """执行远程命令，返回结果字典（等待设备响应时控制通道超时相应放宽）
+
+        worker 上不排队（ttl=0），设备不在任何 worker 上时由主进程放入发件箱，不等待补发结果。
+        """
+        not_connected = {"success": False, "status": "not_connected", "flowNumber": None,
+                         "command": f"0x{command:02X}", "resultCode": None, "elapsed": 0}
+        rpc_timeout = self.workers[0].timeout + (float(timeout) if wait else 0) if self.workers else None
+        result = self.call_owner(device_serial, "execute_command", command, state, wait, timeout, 0,
+                                 default=not_connected, timeout=rpc_timeout, log_miss=False)
+        if result["status"] == "not_connected":
+            queued = self.queue_command(device_serial, command, state, ttl, timeout)
+            if queued is not None:
+                return queued.result()
+            logger.error(f"Device {binascii.hexlify(device_serial)} not connected to any worker, "
+                         f"command 0x{command:02X} not sent")
+        return result
+
+    def queue_command(self, device_serial, command, state=None, ttl=None, timeout=COMMAND_TIMEOUT):
+        """把命令放入共享发件箱；入队时设备恰好登录的，通知其所在 worker 补发"""
+        ttl = queue_ttl(ttl)
+        if ttl <= 0 or outbox_kind(command) is None:
+            return None
+        queued = self.outbox.enqueue(device_serial, command, state, ttl, timeout)
+        if queued is not None:
+            owner = self.locate(device_serial)
+            if owner is not None:
+                try:
+                    self.workers[owner].call("flush_outbox", _serial_hex(device_serial))
+                except (ConnectionError, RuntimeError) as e:
+                    logger.error(str(e))
+        return queued
+
+    def execute_batch(self, commands, wait=False, timeout=COMMAND_TIMEOUT, ttl=None):
+        """批量执行远程命令：按所属 worker 分组后并行转发，结果按输入顺序合并"""
+        results, stale = self._execute_batch(commands, wait, timeout)
+        # 缓存的所属 worker 已过期（设备重连到其他 worker）的命令，重新定位后再试一次
+        if stale:
+            retried, _ = self._execute_batch([commands[position] for position in stale], wait, timeout)
+            for position, result in zip(stale, retried):
+                results[position] = result
+        # 仍未连接的设备，命令放入发件箱
+        for position, result in enumerate(results):
+            if result["status"] == "not_connected":
+                serial, command, state = commands[position]
+                queued = self.queue_command(serial, command, state, ttl, timeout)
+                if queued is not None:
+                    results[position] = queued.result()
+        return results
+
+    def _execute_batch(self, commands, wait, timeout):
+        """返回 (结果列表, 所属 worker 缓存过期的输入下标列表)"""
+        unknown = [serial for serial, _, _ in commands if serial not in self.owners]
+        if unknown:
+            hex_serials = [_serial_hex(serial) for serial in set(unknown)]
+            for index, present in self.broadcast("locate_devices", hex_serials):
+                for serial in present:
+                    self.owners[binascii.unhexlify(serial)] = index
+
+        results = [None] * len(commands)
+        groups = {}  # worker 下标 -> [(输入下标, [序列号, 命令字, 状态]), ...]
+        for position, (serial, command, state) in enumerate(commands):
+            index = self.owners.get(serial)
+            if index is None:
+                results[position] = unsent_result(command, "not_connected")
+            else:
+                groups.setdefault(index, []).append((position, [_serial_hex(serial), command, state]))
+
+        rpc_timeout = self.workers[0].timeout + (float(timeout) if wait else 0) if self.workers else None
+
+        def forward(index, items):
+            try:
+                return self.workers[index].call("execute_batch", [item for _, item in items], wait, timeout, 0,
+                                                timeout=rpc_timeout + len(items) * self.worker_count / max(BATCH_RATE_LIMIT, 1))
+            except (ConnectionError, RuntimeError) as e:
+                logger.error(str(e))
+                return [unsent_result(command, "send_failed") for _, (_, command, _) in items]
+
+        with ThreadPoolExecutor(max_workers=max(1, len(groups))) as executor:
+            outcomes = {index: executor.submit(forward, index, items) for index, items in groups.items()}
+        stale = []
+        for index, items in groups.items():
+            for (position, _), outcome in zip(items, outcomes[index].result()):
+                if outcome["status"] == "not_connected":
+                    self.owners.pop(commands[position][0], None)
+                    stale.append(position)
+                results[position] = outcome
+        return results, stale
+
+    def remote_open_lock(self, device_serial):
+        """远程开锁"""
+        return self.call_owner(device_serial, "remote_open_lock")
+
+    def remote_close_lock(self, device_serial):
+        """远程关锁"""
+        return self.call_owner(device_serial, "remote_close_lock")
+
+    def set_lock_state(self, device_serial, state):
+        """设置锁状态（0:正常, 1:保持开, 2:保持关）"""
+        return self.call_owner(device_serial, "set_lock_state", state)
+
+    def sync_time(self, device_serial):
+        """同步时间"""
+        return self.call_owner(device_serial, "sync_time")
+
+    def remote_restart(self, device_serial):
+        """远程重启设备"""
+        return self.call_owner(device_serial, "remote_restart")
+
+    def get_connected_devices(self):
+        """获取所有 worker 上当前连接的设备列表"""
+        devices = []
+        for _, worker_devices in self.broadcast("get_connected_devices"):
+            devices.extend(worker_devices)
+        return devices
+
+    def subscribe_events(self, serials=None, types=None):
+        """订阅设备事件；第一个订阅者出现时向各 worker 打开事件流"""
+        subscription = self.events.subscribe(serials, types)
+        with self.event_lock:
+            if not self.event_streams:
+                for worker in self.workers:
+                    try:
+                        sock, reader = worker.connect()
+                        sock.sendall(b'{"method": "stream_events"}\n')
+                    except OSError as e:
+                        logger.error(f"Cluster worker {worker.index} event stream unavailable: {e}")
+                        continue
+                    self.event_streams.append((sock, reader))
+                    thread = threading.Thread(target=self._forward_events, args=(worker.index, reader),
+                                              name=f"cluster-events-{worker.index}")
+                    thread.daemon = True
+                    thread.start()
+        return subscription
+
+    def unsubscribe_events(self, subscription):
+        """退订；最后一个订阅者离开后关闭各 worker 的事件流，worker 不再构建事件"""
+        self.events.unsubscribe(subscription)
+        with self.event_lock:
+            if not self.events.active:
+                self._close_event_streams()
+
+    def _close_event_streams(self):
+        streams, self.event_streams = self.event_streams, []
+        for sock, reader in streams:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+                sock.close()
+            except OSError:
+                pass
+
+    def _forward_events(self, index, reader):
+        """读取一个 worker 的事件流，重新编号后分发给主进程的订阅者"""
+        try:
+            for line in reader:
+                if line.startswith(b"data: "):
+                    event = json.loads(line[6:])
+                    event["id"] = next(self.events.sequence)
+                    self.events.dispatch(event)
+        except (OSError, ValueError) as e:
+            if self.events.active:
+                logger.error(f"Cluster worker {index} event stream failed: {e}")
+        finally:
+            reader.close()
+
+    def get_offline_devices(self):
+        """合并各 worker 的离线设备列表
+
+        设备重连时可能被内核分配到另一个 worker，原 worker 仍保留它的离线记录，
+        因此排除当前在任一 worker 上在线的设备，同一设备只保留最近的一条记录。
+        """
+        online = {device["serial"] for device in self.get_connected_devices()}
+        records = {}
+        for _, worker_records in self.broadcast("get_offline_devices"):
+            for record in worker_records:
+                current = records.get(record["serial"])
+                if record["serial"] not in online and (current is None
+                                                       or record["offline_since"] > current["offline_since"]):
+                    records[record["serial"]] = record
+        return sorted(records.values(), key=lambda record: record["offline_since"], reverse=True)
+
+    def get_outbox(self, device_serial=None):
+        """获取发件箱中等待设备登录的命令，直接读取共享的发件箱数据库"""
+        return self.outbox.list_commands(device_serial)
+
+    def get_device_status(self, device_serial):
+        """获取设备详细状态；设备未连接时查找各 worker 从快照恢复的 stale 状态"""
+        status = self.call_owner(device_serial, "get_device_status", default=None)
+        if status is None:
+            for _, worker_status in self.broadcast("get_device_status", _serial_hex(device_serial)):
+                if worker_status is not None and (status is None or not worker_status.get("stale")):
+                    status = worker_status
+        return _status_from_wire(status)
+
+    @staticmethod
+    def _drop_shadowed_stale(statuses, key):
+        """设备重启前后可能落在不同 worker 上：已在某个 worker 上线的设备不再列出其他 worker 的 stale 状态"""
+        online = {status[key] for status in statuses if not status.get("stale")}
+        return [status for status in statuses if not status.get("stale") or status[key] not in online]
+
+    def get_all_device_statuses(self):
+        """获取所有设备的详细状态"""
+        statuses = []
+        for _, worker_statuses in self.broadcast("get_all_device_statuses"):
+            statuses.extend(worker_statuses)
+        return [_status_from_wire(status) for status in self._drop_shadowed_stale(statuses, "serial_number")]
+
+    def get_status_etag(self):
+        """合并各 worker 的快照版本号，任一 worker 的设备状态变化都会改变 ETag"""
+        etags = ",".join(f"{index}:{etag}" for index, etag in self.broadcast("get_status_etag"))
+        return hashlib.sha1(etags.encode('utf-8')).hexdigest()[:16]
+
+    def get_status_snapshot(self):
+        """合并所有 worker 的状态快照，返回 (etag, 响应体 bytes)；ETag 不变时复用上次合并结果"""
+        snapshots = self.broadcast("get_status_snapshot")
+        etags = ",".join(f"{index}:{etag}" for index, (etag, _) in snapshots)
+        etag = hashlib.sha1(etags.encode('utf-8')).hexdigest()[:16]
+
+        with self.snapshot_lock:
+            cached_etag, body = self.cached_snapshot
+            if cached_etag != etag:
+                devices = []
+                for _, (_, worker_body) in snapshots:
+                    devices.extend(json.loads(worker_body)["devices"])
+                devices = self._drop_shadowed_stale(devices, "serialNumber")
+                body = json.dumps({"success": True, "deviceCount": len(devices), "devices": devices}).encode('utf-8')
+                self.cached_snapshot = (etag, body)
+        return etag, body
+
+    def get_command_stats(self):
+        """获取各 worker 远程命令结果计数之和"""
+        stats = {}
+        for _, worker_stats in self.broadcast("get_command_stats"):
+            for key, value in worker_stats.items():
+                stats[key] = stats.get(key, 0) + value
+        return stats
+
+    def get_device_history(self, serial_number, start, end, fields=None, resolution="auto"):
+        """查询设备心跳历史，直接读取共享的历史数据库，不经过 worker"""
+        return self.history.query(serial_number, start, end, fields, resolution)
+
+    def get_webhook_stats(self):
+        """获取各 worker 的 Webhook 投递统计：计数字段求和，同时保留每个 worker 的明细"""
+        stats = {key: 0 for key in self.WEBHOOK_TOTAL_KEYS}
+        stats["workers_detail"] = {}
+        for index, worker_stats in self.broadcast("get_webhook_stats"):
+            stats["workers_detail"][str(index)] = worker_stats
+            for key in self.WEBHOOK_TOTAL_KEYS:
+                stats[key] += worker_stats.get(key, 0)
+        return stats
+
+    def get_metrics(self):
+        """获取各 worker 指标之和（同名同标签的计数器、瞬时值、直方图相加）"""
+        results = self.broadcast("get_metrics")
+        # 离线设备命令在主进程入队，合并主进程的发件箱计数
+        outbox = [family for family in metrics.collect() if family["name"] == "lock_outbox_commands_total"]
+        families = merge_metrics([worker_metrics for _, worker_metrics in results] + [outbox])
+        # worker 上的事件订阅者只是主进程的转发连接，改为报告主进程的订阅者数；
+        # 各 worker 读的是同一个发件箱数据库，发件箱深度只报告一次
+        families = [family for family in families
+                    if family["name"] not in ("lock_event_subscribers", "lock_outbox_depth")]
+        families.append(gauge_family("lock_event_subscribers", "Clients subscribed to the device event stream",
+                                     len(self.events.subscribers)))
+        families.append(gauge_family("lock_outbox_depth", "Commands queued for offline devices", self.outbox.count()))
+        families.append(gauge_family("lock_cluster_workers", "Worker processes answering the control channel",
+                                     len(results)))
+        return families
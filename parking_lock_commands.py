@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import struct
+import logging
+import binascii
+import threading
+from concurrent.futures import Future
+
+from parking_lock_metrics import metrics, InstrumentedLock, COMMAND_LABELS
+from parking_lock_opcodes import OPCODES
+
+logger = logging.getLogger("ParkingLockServer")
+
+# 远程命令等待设备响应的默认超时和上限（秒）
+COMMAND_TIMEOUT = float(os.environ.get('LOCK_COMMAND_TIMEOUT', '5'))
+COMMAND_MAX_TIMEOUT = float(os.environ.get('LOCK_COMMAND_MAX_TIMEOUT', '30'))
+
+# 批量命令配置：单批最大条数、下行限速（帧/秒，<=0 不限速）、突发容量
+BATCH_MAX_SIZE = int(os.environ.get('LOCK_BATCH_MAX_SIZE', '1000'))
+BATCH_RATE_LIMIT = float(os.environ.get('LOCK_BATCH_RATE_LIMIT', '200'))
+BATCH_BURST = int(os.environ.get('LOCK_BATCH_BURST', '50'))
+
+# 设备响应中的结果码，与服务器应答使用的约定一致
+RESULT_SUCCESS = 0x01
+
+# 从发送到得到结果（确认、完成、超时等）的耗时
+COMMAND_LATENCY = metrics.histogram("lock_command_latency_seconds",
+                                    "Time from sending a remote command to its result", ("command", "status"))
+
+
+def unsent_result(command, status):
+    """没有发出（设备未连接等）的命令结果，字段与 PendingCommand.result 一致"""
+    return {"success": False, "status": status, "flowNumber": None,
+            "command": f"0x{command:02X}", "resultCode": None, "elapsed": 0}
+
+
+class TokenBucket:
+    """令牌桶限速器
+
+    rate 为每秒补充的令牌数，burst 为桶容量。acquire 采用预约方式：
+    先扣除令牌（允许欠账），再按欠账时长睡眠，多个线程共享时总速率不超过 rate。
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """取得 tokens 个令牌，必要时阻塞，返回等待的秒数"""
+        if self.rate <= 0:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= tokens
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+class PendingCommand:
+    """一条已发送、等待设备响应的命令
+
+    future 完成时的结果是一个字典:
+    {"success", "status", "flowNumber", "command", "resultCode", "elapsed"}，
+    status 取值 acknowledged / completed / rejected / failed / timeout / disconnected / send_failed。
+    异步调用方可以用 asyncio.wrap_future(pending.future) 等待。
+    """
+
+    __slots__ = ('serial', 'command', 'flow_number', 'state', 'created', 'future', 'timer')
+
+    def __init__(self, serial, command, flow_number, state=None):
+        self.serial = serial
+        self.command = command
+        self.flow_number = flow_number
+        self.state = state  # 设置锁状态命令的目标常控状态
+        self.created = time.monotonic()
+        self.future = Future()
+        self.timer = None
+
+    def result(self, status, success, result_code=None):
+        return {
+            "success": success,
+            "status": status,
+            "flowNumber": self.flow_number,
+            "command": f"0x{self.command:02X}",
+            "resultCode": result_code,
+            "elapsed": round(time.monotonic() - self.created, 3)
+        }
+
+
+class CommandTracker:
+    """远程命令的请求/响应关联
+
+    每台设备分配单调递增的 4 字节流水号；发送命令前登记 PendingCommand，
+    设备的同命令字响应帧（按流水号，或按发送顺序）、心跳中的目标状态、
+    重启后的重新登录都会完成对应的 future。超时由时间轮回收，不扫描待响应表。
+    响应是否带流水号、心跳中的目标状态取自命令字表（Opcode.flow_number / target_status / failed_status）。
+    """
+
+    def __init__(self, timer_wheel, opcodes=OPCODES):
+        self.timer_wheel = timer_wheel
+        self.opcodes = opcodes
+        self.lock = InstrumentedLock("command_tracker")
+        self.flow_numbers = {}  # 序列号 -> 上次分配的流水号
+        self.pending = {}  # 序列号 -> [PendingCommand, ...]（按发送顺序）
+        self.counters = {
+            "submitted": 0,
+            "acknowledged": 0,
+            "completed": 0,
+            "rejected": 0,
+            "failed": 0,
+            "timeout": 0,
+            "disconnected": 0,
+            "send_failed": 0
+        }
+
+    def next_flow_number(self, serial):
+        """分配设备的下一个流水号；首次使用时以当前时间戳为起点，重启服务后也不会回退"""
+        with self.lock:
+            last = self.flow_numbers.get(serial)
+            flow_number = int(time.time()) if last is None else last + 1
+            flow_number &= 0xFFFFFFFF
+            self.flow_numbers[serial] = flow_number
+        return flow_number
+
+    def register(self, serial, command, timeout=COMMAND_TIMEOUT, state=None):
+        """登记一条即将发送的命令，返回 PendingCommand"""
+        pending = PendingCommand(serial, command, self.next_flow_number(serial), state)
+        with self.lock:
+            self.pending.setdefault(serial, []).append(pending)
+            self.counters["submitted"] += 1
+        pending.timer = self.timer_wheel.schedule(timeout, self._expire, pending)
+        return pending
+
+    def resolve(self, pending, status, success, result_code=None):
+        """完成命令并从待响应表移除；已完成的命令忽略"""
+        with self.lock:
+            commands = self.pending.get(pending.serial)
+            if commands is None or pending not in commands:
+                return False
+            commands.remove(pending)
+            if not commands:
+                del self.pending[pending.serial]
+            self.counters[status] += 1
+        if pending.timer is not None:
+            pending.timer.cancel()
+        COMMAND_LATENCY.observe(time.monotonic() - pending.created, COMMAND_LABELS[pending.command], status)
+        pending.future.set_result(pending.result(status, success, result_code))
+        logger.info(f"Command 0x{pending.command:02X} flow {pending.flow_number} for device "
+                    f"{binascii.hexlify(pending.serial)}: {status}")
+        return True
+
+    def _expire(self, pending):
+        self.resolve(pending, "timeout", False)
+
+    def _find(self, serial, predicate):
+        with self.lock:
+            for pending in self.pending.get(serial, ()):
+                if predicate(pending):
+                    return pending
+        return None
+
+    def match_response(self, serial, command, payload):
+        """匹配设备对远程命令的响应帧，返回是否找到对应的待响应命令"""
+        if serial not in self.pending:
+            return False
+
+        flow_number = None
+        result_code = None
+        opcode = self.opcodes.get(command)
+        if opcode is not None and opcode.flow_number and len(payload) >= 12:
+            flow_number = struct.unpack_from("<I", payload, 8)[0]
+            if len(payload) > 12:
+                result_code = payload[12]
+        elif len(payload) == 1:
+            result_code = payload[0]
+
+        if flow_number is not None:
+            pending = self._find(serial, lambda p: p.command == command and p.flow_number == flow_number)
+        else:
+            # 响应中没有流水号时按发送顺序匹配最早的同命令字请求
+            pending = self._find(serial, lambda p: p.command == command)
+        if pending is None:
+            return False
+
+        if result_code is None or result_code == RESULT_SUCCESS:
+            return self.resolve(pending, "acknowledged", True, result_code)
+        return self.resolve(pending, "rejected", False, result_code)
+
+    def match_heartbeat(self, serial, heartbeat):
+        """心跳中的设备状态到达（或无法到达）命令的目标状态时完成命令"""
+        if serial not in self.pending:
+            return
+        device_status = heartbeat['device_status']
+        for pending in list(self.pending.get(serial, ())):
+            opcode = self.opcodes.get(pending.command)
+            if opcode is not None and opcode.target_status is not None:
+                if device_status == opcode.target_status:
+                    self.resolve(pending, "completed", True)
+                elif device_status in opcode.failed_status:
+                    self.resolve(pending, "failed", False)
+            elif pending.command == 0x8E and heartbeat['control_status'] == pending.state:
+                self.resolve(pending, "completed", True)
+
+    def match_login(self, serial):
+        """设备重新登录，视为重启命令已完成"""
+        if serial not in self.pending:
+            return
+        for pending in list(self.pending.get(serial, ())):
+            if pending.command == 0x8F:
+                self.resolve(pending, "completed", True)
+
+    def fail_device(self, serial):
+        """设备断开：除重启命令（预期会断开）外，所有待响应命令以 disconnected 结束"""
+        if serial not in self.pending:
+            return
+        for pending in list(self.pending.get(serial, ())):
+            if pending.command != 0x8F:
+                self.resolve(pending, "disconnected", False)
+
+    def get_stats(self):
+        """获取命令结果计数和当前待响应命令数"""
+        with self.lock:
+            stats = dict(self.counters)
+            stats["pending"] = sum(len(commands) for commands in self.pending.values())
+        return stats
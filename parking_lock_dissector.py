@@ -0,0 +1,813 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""车位锁协议分析 / 流量回放工具
+
+读取抓包文件（pcap / pcapng）、原始 TCP 字节流转储或服务器日志中的 FULL FRAME 行，
+经与服务器相同的 FrameDecoder 逐流提取帧，输出:
+  --frames      每帧一行的时间线（时间、连接、方向、序列号、命令字、CRC、距该设备上一帧的间隔）
+  --heartbeats  心跳帧解析出的全部字段
+  --devices     每台设备的汇总（首末帧时间、帧数、登录次数、最大心跳间隔、最后状态）
+  --stats       按命令字和方向的帧数、字节数、CRC 错误数、设备数（同时打印到终端）
+文件扩展名为 .csv 时输出 CSV，否则输出 JSONL；路径为 - 时写到标准输出（汇总改为输出到标准错误）。
+
+各阶段都是生成器，文件按块流式读取，内存占用只与同时活跃的连接数和设备数有关，
+与抓包大小无关，可以直接处理数 GB 的文件；.gz 压缩的输入会透明解压。
+
+--replay 把抓到的设备上行帧（SEND 方向以外的帧）按原始时间间隔的 1/--speed 重新发送给
+运行中的服务器：原抓包中的每个设备连接对应一个新连接，连接结束时关闭。结束时比较回放得到的
+应答与抓包中服务器的应答（按命令字计数），用于回归测试。
+
+日志输入说明：INFO 级别下 FULL FRAME 行按 LOCK_LOG_FRAME_SAMPLE_INTERVAL 采样，只有
+DEBUG 级别或 LOCK_LOG_SERIALS 中的设备才有完整记录；文本格式的日志只能从登录/心跳等
+载荷中识别序列号，JSON 格式（LOCK_LOG_FORMAT=json）的日志带有每帧的序列号。
+
+用法:
+    python parking_lock_dissector.py capture.pcap --frames frames.csv --heartbeats heartbeats.jsonl
+    python parking_lock_dissector.py parking_lock_server.log* --serial 0100000050000000 --frames -
+    python parking_lock_dissector.py device.bin --format raw --stats stats.csv
+    python parking_lock_dissector.py capture.pcapng --replay 127.0.0.1:11457 --speed 10
+"""
+
+import io
+import re
+import sys
+import csv
+import gzip
+import json
+import time
+import socket
+import struct
+import asyncio
+import logging
+import argparse
+import binascii
+from collections import namedtuple
+
+from parking_lock_logging import configure_logging
+
+# 分析工具自己的日志文件；必须在导入服务器模块之前配置，否则会沿用服务器的日志文件
+configure_logging("parking_lock_dissector.log")
+
+from parking_lock_server import ParkingLockProtocol, FrameDecoder, Heartbeat
+from parking_lock_opcodes import OPCODES, HEARTBEAT_STRUCT, load_plugins
+
+logger = logging.getLogger("ParkingLockDissector")
+
+DEFAULT_PORT = 11457
+READ_SIZE = 1 << 16
+
+# 读取阶段输出的数据段：flow 标识一条设备连接，direction 为 RECV（设备->服务器）、SEND（服务器->设备）
+# 或空字符串（未知）；data 为 None 表示该连接结束；serial 为读取时已知的序列号（日志输入）
+Segment = namedtuple("Segment", "ts flow direction data serial", defaults=(None,))
+# 解码阶段输出的帧（data 为 None 表示连接结束，其余字段只有 ts / flow 有效）
+Frame = namedtuple("Frame", "ts flow direction data serial command crc_ok heartbeat gap")
+
+FRAME_FIELDS = ("ts", "flow", "direction", "serial", "command", "name", "length", "crc_ok", "gap", "payload")
+HEARTBEAT_FIELDS = ("ts", "flow") + Heartbeat.FIELDS
+DEVICE_FIELDS = ("serial", "first_seen", "last_seen", "frames", "logins", "heartbeats", "max_heartbeat_gap",
+                 "last_flow", "device_status", "car_status")
+STATS_FIELDS = ("command", "name", "direction", "frames", "bytes", "crc_errors", "devices")
+
+
+def serial_prefixed(command):
+    """命令字的载荷是否以设备序列号开头（Opcode.serial_prefixed）；其他帧按所在连接归属设备"""
+    opcode = OPCODES.get(command)
+    return opcode is not None and opcode.serial_prefixed
+
+
+class DissectorStats:
+    """分析过程的统计：按 (命令字, 方向) 的帧计数、每台设备的汇总和读取/解码计数"""
+
+    def __init__(self):
+        self.commands = {}  # (命令字, 方向) -> [帧数, 字节数, CRC 错误数, 设备序列号集合]
+        self.devices = {}   # 序列号 -> DeviceSummary
+        self.counters = {}
+
+    def count(self, key, amount=1):
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def command_rows(self):
+        rows = []
+        for (command, direction), (frames, size, crc_errors, serials) in sorted(self.commands.items()):
+            rows.append({"command": f"0x{command:02X}", "name": OPCODES.name(command),
+                         "direction": direction, "frames": frames, "bytes": size, "crc_errors": crc_errors,
+                         "devices": len(serials)})
+        return rows
+
+
+class DeviceSummary:
+    __slots__ = ('first_seen', 'last_seen', 'frames', 'logins', 'heartbeats', 'last_heartbeat', 'max_heartbeat_gap',
+                 'last_flow', 'device_status', 'car_status')
+
+    def __init__(self, ts):
+        self.first_seen = ts
+        self.last_seen = ts
+        self.frames = 0
+        self.logins = 0
+        self.heartbeats = 0
+        self.last_heartbeat = None
+        self.max_heartbeat_gap = None
+        self.last_flow = None
+        self.device_status = None
+        self.car_status = None
+
+    def to_dict(self, serial):
+        return {"serial": serial, "first_seen": _round(self.first_seen), "last_seen": _round(self.last_seen),
+                "frames": self.frames, "logins": self.logins, "heartbeats": self.heartbeats,
+                "max_heartbeat_gap": _round(self.max_heartbeat_gap), "last_flow": self.last_flow,
+                "device_status": self.device_status, "car_status": self.car_status}
+
+
+def _round(value, digits=6):
+    return round(value, digits) if value is not None else None
+
+
+# ---------------------------------------------------------------------------
+# 读取阶段：文件 -> Segment
+# ---------------------------------------------------------------------------
+
+def open_input(path):
+    """以二进制方式打开输入文件，gzip 压缩的文件透明解压"""
+    f = open(path, 'rb')
+    if f.peek(2)[:2] == b'\x1f\x8b':
+        return io.BufferedReader(gzip.GzipFile(fileobj=f), READ_SIZE)
+    return f
+
+
+def detect_format(f, path):
+    """按文件头判断输入格式：pcap / pcapng 魔数，文本行（日志），其余视为原始字节流"""
+    head = f.peek(4)[:4]
+    if head in (b'\xd4\xc3\xb2\xa1', b'\xa1\xb2\xc3\xd4', b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d',
+                b'\x0a\x0d\x0d\x0a'):
+        return "pcap"
+    if ".log" in path or head[:1] == b'{' or re.match(rb'\d{4}-', head):
+        return "log"
+    return "raw"
+
+
+def read_segments(path, fmt="auto", port=DEFAULT_PORT, stats=None):
+    """读取一个输入文件，产生 Segment"""
+    stats = stats if stats is not None else DissectorStats()
+    with open_input(path) as f:
+        if fmt == "auto":
+            fmt = detect_format(f, path)
+        if fmt == "pcap":
+            yield from read_pcap(f, port, stats)
+        elif fmt == "log":
+            yield from read_log(f, stats)
+        else:
+            yield from read_raw(f, path, stats)
+
+
+def read_raw(f, flow, stats):
+    """原始 TCP 字节流（单个连接，方向未知）"""
+    while True:
+        data = f.read(READ_SIZE)
+        if not data:
+            break
+        stats.count("bytes_read", len(data))
+        yield Segment(None, flow, "", data)
+    yield Segment(None, flow, "", None)
+
+
+LOG_FRAME_PATTERN = re.compile(r'(?:(RECV|SEND) )?FULL FRAME(?: \[[^\]]*\])?: ([0-9a-fA-F]+)\s*$')
+
+
+class _LogClock:
+    """把日志中的 asctime（本地时间，毫秒）转换为时间戳，同一秒内的行复用解析结果"""
+
+    def __init__(self):
+        self.second = None
+        self.base = None
+
+    def parse(self, text):
+        second, _, millis = text.partition(',')
+        if second != self.second:
+            try:
+                self.base = time.mktime(time.strptime(second, "%Y-%m-%d %H:%M:%S"))
+            except ValueError:
+                return None
+            self.second = second
+        return self.base + int(millis or 0) / 1000
+
+
+def read_log(f, stats):
+    """服务器日志（文本或 JSON 格式）中的 FULL FRAME 行；连接以序列号标识，没有序列号的帧 flow 为 None"""
+    clock = _LogClock()
+    for line in io.TextIOWrapper(f, encoding='utf-8', errors='replace'):
+        if "FULL FRAME" not in line:
+            continue
+        serial = None
+        if line.startswith('{'):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                stats.count("bad_log_lines")
+                continue
+            message, ts, serial = entry.get("msg", ""), clock.parse(entry.get("ts", "")), entry.get("serial")
+        else:
+            message, ts = line, clock.parse(line[:23])
+        match = LOG_FRAME_PATTERN.search(message)
+        if match is None:
+            stats.count("bad_log_lines")
+            continue
+        try:
+            data = binascii.unhexlify(match.group(2))
+        except (binascii.Error, ValueError):
+            stats.count("bad_log_lines")  # 日志轮转或进程被杀死时截断的行
+            continue
+        if serial is None and len(data) >= 14 and serial_prefixed(data[5]):
+            serial = binascii.hexlify(data[6:14]).decode('ascii')
+        stats.count("bytes_read", len(data))
+        yield Segment(ts, serial, match.group(1) or "", data, serial)
+
+
+# 链路层类型 -> 解析函数，返回 (IP 版本, IP 报文)
+def _link_ethernet(packet):
+    offset = 12
+    ethertype = int.from_bytes(packet[offset:offset + 2], 'big')
+    while ethertype in (0x8100, 0x88A8):  # VLAN 标签
+        offset += 4
+        ethertype = int.from_bytes(packet[offset:offset + 2], 'big')
+    return _ethertype_version(ethertype), packet[offset + 2:]
+
+
+def _link_sll(packet):
+    return _ethertype_version(int.from_bytes(packet[14:16], 'big')), packet[16:]
+
+
+def _link_sll2(packet):
+    return _ethertype_version(int.from_bytes(packet[0:2], 'big')), packet[20:]
+
+
+def _link_null(packet):
+    family = struct.unpack('=I', packet[:4])[0]
+    if family > 0xFFFF:  # 抓包机器与本机字节序不同
+        family = struct.unpack('>I' if sys.byteorder == 'little' else '<I', packet[:4])[0]
+    return 4 if family == 2 else 6 if family in (10, 24, 28, 30) else None, packet[4:]
+
+
+def _link_raw(packet):
+    return packet[0] >> 4 if packet else None, packet
+
+
+def _ethertype_version(ethertype):
+    return 4 if ethertype == 0x0800 else 6 if ethertype == 0x86DD else None
+
+
+LINK_TYPES = {0: _link_null, 1: _link_ethernet, 12: _link_raw, 14: _link_raw, 101: _link_raw, 108: _link_null,
+              113: _link_sll, 228: _link_raw, 229: _link_raw, 276: _link_sll2}
+
+
+def pcap_packets(f, stats):
+    """逐个产生 (时间戳, 链路层类型, 报文)，支持 pcap（微秒 / 纳秒，任意字节序）和 pcapng"""
+    magic = f.read(4)
+    if magic == b'\x0a\x0d\x0d\x0a':
+        yield from _pcapng_packets(f, magic, stats)
+        return
+    if magic in (b'\xd4\xc3\xb2\xa1', b'\x4d\x3c\xb2\xa1'):
+        endian = '<'
+    elif magic in (b'\xa1\xb2\xc3\xd4', b'\xa1\xb2\x3c\x4d'):
+        endian = '>'
+    else:
+        raise ValueError("not a pcap file")
+    scale = 1e-9 if magic in (b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d') else 1e-6
+    header = f.read(20)
+    linktype = struct.unpack(endian + 'HHiIII', header)[5] & 0xFFFF
+    record = struct.Struct(endian + 'IIII')
+    while True:
+        head = f.read(16)
+        if len(head) < 16:
+            break
+        seconds, fraction, captured, _ = record.unpack(head)
+        packet = f.read(captured)
+        if len(packet) < captured:
+            stats.count("truncated_file")
+            break
+        yield seconds + fraction * scale, linktype, packet
+
+
+def _pcapng_packets(f, magic, stats):
+    interfaces = []  # 接口序号 -> (链路层类型, 时间戳单位秒)
+    endian = '<'
+    block = magic
+    while len(block) == 4:
+        head = f.read(4)
+        if len(head) < 4:
+            break
+        if block == b'\x0a\x0d\x0d\x0a':
+            # 节头块：由字节序魔数确定本节的字节序，接口编号重新开始
+            order = f.read(4)
+            endian = '<' if order == b'\x4d\x3c\x2b\x1a' else '>'
+            length = struct.unpack(endian + 'I', head)[0]
+            body = f.read(length - 12)
+            interfaces = []
+        else:
+            block_type = struct.unpack(endian + 'I', block)[0]
+            length = struct.unpack(endian + 'I', head)[0]
+            body = f.read(length - 8)
+            if len(body) < length - 8:
+                stats.count("truncated_file")
+                break
+            if block_type == 1:  # 接口描述块
+                interfaces.append((struct.unpack_from(endian + 'H', body)[0], _pcapng_resolution(body, endian)))
+            elif block_type == 6 and interfaces:  # 增强分组块
+                interface, high, low, captured = struct.unpack_from(endian + 'IIII', body)
+                linktype, resolution = interfaces[interface]
+                yield ((high << 32) | low) * resolution, linktype, body[20:20 + captured]
+            elif block_type == 3 and interfaces:  # 简单分组块（没有时间戳）
+                original = struct.unpack_from(endian + 'I', body)[0]
+                yield None, interfaces[0][0], body[4:4 + min(original, len(body) - 8)]
+        block = f.read(4)
+
+
+def _pcapng_resolution(body, endian):
+    """接口描述块的 if_tsresol 选项（默认微秒）"""
+    offset = 8
+    while offset + 4 <= len(body) - 4:
+        code, length = struct.unpack_from(endian + 'HH', body, offset)
+        if code == 0:
+            break
+        if code == 9 and length >= 1:
+            value = body[offset + 4]
+            return 2.0 ** -(value & 0x7F) if value & 0x80 else 10.0 ** -value
+        offset += 4 + (length + 3) // 4 * 4
+    return 1e-6
+
+
+def _tcp_segment(version, packet):
+    """解析 IP/TCP 头，返回 (源地址, 目的地址, 源端口, 目的端口, 序号, 标志, 载荷)，非 TCP 报文返回 None"""
+    if version == 4:
+        if len(packet) < 20 or packet[9] != 6:
+            return None
+        header_length = (packet[0] & 0x0F) * 4
+        total_length = int.from_bytes(packet[2:4], 'big')
+        if int.from_bytes(packet[6:8], 'big') & 0x3FFF:
+            return None  # IP 分片（设备帧都很短，正常不会出现）
+        source, destination = socket.inet_ntoa(packet[12:16]), socket.inet_ntoa(packet[16:20])
+        segment = packet[header_length:total_length or len(packet)]
+    elif version == 6:
+        if len(packet) < 40 or packet[6] != 6:
+            return None  # 带扩展头的报文不解析
+        source = f"[{socket.inet_ntop(socket.AF_INET6, packet[8:24])}]"
+        destination = f"[{socket.inet_ntop(socket.AF_INET6, packet[24:40])}]"
+        segment = packet[40:40 + int.from_bytes(packet[4:6], 'big')]
+    else:
+        return None
+    if len(segment) < 20:
+        return None
+    source_port, destination_port, sequence = struct.unpack_from('>HHI', segment)
+    data_offset = (segment[12] >> 4) * 4
+    return source, destination, source_port, destination_port, sequence, segment[13], segment[data_offset:]
+
+
+TCP_FIN, TCP_SYN, TCP_RST = 0x01, 0x02, 0x04
+
+
+def read_pcap(f, port, stats):
+    """从抓包中提取服务器端口上的 TCP 流，按序号去掉重传的数据；连接以设备端的 地址:端口 标识
+
+    只按序号做去重和裁剪，不缓存乱序到达的报文：抓包中出现空洞（丢包）时直接继续，
+    FrameDecoder 会在下一个帧头处重新同步。
+    """
+    expected = {}  # (连接, 方向) -> 下一个期望的序号
+    for ts, linktype, packet in pcap_packets(f, stats):
+        stats.count("packets")
+        link = LINK_TYPES.get(linktype)
+        if link is None:
+            stats.count("unsupported_link_packets")
+            continue
+        try:
+            parsed = _tcp_segment(*link(packet))
+        except (IndexError, struct.error):
+            parsed = None
+        if parsed is None:
+            stats.count("skipped_packets")
+            continue
+        source, destination, source_port, destination_port, sequence, flags, data = parsed
+        if destination_port == port:
+            flow, direction = f"{source}:{source_port}", "RECV"
+        elif source_port == port:
+            flow, direction = f"{destination}:{destination_port}", "SEND"
+        else:
+            stats.count("skipped_packets")
+            continue
+
+        key = (flow, direction)
+        known = (flow, "RECV") in expected or (flow, "SEND") in expected
+        if flags & TCP_SYN:
+            if not known:
+                stats.count("flows")
+                known = True
+            expected[key] = (sequence + 1) & 0xFFFFFFFF
+        if data:
+            next_sequence = expected.get(key)
+            end = (sequence + len(data)) & 0xFFFFFFFF
+            if next_sequence is None:
+                if not known:
+                    stats.count("flows")  # 抓包开始前已建立的连接
+                    known = True
+            else:
+                # 序号按 32 位回绕比较
+                offset = (next_sequence - sequence) & 0xFFFFFFFF
+                if offset >= 0x80000000:
+                    stats.count("tcp_gaps")
+                elif offset >= len(data):
+                    stats.count("tcp_retransmissions")
+                    data = b''
+                elif offset:
+                    data = data[offset:]
+            if data:
+                expected[key] = end
+                stats.count("bytes_read", len(data))
+                yield Segment(ts, flow, direction, bytes(data))
+        if flags & (TCP_FIN | TCP_RST) and known:
+            expected.pop((flow, "RECV"), None)
+            expected.pop((flow, "SEND"), None)
+            yield Segment(ts, flow, direction, None)
+    for flow in {flow for flow, _ in expected}:
+        yield Segment(None, flow, "", None)
+
+
+# ---------------------------------------------------------------------------
+# 解码阶段：Segment -> Frame
+# ---------------------------------------------------------------------------
+
+def decode_frames(segments, stats, serials=None):
+    """按 (连接, 方向) 用 FrameDecoder 提取帧，补充序列号、CRC 校验、心跳解析，并更新统计
+
+    serials 为序列号（十六进制）集合时只输出这些设备的帧（连接结束事件总是输出）。
+    """
+    decoders = {}      # (连接, 方向) -> FrameDecoder
+    flow_serials = {}  # 连接 -> 序列号（十六进制）
+    commands = stats.commands
+    devices = stats.devices
+    for segment in segments:
+        ts, flow, direction, data, known_serial = segment
+        if data is None:
+            for key in ((flow, "RECV"), (flow, "SEND"), (flow, "")):
+                decoder = decoders.pop(key, None)
+                if decoder is not None:
+                    stats.count("resync_bytes", decoder.resync_bytes)
+            flow_serials.pop(flow, None)
+            yield Frame(ts, flow, direction, None, None, None, None, None, None)
+            continue
+
+        decoder = decoders.get((flow, direction))
+        if decoder is None:
+            decoder = decoders[(flow, direction)] = FrameDecoder()
+        for view in decoder.feed(data):
+            frame = bytes(view)
+            command = frame[5]
+            stats.count("frames")
+            crc_ok = ParkingLockProtocol.calculate_crc16(frame[:-3]) == frame[-3] + (frame[-2] << 8)
+            payload = frame[6:-3]
+            serial = known_serial or flow_serials.get(flow)
+            if len(payload) >= 8 and crc_ok and serial_prefixed(command):
+                serial = binascii.hexlify(payload[:8]).decode('ascii')
+                if flow is not None:
+                    flow_serials[flow] = serial
+            if serials is not None and serial not in serials:
+                stats.count("frames_filtered")
+                continue
+
+            entry = commands.get((command, direction))
+            if entry is None:
+                entry = commands[(command, direction)] = [0, 0, 0, set()]
+            entry[0] += 1
+            entry[1] += len(frame)
+            if not crc_ok:
+                entry[2] += 1
+            heartbeat = None
+            gap = None
+            if serial is not None:
+                entry[3].add(serial)
+                device = devices.get(serial)
+                if device is None:
+                    device = devices[serial] = DeviceSummary(ts)
+                if direction != "SEND":
+                    if device.last_seen is not None and ts is not None and device.frames:
+                        gap = ts - device.last_seen
+                    device.last_seen = ts if ts is not None else device.last_seen
+                device.frames += 1
+                device.last_flow = flow
+                if crc_ok and command == 0x80 and direction != "SEND":
+                    device.logins += 1
+                elif crc_ok and command == 0x81 and len(payload) >= HEARTBEAT_STRUCT.size:
+                    heartbeat = Heartbeat(payload)
+                    device.heartbeats += 1
+                    device.device_status = heartbeat.device_status
+                    device.car_status = heartbeat.car_status
+                    if device.last_heartbeat is not None and ts is not None:
+                        heartbeat_gap = ts - device.last_heartbeat
+                        if device.max_heartbeat_gap is None or heartbeat_gap > device.max_heartbeat_gap:
+                            device.max_heartbeat_gap = heartbeat_gap
+                    device.last_heartbeat = ts
+            yield Frame(ts, flow, direction, frame, serial, command, crc_ok, heartbeat, gap)
+    for decoder in decoders.values():
+        stats.count("resync_bytes", decoder.resync_bytes)
+
+
+def frame_record(frame):
+    """时间线中的一行"""
+    data = frame.data
+    return {"ts": _round(frame.ts), "flow": frame.flow, "direction": frame.direction, "serial": frame.serial,
+            "command": f"0x{frame.command:02X}", "name": OPCODES.name(frame.command),
+            "length": len(data), "crc_ok": frame.crc_ok, "gap": _round(frame.gap),
+            "payload": binascii.hexlify(data[6:-3]).decode('ascii')}
+
+
+def heartbeat_record(frame):
+    record = frame.heartbeat.to_dict()
+    record["serial_number"] = frame.serial
+    record["ts"] = _round(frame.ts)
+    record["flow"] = frame.flow
+    return record
+
+
+# ---------------------------------------------------------------------------
+# 输出
+# ---------------------------------------------------------------------------
+
+class RecordWriter:
+    """按扩展名写 CSV（.csv）或 JSONL（其他扩展名，- 表示标准输出）
+
+    list_fields 中的字段值为列表，CSV 中以分号连接。
+    """
+
+    def __init__(self, path, fields, list_fields=()):
+        self.fields = fields
+        self.list_indexes = [fields.index(field) for field in list_fields]
+        self.file = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        self.csv = None
+        if path.endswith('.csv'):
+            self.csv = csv.writer(self.file)
+            self.csv.writerow(fields)
+
+    def write(self, record):
+        if self.csv is not None:
+            values = list(map(record.get, self.fields))
+            for index in self.list_indexes:
+                values[index] = ";".join(values[index])
+            self.csv.writerow(values)
+        else:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def close(self):
+        if self.file is sys.stdout:
+            self.file.flush()
+        else:
+            self.file.close()
+
+
+def write_frames(frames, frames_path=None, heartbeats_path=None):
+    """写时间线和心跳字段，帧原样传给下一阶段"""
+    timeline = RecordWriter(frames_path, FRAME_FIELDS) if frames_path else None
+    heartbeats = (RecordWriter(heartbeats_path, HEARTBEAT_FIELDS, ("error_descriptions",))
+                  if heartbeats_path else None)
+    try:
+        for frame in frames:
+            if frame.data is not None:
+                if timeline is not None:
+                    timeline.write(frame_record(frame))
+                if heartbeats is not None and frame.heartbeat is not None:
+                    heartbeats.write(heartbeat_record(frame))
+            yield frame
+    finally:
+        for writer in (timeline, heartbeats):
+            if writer is not None:
+                writer.close()
+
+
+def write_records(path, fields, records):
+    writer = RecordWriter(path, fields)
+    try:
+        for record in records:
+            writer.write(record)
+    finally:
+        writer.close()
+
+
+def print_summary(stats, elapsed, out):
+    counters = stats.counters
+    print(f"{counters.get('frames', 0)} frames, {len(stats.devices)} devices, "
+          f"{counters.get('bytes_read', 0) / 1e6:.1f} MB in {elapsed:.1f}s", file=out)
+    print(f"  {'command':<9}{'direction':<11}{'frames':>10}{'bytes':>12}{'crc_err':>9}{'devices':>9}  name", file=out)
+    for row in stats.command_rows():
+        print(f"  {row['command']:<9}{row['direction'] or '-':<11}{row['frames']:>10}{row['bytes']:>12}"
+              f"{row['crc_errors']:>9}{row['devices']:>9}  {row['name']}", file=out)
+    print("counters:", file=out)
+    for key, value in sorted(counters.items()):
+        print(f"  {key}: {value}", file=out)
+
+
+# ---------------------------------------------------------------------------
+# 回放
+# ---------------------------------------------------------------------------
+
+class ReplayClient:
+    """把解码出的设备上行帧按原始节奏重新发给服务器
+
+    原始抓包中的每个连接对应一个新连接（首帧时建立，连接结束事件到达时半关闭，
+    读完服务器的应答后关闭）；同一设备在新连接上登录时结束它的旧连接。
+    服务器的应答按命令字计数，与抓包中服务器发出的帧（SEND 方向）比较。
+    """
+
+    def __init__(self, host, port, speed=1.0, response_wait=2.0):
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self.response_wait = response_wait
+        self.connections = {}  # 原连接 -> (StreamWriter, 读取任务)，建立失败时为 None
+        self.closing = set()    # 已半关闭、等待读完应答的读取任务
+        self.serial_flows = {}  # 序列号 -> 原连接
+        self.sent = {}
+        self.received = {}
+        self.captured = {}
+        self.counters = {}
+
+    def count(self, table, key, amount=1):
+        table[key] = table.get(key, 0) + amount
+
+    async def run(self, frames):
+        loop = asyncio.get_running_loop()
+        origin = None  # (抓包时间, 回放开始的事件循环时间)
+        started = loop.time()
+        for index, frame in enumerate(frames, 1):
+            if frame.data is None:
+                await self._close(frame.flow)
+                continue
+            if frame.direction == "SEND":
+                self.count(self.captured, frame.command)
+                continue
+            if frame.flow is None:
+                self.count(self.counters, "skipped_no_connection")
+                continue
+
+            if self.speed > 0 and frame.ts is not None:
+                if origin is None:
+                    origin = (frame.ts, loop.time())
+                delay = origin[1] + (frame.ts - origin[0]) / self.speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif index % 100 == 0:
+                await asyncio.sleep(0)  # 让读取任务处理应答
+
+            if frame.command == 0x80 and frame.serial is not None:
+                previous = self.serial_flows.get(frame.serial)
+                if previous is not None and previous != frame.flow:
+                    await self._close(previous)
+                self.serial_flows[frame.serial] = frame.flow
+            connection = await self._connection(frame.flow)
+            if connection is None:
+                self.count(self.counters, "skipped_connect_failed")
+                continue
+            writer = connection[0]
+            try:
+                writer.write(frame.data)
+                await writer.drain()
+            except ConnectionError:
+                self.count(self.counters, "send_failed")
+                await self._close(frame.flow)
+                continue
+            self.count(self.sent, frame.command)
+
+        for flow in list(self.connections):
+            await self._close(flow)
+        if self.closing:
+            _, unfinished = await asyncio.wait(self.closing, timeout=self.response_wait)
+            for task in unfinished:
+                task.cancel()
+            if unfinished:
+                self.count(self.counters, "response_wait_timeouts", len(unfinished))
+        return loop.time() - started
+
+    async def _connection(self, flow):
+        if flow in self.connections:
+            return self.connections[flow]
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        except OSError as e:
+            logger.error(f"Replay connection for {flow} failed: {e}")
+            self.count(self.counters, "connect_failed")
+            self.connections[flow] = None
+            return None
+        self.count(self.counters, "connections")
+        connection = self.connections[flow] = (writer, asyncio.ensure_future(self._read(reader, writer)))
+        return connection
+
+    async def _read(self, reader, writer):
+        decoder = FrameDecoder()
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                for frame in decoder.feed(data):
+                    self.count(self.received, frame[5])
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _close(self, flow):
+        """原连接结束：半关闭，服务器读到 EOF 后会在发完应答后关闭连接"""
+        connection = self.connections.pop(flow, None)
+        if connection is None:
+            return
+        writer, reader_task = connection
+        try:
+            writer.write_eof()
+        except (OSError, RuntimeError):
+            writer.close()
+        self.closing.add(reader_task)
+        reader_task.add_done_callback(self.closing.discard)
+
+    def summary(self):
+        commands = sorted(set(self.sent) | set(self.received) | set(self.captured))
+        return {
+            "commands": {f"0x{command:02X}": {"sent": self.sent.get(command, 0),
+                                              "responses": self.received.get(command, 0),
+                                              "captured_responses": self.captured.get(command, 0)}
+                         for command in commands},
+            "counters": self.counters
+        }
+
+
+def print_replay_summary(summary, elapsed, out):
+    print(f"replay finished in {elapsed:.1f}s", file=out)
+    print(f"  {'command':<9}{'sent':>10}{'responses':>11}{'captured':>10}  name", file=out)
+    for command, entry in summary["commands"].items():
+        mark = "" if entry["responses"] == entry["captured_responses"] else "  *"
+        print(f"  {command:<9}{entry['sent']:>10}{entry['responses']:>11}{entry['captured_responses']:>10}  "
+              f"{OPCODES.name(int(command, 16))}{mark}", file=out)
+    for key, value in sorted(summary["counters"].items()):
+        print(f"  {key}: {value}", file=out)
+
+
+# ---------------------------------------------------------------------------
+# 命令行
+# ---------------------------------------------------------------------------
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="抓包 / 原始字节流 / 日志文件（按顺序处理，可为 .gz）")
+    parser.add_argument("--format", choices=("auto", "pcap", "raw", "log"), default="auto", help="输入格式")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="抓包中服务器的 TCP 端口")
+    parser.add_argument("--serial", action="append", help="只处理该序列号（十六进制）的帧，可重复")
+    parser.add_argument("--frames", help="每帧时间线输出文件（.csv 或 JSONL，- 为标准输出）")
+    parser.add_argument("--heartbeats", help="心跳字段输出文件")
+    parser.add_argument("--devices", help="设备汇总输出文件")
+    parser.add_argument("--stats", help="按命令字统计的输出文件")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出终端汇总")
+    parser.add_argument("--replay", metavar="HOST:PORT", help="把设备上行帧回放到运行中的服务器")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放速度倍数，0 表示不等待、尽快发送")
+    parser.add_argument("--response-wait", type=float, default=2.0, help="回放结束后等待应答的秒数")
+    return parser
+
+
+def main():
+    config = build_parser().parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    load_plugins()  # 其他设备型号的命令字名称（LOCK_OPCODE_PLUGINS）
+    serials = {serial.lower() for serial in config.serial} if config.serial else None
+    out = sys.stderr if '-' in (config.frames, config.heartbeats, config.devices, config.stats) else sys.stdout
+
+    stats = DissectorStats()
+    segments = (segment for path in config.inputs for segment in read_segments(path, config.format, config.port, stats))
+    frames = write_frames(decode_frames(segments, stats, serials), config.frames, config.heartbeats)
+    started = time.perf_counter()
+    replay = None
+    try:
+        if config.replay:
+            host, _, port = config.replay.rpartition(':')
+            replay = ReplayClient(host or '127.0.0.1', int(port), config.speed, config.response_wait)
+            asyncio.run(replay.run(frames))
+        else:
+            for _ in frames:
+                pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        frames.close()
+    elapsed = time.perf_counter() - started
+
+    if config.devices:
+        write_records(config.devices, DEVICE_FIELDS,
+                      (device.to_dict(serial) for serial, device in sorted(stats.devices.items())))
+    if config.stats:
+        write_records(config.stats, STATS_FIELDS, stats.command_rows())
+    report = {"commands": stats.command_rows(), "devices": len(stats.devices), "counters": stats.counters,
+              "elapsed": round(elapsed, 3)}
+    if replay is not None:
+        report["replay"] = replay.summary()
+    if config.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False), file=out)
+        return
+    print_summary(stats, elapsed, out)
+    if replay is not None:
+        print_replay_summary(report["replay"], elapsed, out)
+
+
+if __name__ == "__main__":
+    main()
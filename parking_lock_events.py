@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import queue
+import asyncio
+import logging
+import binascii
+import itertools
+
+from parking_lock_metrics import metrics, InstrumentedLock
+
+logger = logging.getLogger("ParkingLockEvents")
+
+# 设备事件推送配置
+LOCK_EVENTS_QUEUE_SIZE = int(os.environ.get('LOCK_EVENTS_QUEUE_SIZE', '1000'))        # 每个订阅者的事件队列上限
+LOCK_EVENTS_MAX_SUBSCRIBERS = int(os.environ.get('LOCK_EVENTS_MAX_SUBSCRIBERS', '100'))
+LOCK_EVENTS_KEEPALIVE = float(os.environ.get('LOCK_EVENTS_KEEPALIVE', '15'))          # 没有事件时发送注释行的间隔（秒）
+LOCK_EVENTS_SLOW_TIMEOUT = float(os.environ.get('LOCK_EVENTS_SLOW_TIMEOUT', '30'))    # 队列持续满超过该秒数即断开订阅者
+
+# 事件类型：设备登录、断开（含超时）、0x60 车状态改变、心跳中字段的变化
+EVENT_TYPES = ("login", "logout", "car_status", "heartbeat")
+
+# 心跳变化事件比较的字段（流水号、地感频率和基准值每次心跳都会变化，不作为变化推送）
+HEARTBEAT_DIFF_FIELDS = ('device_status', 'car_status', 'control_status', 'error_code', 'water_detection',
+                         'action_step', 'battery_3_7v', 'battery_12v', 'signal_strength')
+
+EVENTS_PUBLISHED = metrics.counter("lock_events_published_total", "Device events published to subscribers", ("type",))
+EVENTS_DROPPED = metrics.counter("lock_events_dropped_total", "Device events dropped because a subscriber was too slow")
+
+
+def heartbeat_changes(previous, current, fields=HEARTBEAT_DIFF_FIELDS):
+    """比较两次心跳，返回 {字段: [旧值, 新值]}；没有上一次心跳时旧值为 None"""
+    changes = {}
+    for field in fields:
+        new = getattr(current, field)
+        old = getattr(previous, field) if previous is not None else None
+        if old != new:
+            changes[field] = [old, new]
+    return changes
+
+
+class Subscription:
+    """一个订阅者：有界事件队列和过滤条件
+
+    队列满时丢弃新事件并计数（发布方从不阻塞），下次读取时先通知订阅者有事件丢失，
+    客户端应重新拉取一次完整状态。队列持续满超过 slow_timeout 的订阅者被关闭。
+    waiter 为可选的回调，事件入队后调用，用于唤醒在事件循环中等待的读取方。
+    """
+
+    def __init__(self, serials=None, types=None, queue_size=LOCK_EVENTS_QUEUE_SIZE):
+        self.serials = frozenset(serials) if serials else None
+        self.types = frozenset(types) if types else None
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.reported_dropped = 0
+        self.full_since = None
+        self.closed = False
+        self.waiter = None
+
+    def offer(self, event, slow_timeout):
+        """发布方调用，不阻塞；返回是否入队"""
+        try:
+            self.queue.put_nowait(event)
+            self.full_since = None
+            if self.waiter is not None:
+                self.waiter()
+            return True
+        except queue.Full:
+            self.dropped += 1
+            now = time.monotonic()
+            if self.full_since is None:
+                self.full_since = now
+            elif now - self.full_since > slow_timeout:
+                self.closed = True
+            return False
+
+    def get(self, timeout):
+        """读取下一个事件，超时返回 None"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def take_dropped(self):
+        """返回自上次调用以来丢弃的事件数"""
+        dropped = self.dropped - self.reported_dropped
+        self.reported_dropped += dropped
+        return dropped
+
+
+class EventBroker:
+    """设备事件的进程内发布/订阅
+
+    发布方是设备 I/O 线程（或事件循环），没有订阅者时 publish 立即返回；
+    有订阅者时事件只编码一次，按序列号索引找到关心该设备的订阅者，逐个非阻塞入队。
+    订阅者列表以写时复制的方式发布，发布时不需要加锁。
+    """
+
+    def __init__(self, max_subscribers=LOCK_EVENTS_MAX_SUBSCRIBERS, slow_timeout=LOCK_EVENTS_SLOW_TIMEOUT):
+        self.max_subscribers = max_subscribers
+        self.slow_timeout = slow_timeout
+        self.lock = InstrumentedLock("event_broker")
+        self.subscribers = ()    # 所有订阅者
+        self.wildcard = ()       # 不按序列号过滤的订阅者
+        self.by_serial = {}      # 序列号 -> 订阅该设备的订阅者元组
+        self.sequence = itertools.count(1)
+
+    @property
+    def active(self):
+        """是否有订阅者（发布方据此跳过事件构建）"""
+        return bool(self.subscribers)
+
+    def subscribe(self, serials=None, types=None, queue_size=LOCK_EVENTS_QUEUE_SIZE):
+        """新增订阅者，超过上限时抛出 RuntimeError"""
+        subscription = Subscription(serials, types, queue_size)
+        with self.lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                raise RuntimeError(f"Too many event subscribers ({self.max_subscribers})")
+            self._rebuild(self.subscribers + (subscription,))
+        logger.info(f"Event subscriber added ({len(self.subscribers)} active)")
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscription.closed = True
+        with self.lock:
+            if subscription not in self.subscribers:
+                return
+            self._rebuild(tuple(s for s in self.subscribers if s is not subscription))
+        logger.info(f"Event subscriber removed ({len(self.subscribers)} active)")
+
+    def _rebuild(self, subscribers):
+        by_serial = {}
+        for subscription in subscribers:
+            for serial in subscription.serials or ():
+                by_serial[serial] = by_serial.get(serial, ()) + (subscription,)
+        self.by_serial = by_serial
+        self.wildcard = tuple(s for s in subscribers if s.serials is None)
+        self.subscribers = subscribers
+
+    def publish(self, event_type, serial, data):
+        """发布事件；serial 为 bytes，data 为可 JSON 序列化的字典"""
+        if not self.subscribers:
+            return
+        targets = self.wildcard + self.by_serial.get(serial, ())
+        if not targets:
+            return
+        event = {"id": next(self.sequence), "type": event_type,
+                 "serial": binascii.hexlify(serial).decode('utf-8'), "ts": time.time(), "data": data}
+        self.dispatch(event, serial, targets)
+
+    def dispatch(self, event, serial=None, targets=None):
+        """把已构建的事件分发给订阅者（多进程模式下主进程转发 worker 的事件时直接调用）"""
+        if targets is None:
+            if serial is None:
+                serial = binascii.unhexlify(event["serial"])
+            targets = self.wildcard + self.by_serial.get(serial, ())
+        encoded = None
+        dropped = 0
+        for subscription in targets:
+            if subscription.closed or (subscription.types is not None and event["type"] not in subscription.types):
+                continue
+            if encoded is None:
+                encoded = encode_event(event)
+            if not subscription.offer(encoded, self.slow_timeout):
+                dropped += 1
+        if encoded is not None:
+            EVENTS_PUBLISHED.inc(event["type"])
+        if dropped:
+            EVENTS_DROPPED.inc(amount=dropped)
+
+    def get_stats(self):
+        subscribers = self.subscribers
+        return {
+            "subscribers": len(subscribers),
+            "queued": sum(s.queue.qsize() for s in subscribers),
+            "dropped": sum(s.dropped for s in subscribers)
+        }
+
+
+def encode_event(event):
+    """编码为一条 SSE 消息（id / event / data 三行），所有订阅者共享同一份 bytes"""
+    return (f"id: {event['id']}\nevent: {event['type']}\ndata: ".encode('utf-8')
+            + json.dumps(event, separators=(',', ':')).encode('utf-8') + b"\n\n")
+
+
+def stream_events(subscription, unsubscribe, keepalive=LOCK_EVENTS_KEEPALIVE):
+    """SSE 响应体生成器：输出事件、丢失通知和保活注释，客户端断开或订阅被关闭时调用 unsubscribe"""
+    try:
+        yield b"retry: 3000\n\n"
+        while not subscription.closed:
+            message = subscription.get(keepalive)
+            dropped = subscription.take_dropped()
+            if dropped:
+                yield f"event: overflow\ndata: {json.dumps({'dropped': dropped})}\n\n".encode('utf-8')
+            if message is None:
+                yield b": keepalive\n\n"
+            else:
+                yield message
+    finally:
+        unsubscribe(subscription)
+
+
+async def stream_events_async(subscription, keepalive=LOCK_EVENTS_KEEPALIVE):
+    """stream_events 的异步版本，供异步 API 使用
+
+    读取方不阻塞线程：队列为空时在 asyncio.Event 上等待，由发布方通过 subscription.waiter 唤醒
+    （发布方可能在其他线程，经 call_soon_threadsafe 转交）。退订由调用方负责。
+    """
+    loop = asyncio.get_running_loop()
+    wakeup = asyncio.Event()
+    # 已唤醒时不再重复投递回调，突发事件只唤醒事件循环一次
+    subscription.waiter = lambda: wakeup.is_set() or loop.call_soon_threadsafe(wakeup.set)
+    yield b"retry: 3000\n\n"
+    while not subscription.closed:
+        message = subscription.get(0)
+        if message is None:
+            wakeup.clear()
+            message = subscription.get(0)  # 清除标志后再查一次，避免错过清除前入队的事件
+        if message is None:
+            try:
+                await asyncio.wait_for(wakeup.wait(), keepalive)
+                continue
+            except asyncio.TimeoutError:
+                pass
+        dropped = subscription.take_dropped()
+        if dropped:
+            yield f"event: overflow\ndata: {json.dumps({'dropped': dropped})}\n\n".encode('utf-8')
+        yield message if message is not None else b": keepalive\n\n"
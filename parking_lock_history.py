@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import queue
+import sqlite3
+import logging
+import calendar
+import threading
+
+from parking_lock_metrics import metrics
+
+logger = logging.getLogger("ParkingLockHistory")
+
+# 心跳历史存储配置（LOCK_HISTORY_DB 设为空字符串可关闭）
+LOCK_HISTORY_DB = os.environ.get('LOCK_HISTORY_DB', 'parking_lock_history.db')
+LOCK_HISTORY_QUEUE_SIZE = int(os.environ.get('LOCK_HISTORY_QUEUE_SIZE', '100000'))  # 待写入队列上限，满了直接丢弃
+LOCK_HISTORY_BATCH_SIZE = int(os.environ.get('LOCK_HISTORY_BATCH_SIZE', '2000'))    # 每个事务最多写入的心跳数
+LOCK_HISTORY_FLUSH_INTERVAL = float(os.environ.get('LOCK_HISTORY_FLUSH_INTERVAL', '1.0'))  # 批量未满时最长等待秒数
+# 各精度的保留天数：原始心跳、1 分钟聚合、1 小时聚合
+LOCK_HISTORY_RAW_DAYS = float(os.environ.get('LOCK_HISTORY_RAW_DAYS', '3'))
+LOCK_HISTORY_MINUTE_DAYS = float(os.environ.get('LOCK_HISTORY_MINUTE_DAYS', '30'))
+LOCK_HISTORY_HOUR_DAYS = float(os.environ.get('LOCK_HISTORY_HOUR_DAYS', '730'))
+LOCK_HISTORY_MAX_POINTS = int(os.environ.get('LOCK_HISTORY_MAX_POINTS', '10000'))  # 单次查询返回的最大点数
+
+# 原始心跳保存的字段；聚合表只对数值型字段保存 总和/最小/最大
+RAW_FIELDS = ('battery_12v', 'battery_3_7v', 'signal_strength', 'current_frequency',
+              'device_status', 'car_status', 'error_code')
+ROLLUP_FIELDS = ('battery_12v', 'battery_3_7v', 'signal_strength', 'current_frequency')
+
+DAY = 86400
+
+# 精度 -> (聚合桶秒数, 分区秒数或 'month', 表名前缀)；原始心跳按天分区，1 小时聚合按月分区
+LEVELS = {
+    "raw": (0, DAY, "hb_raw"),
+    "1m": (60, DAY, "hb_1m"),
+    "1h": (3600, "month", "hb_1h"),
+}
+
+# 自动选择精度时，各精度能覆盖的最大查询跨度（秒）
+AUTO_RESOLUTION_SPANS = (("raw", 6 * 3600), ("1m", 7 * DAY), ("1h", float("inf")))
+
+# 聚合桶结束后再等待的秒数，给迟到的心跳留出时间
+ROLLUP_GRACE = 5
+
+HISTORY_FLUSH_SECONDS = metrics.histogram("lock_history_flush_seconds", "Time to write one history batch to SQLite")
+
+
+def partition_start(level, ts):
+    """时间戳所在分区的起始时间（UTC）"""
+    period = LEVELS[level][1]
+    if period == "month":
+        year, month = time.gmtime(ts)[:2]
+        return calendar.timegm((year, month, 1, 0, 0, 0))
+    return int(ts // period * period)
+
+
+def partition_end(level, start):
+    period = LEVELS[level][1]
+    if period == "month":
+        year, month = time.gmtime(start)[:2]
+        return calendar.timegm((year + month // 12, month % 12 + 1, 1, 0, 0, 0))
+    return start + period
+
+
+def _partition_pattern(level):
+    return "%Y%m" if LEVELS[level][1] == "month" else "%Y%m%d"
+
+
+def partition_table(level, start):
+    """分区表名，例如 hb_raw_20261018、hb_1h_202610"""
+    return f"{LEVELS[level][2]}_{time.strftime(_partition_pattern(level), time.gmtime(start))}"
+
+
+def _table_schema(level, table):
+    if level == "raw":
+        columns = ", ".join(f"{field} REAL" if field == "battery_12v" else f"{field} INTEGER" for field in RAW_FIELDS)
+    else:
+        columns = "samples INTEGER NOT NULL, " + ", ".join(
+            f"{field}_sum REAL, {field}_min REAL, {field}_max REAL" for field in ROLLUP_FIELDS)
+    # 以 (序列号, 时间) 为主键的 WITHOUT ROWID 表按主键聚簇存储，单设备时间范围查询只读取相关的页
+    return (f"CREATE TABLE IF NOT EXISTS {table} (serial BLOB NOT NULL, ts REAL NOT NULL, {columns}, "
+            f"PRIMARY KEY (serial, ts)) WITHOUT ROWID")
+
+
+class _Rollup:
+    """一个 (设备, 聚合桶) 的累加器"""
+
+    __slots__ = ('samples', 'sums', 'mins', 'maxs')
+
+    def __init__(self):
+        self.samples = 0
+        self.sums = [0.0] * len(ROLLUP_FIELDS)
+        self.mins = [None] * len(ROLLUP_FIELDS)
+        self.maxs = [None] * len(ROLLUP_FIELDS)
+
+    def add(self, sums, samples=1, mins=None, maxs=None):
+        """累加一条心跳（只传 sums 时即为各字段的值），或合并另一个桶的 总和/最小/最大"""
+        self.samples += samples
+        mins = mins or sums
+        maxs = maxs or sums
+        for i in range(len(ROLLUP_FIELDS)):
+            self.sums[i] += sums[i]
+            if self.mins[i] is None or mins[i] < self.mins[i]:
+                self.mins[i] = mins[i]
+            if self.maxs[i] is None or maxs[i] > self.maxs[i]:
+                self.maxs[i] = maxs[i]
+
+    def merge(self, other):
+        self.add(other.sums, other.samples, other.mins, other.maxs)
+
+    def row(self, serial, bucket):
+        values = [serial, bucket, self.samples]
+        for i in range(len(ROLLUP_FIELDS)):
+            values += [self.sums[i], self.mins[i], self.maxs[i]]
+        return values
+
+
+class HeartbeatHistory:
+    """心跳时间序列存储（SQLite WAL）
+
+    心跳处理线程只把需要保存的字段放入有界队列（不阻塞）；写线程按批在一个事务中写入
+    按天分区的原始表，同时在内存中累加 1 分钟 / 1 小时聚合，桶结束后以 upsert 合并写入，
+    因此聚合不需要回扫原始数据，进程重启或多个 worker 写同一设备时结果也可以相加合并。
+    保留期以分区为单位删除整张表，不做全表扫描。查询按主键 (序列号, 时间) 读取覆盖的分区。
+    """
+
+    _STOP = object()
+
+    def __init__(self, path=LOCK_HISTORY_DB, queue_size=LOCK_HISTORY_QUEUE_SIZE, batch_size=LOCK_HISTORY_BATCH_SIZE,
+                 flush_interval=LOCK_HISTORY_FLUSH_INTERVAL):
+        self.path = path
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.retention = {"raw": LOCK_HISTORY_RAW_DAYS * DAY, "1m": LOCK_HISTORY_MINUTE_DAYS * DAY,
+                          "1h": LOCK_HISTORY_HOUR_DAYS * DAY}
+        self.writer = None
+        self.local = threading.local()  # 查询线程各自的只读连接
+        self.readers = []               # 所有查询线程的只读连接，stop() 时关闭
+        self.readers_lock = threading.Lock()
+        # 以下只由写线程访问
+        self.tables = set()
+        self.minutes = {}  # (序列号, 分钟桶) -> _Rollup
+        self.hours = {}    # (序列号, 小时桶) -> _Rollup
+        self.next_retention = 0
+        self.stats_lock = threading.Lock()
+        self.counters = {"recorded": 0, "dropped": 0, "written": 0, "batches": 0, "errors": 0}
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def start(self):
+        """启动写线程"""
+        if not self.enabled or self.writer is not None:
+            return
+        self.writer = threading.Thread(target=self._run, name="history-writer")
+        self.writer.daemon = True
+        self.writer.start()
+        logger.info(f"Heartbeat history enabled: {self.path}")
+
+    def stop(self, timeout=10):
+        """停止写线程，写完队列中剩余的心跳并写出未完成的聚合桶，关闭查询连接"""
+        self._close_readers()
+        writer, self.writer = self.writer, None
+        if writer is None:
+            return
+        try:
+            self.queue.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        writer.join(timeout=timeout)
+
+    def record(self, serial, heartbeat, ts):
+        """记录一条心跳，不阻塞调用方；队列满或未启用时返回 False"""
+        if self.writer is None:
+            return False
+        try:
+            self.queue.put_nowait((serial, ts, heartbeat.battery_12v, heartbeat.battery_3_7v,
+                                   heartbeat.signal_strength, heartbeat.current_frequency,
+                                   heartbeat.device_status, heartbeat.car_status, heartbeat.error_code))
+        except queue.Full:
+            with self.stats_lock:
+                self.counters["dropped"] += 1
+            return False
+        with self.stats_lock:
+            self.counters["recorded"] += 1
+        return True
+
+    def get_stats(self):
+        with self.stats_lock:
+            stats = dict(self.counters)
+        stats["queue_depth"] = self.queue.qsize()
+        stats["enabled"] = self.enabled
+        return stats
+
+    # ---- 写线程 ----
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _run(self):
+        connection = self._connect()
+        try:
+            stopping = False
+            while not stopping:
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self.queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if item is self._STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+                self._flush(connection, batch, final=stopping)
+        finally:
+            connection.close()
+
+    def _ensure_table(self, connection, level, start):
+        table = partition_table(level, start)
+        if table not in self.tables:
+            connection.execute(_table_schema(level, table))
+            self.tables.add(table)
+        return table
+
+    def _flush(self, connection, batch, final=False):
+        """在一个事务中写入原始心跳、已结束的聚合桶，并按需删除过期分区"""
+        started = time.perf_counter()
+        now = time.time()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            if batch:
+                self._write_raw(connection, batch)
+            self._write_rollups(connection, now, final)
+            if now >= self.next_retention:
+                self._apply_retention(connection, now)
+                self.next_retention = now + 600
+            connection.execute("COMMIT")
+        except sqlite3.Error as e:
+            logger.error(f"Failed to write heartbeat history: {e}")
+            try:
+                connection.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            with self.stats_lock:
+                self.counters["errors"] += 1
+            return
+        HISTORY_FLUSH_SECONDS.observe(time.perf_counter() - started)
+        with self.stats_lock:
+            self.counters["written"] += len(batch)
+            self.counters["batches"] += 1
+
+    def _write_raw(self, connection, batch):
+        partitions = {}
+        for item in batch:
+            partitions.setdefault(partition_start("raw", item[1]), []).append(item)
+            # 数值字段累加到 1 分钟桶（字段顺序与 ROLLUP_FIELDS 一致）
+            key = (item[0], int(item[1] // 60 * 60))
+            rollup = self.minutes.get(key)
+            if rollup is None:
+                rollup = self.minutes[key] = _Rollup()
+            rollup.add(item[2:2 + len(ROLLUP_FIELDS)])
+
+        placeholders = ", ".join("?" * (2 + len(RAW_FIELDS)))
+        for start, rows in partitions.items():
+            table = self._ensure_table(connection, "raw", start)
+            connection.executemany(f"INSERT OR REPLACE INTO {table} (serial, ts, {', '.join(RAW_FIELDS)}) "
+                                   f"VALUES ({placeholders})", rows)
+
+    def _upsert_rollups(self, connection, level, rollups):
+        columns = ["samples"] + [f"{field}_{kind}" for field in ROLLUP_FIELDS for kind in ("sum", "min", "max")]
+        updates = ["samples = samples + excluded.samples"]
+        for field in ROLLUP_FIELDS:
+            updates += [f"{field}_sum = {field}_sum + excluded.{field}_sum",
+                        f"{field}_min = min({field}_min, excluded.{field}_min)",
+                        f"{field}_max = max({field}_max, excluded.{field}_max)"]
+        partitions = {}
+        for (serial, bucket), rollup in rollups:
+            partitions.setdefault(partition_start(level, bucket), []).append(rollup.row(serial, bucket))
+        for start, rows in partitions.items():
+            table = self._ensure_table(connection, level, start)
+            connection.executemany(
+                f"INSERT INTO {table} (serial, ts, {', '.join(columns)}) VALUES ({', '.join('?' * (2 + len(columns)))}) "
+                f"ON CONFLICT (serial, ts) DO UPDATE SET {', '.join(updates)}", rows)
+
+    def _write_rollups(self, connection, now, final):
+        """写出已结束（或停止时全部）的 1 分钟桶，并把它们并入 1 小时桶"""
+        done = [(key, rollup) for key, rollup in self.minutes.items()
+                if final or key[1] + 60 + ROLLUP_GRACE <= now]
+        if done:
+            self._upsert_rollups(connection, "1m", done)
+            for (serial, minute), rollup in done:
+                del self.minutes[(serial, minute)]
+                key = (serial, minute // 3600 * 3600)
+                hour = self.hours.get(key)
+                if hour is None:
+                    hour = self.hours[key] = _Rollup()
+                hour.merge(rollup)
+
+        done = [(key, rollup) for key, rollup in self.hours.items()
+                if final or key[1] + 3600 + ROLLUP_GRACE <= now]
+        if done:
+            self._upsert_rollups(connection, "1h", done)
+            for key, _ in done:
+                del self.hours[key]
+
+    def _apply_retention(self, connection, now):
+        """删除整个分区都超出保留期的表"""
+        for level in LEVELS:
+            cutoff = now - self.retention[level]
+            for start, table in self._partitions(connection, level):
+                if partition_end(level, start) <= cutoff:
+                    connection.execute(f"DROP TABLE IF EXISTS {table}")
+                    self.tables.discard(table)
+                    logger.info(f"Dropped expired history partition {table}")
+
+    @staticmethod
+    def _partitions(connection, level):
+        """列出某个精度的所有分区，返回 [(起始时间, 表名)]"""
+        prefix = LEVELS[level][2] + "_"
+        rows = connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ?",
+                                  (prefix + "%",)).fetchall()
+        partitions = []
+        for (name,) in rows:
+            try:
+                parsed = time.strptime(name[len(prefix):], _partition_pattern(level))
+            except ValueError:
+                continue
+            partitions.append((calendar.timegm(parsed), name))
+        return sorted(partitions)
+
+    # ---- 查询 ----
+
+    def _reader(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30, check_same_thread=False)
+            self.local.connection = connection
+            with self.readers_lock:
+                self.readers.append(connection)
+        return connection
+
+    def _close_readers(self):
+        """关闭所有查询线程的只读连接；之后的查询重新打开连接"""
+        with self.readers_lock:
+            readers, self.readers = self.readers, []
+            self.local = threading.local()
+        for connection in readers:
+            connection.close()
+
+    @staticmethod
+    def choose_resolution(start, end):
+        """按查询跨度选择精度"""
+        span = end - start
+        for level, limit in AUTO_RESOLUTION_SPANS:
+            if span <= limit:
+                return level
+        return "1h"
+
+    def query(self, serial, start, end, fields=None, resolution="auto", limit=LOCK_HISTORY_MAX_POINTS):
+        """查询设备在 [start, end] 内的历史，返回 (精度, 点列表)
+
+        原始精度的点为 {"ts", 字段...}；聚合精度的点为 {"ts", "samples", 字段(平均值), 字段_min, 字段_max}。
+        最近一个尚未结束的聚合桶要在桶结束后才会出现在聚合结果中。
+        """
+        if resolution == "auto":
+            resolution = self.choose_resolution(start, end)
+        if resolution not in LEVELS:
+            raise ValueError(f"Unknown resolution: {resolution}")
+        available = RAW_FIELDS if resolution == "raw" else ROLLUP_FIELDS
+        fields = [field for field in (fields or available) if field in available]
+        if not fields:
+            raise ValueError(f"No valid fields for resolution {resolution}, available: {', '.join(available)}")
+
+        if resolution == "raw":
+            columns = ["ts"] + list(fields)
+        else:
+            columns = ["ts", "samples"] + [f"{field}_{kind}" for field in fields for kind in ("sum", "min", "max")]
+
+        if not os.path.exists(self.path):
+            return resolution, []
+        bucket = LEVELS[resolution][0]
+        if bucket:
+            start = start // bucket * bucket  # 包含与查询范围部分重叠的第一个聚合桶
+        connection = self._reader()
+        points = []
+        for table_start, table in self._partitions(connection, resolution):
+            if partition_end(resolution, table_start) <= start or table_start > end:
+                continue
+            try:
+                rows = connection.execute(
+                    f"SELECT {', '.join(columns)} FROM {table} WHERE serial = ? AND ts >= ? AND ts <= ? "
+                    f"ORDER BY ts LIMIT ?", (serial, start, end, limit - len(points))).fetchall()
+            except sqlite3.OperationalError:
+                continue  # 分区在查询期间被保留期清理删除
+            for row in rows:
+                if resolution == "raw":
+                    points.append(dict(zip(columns, row)))
+                    continue
+                point = {"ts": row[0], "samples": row[1]}
+                for i, field in enumerate(fields):
+                    total, low, high = row[2 + i * 3:5 + i * 3]
+                    point[field] = round(total / row[1], 3) if row[1] else None
+                    point[f"{field}_min"] = low
+                    point[f"{field}_max"] = high
+                points.append(point)
+            if len(points) >= limit:
+                break
+        return resolution, points
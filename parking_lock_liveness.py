@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import socket
+import logging
+import binascii
+
+from parking_lock_metrics import metrics, InstrumentedLock
+
+logger = logging.getLogger("ParkingLockServer")
+
+# 连接存活检测配置
+LOCK_DEVICE_TIMEOUT = float(os.environ.get('LOCK_DEVICE_TIMEOUT', '180'))  # 已登录设备超过该秒数没有任何帧即判定离线
+LOCK_LOGIN_TIMEOUT = float(os.environ.get('LOCK_LOGIN_TIMEOUT', '60'))     # 建立连接后超过该秒数仍未登录即关闭
+# 线程模式下 recv 的超时（秒，0 表示不设置），作为时间轮检测之外的兜底
+LOCK_RECV_TIMEOUT = float(os.environ.get('LOCK_RECV_TIMEOUT', '300'))
+# TCP keepalive：空闲多少秒后开始探测、探测间隔、探测失败几次后内核断开连接（LOCK_TCP_KEEPALIVE=0 关闭）
+LOCK_TCP_KEEPALIVE = os.environ.get('LOCK_TCP_KEEPALIVE', '1') == '1'
+LOCK_TCP_KEEPIDLE = int(os.environ.get('LOCK_TCP_KEEPIDLE', '60'))
+LOCK_TCP_KEEPINTVL = int(os.environ.get('LOCK_TCP_KEEPINTVL', '10'))
+LOCK_TCP_KEEPCNT = int(os.environ.get('LOCK_TCP_KEEPCNT', '5'))
+LOCK_OFFLINE_MAX = int(os.environ.get('LOCK_OFFLINE_MAX', '100000'))  # 离线设备列表最多保留的设备数
+
+CONNECTIONS_REAPED = metrics.counter("lock_connections_reaped_total",
+                                     "Connections closed by the liveness checker", ("reason",))
+DEVICES_OFFLINE = metrics.counter("lock_devices_offline_total", "Logged-in devices that went offline", ("reason",))
+
+
+def configure_keepalive(sock):
+    """为设备连接开启 TCP keepalive，由内核探测并断开半开连接（平台不支持的选项跳过）"""
+    if not LOCK_TCP_KEEPALIVE or sock is None:
+        return
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for option, value in (("TCP_KEEPIDLE", LOCK_TCP_KEEPIDLE), ("TCP_KEEPINTVL", LOCK_TCP_KEEPINTVL),
+                              ("TCP_KEEPCNT", LOCK_TCP_KEEPCNT)):
+            if hasattr(socket, option):
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+    except OSError as e:
+        logger.warning(f"Failed to enable TCP keepalive: {e}")
+
+
+class LivenessMonitor:
+    """连接存活检测与离线设备记录
+
+    每个连接在时间轮上只挂一个检查定时项。收到帧时只更新 connection.last_seen（O(1)，不加锁、
+    不操作时间轮）；定时项到期时若连接期间有过活动，就按剩余时间重新挂到时间轮上（惰性重排），
+    否则判定超时并关闭连接，由连接的断开流程移除设备登记并上报离线。
+    未登录的连接使用较短的登录超时，避免只建连不登录的连接长期占用线程和缓冲区。
+    """
+
+    def __init__(self, timer_wheel, device_timeout=LOCK_DEVICE_TIMEOUT, login_timeout=LOCK_LOGIN_TIMEOUT,
+                 max_offline=LOCK_OFFLINE_MAX):
+        self.timer_wheel = timer_wheel
+        self.device_timeout = device_timeout
+        self.login_timeout = login_timeout
+        self.max_offline = max_offline
+        self.lock = InstrumentedLock("offline_devices")
+        self.offline = {}  # 序列号 -> 离线记录（按离线时间先后插入）
+
+    def watch(self, connection):
+        """新连接建立时开始检测"""
+        connection.last_seen = time.monotonic()
+        connection.liveness_timer = self.timer_wheel.schedule(self.login_timeout, self._check, connection)
+
+    def unwatch(self, connection):
+        """连接关闭时取消检测"""
+        timer, connection.liveness_timer = connection.liveness_timer, None
+        if timer is not None:
+            timer.cancel()
+
+    def _check(self, connection):
+        """时间轮线程中执行：连接仍有活动则按剩余时间重排，否则关闭"""
+        if connection.liveness_timer is None:
+            return
+        timeout = self.device_timeout if connection.serial else self.login_timeout
+        idle = time.monotonic() - connection.last_seen
+        if idle < timeout:
+            connection.liveness_timer = self.timer_wheel.schedule(timeout - idle, self._check, connection)
+            return
+
+        connection.liveness_timer = None
+        reason = "heartbeat_timeout" if connection.serial else "login_timeout"
+        connection.close_reason = reason
+        CONNECTIONS_REAPED.inc(reason)
+        if connection.serial:
+            logger.warning(f"Device {binascii.hexlify(connection.serial)} at {connection.address} "
+                           f"silent for {idle:.0f}s, closing connection")
+        else:
+            logger.info(f"Connection from {connection.address} did not log in within {idle:.0f}s, closing")
+        connection.close()
+
+    def mark_online(self, serial):
+        """设备登录后从离线列表移除"""
+        if serial in self.offline:
+            with self.lock:
+                self.offline.pop(serial, None)
+
+    def mark_offline(self, entry, reason):
+        """记录设备离线，返回离线记录（同时作为 Webhook 离线事件的内容）"""
+        record = {
+            "serial": binascii.hexlify(entry.serial).decode('utf-8'),
+            "address": entry.address,
+            "reason": reason,
+            "login_time": entry.login_time,
+            "last_heartbeat": entry.last_heartbeat,
+            "offline_since": time.time(),
+            "device_status": entry.heartbeat.device_status if entry.heartbeat is not None else None,
+            "car_status": entry.heartbeat.car_status if entry.heartbeat is not None else None
+        }
+        DEVICES_OFFLINE.inc(reason)
+        with self.lock:
+            self.offline.pop(entry.serial, None)
+            self.offline[entry.serial] = record
+            while len(self.offline) > self.max_offline:
+                del self.offline[next(iter(self.offline))]
+        return record
+
+    def get_offline_devices(self):
+        """离线设备列表，最近离线的在前"""
+        with self.lock:
+            records = list(self.offline.values())
+        records.reverse()
+        return records
+
+    def __len__(self):
+        return len(self.offline)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import binascii
+import threading
+import logging.handlers
+
+# 日志配置
+LOCK_LOG_LEVEL = os.environ.get('LOCK_LOG_LEVEL', 'INFO').upper()
+LOCK_LOG_FORMAT = os.environ.get('LOCK_LOG_FORMAT', 'text')  # text 或 json（结构化，每行一个 JSON 对象）
+LOCK_LOG_MAX_BYTES = int(os.environ.get('LOCK_LOG_MAX_BYTES', str(50 * 1024 * 1024)))  # 单个日志文件上限
+LOCK_LOG_BACKUPS = int(os.environ.get('LOCK_LOG_BACKUPS', '5'))  # 保留的轮转文件数
+# INFO 级别下同一设备同一命令字同一方向的帧，每隔多少秒输出一次 FULL FRAME（0 表示每帧都输出）
+LOCK_LOG_FRAME_SAMPLE_INTERVAL = float(os.environ.get('LOCK_LOG_FRAME_SAMPLE_INTERVAL', '60'))
+# 需要完整帧解析的设备序列号（十六进制，逗号分隔），这些设备的帧不采样并按 INFO 输出帧结构。
+# 由 configure_logging() 解析后原地填入 LOCK_LOG_SERIALS，无效的序列号记录警告后跳过
+LOCK_LOG_SERIALS_TEXT = os.environ.get('LOCK_LOG_SERIALS', '')
+LOCK_LOG_SERIALS = set()
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """结构化日志：每条记录一行 JSON，附带 serial / command / direction 等 extra 字段"""
+
+    EXTRA_FIELDS = ('serial', 'command', 'direction', 'address')
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        for field in self.EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def configure_logging(log_file, level=LOCK_LOG_LEVEL, log_format=LOCK_LOG_FORMAT, force=False,
+                      serials=LOCK_LOG_SERIALS_TEXT):
+    """配置根日志：记录先放入内存队列，由 QueueListener 线程写入轮转文件和标准输出
+
+    与 logging.basicConfig 一样只有第一次调用生效；force=True 时停止原有监听线程并重新配置
+    （例如多进程模式下每个 worker 改用自己的日志文件）。serials 为 LOCK_LOG_SERIALS 白名单。返回 QueueListener。
+    """
+    global _listener
+    with _listener_lock:
+        root = logging.getLogger()
+        if _listener is not None or root.handlers:
+            if not force:
+                return _listener
+            if _listener is not None:
+                _listener.stop()
+                _listener = None
+            for handler in list(root.handlers):
+                root.removeHandler(handler)
+                handler.close()
+
+        formatter = JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT)
+        handlers = [
+            logging.handlers.RotatingFileHandler(log_file, maxBytes=LOCK_LOG_MAX_BYTES,
+                                                 backupCount=LOCK_LOG_BACKUPS, encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        log_queue = queue.SimpleQueue()
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+        root.setLevel(level)
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        LOCK_LOG_SERIALS.clear()
+        LOCK_LOG_SERIALS.update(parse_log_serials(serials))
+        return _listener
+
+
+def parse_log_serials(text):
+    """解析逗号分隔的十六进制序列号，跳过（并记录）不是 8 字节十六进制的项"""
+    serials = set()
+    for item in text.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            serial = binascii.unhexlify(item)
+        except (binascii.Error, ValueError):
+            serial = None
+        if serial is None or len(serial) != 8:
+            logging.getLogger("ParkingLockServer").warning(f"Ignoring invalid serial in LOCK_LOG_SERIALS: {item!r}")
+            continue
+        serials.add(serial)
+    return serials
+
+
+def stop_logging():
+    """停止监听线程并写出队列中剩余的日志"""
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+atexit.register(stop_logging)
+
+
+class FrameLogSampler:
+    """按 (设备, 命令字, 方向) 对帧日志采样，每个键在 interval 秒内只放行一次"""
+
+    def __init__(self, interval=LOCK_LOG_FRAME_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.last_logged = {}  # 序列号 -> {(命令字, 方向): 上次输出时间}
+        self.suppressed = 0
+
+    def should_log(self, serial, command, direction):
+        if self.interval <= 0:
+            return True
+        now = time.monotonic()
+        device = self.last_logged.get(serial)
+        if device is None:
+            device = self.last_logged[serial] = {}
+        last = device.get((command, direction))
+        if last is not None and now - last < self.interval:
+            self.suppressed += 1
+            return False
+        # 多线程下偶尔多放行一条无关紧要，不加锁
+        device[(command, direction)] = now
+        return True
+
+    def forget(self, serial):
+        """设备断开后清除其采样记录"""
+        self.last_logged.pop(serial, None)
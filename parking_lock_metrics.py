@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import math
+import time
+import bisect
+import threading
+
+# 帧解析/处理耗时的直方图分桶（秒），心跳处理通常在几十微秒量级
+FRAME_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+# 网络往返（Webhook 请求、命令发送/响应）的直方图分桶（秒）
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# 锁等待时间的直方图分桶（秒），只在发生争用时记录
+LOCK_WAIT_BUCKETS = (0.000001, 0.00001, 0.0001, 0.001, 0.01, 0.1, 1)
+
+# 命令字标签，避免在每帧上格式化十六进制字符串
+COMMAND_LABELS = tuple(f"0x{command:02X}" for command in range(256))
+
+
+class _Metric:
+    """带标签的指标基类，values 以标签值元组为键"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def collect(self):
+        """返回可 JSON 序列化的指标族，供文本输出或跨进程合并"""
+        with self.lock:
+            samples = [[list(key), self._export(value)] for key, value in self.values.items()]
+        return {"name": self.name, "type": self.kind, "help": self.documentation,
+                "labels": list(self.labels), "samples": samples}
+
+    @staticmethod
+    def _export(value):
+        return value
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """可增可减的瞬时值"""
+
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Histogram(_Metric):
+    """固定分桶直方图
+
+    每个标签组合保存各桶计数（非累计）、总和；输出时再转换为 Prometheus 的累计桶。
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def time(self, *labels):
+        """上下文管理器：记录代码块耗时"""
+        return _Timer(self, labels)
+
+    def collect(self):
+        family = super().collect()
+        family["buckets"] = list(self.buckets)
+        return family
+
+    @staticmethod
+    def _export(value):
+        return [list(value[0]), value[1]]
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class MetricsRegistry:
+    """进程内指标注册表
+
+    指标按名称注册一次（重复注册返回同一对象），热路径上只做一次加锁的字典更新。
+    collect() 返回的指标族是普通字典，可以通过多进程控制通道传输后用 merge_metrics 合并。
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} already registered as {metric.kind}")
+            return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter, name, documentation, labels)
+
+    def gauge(self, name, documentation, labels=()):
+        return self._register(Gauge, name, documentation, labels)
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram, name, documentation, labels, buckets)
+
+    def collect(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return [metric.collect() for metric in metrics]
+
+
+# 全局注册表，各模块在导入时注册自己的指标
+metrics = MetricsRegistry()
+
+# 锁等待时间，由 InstrumentedLock 记录
+LOCK_WAIT = metrics.histogram("lock_wait_seconds", "Time spent waiting for a contended lock",
+                              ("lock",), LOCK_WAIT_BUCKETS)
+
+
+class InstrumentedLock:
+    """记录争用情况的互斥锁
+
+    先以非阻塞方式获取，成功时与普通 Lock 开销相当；只有需要等待时才计时并记入 lock_wait_seconds。
+    """
+
+    __slots__ = ('lock', 'name')
+
+    def __init__(self, name):
+        self.lock = threading.Lock()
+        self.name = name
+
+    def acquire(self):
+        if not self.lock.acquire(False):
+            started = time.perf_counter()
+            self.lock.acquire()
+            LOCK_WAIT.observe(time.perf_counter() - started, self.name)
+        return True
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+
+
+def gauge_family(name, documentation, value):
+    """构造一个无标签的瞬时值指标族（用于查询时从现有统计生成的指标）"""
+    return {"name": name, "type": "gauge", "help": documentation, "labels": [], "samples": [[[], value]]}
+
+
+def counter_family(name, documentation, value, label=None):
+    """由现有统计构造计数器指标族；指定 label 时 value 为 {标签值: 计数}"""
+    if label is None:
+        return {"name": name, "type": "counter", "help": documentation, "labels": [], "samples": [[[], value]]}
+    return {"name": name, "type": "counter", "help": documentation, "labels": [label],
+            "samples": [[[key], count] for key, count in value.items()]}
+
+
+def merge_metrics(collections):
+    """合并多个进程的指标族：同名同标签的计数器、瞬时值、直方图逐项相加"""
+    merged = {}
+    for families in collections:
+        for family in families:
+            target = merged.get(family["name"])
+            if target is None:
+                target = merged[family["name"]] = dict(family, samples={})
+            for labels, value in family["samples"]:
+                key = tuple(labels)
+                current = target["samples"].get(key)
+                if current is None:
+                    target["samples"][key] = value
+                elif family["type"] == "histogram":
+                    target["samples"][key] = [[a + b for a, b in zip(current[0], value[0])], current[1] + value[1]]
+                else:
+                    target["samples"][key] = current + value
+    for family in merged.values():
+        family["samples"] = [[list(key), value] for key, value in family["samples"].items()]
+    return list(merged.values())
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def render_metrics(families):
+    """按 Prometheus 文本格式 (0.0.4) 输出指标族"""
+    lines = []
+    for family in sorted(families, key=lambda f: f["name"]):
+        name = family["name"]
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        for labels, value in sorted(family["samples"], key=lambda s: s[0]):
+            if family["type"] == "histogram":
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(family["buckets"] + [float("inf")], counts):
+                    cumulative += count
+                    label_text = _format_labels(family["labels"], labels, ("le", _format_value(float(bound))))
+                    lines.append(f"{name}_bucket{label_text} {cumulative}")
+                label_text = _format_labels(family["labels"], labels)
+                lines.append(f"{name}_sum{label_text} {_format_value(float(total))}")
+                lines.append(f"{name}_count{label_text} {cumulative}")
+            else:
+                lines.append(f"{name}{_format_labels(family['labels'], labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def histogram_delta(after, before=None):
+    """两次采集之间的直方图增量：返回 {标签值元组: (各桶计数, 总和)}"""
+    previous = {tuple(labels): value for labels, value in before["samples"]} if before else {}
+    delta = {}
+    for labels, (counts, total) in after["samples"]:
+        old = previous.get(tuple(labels))
+        if old is not None:
+            counts = [a - b for a, b in zip(counts, old[0])]
+            total -= old[1]
+        if sum(counts):
+            delta[tuple(labels)] = (counts, total)
+    return delta
+
+
+def histogram_quantile(q, buckets, counts):
+    """按分桶计数估计分位数（桶内线性插值，与 Prometheus histogram_quantile 相同）"""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    cumulative = 0
+    lower = 0.0
+    for bound, count in zip(list(buckets) + [float("inf")], counts):
+        if cumulative + count >= rank and count:
+            if bound == float("inf"):
+                return lower  # 落在最后一个桶时只能给出下界
+            return lower + (bound - lower) * (rank - cumulative) / count
+        cumulative += count
+        lower = bound
+    return lower
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import struct
+import logging
+import threading
+import importlib
+
+logger = logging.getLogger("ParkingLockServer")
+
+# 启动时导入的命令字扩展模块（逗号分隔的模块名），模块在导入时调用 OPCODES.register() 注册其他型号的命令字
+LOCK_OPCODE_PLUGINS = os.environ.get('LOCK_OPCODE_PLUGINS', '')
+
+# 方向：设备上报、服务器应答（up），或服务器下发、设备回应（down）
+UPLINK = "up"
+DOWNLINK = "down"
+
+# 应答策略：不应答、载荷为当前时间戳（秒，小端序）、载荷固定为 0x01（成功）
+RESPOND_NONE = "none"
+RESPOND_TIMESTAMP = "timestamp"
+RESPOND_ACK = "ack"
+
+# 心跳载荷布局（小端序，共 38 字节，第 39 字节常控状态为可选）:
+# 序列号(8s) 动作步骤(B) 进水检测(B) 3.7V电量(B) 4G信号(B) 流水号(I) 设备类型(B) 12V电量(B)
+# 设备状态(B) 是否有车(B) 错误号(H) 当前地感频率(I) 无车基准(I) 有车基准(I) 有车万分比(H) 无车万分比(H)
+HEARTBEAT_STRUCT = struct.Struct('<8sBBBBIBBBBHIIIHH')
+HEARTBEAT_FIELDS = ('serial', 'action_step', 'water_detection', 'battery_3_7v', 'signal_strength', 'flow_number',
+                    'device_type', 'battery_12v_raw', 'device_status', 'car_status', 'error_code',
+                    'current_frequency', 'no_car_base', 'car_base', 'car_ratio', 'no_car_ratio')
+
+
+class Opcode:
+    """一个命令字的声明
+
+    layout 为载荷布局（struct 格式或 struct.Struct，None 表示不解析），fields 为各字段的名称：
+    上行命令字描述设备发来的载荷，下行命令字描述服务器下发的载荷（设备回应的载荷由处理函数自行解析）。
+    handler 为服务器方法名，或 handler(server, connection, opcode, payload) 形式的函数，在应答之后调用；
+    response 为应答策略，response_name 为应答帧在日志中的名称。
+    api_name 为命令在 API（批量命令）、统计和工具中使用的英文名称；
+    target_status / failed_status 为下行命令执行完成 / 失败时心跳中的设备状态（None / 空表示不按心跳判断）；
+    outbox_kind 为离线设备发件箱中的去重类别（None 表示该命令不进入发件箱）。
+    serial_prefixed 和 flow_number 由载荷布局得出：载荷以 8 字节序列号开头、其后为 4 字节流水号。
+    """
+
+    __slots__ = ('code', 'name', 'direction', 'layout', 'fields', 'handler', 'response', 'response_name',
+                 'api_name', 'target_status', 'failed_status', 'outbox_kind', 'serial_prefixed', 'flow_number')
+
+    def __init__(self, code, name, direction=UPLINK, layout=None, fields=(), handler=None,
+                 response=RESPOND_NONE, response_name=None, api_name=None, target_status=None, failed_status=(),
+                 outbox_kind=None):
+        if response not in (RESPOND_NONE, RESPOND_TIMESTAMP, RESPOND_ACK):
+            raise ValueError(f"Unknown response policy for 0x{code:02X}: {response}")
+        self.code = code
+        self.name = name
+        self.direction = direction
+        self.layout = struct.Struct(layout) if isinstance(layout, str) else layout
+        self.fields = tuple(fields)
+        if self.layout is not None and len(self.fields) != len(self.layout.unpack(bytes(self.layout.size))):
+            raise ValueError(f"Field names of 0x{code:02X} do not match its layout")
+        self.handler = handler
+        self.response = response
+        self.response_name = response_name or f"{name}响应"
+        self.api_name = api_name
+        self.target_status = target_status
+        self.failed_status = tuple(failed_status)
+        self.outbox_kind = outbox_kind
+        self.serial_prefixed = self.fields[:1] == ('serial',)  # 载荷以 8 字节设备序列号开头
+        # 序列号之后为流水号：设备响应带回流水号，按流水号匹配等待中的命令
+        self.flow_number = self.serial_prefixed and self.fields[1:2] == ('flow_number',)
+
+    def unpack(self, payload):
+        """按载荷布局解析为 {字段名: 值}；没有布局或载荷长度不足时返回 None"""
+        if self.layout is None or len(payload) < self.layout.size:
+            return None
+        return dict(zip(self.fields, self.layout.unpack_from(payload)))
+
+    def pack(self, **values):
+        """按载荷布局从同名参数构建载荷（多余的参数忽略）"""
+        if self.layout is None:
+            return b''
+        return self.layout.pack(*[values[field] for field in self.fields])
+
+    def __repr__(self):
+        return f"Opcode(0x{self.code:02X}, {self.name}, {self.direction}, response={self.response})"
+
+
+class OpcodeTable:
+    """命令字注册表
+
+    通用表适用于所有设备；按设备类型（心跳中的 device_type 字节）登记的命令字覆盖或补充通用表。
+    每种设备类型的合并结果预先算好，查找只是两次字典取值。注册在运行时进行，
+    按写时复制整体替换合并结果，处理线程读取时不需要加锁。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.common = {}     # 命令字 -> Opcode
+        self.overrides = {}  # 设备类型 -> {命令字: Opcode}
+        self.tables = {None: {}}  # 设备类型 -> 合并后的 {命令字: Opcode}，None 为通用表
+        self.api_names = {}       # 通用表中下行命令的 api_name -> Opcode
+
+    def register(self, opcode, device_type=None):
+        """登记（或替换）一个命令字，device_type 为 None 时登记到通用表；返回 opcode"""
+        with self.lock:
+            target = self.common if device_type is None else self.overrides.setdefault(device_type, {})
+            target[opcode.code] = opcode
+            self._rebuild()
+        if device_type is not None:
+            logger.info(f"Registered command 0x{opcode.code:02X} ({opcode.name}) for device type {device_type}")
+        return opcode
+
+    def unregister(self, code, device_type=None):
+        """移除一个命令字，返回被移除的 Opcode（不存在时返回 None）"""
+        with self.lock:
+            target = self.common if device_type is None else self.overrides.get(device_type, {})
+            opcode = target.pop(code, None)
+            if device_type is not None and not target:
+                self.overrides.pop(device_type, None)
+            self._rebuild()
+        return opcode
+
+    def _rebuild(self):
+        tables = {None: dict(self.common)}
+        for device_type, opcodes in self.overrides.items():
+            tables[device_type] = {**self.common, **opcodes}
+        self.tables = tables
+        self.api_names = {opcode.api_name: opcode for opcode in self.common.values()
+                          if opcode.api_name and opcode.direction == DOWNLINK}
+
+    def table(self, device_type=None):
+        """设备类型对应的 {命令字: Opcode}（没有专门登记的类型使用通用表），调用方不得修改"""
+        tables = self.tables
+        return tables.get(device_type) or tables[None]
+
+    def get(self, code, device_type=None):
+        return self.table(device_type).get(code)
+
+    def named(self, api_name):
+        """按 api_name 查找通用表中的下行命令，不存在时返回 None"""
+        return self.api_names.get(api_name)
+
+    def name(self, code, device_type=None):
+        """命令字名称，未登记时返回空字符串"""
+        opcode = self.table(device_type).get(code)
+        return opcode.name if opcode is not None else ""
+
+    def __iter__(self):
+        """遍历所有登记的 Opcode（含各设备类型的专门登记）"""
+        for table in self.tables.values():
+            yield from table.values()
+
+
+def default_opcodes():
+    """本协议（通用车位锁型号）的命令字"""
+    table = OpcodeTable()
+    for opcode in (
+        Opcode(0x80, "设备登录", UPLINK, '<8s', ('serial',), "handle_login", RESPOND_TIMESTAMP, api_name="login"),
+        Opcode(0x81, "心跳数据", UPLINK, HEARTBEAT_STRUCT, HEARTBEAT_FIELDS, "handle_heartbeat",
+               RESPOND_TIMESTAMP, "心跳响应", api_name="heartbeat"),
+        Opcode(0x87, "确认订单", UPLINK, handler="handle_device_report", response=RESPOND_ACK),   # 常降型设备
+        Opcode(0x88, "结束订单", UPLINK, handler="handle_device_report", response=RESPOND_ACK),   # 常升型设备
+        Opcode(0x89, "设备故障", UPLINK, handler="handle_device_report", response=RESPOND_ACK),
+        Opcode(0x60, "车状态改变", UPLINK, '<8sBB', ('serial', 'car_present', 'lock_status'),
+               "handle_car_status", RESPOND_ACK, api_name="car_state"),
+        # 远程命令：载荷为 序列号(8) + 流水号(4) [+ 参数]，设备回应由 handle_command_response 匹配
+        # 开锁 = 车位锁下降到位(2)，关锁 = 车位锁上升到位(1)；对应的动作错误状态视为执行失败
+        # 同一设备的开锁和关锁属于同一发件箱类别：后发的关锁取代未发出的开锁，反之亦然
+        Opcode(0x70, "远程开锁", DOWNLINK, '<8sI', ('serial', 'flow_number'), "handle_command_response",
+               api_name="open_lock", target_status=2, failed_status=(4,), outbox_kind="lock"),
+        Opcode(0x71, "远程关锁", DOWNLINK, '<8sI', ('serial', 'flow_number'), "handle_command_response",
+               api_name="close_lock", target_status=1, failed_status=(3, 9), outbox_kind="lock"),
+        Opcode(0x8E, "设置锁状态", DOWNLINK, '<8sIB', ('serial', 'flow_number', 'state'), "handle_command_response",
+               api_name="set_state", outbox_kind="state"),
+        Opcode(0x86, "同步时间", DOWNLINK, '<8sI', ('serial', 'timestamp'), "handle_command_response",
+               api_name="sync_time", outbox_kind="time"),
+        Opcode(0x8F, "远程重启", DOWNLINK, '<', (), "handle_command_response",
+               api_name="restart_device", outbox_kind="restart"),
+    ):
+        table.register(opcode)
+    return table
+
+
+OPCODES = default_opcodes()
+
+
+def load_plugins(names=LOCK_OPCODE_PLUGINS):
+    """导入命令字扩展模块（每个模块只导入一次，失败时记录错误后继续）"""
+    for name in (name.strip() for name in names.split(',')):
+        if not name or name in sys.modules:
+            continue
+        try:
+            importlib.import_module(name)
+            logger.info(f"Loaded opcode plugin {name}")
+        except Exception as e:
+            logger.error(f"Failed to load opcode plugin {name}: {e}")
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import socket
+import logging
+import selectors
+import threading
+import collections
+
+from parking_lock_metrics import metrics
+
+logger = logging.getLogger("ParkingLockServer")
+
+# 设备连接下行写队列配置
+LOCK_SEND_HIGH_WATER = int(os.environ.get('LOCK_SEND_HIGH_WATER', '65536'))  # 待写出字节数超过该值后拒绝新的写入
+LOCK_SEND_LOW_WATER = int(os.environ.get('LOCK_SEND_LOW_WATER', '16384'))    # 回落到该值以下后恢复接受写入
+LOCK_SEND_TIMEOUT = float(os.environ.get('LOCK_SEND_TIMEOUT', '10'))        # 待写出的数据超过该秒数没有进展即标记为 degraded
+
+# 一次 writev 最多合并的帧数（远小于 IOV_MAX）
+WRITEV_MAX_BUFFERS = 64
+
+OUTBOUND_REJECTED = metrics.counter("lock_outbound_rejected_total",
+                                    "Frames refused because the connection's send queue was congested", ("reason",))
+CONNECTIONS_DEGRADED = metrics.counter("lock_connections_degraded_total",
+                                       "Connections whose queued frames made no progress within LOCK_SEND_TIMEOUT")
+WRITE_FRAMES = metrics.histogram("lock_outbound_write_frames", "Frames coalesced into one socket write", (),
+                                 (1, 2, 4, 8, 16, 32, 64))
+
+
+class OutboundQueue:
+    """一个设备连接的下行写队列（基类）
+
+    write() 从不阻塞调用方：帧进入队列后以非阻塞方式写出，写不完的部分由连接的所有者
+    （线程模式为 OutboundWriter 写线程，异步模式为事件循环）在连接可写时继续写出。
+    待写出的字节数超过高水位后拒绝新的写入，回落到低水位以下再恢复；
+    有数据待写出且超过 send_timeout 秒没有任何进展时把连接标记为 degraded，
+    标记期间同样拒绝写入，数据重新写出后自动清除。
+    子类实现 pending()（已接受但尚未交给内核的字节数）和 _schedule()。
+    """
+
+    def __init__(self, address, high_water=LOCK_SEND_HIGH_WATER, low_water=LOCK_SEND_LOW_WATER,
+                 send_timeout=LOCK_SEND_TIMEOUT):
+        self.address = address
+        self.high_water = high_water
+        self.low_water = low_water
+        self.send_timeout = send_timeout
+        self.accepted = 0         # 累计接受写入的字节数
+        self.paused = False       # 超过高水位，回落到低水位以下前拒绝写入
+        self.degraded = False
+        self.closed = False
+        self.stall_timer = None
+        self.stall_generation = 0  # 每次重排或取消进展检测时加一，过期的检测直接返回
+        self.progress_mark = 0     # 上次检查时已写出的字节数
+
+    def pending(self):
+        raise NotImplementedError
+
+    def _schedule(self, delay, callback, *args):
+        """delay 秒后在连接所有者的上下文中调用 callback(*args)，返回可取消的定时项"""
+        raise NotImplementedError
+
+    def _admit(self, size):
+        """检查能否接受写入：连接已关闭时抛出 ConnectionError，拥塞时返回 False"""
+        if self.closed:
+            raise ConnectionError("Connection closed")
+        if self.degraded or self.paused or self.pending() >= self.high_water:
+            reason = "degraded" if self.degraded else "high_water"
+            OUTBOUND_REJECTED.inc(reason)
+            logger.debug("Send queue of %s congested (%s, %d bytes pending), dropping %d bytes",
+                         self.address, reason, self.pending(), size)
+            return False
+        return True
+
+    def _watch_stall(self):
+        """仍有数据待写出：开始检测写出进展"""
+        if self.stall_timer is None and not self.closed:
+            self.progress_mark = self.accepted - self.pending()
+            self._schedule_stall_check()
+
+    def _schedule_stall_check(self):
+        self.stall_generation += 1
+        self.stall_timer = self._schedule(self.send_timeout, self._check_stall, self.stall_generation)
+
+    def _check_stall(self, generation):
+        if generation != self.stall_generation:
+            return
+        self.stall_timer = None
+        if self.closed:
+            return
+        pending = self.pending()
+        if not pending:
+            self._recovered()
+            return
+        sent = self.accepted - pending
+        if sent == self.progress_mark:
+            if not self.degraded:
+                self.degraded = True
+                CONNECTIONS_DEGRADED.inc()
+                logger.warning(f"Connection {self.address} made no send progress for {self.send_timeout:.0f}s "
+                               f"({pending} bytes pending), marking degraded")
+        elif pending <= self.low_water:
+            self._recovered()
+        self.progress_mark = sent
+        self._schedule_stall_check()
+
+    def _drained(self, pending):
+        """按待写出的字节数更新高/低水位状态"""
+        if pending > self.high_water:
+            self.paused = True
+        elif pending <= self.low_water:
+            self.paused = False
+
+    def _recovered(self):
+        if self.degraded:
+            self.degraded = False
+            logger.info(f"Connection {self.address} is sending again, degraded flag cleared")
+
+    def _cancel_stall(self):
+        self.stall_generation += 1
+        timer, self.stall_timer = self.stall_timer, None
+        if timer is not None:
+            timer.cancel()
+
+
+class SocketOutbound(OutboundQueue):
+    """线程模式的下行写队列
+
+    连接空闲（没有积压）时由调用线程在连接锁内直接做一次非阻塞写；写不完时把连接交给
+    OutboundWriter，之后的帧只入队，由写线程在 socket 可写时合并成一次 writev 写出。
+    同一连接的所有写入都在连接锁内进行，API 线程和处理线程的帧不会交错。
+    """
+
+    def __init__(self, sock, address, writer, timer_wheel, **kwargs):
+        super().__init__(address, **kwargs)
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.writer = writer
+        self.timer_wheel = timer_wheel
+        self.lock = threading.Lock()
+        self.buffers = collections.deque()
+        self.size = 0
+        self.waiting = False  # 已交给写线程等待可写
+
+    def pending(self):
+        return self.size
+
+    def _schedule(self, delay, callback, *args):
+        return self.timer_wheel.schedule(delay, self._locked, callback, *args)
+
+    def _locked(self, callback, *args):
+        with self.lock:
+            callback(*args)
+
+    def write(self, data):
+        """写入一帧或多帧；返回是否接受，连接已断开时抛出 ConnectionError"""
+        data = bytes(data)
+        with self.lock:
+            if not self._admit(len(data)):
+                return False
+            self.buffers.append(data)
+            self.size += len(data)
+            self.accepted += len(data)
+            if not self.waiting:
+                self._flush()
+                if self.size:
+                    self.waiting = True
+                    self.writer.watch(self)
+            if self.size:
+                self._drained(self.size)
+                self._watch_stall()
+        return True
+
+    def _send(self, buffers):
+        if self.sock.gettimeout() is None:
+            # 阻塞模式的 socket：用 MSG_DONTWAIT 做单次非阻塞写
+            return self.sock.sendmsg(buffers, (), socket.MSG_DONTWAIT)
+        # 设置了超时的 socket 的 fd 已是非阻塞的，但 socket.send 会先等待可写，直接对 fd 做 writev
+        return os.writev(self.fd, buffers)
+
+    def _flush(self):
+        """在连接锁内尽量写出积压的帧，发送缓冲区满时返回；连接出错时关闭队列并抛出 ConnectionError"""
+        while self.buffers:
+            if len(self.buffers) == 1:
+                buffers = [self.buffers[0]]
+            else:
+                buffers = [self.buffers[i] for i in range(min(len(self.buffers), WRITEV_MAX_BUFFERS))]
+            try:
+                sent = self._send(buffers)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                self._close()
+                raise ConnectionError(f"Send to {self.address} failed: {e}") from e
+            WRITE_FRAMES.observe(len(buffers))
+            self.size -= sent
+            complete = sent == sum(len(buffer) for buffer in buffers)
+            while sent:
+                head = self.buffers[0]
+                if sent < len(head):
+                    self.buffers[0] = head[sent:]
+                    break
+                sent -= len(head)
+                self.buffers.popleft()
+            if not complete:
+                break
+        self._drained(self.size)
+
+    def flush_ready(self):
+        """写线程在 socket 可写时调用；返回 True 表示积压已写完（或连接已关闭），不再需要等待可写"""
+        with self.lock:
+            if self.closed:
+                return True
+            try:
+                self._flush()
+            except ConnectionError as e:
+                logger.warning(str(e))
+                return True
+            if self.size:
+                return False
+            self.waiting = False
+            self._cancel_stall()
+            self._recovered()
+            return True
+
+    def close(self):
+        """连接关闭前调用：丢弃积压并停止写出（须在关闭 socket 之前，避免写到被复用的 fd）"""
+        with self.lock:
+            self._close()
+
+    def _close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.buffers.clear()
+        self.size = 0
+        self._cancel_stall()
+        if self.waiting:
+            self.waiting = False
+            self.writer.unwatch(self)
+
+
+class OutboundWriter:
+    """线程模式的写线程：等待发送缓冲区已满的连接重新可写，再写出它们积压的帧
+
+    只有写不完的连接才交给写线程，正常情况下这里没有注册任何连接。
+    注册变化经队列交给写线程执行（selector 不是线程安全的），再通过 socketpair 唤醒它。
+    """
+
+    def __init__(self):
+        self.selector = None
+        self.lock = threading.Lock()
+        self.changes = []
+        self.wakeup_reader = self.wakeup_writer = None
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        if self.running:
+            return
+        self.selector = selectors.DefaultSelector()
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_reader.setblocking(False)
+        self.wakeup_writer.setblocking(False)
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ, None)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="outbound-writer", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        self._wakeup()
+        self.thread.join(timeout=5)
+        self.selector.close()
+        self.wakeup_reader.close()
+        self.wakeup_writer.close()
+
+    def watch(self, queue):
+        """queue 的积压写不完，等待可写后继续写出"""
+        self._change(True, queue)
+
+    def unwatch(self, queue):
+        self._change(False, queue)
+
+    def _change(self, add, queue):
+        with self.lock:
+            self.changes.append((add, queue))
+        self._wakeup()
+
+    def _wakeup(self):
+        try:
+            self.wakeup_writer.send(b'\0')
+        except (BlockingIOError, AttributeError):
+            pass  # 已有未处理的唤醒，或写线程尚未启动
+
+    def _apply_changes(self):
+        with self.lock:
+            changes, self.changes = self.changes, []
+        registered = self.selector.get_map()
+        for add, queue in changes:
+            key = registered.get(queue.fd)
+            if not add:
+                if key is not None and key.data is queue:
+                    self.selector.unregister(queue.fd)
+                continue
+            if key is not None:
+                # fd 被新连接复用，旧连接的注册还没有移除
+                self.selector.unregister(queue.fd)
+            if not queue.closed:
+                self.selector.register(queue.fd, selectors.EVENT_WRITE, queue)
+
+    def _run(self):
+        while self.running:
+            try:
+                events = self.selector.select()
+            except OSError as e:
+                logger.error(f"Outbound writer select failed: {e}")
+                continue
+            for key, _ in events:
+                queue = key.data
+                if queue is None:
+                    try:
+                        while self.wakeup_reader.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                elif queue.flush_ready() and self.selector.get_map().get(key.fd) is key:
+                    self.selector.unregister(key.fd)
+            self._apply_changes()
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import sqlite3
+import logging
+import binascii
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+
+from parking_lock_metrics import metrics, InstrumentedLock
+from parking_lock_opcodes import OPCODES
+
+logger = logging.getLogger("ParkingLockServer")
+
+# 离线设备命令发件箱配置（LOCK_OUTBOX_DB 设为空字符串可关闭，命令对离线设备直接返回 not_connected）
+# 排队需要调用方选择：请求中指定 ttl，或把 LOCK_OUTBOX_TTL 设为正数作为默认有效期；默认 0 表示不排队
+LOCK_OUTBOX_DB = os.environ.get('LOCK_OUTBOX_DB', 'parking_lock_outbox.db')
+LOCK_OUTBOX_TTL = float(os.environ.get('LOCK_OUTBOX_TTL', '0'))             # 命令在发件箱中的默认有效期（秒）
+LOCK_OUTBOX_MAX_TTL = float(os.environ.get('LOCK_OUTBOX_MAX_TTL', '3600'))  # 请求可指定的最长有效期（秒）
+LOCK_OUTBOX_MAX = int(os.environ.get('LOCK_OUTBOX_MAX', '10000'))           # 发件箱中最多保存的命令数
+LOCK_OUTBOX_PURGE_INTERVAL = float(os.environ.get('LOCK_OUTBOX_PURGE_INTERVAL', '30'))  # 清理过期命令的间隔（秒）
+
+
+
+def outbox_kind(command):
+    """命令的去重类别（Opcode.outbox_kind）：同一设备同一类别只保留最新的一条；None 表示该命令不排队"""
+    opcode = OPCODES.get(command)
+    return opcode.outbox_kind if opcode is not None else None
+
+
+def queue_ttl(ttl):
+    """请求中的 ttl（秒，None 表示默认值）限制到允许范围，<=0 表示不排队"""
+    return LOCK_OUTBOX_TTL if ttl is None else min(float(ttl), LOCK_OUTBOX_MAX_TTL)
+
+
+OUTBOX_COMMANDS = metrics.counter("lock_outbox_commands_total",
+                                  "Commands for offline devices by outbox outcome", ("result",))
+
+
+class QueuedCommand:
+    """发件箱中的一条命令
+
+    future 只在入队的进程内有效：命令补发后以设备的执行结果完成，
+    被取代或过期时以 superseded / expired 结果完成，供 wait=true 的调用方等待。
+    """
+
+    __slots__ = ('id', 'serial', 'command', 'state', 'created', 'expires', 'timeout', 'pending', 'future')
+
+    def __init__(self, id, serial, command, state, created, expires, timeout=None):
+        self.id = id
+        self.serial = serial
+        self.command = command
+        self.state = state
+        self.created = created
+        self.expires = expires
+        self.timeout = timeout  # 补发后等待设备响应的超时，None 使用默认值
+        self.pending = None     # 补发后的 PendingCommand
+        self.future = Future()
+
+    def result(self):
+        """当前结果字典：已补发时与 PendingCommand.result 一致（status 为 sent），
+        否则 status 为 queued——命令尚未发出，success 为 False，queued 为 True"""
+        if self.pending is not None:
+            return self.pending.result("sent", True)
+        return {"success": False, "queued": True, "status": "queued", "flowNumber": None, "command": f"0x{self.command:02X}",
+                "resultCode": None, "elapsed": 0, "queueId": self.id, "expiresAt": self.expires}
+
+    def complete(self, result):
+        try:
+            self.future.set_result(result)
+        except InvalidStateError:
+            pass  # 已经以其他结果完成
+
+    def finish(self, status):
+        """没有补发就结束（被取代、过期等）"""
+        self.complete({"success": False, "status": status, "flowNumber": None, "command": f"0x{self.command:02X}",
+                       "resultCode": None, "elapsed": round(time.time() - self.created, 3)})
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "deviceSerial": binascii.hexlify(self.serial).decode('utf-8'),
+            "command": f"0x{self.command:02X}",
+            "state": self.state,
+            "created": self.created,
+            "expiresAt": self.expires
+        }
+
+
+class CommandOutbox:
+    """离线设备的持久化命令发件箱（SQLite）
+
+    设备未连接时命令写入发件箱，设备登录（0x80）后由登录处理按入队顺序取出并补发。
+    每台设备每个去重类别（Opcode.outbox_kind）只保留最新的一条，因此单台设备最多积压的条数等于类别数；
+    总条数另有上限。过期的命令在取出和定期清理时丢弃，不会补发。
+    多进程模式下主进程和各 worker 打开同一个数据库：主进程入队，设备所在的 worker 取出，
+    取出在 BEGIN IMMEDIATE 事务中进行，同一条命令只会被补发一次。
+    所有操作共用一个连接，由锁串行化。本进程独占数据库时，有积压命令的设备序列号另存一份在内存中，
+    设备登录时没有积压命令的情况不访问数据库；shared=True（多进程共用数据库）时由 take 查询数据库。
+    executor 是发件箱专用的线程，事件循环上的调用方把入队和补发交给它执行，不在事件循环上等待 SQLite。
+    """
+
+    def __init__(self, path=LOCK_OUTBOX_DB, max_commands=LOCK_OUTBOX_MAX, purge_interval=LOCK_OUTBOX_PURGE_INTERVAL,
+                 shared=False):
+        self.path = path
+        self.max_commands = max_commands
+        self.purge_interval = purge_interval
+        self.shared = shared      # 其他进程也在入队或取出（多进程模式）
+        self.lock = InstrumentedLock("command_outbox")
+        self.connection = None
+        self.executor = None
+        self.depth = 0            # 发件箱中的命令数（本进程的估计值，定期清理时从数据库校正）
+        self.serials = set()      # 发件箱中有命令的设备序列号（shared=False 时使用）
+        self.next_purge = 0
+        self.waiting = {}         # 命令 id -> QueuedCommand（本进程中正在等待结果的命令）
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def start(self):
+        """打开数据库并清理已过期的命令"""
+        if not self.enabled or self.connection is not None:
+            return
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("""CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            serial BLOB NOT NULL,
+            kind TEXT NOT NULL,
+            command INTEGER NOT NULL,
+            state INTEGER,
+            created REAL NOT NULL,
+            expires REAL NOT NULL,
+            UNIQUE (serial, kind))""")
+        with self.lock:
+            self.connection = connection
+            self._purge(time.time())
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="command-outbox")
+        logger.info(f"Command outbox enabled: {self.path} ({self.depth} queued)")
+
+    def stop(self):
+        with self.lock:
+            connection, self.connection = self.connection, None
+            waiting, self.waiting = self.waiting, {}
+            self.serials = set()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        for queued in waiting.values():
+            queued.finish("not_connected")
+        if connection is not None:
+            connection.close()
+
+    def enqueue(self, serial, command, state=None, ttl=LOCK_OUTBOX_TTL, timeout=None, wait=False):
+        """命令入队，取代同一设备同类别的旧命令；返回 QueuedCommand，发件箱未启用或已满时返回 None
+
+        wait=True 时保留该命令的 future，补发的进程是本进程时以设备执行结果完成，
+        调用方结束等待后应调用 forget()。
+        """
+        now = time.time()
+        kind = outbox_kind(command)
+        with self.lock:
+            if self.connection is None:
+                return None
+            if now >= self.next_purge:
+                self._purge(now)
+            connection = self.connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                superseded = [row[0] for row in connection.execute(
+                    "SELECT id FROM outbox WHERE serial = ? AND kind = ?", (serial, kind))]
+                # 只有新增的命令受总条数限制，取代同类旧命令不增加条数
+                if not superseded and self.depth >= self.max_commands:
+                    connection.execute("ROLLBACK")
+                    OUTBOX_COMMANDS.inc("rejected")
+                    logger.warning(f"Command outbox full ({self.depth}), dropping 0x{command:02X} for device "
+                                   f"{binascii.hexlify(serial)}")
+                    return None
+                if superseded:
+                    connection.execute("DELETE FROM outbox WHERE serial = ? AND kind = ?", (serial, kind))
+                queue_id = connection.execute(
+                    "INSERT INTO outbox (serial, kind, command, state, created, expires) VALUES (?, ?, ?, ?, ?, ?)",
+                    (serial, kind, command, state, now, now + ttl)).lastrowid
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+            self.depth += 1 - len(superseded)
+            self.serials.add(serial)
+            replaced = [queued for queued in (self.waiting.pop(old, None) for old in superseded) if queued]
+            queued = QueuedCommand(queue_id, serial, command, state, now, now + ttl, timeout)
+            if wait:
+                self.waiting[queue_id] = queued
+
+        OUTBOX_COMMANDS.inc("queued")
+        if superseded:
+            OUTBOX_COMMANDS.inc("superseded", amount=len(superseded))
+            for old in replaced:
+                old.finish("superseded")
+        logger.info(f"Device {binascii.hexlify(serial)} not connected, queued command 0x{command:02X} "
+                    f"for {ttl:.0f}s" + (f" (superseded {len(superseded)})" if superseded else ""))
+        return queued
+
+    def has_pending(self, serial):
+        """设备在发件箱中是否可能有命令（不访问数据库；shared=True 时总是 True，由 take 查询）"""
+        return self.connection is not None and (self.shared or serial in self.serials)
+
+    def take(self, serial):
+        """取出设备的全部未过期命令（按入队顺序）并从发件箱删除，没有积压时只做一次查询"""
+        with self.lock:
+            connection = self.connection
+            if connection is None or not self.has_pending(serial):
+                return []
+            if connection.execute("SELECT 1 FROM outbox WHERE serial = ? LIMIT 1", (serial,)).fetchone() is None:
+                return []
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = connection.execute("SELECT id, command, state, created, expires FROM outbox "
+                                          "WHERE serial = ? ORDER BY id", (serial,)).fetchall()
+                connection.execute("DELETE FROM outbox WHERE serial = ?", (serial,))
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+            self.depth = max(0, self.depth - len(rows))
+            self.serials.discard(serial)
+            queued = [self.waiting.get(row[0]) or QueuedCommand(row[0], serial, *row[1:]) for row in rows]
+
+        now = time.time()
+        commands = []
+        for command in queued:
+            if command.expires <= now:
+                OUTBOX_COMMANDS.inc("expired")
+                command.finish("expired")
+            else:
+                commands.append(command)
+        return commands
+
+    def replayed(self, queued, pending):
+        """命令已补发：wait 的调用方改为等待设备的执行结果"""
+        OUTBOX_COMMANDS.inc("replayed")
+        queued.pending = pending
+        if pending is None:
+            queued.finish("send_failed")
+            return
+        pending.future.add_done_callback(lambda future: queued.complete(future.result()))
+
+    def forget(self, queued):
+        """调用方不再等待该命令的结果（命令仍留在发件箱中）
+
+        不取锁：事件循环上的调用方不能等待持有锁的 SQLite 事务，单次字典删除本身是原子的。
+        """
+        self.waiting.pop(queued.id, None)
+
+    def list_commands(self, serial=None):
+        """发件箱中的命令（按入队顺序），可按设备过滤"""
+        with self.lock:
+            if self.connection is None:
+                return []
+            query = "SELECT id, serial, command, state, created, expires FROM outbox"
+            args = ()
+            if serial is not None:
+                query += " WHERE serial = ?"
+                args = (serial,)
+            rows = self.connection.execute(query + " ORDER BY id", args).fetchall()
+        return [QueuedCommand(*row).to_dict() for row in rows]
+
+    def count(self):
+        """发件箱中的命令数：本进程独占数据库时返回内存中的计数（不访问数据库），
+        shared=True 时查询数据库，包含其他进程的入队和取出"""
+        if not self.shared:
+            return self.depth if self.connection is not None else 0
+        with self.lock:
+            if self.connection is None:
+                return 0
+            return self.connection.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def _purge(self, now):
+        """删除过期命令并校正计数（调用方持有锁）"""
+        expired = self.connection.execute("DELETE FROM outbox WHERE expires <= ?", (now,)).rowcount
+        self.depth = self.connection.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        if not self.shared:
+            self.serials = {row[0] for row in self.connection.execute("SELECT DISTINCT serial FROM outbox")}
+        self.next_purge = now + self.purge_interval
+        if expired:
+            OUTBOX_COMMANDS.inc("expired", amount=expired)
+            logger.info(f"Command outbox: {expired} expired commands dropped")
+        for queue_id, queued in list(self.waiting.items()):
+            if queued.expires <= now:
+                self.waiting.pop(queue_id, None)
+                queued.finish("expired")
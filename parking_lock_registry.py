@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+
+from parking_lock_metrics import InstrumentedLock
+
+# 分片数量，必须是 2 的幂
+DEVICE_REGISTRY_SHARDS = int(os.environ.get('DEVICE_REGISTRY_SHARDS', '16'))
+
+
+class DeviceEntry:
+    """已登录设备的登记信息
+
+    心跳更新只由持有该连接的处理线程（或事件循环）写入，直接修改属性即可，不需要加锁。
+    """
+
+    __slots__ = ('serial', 'connection', 'address', 'login_time', 'last_heartbeat', 'heartbeat',
+                 'previous_status', 'previous_status_desc', 'previous_car_status')
+
+    def __init__(self, serial, connection, address):
+        self.serial = serial
+        self.connection = connection
+        self.address = address
+        self.login_time = time.time()
+        self.last_heartbeat = self.login_time
+        self.heartbeat = None  # 最新的 Heartbeat 记录
+        self.previous_status = None
+        self.previous_status_desc = None
+        self.previous_car_status = None
+
+
+class _Shard:
+    __slots__ = ('lock', 'devices')
+
+    def __init__(self):
+        self.lock = InstrumentedLock("registry_shard")
+        self.devices = {}  # 只整体替换，不原地修改（写时复制）
+
+
+class DeviceRegistry:
+    """按序列号哈希分片的设备登记表
+
+    登录/断开等成员变更只锁住对应分片，并以写时复制的方式发布新的分片字典；
+    查询和列表接口直接读取当前发布的字典，不需要任何锁，也不会阻塞心跳处理。
+    """
+
+    def __init__(self, shard_count=DEVICE_REGISTRY_SHARDS):
+        if shard_count <= 0 or shard_count & (shard_count - 1):
+            raise ValueError(f"Shard count must be a power of two: {shard_count}")
+        self.shards = tuple(_Shard() for _ in range(shard_count))
+        self.mask = shard_count - 1
+
+    def _shard(self, serial):
+        return self.shards[hash(serial) & self.mask]
+
+    def get(self, serial):
+        """查找设备，不加锁"""
+        return self._shard(serial).devices.get(serial)
+
+    def __contains__(self, serial):
+        return self.get(serial) is not None
+
+    def __len__(self):
+        return sum(len(shard.devices) for shard in self.shards)
+
+    def register(self, serial, connection, address):
+        """登记设备连接，返回 (新登记项, 被替换的旧登记项或 None)"""
+        entry = DeviceEntry(serial, connection, address)
+        shard = self._shard(serial)
+        with shard.lock:
+            devices = dict(shard.devices)
+            previous = devices.get(serial)
+            devices[serial] = entry
+            shard.devices = devices
+        return entry, previous
+
+    def unregister(self, serial, connection=None):
+        """移除设备登记；指定 connection 时只有登记项仍属于该连接才移除，返回被移除的登记项"""
+        shard = self._shard(serial)
+        with shard.lock:
+            entry = shard.devices.get(serial)
+            if entry is None or (connection is not None and entry.connection is not connection):
+                return None
+            devices = dict(shard.devices)
+            del devices[serial]
+            shard.devices = devices
+        return entry
+
+    def snapshot(self):
+        """返回当前所有登记项的列表（无锁读取各分片当前发布的字典）"""
+        entries = []
+        for shard in self.shards:
+            entries.extend(shard.devices.values())
+        return entries
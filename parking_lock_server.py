@@ -10,34 +10,198 @@ import struct
 from datetime import datetime
 import requests
 import os
+import json
 
-# 从环境变量加载配置，提供默认值
+from parking_lock_webhook import (WebhookDispatcher, HeartbeatEmissionPolicy, build_webhook_payload,
+                                  build_offline_payload)
+from parking_lock_registry import DeviceRegistry, DeviceEntry
+from parking_lock_commands import (CommandTracker, TokenBucket, unsent_result, COMMAND_TIMEOUT,
+                                   COMMAND_MAX_TIMEOUT, BATCH_RATE_LIMIT, BATCH_BURST)
+from parking_lock_opcodes import (OPCODES, HEARTBEAT_STRUCT, UPLINK, RESPOND_NONE, RESPOND_TIMESTAMP, RESPOND_ACK,
+                                  load_plugins)
+from parking_lock_timer_wheel import TimerWheel
+from parking_lock_history import HeartbeatHistory
+from parking_lock_outbox import CommandOutbox, outbox_kind, queue_ttl
+from parking_lock_liveness import LivenessMonitor, configure_keepalive, LOCK_RECV_TIMEOUT
+from parking_lock_outbound import SocketOutbound, OutboundWriter
+from parking_lock_snapshot import RegistrySnapshot
+from parking_lock_events import EventBroker, heartbeat_changes
+from parking_lock_logging import configure_logging, FrameLogSampler, LOCK_LOG_SERIALS
+from parking_lock_metrics import (metrics, gauge_family, counter_family, InstrumentedLock,
+                                  COMMAND_LABELS, FRAME_BUCKETS)
+
+# 从环境变量加载配置，提供默认值（NODE_WEBHOOK_URL 设为空字符串可关闭 Webhook 推送）
 NODE_WEBHOOK_URL = os.environ.get('NODE_WEBHOOK_URL', 'http://localhost:3002/api/parking-locks/webhook/status-update')
 WEBHOOK_SECRET = os.environ.get('LOCK_WEBHOOK_SECRET', 'a_very_secret_string_for_lock_webhook')
+# 服务器运行模式: thread (每个连接一个线程)、async (单个事件循环复用所有连接)
+# 或 cluster (多个 worker 进程通过 SO_REUSEPORT 共享端口，见 parking_lock_cluster.py)
+LOCK_SERVER_MODE = os.environ.get('LOCK_SERVER_MODE', 'thread')
 
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("parking_lock_server.log"),
-        logging.StreamHandler()
-    ]
-)
+# 配置日志（经队列异步写入轮转文件，级别、格式、采样见 parking_lock_logging.py）
+configure_logging("parking_lock_server.log")
 logger = logging.getLogger("ParkingLockServer")
 
-# 全局变量，存储所有连接的设备信息
-connected_devices = {}
-# 设备锁，防止多线程同时操作
-device_lock = threading.Lock()
+# 帧日志采样器（INFO 级别下限制 FULL FRAME 输出频率）
+frame_sampler = FrameLogSampler()
+
+# 服务器指标（/metrics 输出，见 parking_lock_metrics.py）
+FRAMES_RECEIVED = metrics.counter("lock_frames_received_total", "Frames received from devices", ("command",))
+FRAMES_UNHANDLED = metrics.counter("lock_frames_unhandled_total",
+                                   "Frames whose command is not in the device type's opcode table", ("command",))
+FRAME_ERRORS = metrics.counter("lock_frame_errors_total", "Frames rejected by parse_frame", ("reason",))
+FRAME_SECONDS = metrics.histogram("lock_frame_processing_seconds",
+                                  "Time to parse, handle and answer one received frame", ("command",), FRAME_BUCKETS)
+DECODER_RESYNC_BYTES = metrics.counter("lock_decoder_resync_bytes_total",
+                                       "Bytes skipped by FrameDecoder while resynchronizing on a frame header")
+CONNECTIONS_ACCEPTED = metrics.counter("lock_connections_accepted_total", "Device TCP connections accepted")
+COMMAND_SEND_SECONDS = metrics.histogram("lock_command_send_seconds",
+                                         "Time to write remote command frames to a device socket", ("command",))
+
+
+def _build_crc16_table():
+    """预计算 Modbus CRC-16 (多项式 0xA001) 的 256 项查找表"""
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc = crc >> 1
+        table.append(crc)
+    return tuple(table)
+
+
+CRC16_TABLE = _build_crc16_table()
+
+# 设备状态说明
+DEVICE_STATUS_DESCRIPTIONS = {
+    0: "上电初始化",
+    1: "车位锁上升到位",
+    2: "车位锁下降到位",
+    3: "车位锁上升错误",
+    4: "车位锁下降错误",
+    5: "车位锁正在动作，还未到位",
+    6: "地感错误",
+    9: "设备上有车"
+}
+
+# 车辆状态说明
+CAR_STATUS_DESCRIPTIONS = {
+    0: "准备",
+    1: "有车",
+    2: "无车"
+}
+
+# 常控状态说明
+CONTROL_STATUS_DESCRIPTIONS = {
+    0: "正常",
+    1: "保持开",
+    2: "保持关"
+}
+
+# 错误号各个位的说明
+ERROR_CODE_DESCRIPTIONS = (
+    (0x0001, "上限位开关错误"),
+    (0x0002, "下限位开关错误"),
+    (0x0004, "电机下降堵转"),
+    (0x0008, "电机上升堵转"),
+    (0x0010, "上升超时"),
+    (0x0020, "下降超时"),
+    (0x0040, "地感错误"),
+    (0x0080, "齿轮故障"),
+    (0x0100, "电机线圈故障"),
+    (0x0200, "车检模块错误故障"),
+    (0x0400, "临时常控开"),
+)
+
+
+class Heartbeat:
+    """心跳数据记录
+    
+    使用 __slots__ 保存一次 struct 解包得到的字段和原始载荷，状态说明和错误列表
+    在访问时才从模块级查找表生成。支持 hb['field'] / hb.get('field') 形式的读取，
+    to_dict() 返回与旧版相同的 21 个键的字典。
+    """
+    
+    __slots__ = ('raw', 'serial_number', 'action_step', 'water_detection', 'battery_3_7v',
+                 'signal_strength', 'flow_number', 'device_type', 'battery_12v_raw', 'device_status',
+                 'car_status', 'error_code', 'current_frequency', 'no_car_base', 'car_base',
+                 'car_ratio', 'no_car_ratio', 'control_status')
+    
+    FIELDS = ('serial_number', 'action_step', 'water_detection', 'battery_3_7v', 'signal_strength',
+              'flow_number', 'device_type', 'battery_12v', 'device_status', 'device_status_description',
+              'car_status', 'car_status_description', 'error_code', 'error_descriptions',
+              'current_frequency', 'no_car_base', 'car_base', 'car_ratio', 'no_car_ratio',
+              'control_status', 'control_status_description')
+    KEYS = frozenset(FIELDS)  # 字典式读取只接受这些键，raw 等内部属性和方法不作为键
+    
+    def __init__(self, payload):
+        self.raw = bytes(payload)
+        (self.serial_number, self.action_step, self.water_detection, self.battery_3_7v,
+         self.signal_strength, self.flow_number, self.device_type, self.battery_12v_raw,
+         self.device_status, self.car_status, self.error_code, self.current_frequency,
+         self.no_car_base, self.car_base, self.car_ratio, self.no_car_ratio) = HEARTBEAT_STRUCT.unpack_from(self.raw)
+        self.control_status = self.raw[38] if len(self.raw) > 38 else 0
+    
+    @property
+    def battery_12v(self):
+        """12V电池实际电压（原始值/10）"""
+        return self.battery_12v_raw / 10.0
+    
+    @property
+    def device_status_description(self):
+        return DEVICE_STATUS_DESCRIPTIONS.get(self.device_status, f"未知状态({self.device_status})")
+    
+    @property
+    def car_status_description(self):
+        return CAR_STATUS_DESCRIPTIONS.get(self.car_status, f"未知状态({self.car_status})")
+    
+    @property
+    def control_status_description(self):
+        return CONTROL_STATUS_DESCRIPTIONS.get(self.control_status, f"未知状态({self.control_status})")
+    
+    @property
+    def error_descriptions(self):
+        error_code = self.error_code
+        return [description for bit, description in ERROR_CODE_DESCRIPTIONS if error_code & bit]
+    
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def __contains__(self, key):
+        return key in self.KEYS
+    
+    def get(self, key, default=None):
+        if key not in self.KEYS:
+            return default
+        return getattr(self, key)
+    
+    def to_dict(self):
+        """转换为旧版心跳字典"""
+        return {field: getattr(self, field) for field in self.FIELDS}
+    
+    def __repr__(self):
+        return f"Heartbeat({binascii.hexlify(self.serial_number).decode('utf-8')}, status={self.device_status}, car={self.car_status})"
+
 
 class ParkingLockProtocol:
     """解析和构建车位锁通信协议"""
     
     @staticmethod
-    def calculate_crc16(data):
-        """计算CRC16校验码"""
+    def calculate_crc16(data, crc=0xFFFF):
+        """计算CRC16校验码（查表法，每字节一次查表）"""
+        table = CRC16_TABLE
+        for byte in data:
+            crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+        return crc
+    
+    @staticmethod
+    def calculate_crc16_bitwise(data):
+        """逐位计算CRC16校验码（参考实现，用于校验查表法和基准测试）"""
         crc = 0xFFFF
         for byte in data:
             crc ^= byte
@@ -48,21 +212,42 @@ class ParkingLockProtocol:
                     crc = crc >> 1
         return crc
     
+    @staticmethod
+    def crc16_many(frames):
+        """批量校验多个完整帧的CRC16，返回与输入一一对应的布尔值列表
+        
+        每个帧的最后三个字节为 CRC16(低字节在前) + 帧尾，校验范围为其之前的所有字节。
+        """
+        table = CRC16_TABLE
+        results = []
+        for frame in frames:
+            if len(frame) < 3:
+                results.append(False)
+                continue
+            crc = 0xFFFF
+            for byte in frame[:-3]:
+                crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+            results.append(crc == frame[-3] + (frame[-2] << 8))
+        return results
+    
     @staticmethod
     def parse_frame(data):
         """解析接收到的数据帧"""
         if len(data) < 8:  # 至少需要帧头、校验码、长度、映射因子、命令字、CRC16、帧尾
+            FRAME_ERRORS.inc("too_short")
             return None
         
         # 检查帧头和帧尾
         if data[0] != 0xDA or data[-1] != 0xDD:
             logger.error(f"Invalid frame header or footer: {binascii.hexlify(data)}")
+            FRAME_ERRORS.inc("header_footer")
             return None
         
         # 解析帧长度
         frame_length = data[2] + (data[3] << 8)
         if len(data) != frame_length:
             logger.error(f"Frame length mismatch: expected {frame_length}, got {len(data)}")
+            FRAME_ERRORS.inc("length")
             return None
         
         # 校验CRC16
@@ -70,6 +255,7 @@ class ParkingLockProtocol:
         calculated_crc = ParkingLockProtocol.calculate_crc16(data[:-3])
         if received_crc != calculated_crc:
             logger.error(f"CRC mismatch: expected {calculated_crc:04X}, got {received_crc:04X}")
+            FRAME_ERRORS.inc("crc")
             return None
         
         # 提取命令字和数据
@@ -110,232 +296,350 @@ class ParkingLockProtocol:
         return None
     @staticmethod
     def parse_heartbeat_data(payload):
-        """解析心跳帧中的详细设备状态信息"""
-        if len(payload) < 32:  # 确保有足够的数据
+        """解析心跳帧中的详细设备状态信息，返回 Heartbeat 记录"""
+        if len(payload) < HEARTBEAT_STRUCT.size:  # 确保有足够的数据
             return None
         
         try:
-            # 使用bytes而不是bytearray作为键
-            serial_number = bytes(payload[:8])
-            action_step = payload[8]
-            water_detection = payload[9]  # 0x00: 无水, 0x01: 有水
-            battery_3_7v = payload[10]  # 电池电量 (实际值)
-            signal_strength = payload[11]  # 4G信号强度 (0-99)
-            flow_number = struct.unpack("<I", payload[12:16])[0]  # 流水号
-            device_type = payload[16]
-            battery_12v = payload[17]  # 12V电量 (实际值/10)
-            device_status = payload[18]  # 设备状态
-            car_status = payload[19]  # 是否有车
-            error_code = struct.unpack("<H", payload[20:22])[0]  # 错误号
-            current_frequency = struct.unpack("<I", payload[22:26])[0]  # 当前地感频率
-            no_car_base = struct.unpack("<I", payload[26:30])[0]  # 无车基准
-            car_base = struct.unpack("<I", payload[30:34])[0]  # 有车基准
-            car_ratio = struct.unpack("<H", payload[34:36])[0]  # 有车万分比
-            no_car_ratio = struct.unpack("<H", payload[36:38])[0]  # 无车万分比
-            control_status = payload[38] if len(payload) > 38 else 0  # 常控状态
-            
-            # 错误号说明
-            error_descriptions = []
-            if error_code & 0x0001: error_descriptions.append("上限位开关错误")
-            if error_code & 0x0002: error_descriptions.append("下限位开关错误")
-            if error_code & 0x0004: error_descriptions.append("电机下降堵转")
-            if error_code & 0x0008: error_descriptions.append("电机上升堵转")
-            if error_code & 0x0010: error_descriptions.append("上升超时")
-            if error_code & 0x0020: error_descriptions.append("下降超时")
-            if error_code & 0x0040: error_descriptions.append("地感错误")
-            if error_code & 0x0080: error_descriptions.append("齿轮故障")
-            if error_code & 0x0100: error_descriptions.append("电机线圈故障")
-            if error_code & 0x0200: error_descriptions.append("车检模块错误故障")
-            if error_code & 0x0400: error_descriptions.append("临时常控开")
-            
-            # 设备状态说明
-            status_description = {
-                0: "上电初始化",
-                1: "车位锁上升到位",
-                2: "车位锁下降到位",
-                3: "车位锁上升错误",
-                4: "车位锁下降错误",
-                5: "车位锁正在动作，还未到位",
-                6: "地感错误",
-                9: "设备上有车"
-            }.get(device_status, f"未知状态({device_status})")
-            
-            # 车辆状态说明
-            car_status_description = {
-                0: "准备",
-                1: "有车",
-                2: "无车"
-            }.get(car_status, f"未知状态({car_status})")
-            
-            # 常控状态说明
-            control_status_description = {
-                0: "正常",
-                1: "保持开",
-                2: "保持关"
-            }.get(control_status, f"未知状态({control_status})")
-            
-            # 将12V电池电量转换为实际电压
-            battery_12v_actual = battery_12v / 10.0
-            
-            return {
-                "serial_number": serial_number,
-                "action_step": action_step,
-                "water_detection": water_detection,
-                "battery_3_7v": battery_3_7v,
-                "signal_strength": signal_strength,
-                "flow_number": flow_number,
-                "device_type": device_type,
-                "battery_12v": battery_12v_actual,
-                "device_status": device_status,
-                "device_status_description": status_description,
-                "car_status": car_status,
-                "car_status_description": car_status_description,
-                "error_code": error_code,
-                "error_descriptions": error_descriptions,
-                "current_frequency": current_frequency,
-                "no_car_base": no_car_base,
-                "car_base": car_base,
-                "car_ratio": car_ratio,
-                "no_car_ratio": no_car_ratio,
-                "control_status": control_status,
-                "control_status_description": control_status_description
-            }
+            return Heartbeat(payload)
         except Exception as e:
             logger.error(f"Error parsing heartbeat data: {e}")
             return None
     @staticmethod
-    def log_frame(frame, direction="", command_name=""):
-        """详细记录完整帧内容"""
-        frame_hex = binascii.hexlify(frame).decode('utf-8')
+    def log_frame(frame, direction="", command_name="", serial=None):
+        """记录完整帧内容
+        
+        DEBUG 级别或设备在 LOCK_LOG_SERIALS 白名单中时，每帧输出 FULL FRAME 行和完整帧结构解析；
+        INFO 级别下每台设备每种命令字按 LOCK_LOG_FRAME_SAMPLE_INTERVAL 采样输出 FULL FRAME 行；
+        其他情况直接返回，不做任何格式化。
+        """
+        command = frame[5] if len(frame) > 5 else None
+        if serial is None and command in (0x80, 0x81) and len(frame) >= 14:
+            serial = bytes(frame[6:14])  # 登录/心跳帧的载荷以序列号开头
+        
+        if serial in LOCK_LOG_SERIALS:
+            structure_level = logging.INFO
+        elif logger.isEnabledFor(logging.DEBUG):
+            structure_level = logging.DEBUG
+        elif logger.isEnabledFor(logging.INFO) and frame_sampler.should_log(serial, command, direction):
+            structure_level = None
+        else:
+            return
         
         direction_text = f"{direction} " if direction else ""
         command_text = f" [{command_name}]" if command_name else ""
+        extra = {
+            "serial": binascii.hexlify(serial).decode('utf-8') if serial else None,
+            "command": command,
+            "direction": direction or None
+        }
         
         # 记录完整帧
-        logger.info(f"{direction_text}FULL FRAME{command_text}: {frame_hex}")
+        logger.info(f"{direction_text}FULL FRAME{command_text}: {binascii.hexlify(frame).decode('utf-8')}", extra=extra)
         
-        # 如果帧至少包含基本结构，则分析并记录详细信息
-        if len(frame) >= 8:
+        # 帧结构解析合并为一条多行记录
+        if structure_level is not None and len(frame) >= 8:
             try:
-                header = frame[0]
-                check_code = frame[1]
-                frame_length = frame[2] + (frame[3] << 8)
-                map_factor = frame[4]
-                command = frame[5]
-                
-                # 根据不同的命令码，提供不同的解析信息
-                command_info = ""
-                if command == 0x80:
-                    command_info = "设备登录"
-                elif command == 0x81:
-                    command_info = "心跳数据"
-                elif command == 0x87:
-                    command_info = "确认订单"
-                elif command == 0x88:
-                    command_info = "结束订单"
-                elif command == 0x89:
-                    command_info = "设备故障"
-                elif command == 0x60:
-                    command_info = "车状态改变"
-                elif command == 0x70:
-                    command_info = "远程开锁"
-                elif command == 0x71:
-                    command_info = "远程关锁"
-                elif command == 0x8E:
-                    command_info = "设置锁状态"
-                elif command == 0x8F:
-                    command_info = "远程重启"
-                
-                payload = frame[6:-3] if len(frame) > 9 else b''
-                crc = frame[-3] + (frame[-2] << 8) if len(frame) > 3 else 0
-                footer = frame[-1] if len(frame) > 1 else None
-                
-                # 记录帧结构
-                logger.info(f"{direction_text}FRAME STRUCTURE{command_text}:")
-                logger.info(f"  Header (帧头): 0x{header:02X}")
-                logger.info(f"  Check Code (校验码): 0x{check_code:02X}")
-                logger.info(f"  Length (帧长度): {frame_length} bytes")
-                logger.info(f"  Map Factor (映射因子): 0x{map_factor:02X}")
-                logger.info(f"  Command (命令字): 0x{command:02X} {command_info}")
-                logger.info(f"  Payload (数据): {binascii.hexlify(payload).decode('utf-8')}")
-                logger.info(f"  CRC16 (校验CRC16): 0x{crc:04X}")
-                logger.info(f"  Footer (帧尾): 0x{footer:02X}" if footer is not None else "  Footer (帧尾): None")
-                
-                # 根据命令字进一步解析payload
-                if command == 0x80 and len(payload) >= 8:  # 设备登录
-                    logger.info(f"  设备登录: 序列号={binascii.hexlify(payload[:8]).decode('utf-8')}")
-                    if len(payload) > 8:
-                        logger.info(f"  设备登录: 其他数据={binascii.hexlify(payload[8:]).decode('utf-8')}")
-                
-                elif command == 0x81 and len(payload) >= 8:  # 心跳数据
-                    logger.info(f"  心跳数据: 序列号={binascii.hexlify(payload[:8]).decode('utf-8')}")
-                    if len(payload) > 8:
-                        logger.info(f"  心跳数据: 其他数据={binascii.hexlify(payload[8:]).decode('utf-8')}")
-                
-                elif command == 0x60 and len(payload) >= 10:  # 车状态改变
-                    serial_number = payload[:8]
-                    car_present = payload[8]
-                    lock_status = payload[9]
-                    logger.info(f"  车状态: 序列号={binascii.hexlify(serial_number).decode('utf-8')}, 车辆状态={car_present}, 锁状态={lock_status}")
-                
-                # 时间戳响应的解析 (0x80, 0x81等响应)
-                if direction == "SEND" and (command == 0x80 or command == 0x81) and len(payload) == 4:
-                    timestamp = struct.unpack("<I", payload)[0]
-                    timestamp_iso = datetime.fromtimestamp(timestamp).isoformat()
-                    logger.info(f"  响应时间戳: {timestamp} ({timestamp_iso})")
-            
+                logger.log(structure_level, ParkingLockProtocol.describe_frame(frame, direction, command_name),
+                           extra=extra)
             except Exception as e:
                 logger.error(f"Error analyzing frame structure: {e}")
+    
+    @staticmethod
+    def describe_frame(frame, direction="", command_name=""):
+        """生成帧结构的多行文字说明"""
+        direction_text = f"{direction} " if direction else ""
+        command_text = f" [{command_name}]" if command_name else ""
+        
+        header = frame[0]
+        check_code = frame[1]
+        frame_length = frame[2] + (frame[3] << 8)
+        map_factor = frame[4]
+        command = frame[5]
+        
+        # 命令字名称和载荷布局来自命令字表
+        opcode = OPCODES.get(command)
+        command_info = opcode.name if opcode is not None else ""
+        
+        payload = frame[6:-3] if len(frame) > 9 else b''
+        crc = frame[-3] + (frame[-2] << 8)
+        footer = frame[-1]
+        
+        # 帧结构
+        lines = [
+            f"{direction_text}FRAME STRUCTURE{command_text}:",
+            f"  Header (帧头): 0x{header:02X}",
+            f"  Check Code (校验码): 0x{check_code:02X}",
+            f"  Length (帧长度): {frame_length} bytes",
+            f"  Map Factor (映射因子): 0x{map_factor:02X}",
+            f"  Command (命令字): 0x{command:02X} {command_info}",
+            f"  Payload (数据): {binascii.hexlify(payload).decode('utf-8')}",
+            f"  CRC16 (校验CRC16): 0x{crc:04X}",
+            f"  Footer (帧尾): 0x{footer:02X}"
+        ]
+        
+        # 按命令字表中的载荷布局解析 payload（上行命令字解析设备发来的帧，下行命令字解析服务器下发的帧）
+        if opcode is not None and (direction == "SEND") == (opcode.direction != UPLINK):
+            fields = opcode.unpack(payload)
+            if fields:
+                lines.append(f"  {opcode.name}: " + ", ".join(
+                    f"{name}={binascii.hexlify(value).decode('utf-8') if isinstance(value, bytes) else value}"
+                    for name, value in fields.items()))
+                rest = payload[opcode.layout.size:]
+                if rest:
+                    lines.append(f"  {opcode.name}: 其他数据={binascii.hexlify(rest).decode('utf-8')}")
+        
+        # 时间戳响应的解析 (0x80, 0x81等响应)
+        if direction == "SEND" and opcode is not None and opcode.response == RESPOND_TIMESTAMP and len(payload) == 4:
+            timestamp = struct.unpack("<I", payload)[0]
+            timestamp_iso = datetime.fromtimestamp(timestamp).isoformat()
+            lines.append(f"  响应时间戳: {timestamp} ({timestamp_iso})")
+        
+        return "\n".join(lines)
+
+class ResponseFrameCache:
+    """设备上行帧的应答帧缓存
+    
+    应答策略为 ack 的命令字（0x87/0x88/0x89/0x60 等）应答载荷固定为 0x01，整帧构建一次后复用；
+    策略为 timestamp 的命令字（0x80/0x81）应答只有 4 字节时间戳不同：帧头到命令字的字节和 CRC 中间值预先算好，
+    每秒只接上时间戳、从中间值续算 4 个字节的 CRC。
+    同一秒内的应答复用同一个不可变 bytes 对象（(秒, 帧) 整体替换，读取不需要加锁）。
+    启动时为命令字表中已有的命令字构建，运行时新登记的命令字在第一次应答时构建。
+    """
+    
+    def __init__(self, opcodes=OPCODES):
+        self.acks = {}
+        self.templates = {}  # 命令字 -> (帧头到命令字的 6 个字节, 这 6 个字节的 CRC 中间值)
+        self.current = {}  # 命令字 -> (秒, 帧)
+        for opcode in opcodes:
+            if opcode.response == RESPOND_ACK:
+                self.ack(opcode.code)
+            elif opcode.response == RESPOND_TIMESTAMP:
+                self.template(opcode.code)
+    
+    def ack(self, command):
+        """载荷为 0x01 的固定应答帧"""
+        frame = self.acks.get(command)
+        if frame is None:
+            frame = self.acks[command] = bytes(ParkingLockProtocol.build_frame(command, b'\x01'))
+        return frame
+    
+    def template(self, command):
+        template = self.templates.get(command)
+        if template is None:
+            prefix = bytes(ParkingLockProtocol.build_frame(command, bytes(4))[:6])
+            template = self.templates[command] = (prefix, ParkingLockProtocol.calculate_crc16(prefix))
+        return template
+    
+    def timestamped(self, command, timestamp=None):
+        """载荷为当前时间戳（秒，小端序）的应答帧"""
+        if timestamp is None:
+            timestamp = int(time.time())
+        try:
+            second, frame = self.current[command]
+        except KeyError:
+            second = None
+        if second == timestamp:
+            return frame
+        frame = self.build_timestamped(command, timestamp)
+        self.current[command] = (timestamp, frame)
+        return frame
+    
+    def build_timestamped(self, command, timestamp):
+        """在模板后接上时间戳并续算 CRC，结果与 build_frame(command, struct.pack("<I", timestamp)) 相同"""
+        prefix, prefix_crc = self.template(command)
+        payload = struct.pack("<I", timestamp)
+        crc = ParkingLockProtocol.calculate_crc16(payload, prefix_crc)
+        return prefix + payload + struct.pack("<HB", crc, 0xDD)
+
+class FrameDecoder:
+    """按连接维护解析状态的增量帧提取器
+    
+    接收数据直接写入可复用的缓冲区，解析位置在多次 recv 之间保留，
+    已解析的数据不会被重复扫描。返回的帧是缓冲区上的 memoryview，
+    只在下一次写入缓冲区（get_buffer/feed）之前有效，需要长期保存时请复制为 bytes。
+    """
+    
+    MIN_FRAME_LENGTH = 9     # 帧头(1)+校验码(1)+长度(2)+映射因子(1)+命令字(1)+CRC16(2)+帧尾(1)
+    MAX_FRAME_LENGTH = 512   # 协议中最长的心跳帧只有 48 字节，超过此值视为无效长度
+    
+    def __init__(self, capacity=4096):
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # 下一次解析开始的位置
+        self.end = 0    # 缓冲区中有效数据的末尾
+        self.frames_decoded = 0
+        self.resync_bytes = 0  # 重新同步时丢弃的垃圾字节数
+        self.wanted = 0  # 未解析的数据至少要达到的字节数才可能组成下一帧（不足时 feed/commit 不做解析）
+    
+    def pending(self):
+        """尚未组成完整帧的字节数"""
+        return self.end - self.start
+    
+    def get_buffer(self, size):
+        """返回至少 size 字节的可写缓冲区视图，写入后调用 commit"""
+        if self.end + size > len(self.buffer):
+            self._reserve(size)
+        return self.view[self.end:]
+    
+    def _reserve(self, size):
+        pending = self.end - self.start
+        if pending + size <= len(self.buffer):
+            # 空间足够，把未解析的数据搬到缓冲区开头（等长切片赋值，不改变缓冲区大小）
+            self.buffer[0:pending] = self.buffer[self.start:self.end]
+        else:
+            # 空间不足，分配新缓冲区；之前返回的帧视图仍引用旧缓冲区
+            buffer = bytearray(max(len(self.buffer) * 2, pending + size))
+            buffer[0:pending] = self.buffer[self.start:self.end]
+            self.buffer = buffer
+            self.view = memoryview(buffer)
+        self.start = 0
+        self.end = pending
+    
+    def commit(self, nbytes):
+        """确认写入了 nbytes 字节，返回新解析出的完整帧列表"""
+        self.end += nbytes
+        if self.end - self.start < self.wanted:
+            return []
+        return self._decode()
+    
+    def feed(self, data):
+        """追加接收到的数据，返回新解析出的完整帧列表"""
+        size = len(data)
+        end = self.end
+        if end + size > len(self.buffer):
+            self._reserve(size)
+            end = self.end
+        self.buffer[end:end + size] = data
+        self.end = end = end + size
+        if end - self.start < self.wanted:
+            return []  # 分片到达：当前帧还不完整，不必重新扫描
+        return self._decode()
+    
+    def _decode(self):
+        buffer = self.buffer
+        view = self.view
+        pos = self.start
+        end = self.end
+        min_length = self.MIN_FRAME_LENGTH
+        max_length = self.MAX_FRAME_LENGTH
+        skipped = 0  # 本次重新同步丢弃的字节数
+        frames = []
+        wanted = 0
+        
+        while pos < end:
+            # 重新同步：跳到下一个帧头，丢弃中间的垃圾数据
+            if buffer[pos] != 0xDA:
+                next_header = buffer.find(0xDA, pos, end)
+                if next_header == -1:
+                    skipped += end - pos
+                    pos = end
+                    break
+                skipped += next_header - pos
+                pos = next_header
+            
+            # 需要帧头+校验码+长度字段才能判断帧长度
+            if end - pos < 4:
+                wanted = 4
+                break
+            
+            # 先检查长度字段是否合理，避免为一个假帧头等待大量数据
+            frame_length = buffer[pos + 2] + (buffer[pos + 3] << 8)
+            if frame_length < min_length or frame_length > max_length:
+                skipped += 1
+                pos += 1
+                continue
+            
+            # 数据不完整，等待下一次接收
+            frame_end = pos + frame_length
+            if frame_end > end:
+                wanted = frame_length
+                break
+            
+            # 检查帧尾
+            if buffer[frame_end - 1] != 0xDD:
+                skipped += 1
+                pos += 1
+                continue
+            
+            frames.append(view[pos:frame_end])
+            pos = frame_end
+        
+        self.wanted = wanted
+        self.frames_decoded += len(frames)
+        if skipped:
+            self.resync_bytes += skipped
+            DECODER_RESYNC_BYTES.inc(amount=skipped)
+        if pos == end:
+            # 数据全部处理完，下一次从缓冲区开头写入，无需搬移
+            self.start = self.end = 0
+        else:
+            self.start = pos
+        return frames
+
+class DeviceConnection:
+    """一个设备 TCP 连接，持有自己的帧解析器（接收缓冲区）和下行写队列
+    
+    所有下行帧都经 outbound（见 parking_lock_outbound.py）写出，调用方不会被慢连接阻塞；
+    未指定 outbound 时 sock 本身需提供 write()（异步模式的 TransportSocket）。
+    """
+    
+    __slots__ = ('sock', 'address', 'outbound', 'decoder', 'serial', 'device_type', 'last_seen', 'liveness_timer',
+                 'close_reason')
+    
+    def __init__(self, sock, address, outbound=None):
+        self.sock = sock
+        self.address = address
+        self.outbound = outbound if outbound is not None else sock
+        self.decoder = FrameDecoder()
+        self.serial = None  # 登录后绑定的设备序列号
+        self.device_type = None  # 心跳中上报的设备类型，决定使用哪张命令字表
+        self.last_seen = time.monotonic()  # 最近一次收到帧的时间，由存活检测读取
+        self.liveness_timer = None
+        self.close_reason = "disconnected"  # 离线原因，超时关闭时由存活检测设置
+    
+    def send(self, data):
+        """把帧放入写队列，返回是否接受（连接拥塞或 degraded 时拒绝）；连接已断开时抛出 ConnectionError"""
+        return self.outbound.write(data)
+    
+    def sendall(self, data):
+        """写出全部数据（批量命令一次写出同一连接的多个帧），被写队列拒绝时抛出 ConnectionError"""
+        if not self.outbound.write(data):
+            raise ConnectionError(f"Send queue of {self.address} is congested")
+    
+    @property
+    def degraded(self):
+        """写队列中的数据超过 LOCK_SEND_TIMEOUT 没有写出"""
+        return self.outbound.degraded
+    
+    def close(self):
+        # 先停止写队列，之后不会再写这个 fd（关闭后 fd 可能被新连接复用）
+        if self.outbound is not self.sock:
+            self.outbound.close()
+        # 可能由其他线程调用（例如设备重新登录时关闭旧连接），先 shutdown 唤醒阻塞在 recv 上的处理线程
+        try:
+            if hasattr(self.sock, 'shutdown'):
+                self.sock.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+        try:
+            self.sock.close()
+        except Exception:
+            pass
 
-def send_heartbeat_to_webhook(hb):
-    """将心跳数据格式化为驼峰命名法并发送给 Node.js Webhook"""
-    # 转换为与Node.js后端一致的驼峰命名法
-    webhook_payload = {
-        "serialNumber": binascii.hexlify(hb['serial_number']).decode('utf-8'),
-        "deviceStatus": {
-            "code": hb['device_status'],
-            "description": hb['device_status_description']
-        },
-        "carStatus": {
-            "code": hb['car_status'],
-            "description": hb['car_status_description']
-        },
-        "controlStatus": {
-            "code": hb['control_status'],
-            "description": hb['control_status_description']
-        },
-        "battery": {
-            "3.7v": hb['battery_3_7v'],
-            "12v": hb['battery_12v']
-        },
-        "signalStrength": hb['signal_strength'],
-        "flowNumber": hb['flow_number'],
-        "error": {
-            "code": hb['error_code'],
-            "descriptions": hb.get('error_descriptions', []),
-            "hasError": hb['error_code'] > 0
-        },
-        "groundSensor": {
-            "currentFrequency": hb['current_frequency'],
-            "noCarBase": hb['no_car_base'],
-            "carBase": hb['car_base'],
-            "carRatio": hb['car_ratio'],
-            "noCarRatio": hb['no_car_ratio']
-        },
-        "waterDetection": {
-            "code": hb['water_detection'],
-            "description": "有水" if hb['water_detection'] == 1 else "无水"
-        },
-        "lastHeartbeat": hb.get("last_heartbeat", time.time())
-    }
 
+def send_heartbeat_to_webhook(hb):
+    """将心跳数据格式化为驼峰命名法并同步发送给 Node.js Webhook
+    
+    服务器内部已改用 WebhookDispatcher 异步批量投递，此函数保留用于单次手动发送。
+    """
     headers = {
         'Content-Type': 'application/json',
         'X-Webhook-Secret': WEBHOOK_SECRET
     }
     
     try:
-        response = requests.post(NODE_WEBHOOK_URL, json=webhook_payload, headers=headers, timeout=5)
+        response = requests.post(NODE_WEBHOOK_URL, json=build_webhook_payload(hb), headers=headers, timeout=5)
         if response.status_code == 202:
             logger.info(f"成功发送心跳到Webhook: {hb['serial_number'].hex()}")
         else:
@@ -343,6 +647,75 @@ def send_heartbeat_to_webhook(hb):
     except requests.exceptions.RequestException as e:
         logger.error(f"发送心跳到Webhook异常: {e}")
 
+def format_address(address):
+    """把 (ip, port) 格式化为 ip:port"""
+    return f"{address[0]}:{address[1]}" if address else "unknown"
+
+class DeviceStatusCache:
+    """/api/device_statuses 响应的版本化快照缓存
+    
+    心跳到达时只记录该设备的最新数据并作废它自己的 JSON 片段（O(1)，不做序列化）；
+    查询时只重新序列化被作废的设备，其余设备直接复用缓存的字节。
+    没有变化时，版本号和整体响应体都不变，调用方可以直接用 ETag 返回 304。
+    """
+    
+    def __init__(self):
+        self.lock = InstrumentedLock("status_cache")
+        self.entries = {}    # 序列号 -> (心跳数据, 地址, 最后心跳时间, 是否为重启前的快照数据)
+        self.fragments = {}  # 序列号 -> 已序列化的设备 JSON 片段 (bytes)
+        self.epoch = f"{int(time.time()):x}"  # 区分不同进程生命周期的版本号
+        self.version = 0
+        self.cached = (-1, None)  # (版本号, 响应体)，作为一个整体替换，保证无锁读取时一致
+    
+    @property
+    def etag(self):
+        """当前版本的 ETag，读取不需要加锁"""
+        return f"{self.epoch}-{self.version}"
+    
+    def update(self, serial, heartbeat, address, last_heartbeat, stale=False):
+        """记录设备的最新心跳，只作废该设备的片段"""
+        with self.lock:
+            self.entries[serial] = (heartbeat, address, last_heartbeat, stale)
+            self.fragments.pop(serial, None)
+            self.version += 1
+    
+    def remove(self, serial):
+        """设备断开或重新登录时移除"""
+        with self.lock:
+            if self.entries.pop(serial, None) is not None:
+                self.fragments.pop(serial, None)
+                self.version += 1
+    
+    @staticmethod
+    def serialize(heartbeat, address, last_heartbeat, stale=False):
+        """序列化单个设备的状态（与 /api/device_statuses 的设备对象格式一致）"""
+        status = build_webhook_payload(heartbeat, last_heartbeat)
+        status["address"] = format_address(address)
+        status["stale"] = stale
+        return json.dumps(status).encode('utf-8')
+    
+    def snapshot(self):
+        """返回 (etag, 响应体 bytes)"""
+        version, body = self.cached
+        if version == self.version:
+            return f"{self.epoch}-{version}", body
+        
+        with self.lock:
+            version, body = self.cached
+            if version != self.version:
+                fragments = []
+                for serial, entry in self.entries.items():
+                    fragment = self.fragments.get(serial)
+                    if fragment is None:
+                        fragment = self.fragments[serial] = self.serialize(*entry)
+                    fragments.append(fragment)
+                body = (b'{"success": true, "deviceCount": ' + str(len(fragments)).encode('ascii')
+                        + b', "devices": [' + b', '.join(fragments) + b']}')
+                version = self.version
+                self.cached = (version, body)
+            return f"{self.epoch}-{version}", body
+
+
 class ParkingLockServer:
     """车位锁控制服务器"""
     
@@ -352,16 +725,92 @@ class ParkingLockServer:
         self.port = port
         self.server_socket = None
         self.is_running = False
-        self.client_buffers = {}  # 存储每个客户端的接收缓冲区
+        self.reuse_port = False  # 多进程模式下多个 worker 通过 SO_REUSEPORT 共享同一端口
+        self.registry = DeviceRegistry()  # 已登录设备登记表（按序列号分片）
+        self.connections = set()  # 当前所有连接 (DeviceConnection)
+        self.webhook = WebhookDispatcher(NODE_WEBHOOK_URL, WEBHOOK_SECRET)
+        self.emission_policy = HeartbeatEmissionPolicy()
+        self.status_cache = DeviceStatusCache()
+        load_plugins()  # LOCK_OPCODE_PLUGINS 中其他设备型号的命令字
+        self.opcodes = OPCODES  # 命令字表：名称、载荷布局、处理函数和应答策略
+        self.responses = ResponseFrameCache(self.opcodes)  # 登录/心跳/确认类应答帧缓存
+        self.timer_wheel = TimerWheel()
+        self.commands = CommandTracker(self.timer_wheel)  # 远程命令的请求/响应关联
+        self.batch_limiter = TokenBucket(BATCH_RATE_LIMIT, BATCH_BURST)  # 批量命令下行限速（帧/秒）
+        self.history = HeartbeatHistory()  # 心跳时间序列存储
+        self.liveness = LivenessMonitor(self.timer_wheel)  # 连接存活检测和离线设备记录
+        self.events = EventBroker()  # 设备事件推送（/api/events）
+        self.outbox = CommandOutbox()  # 离线设备的命令发件箱，设备登录后补发
+        self.writer = OutboundWriter()  # 线程模式下写出发送缓冲区已满的连接积压的帧
+        self.snapshot = RegistrySnapshot()  # 设备登记表快照，重启后立即回答状态查询
+        self.stale = {}  # 序列号 -> 从快照恢复、尚未重新登录的设备登记项（connection 为 None）
+    
+    def start_services(self):
+        """启动监听端口之外的后台服务"""
+        self.webhook.start()
+        self.timer_wheel.start()
+        self.history.start()
+        self.outbox.start()
+        self.restore_snapshot()
+    
+    def stop_services(self):
+        """停止后台服务"""
+        self.timer_wheel.stop()
+        self.webhook.stop()
+        self.history.stop()
+        self.outbox.stop()
+        self.snapshot.stop()
+    
+    def restore_snapshot(self):
+        """加载上次运行的设备登记表快照，设备以 stale 状态出现在状态查询中，直到重新登录
+        
+        超过设备超时时间仍未重新登录的设备转入离线列表。之后启动快照写线程。
+        """
+        for serial, address, login_time, last_heartbeat, payload in self.snapshot.load():
+            heartbeat = ParkingLockProtocol.parse_heartbeat_data(payload)
+            if heartbeat is None or heartbeat.serial_number != serial:
+                continue
+            entry = DeviceEntry(serial, None, address)
+            entry.login_time = login_time
+            entry.last_heartbeat = last_heartbeat
+            entry.heartbeat = heartbeat
+            self.stale[serial] = entry
+            self.status_cache.update(serial, heartbeat, address, last_heartbeat, stale=True)
+        if self.stale:
+            logger.info(f"Restored {len(self.stale)} devices from registry snapshot, "
+                        f"awaiting reconnection for {self.liveness.device_timeout:.0f}s")
+            self.timer_wheel.schedule(self.liveness.device_timeout, self.expire_stale)
+        self.snapshot.start(self.lookup_snapshot_entry, list(self.stale.values()))
+    
+    def lookup_snapshot_entry(self, serial):
+        """快照写线程按序列号取当前登记项：已登录的设备，或尚未重新登录的快照设备"""
+        return self.registry.get(serial) or self.stale.get(serial)
+    
+    def expire_stale(self):
+        """时间轮线程中执行：快照中超时仍未重新登录的设备转入离线列表
+        
+        多进程模式下设备可能已重连到其他 worker，因此这里不推送离线 Webhook 和事件。
+        """
+        for serial in list(self.stale):
+            entry = self.stale.pop(serial, None)
+            if entry is None or self.registry.get(serial) is not None:
+                continue  # 已重新登录
+            self.status_cache.remove(serial)
+            self.liveness.mark_offline(entry, "not_reconnected")
+            self.snapshot.touch(serial)
     
     def start(self):
         """启动服务器"""
         try:
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.reuse_port:
+                self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             self.server_socket.bind((self.host, self.port))
             self.server_socket.listen(10)
             self.is_running = True
+            self.start_services()
+            self.writer.start()
             
             logger.info(f"Server started on {self.host}:{self.port}")
             
@@ -380,6 +829,8 @@ class ParkingLockServer:
         self.is_running = False
         if self.server_socket:
             self.server_socket.close()
+        self.writer.stop()
+        self.stop_services()
         logger.info("Server stopped")
     
     def accept_clients(self):
@@ -388,12 +839,19 @@ class ParkingLockServer:
             try:
                 client_socket, client_address = self.server_socket.accept()
                 logger.info(f"New connection from {client_address}")
+                CONNECTIONS_ACCEPTED.inc()
                 
-                # 为新客户端创建接收缓冲区
-                self.client_buffers[client_socket] = bytearray()
+                # 为新客户端创建连接对象（包含自己的帧解析器）
+                configure_keepalive(client_socket)
+                if LOCK_RECV_TIMEOUT > 0:
+                    client_socket.settimeout(LOCK_RECV_TIMEOUT)
+                outbound = SocketOutbound(client_socket, client_address, self.writer, self.timer_wheel)
+                connection = DeviceConnection(client_socket, client_address, outbound)
+                self.connections.add(connection)
+                self.liveness.watch(connection)
                 
                 # 启动处理客户端消息的线程
-                client_thread = threading.Thread(target=self.handle_client, args=(client_socket, client_address))
+                client_thread = threading.Thread(target=self.handle_client, args=(connection,))
                 client_thread.daemon = True
                 client_thread.start()
             except Exception as e:
@@ -401,97 +859,85 @@ class ParkingLockServer:
                     logger.error(f"Error accepting client: {e}")
                     time.sleep(1)
     
-    def handle_client(self, client_socket, client_address):
+    def handle_client(self, connection):
         """处理客户端消息"""
-        device_serial = None
+        client_socket = connection.sock
+        decoder = connection.decoder
         
         try:
             while self.is_running:
-                # 接收数据
-                data = client_socket.recv(1024)
-                if not data:
+                # 直接接收到解析器的缓冲区中，避免额外复制
+                received = client_socket.recv_into(decoder.get_buffer(1024), 1024)
+                if not received:
                     break
                 
-                # 添加到缓冲区
-                if client_socket in self.client_buffers:
-                    self.client_buffers[client_socket].extend(data)
-                else:
-                    self.client_buffers[client_socket] = bytearray(data)
-                
                 # 检查是否有完整的帧
-                frames = self.extract_frames(self.client_buffers[client_socket])
+                frames = decoder.commit(received)
                 for frame in frames:
-                    # 记录接收到的完整帧
-                    ParkingLockProtocol.log_frame(frame, "RECV")
-                    
-                    parsed_frame = ParkingLockProtocol.parse_frame(frame)
-                    if parsed_frame:
-                        # 如果是登录帧，提取设备序列号
-                        if parsed_frame["command"] == 0x80:
-                            serial_number = ParkingLockProtocol.extract_serial_number(parsed_frame["payload"])
-                            if serial_number:
-                                # 如果这个设备已经登录过，则更新连接信息
-                                with device_lock:
-                                    if serial_number in connected_devices:
-                                        # 如果已有相同设备序列号的连接，检查是否是同一个客户端
-                                        existing_socket = connected_devices[serial_number]["socket"]
-                                        if existing_socket != client_socket:
-                                            # 如果是新的客户端，关闭旧连接
-                                            try:
-                                                existing_socket.close()
-                                                logger.info(f"Closed previous connection for device {binascii.hexlify(serial_number)}")
-                                            except:
-                                                pass
-                                        else:
-                                            # 同一客户端重复登录，只更新心跳时间
-                                            connected_devices[serial_number]["last_heartbeat"] = time.time()
-                                            # 不记录重复登录日志，减少日志干扰
-                                            # 直接处理并响应
-                                            self.process_frame(parsed_frame, client_socket)
-                                            continue
-                                    
-                                    # 注册新设备连接或更新连接
-                                    connected_devices[serial_number] = {
-                                        "socket": client_socket,
-                                        "address": client_address,
-                                        "last_heartbeat": time.time()
-                                    }
-                                    device_serial = serial_number
-                                    logger.info(f"Device {binascii.hexlify(serial_number)} logged in from {client_address}")
-                        
-                        # 如果是心跳帧，更新最后心跳时间
-                        elif parsed_frame["command"] == 0x81 and device_serial:
-                            with device_lock:
-                                if device_serial in connected_devices:
-                                    connected_devices[device_serial]["last_heartbeat"] = time.time()
-                            logger.debug(f"Heartbeat received from device {binascii.hexlify(device_serial)}")
-                        
-                        # 处理帧并发送响应
-                        self.process_frame(parsed_frame, client_socket)
+                    self.handle_frame(frame, connection)
+        except socket.timeout:
+            connection.close_reason = "recv_timeout"
+            logger.warning(f"No data from {connection.address} for {LOCK_RECV_TIMEOUT:.0f}s, closing connection")
         except Exception as e:
-            logger.error(f"Error handling client {client_address}: {e}")
+            logger.error(f"Error handling client {connection.address}: {e}")
         finally:
             # 关闭连接并移除设备记录
-            try:
-                client_socket.close()
-            except:
-                pass
-            
-            # 移除客户端缓冲区
-            if client_socket in self.client_buffers:
-                del self.client_buffers[client_socket]
-            
-            # 移除设备连接记录
-            if device_serial:
-                with device_lock:
-                    if device_serial in connected_devices and connected_devices[device_serial]["socket"] == client_socket:
-                        del connected_devices[device_serial]
-                        logger.info(f"Device {binascii.hexlify(device_serial)} disconnected")
-            else:
-                logger.info(f"Connection from {client_address} closed")
+            connection.close()
+            self.connections.discard(connection)
+            self.handle_disconnect(connection)
+    
+    def handle_frame(self, frame, connection):
+        """处理一个完整的接收帧
+        
+        线程模式和异步模式共用此方法，保证登录/心跳/命令语义一致。
+        按命令字记录帧数和处理耗时。
+        """
+        command = COMMAND_LABELS[frame[5]]
+        started = time.perf_counter()
+        connection.last_seen = time.monotonic()
+        try:
+            self._handle_frame(frame, connection)
+        finally:
+            FRAME_SECONDS.observe(time.perf_counter() - started, command)
+            FRAMES_RECEIVED.inc(command)
+    
+    def _handle_frame(self, frame, connection):
+        # 记录接收到的完整帧
+        ParkingLockProtocol.log_frame(frame, "RECV", serial=connection.serial)
+        
+        parsed_frame = ParkingLockProtocol.parse_frame(frame)
+        if not parsed_frame:
+            return
+        
+        # 处理帧并发送响应
+        self.process_frame(parsed_frame, connection)
+    
+    def handle_disconnect(self, connection):
+        """连接断开后移除设备连接记录，并记录离线、通知 Node.js（服务器停止时不上报）"""
+        self.liveness.unwatch(connection)
+        device_serial = connection.serial
+        if device_serial:
+            entry = self.registry.unregister(device_serial, connection)
+            if entry is not None:
+                self.emission_policy.forget(device_serial)
+                self.status_cache.remove(device_serial)
+                self.commands.fail_device(device_serial)
+                frame_sampler.forget(device_serial)
+                logger.info(f"Device {binascii.hexlify(device_serial)} disconnected ({connection.close_reason})")
+                if self.is_running:
+                    # 服务器停止时保留快照中的记录，重启后作为 stale 设备恢复
+                    self.snapshot.touch(device_serial)
+                    record = self.liveness.mark_offline(entry, connection.close_reason)
+                    self.webhook.submit(build_offline_payload(record))
+                    self.events.publish("logout", device_serial, {"reason": connection.close_reason})
+        else:
+            logger.info(f"Connection from {connection.address} closed")
     
     def extract_frames(self, buffer):
-        """从缓冲区中提取完整的帧，并从缓冲区中删除已处理的数据"""
+        """从缓冲区中提取完整的帧，并从缓冲区中删除已处理的数据
+        
+        旧的整缓冲区扫描实现，连接处理已改用 FrameDecoder，此方法保留用于兼容和基准对比。
+        """
         frames = []
         start_index = 0
         processed_index = 0
@@ -529,227 +975,496 @@ class ParkingLockServer:
         
         return frames
     
-    def process_frame(self, parsed_frame, client_socket):
-        """处理接收到的帧"""
+    def process_frame(self, parsed_frame, connection):
+        """处理接收到的帧
+        
+        按连接的设备类型在命令字表中查找命令字（一次字典查找），先按应答策略回应设备，再调用处理函数。
+        """
         command = parsed_frame["command"]
         payload = parsed_frame["payload"]
         
-        logger.info(f"Processing command: 0x{command:02X}, payload: {binascii.hexlify(payload)}")
+        # 每帧都会经过这里，只在 DEBUG 级别输出，参数延迟格式化
+        logger.debug("Processing command: 0x%02X, payload: %s", command, bytes(payload).hex())
+        
+        tables = self.opcodes.tables
+        opcode = (tables.get(connection.device_type) or tables[None]).get(command)
+        if opcode is None:
+            FRAMES_UNHANDLED.inc(COMMAND_LABELS[command])
+            logger.debug("No opcode registered for command 0x%02X from %s", command, connection.address)
+            return
         
         try:
-            if command == 0x80:  # 设备登录
-                # 回应设备登录 - 严格按照协议文档格式
-                timestamp = int(time.time())
-                logger.info(f"Responding with timestamp: {timestamp} (0x{timestamp:08X})")
-                
-                # 按照协议要求构建响应payload：4字节时间戳（小端序）
-                response_payload = struct.pack("<I", timestamp)
-                logger.debug(f"Login response payload (timestamp): {binascii.hexlify(response_payload)}")
-                
-                # 构建完整的响应帧
-                response_frame = ParkingLockProtocol.build_frame(0x80, response_payload)
-                
-                # 记录发送的完整帧
-                ParkingLockProtocol.log_frame(response_frame, "SEND", "设备登录响应")
-                
-                # 发送响应
-                client_socket.send(response_frame)
-                logger.info(f"Sent login response with timestamp {timestamp}")
-            
-            elif command == 0x81:  # 心跳数据
-                # 回应心跳
-                timestamp = int(time.time())
-                response_payload = struct.pack("<I", timestamp)
-                response_frame = ParkingLockProtocol.build_frame(0x81, response_payload)
-                
-                # 记录发送的完整帧
-                ParkingLockProtocol.log_frame(response_frame, "SEND", "心跳响应")
-                
-                client_socket.send(response_frame)
-                logger.debug(f"Sent heartbeat response with timestamp {timestamp}")
-                
-                # 解析心跳数据
-                heartbeat_data = ParkingLockProtocol.parse_heartbeat_data(payload)
-                if heartbeat_data:
-                    serial_number = heartbeat_data["serial_number"]
-                    # 存储心跳数据
-                    with device_lock:
-                        if serial_number in connected_devices:
-                            connected_devices[serial_number]["last_heartbeat"] = time.time()
-                            connected_devices[serial_number]["heartbeat_data"] = heartbeat_data
-                            
-                            # 异步发送心跳数据到 Node.js Webhook
-                            threading.Thread(target=send_heartbeat_to_webhook, args=(heartbeat_data,)).start()
-                            
-                            # 记录关键状态变化
-                            if "previous_status" in connected_devices[serial_number]:
-                                prev_status = connected_devices[serial_number]["previous_status"]
-                                current_status = heartbeat_data["device_status"]
-                                prev_car = connected_devices[serial_number]["previous_car_status"]
-                                current_car = heartbeat_data["car_status"]
-                                
-                                if prev_status != current_status or prev_car != current_car:
-                                    logger.info(f"Device {binascii.hexlify(serial_number)} status changed: "
-                                               f"Status {prev_status}({connected_devices[serial_number]['previous_status_desc']}) -> "
-                                               f"{current_status}({heartbeat_data['device_status_description']}), "
-                                               f"Car {prev_car} -> {current_car}")
-                            
-                            # 保存当前状态用于下次比较
-                            connected_devices[serial_number]["previous_status"] = heartbeat_data["device_status"]
-                            connected_devices[serial_number]["previous_status_desc"] = heartbeat_data["device_status_description"]
-                            connected_devices[serial_number]["previous_car_status"] = heartbeat_data["car_status"]
-                            
-                    logger.debug(f"Heartbeat processed from device {binascii.hexlify(serial_number)}")
-            elif command == 0x87:  # 确认订单（常降型设备）
-                # 回应确认订单
-                response_payload = bytes([0x01])  # 成功
-                response_frame = ParkingLockProtocol.build_frame(0x87, response_payload)
-                
-                # 记录发送的完整帧
-                ParkingLockProtocol.log_frame(response_frame, "SEND", "确认订单响应")
-                
-                client_socket.send(response_frame)
-                logger.info(f"Sent order confirmation response")
-            
-            elif command == 0x88:  # 结束订单（常升型设备）
-                # 回应结束订单
-                response_payload = bytes([0x01])  # 成功
-                response_frame = ParkingLockProtocol.build_frame(0x88, response_payload)
-                
-                # 记录发送的完整帧
-                ParkingLockProtocol.log_frame(response_frame, "SEND", "结束订单响应")
-                
-                client_socket.send(response_frame)
-                logger.info(f"Sent order completion response")
-            
-            elif command == 0x89:  # 设备故障
-                # 回应设备故障
-                response_payload = bytes([0x01])  # 成功
-                response_frame = ParkingLockProtocol.build_frame(0x89, response_payload)
+            if opcode.response != RESPOND_NONE:
+                self.respond(opcode, connection, payload)
+            handler = opcode.handler
+            if handler is None:
+                return
+            if isinstance(handler, str):
+                getattr(self, handler)(connection, opcode, payload)
+            else:
+                handler(self, connection, opcode, payload)
+        except Exception as e:
+            logger.error(f"Error processing frame: {e}")
+    
+    def respond(self, opcode, connection, payload):
+        """按命令字的应答策略回应设备（应答帧来自缓存）"""
+        if opcode.response == RESPOND_TIMESTAMP:
+            # 按照协议要求响应payload为4字节时间戳（小端序），同一秒内复用缓存的响应帧
+            response_frame = self.responses.timestamped(opcode.code)
+        else:
+            response_frame = self.responses.ack(opcode.code)  # 载荷 0x01：成功
+        
+        # 记录发送的完整帧（首次登录时连接尚未绑定序列号，取载荷开头的序列号）
+        serial = connection.serial
+        if serial is None and opcode.serial_prefixed and len(payload) >= 8:
+            serial = bytes(payload[:8])
+        ParkingLockProtocol.log_frame(response_frame, "SEND", opcode.response_name, serial)
+        
+        connection.send(response_frame)
+        logger.debug("Sent %s response to %s", opcode.name, connection.address)
+    
+    def handle_login(self, connection, opcode, payload):
+        """0x80 设备登录：注册设备连接，关闭同一设备的旧连接，补发发件箱中积压的命令"""
+        serial_number = ParkingLockProtocol.extract_serial_number(payload)
+        if not serial_number:
+            return
+        entry = self.registry.get(serial_number)
+        if entry is not None and entry.connection is connection:
+            # 同一客户端重复登录，只更新心跳时间
+            # 不记录重复登录日志，减少日志干扰
+            entry.last_heartbeat = time.time()
+            return
+        
+        # 注册新设备连接或更新连接（新连接尚无心跳数据）
+        self.status_cache.remove(serial_number)
+        self.stale.pop(serial_number, None)
+        entry, previous = self.registry.register(serial_number, connection, connection.address)
+        if previous is not None and previous.connection is not connection:
+            # 如果已有相同设备序列号的连接，关闭旧连接
+            previous.connection.close()
+            logger.info(f"Closed previous connection for device {binascii.hexlify(serial_number)}")
+        connection.serial = serial_number
+        self.liveness.mark_online(serial_number)
+        logger.info(f"Device {binascii.hexlify(serial_number)} logged in from {connection.address}")
+        self.events.publish("login", serial_number, {"address": format_address(connection.address)})
+        # 重启命令以设备重新登录作为完成标志
+        self.commands.match_login(serial_number)
+        
+        # 新登录的设备：在登录应答之后补发发件箱中积压的命令
+        self.flush_outbox(serial_number)
+    
+    def handle_heartbeat(self, connection, opcode, payload):
+        """0x81 心跳数据：更新最后心跳时间，存储心跳并推送变化，匹配等待中的远程命令"""
+        if connection.serial:
+            entry = self.registry.get(connection.serial)
+            if entry is not None:
+                entry.last_heartbeat = time.time()
+        
+        # 解析心跳数据
+        heartbeat_data = ParkingLockProtocol.parse_heartbeat_data(payload)
+        if heartbeat_data:
+            # 心跳中的设备类型决定该连接之后的帧使用哪张命令字表
+            connection.device_type = heartbeat_data.device_type
+            serial_number = heartbeat_data["serial_number"]
+            # 存储心跳数据（登记项只由持有该连接的线程更新，不需要加锁）
+            entry = self.registry.get(serial_number)
+            if entry is not None:
+                # 有订阅者时推送与上一次心跳相比变化的字段
+                if self.events.active:
+                    changes = heartbeat_changes(entry.heartbeat, heartbeat_data)
+                    if changes:
+                        self.events.publish("heartbeat", serial_number, {"changes": changes})
+                entry.last_heartbeat = time.time()
+                entry.heartbeat = heartbeat_data
+                self.status_cache.update(serial_number, heartbeat_data, entry.address, entry.last_heartbeat)
+                self.snapshot.touch(serial_number)
+                self.history.record(serial_number, heartbeat_data, entry.last_heartbeat)
                 
-                # 记录发送的完整帧
-                ParkingLockProtocol.log_frame(response_frame, "SEND", "设备故障响应")
+                # 状态变化或到达保活间隔时，放入 Webhook 投递队列，由发送线程异步推送给 Node.js
+                if self.webhook.enabled:
+                    decision = self.emission_policy.decide(heartbeat_data)
+                    if decision is not None:
+                        # 只有成功入队才记入推送状态，被丢弃的状态变化由之后的心跳重新推送
+                        if self.webhook.submit(build_webhook_payload(heartbeat_data)):
+                            self.emission_policy.commit(decision)
+                        else:
+                            self.emission_policy.reject(decision)
                 
-                client_socket.send(response_frame)
-                logger.info(f"Sent fault acknowledgment")
-            
-            elif command == 0x60:  # 车状态改变
-                # 回应车状态改变
-                response_payload = bytes([0x01])  # 成功
-                response_frame = ParkingLockProtocol.build_frame(0x60, response_payload)
+                # 记录关键状态变化
+                if entry.previous_status is not None:
+                    prev_status = entry.previous_status
+                    current_status = heartbeat_data["device_status"]
+                    prev_car = entry.previous_car_status
+                    current_car = heartbeat_data["car_status"]
+                    
+                    if prev_status != current_status or prev_car != current_car:
+                        logger.info(f"Device {binascii.hexlify(serial_number)} status changed: "
+                                   f"Status {prev_status}({entry.previous_status_desc}) -> "
+                                   f"{current_status}({heartbeat_data['device_status_description']}), "
+                                   f"Car {prev_car} -> {current_car}")
                 
-                # 记录发送的完整帧
-                ParkingLockProtocol.log_frame(response_frame, "SEND", "车状态改变响应")
+                # 保存当前状态用于下次比较
+                entry.previous_status = heartbeat_data["device_status"]
+                entry.previous_status_desc = heartbeat_data["device_status_description"]
+                entry.previous_car_status = heartbeat_data["car_status"]
                 
-                client_socket.send(response_frame)
-                logger.info(f"Sent car status change response")
+                # 心跳中的状态可能完成正在等待的开锁/关锁/设置状态命令
+                self.commands.match_heartbeat(serial_number, heartbeat_data)
                 
-                # 解析车状态
-                if len(payload) >= 10:  # 确保有足够的数据
-                    serial_number = payload[:8]
-                    car_present = payload[8]
-                    lock_status = payload[9]
-                    logger.info(f"Car status change: Device {binascii.hexlify(serial_number)}, Car present: {car_present}, Lock status: {lock_status}")
-        except Exception as e:
-            logger.error(f"Error processing frame: {e}")
+            logger.debug("Heartbeat processed from device %s", serial_number.hex())
+    
+    def handle_device_report(self, connection, opcode, payload):
+        """0x87 确认订单 / 0x88 结束订单 / 0x89 设备故障：已按固定应答确认，只记录日志"""
+        serial = binascii.hexlify(connection.serial) if connection.serial else connection.address
+        logger.info(f"Acknowledged {opcode.name} from device {serial}: {binascii.hexlify(payload)}")
+    
+    def handle_car_status(self, connection, opcode, payload):
+        """0x60 车状态改变：记录并推送 car_status 事件"""
+        fields = opcode.unpack(payload)
+        if fields is None:
+            return
+        serial_number = fields["serial"]
+        car_present = fields["car_present"]
+        lock_status = fields["lock_status"]
+        logger.info(f"Car status change: Device {binascii.hexlify(serial_number)}, Car present: {car_present}, Lock status: {lock_status}")
+        self.events.publish("car_status", serial_number, {"car_present": car_present,
+                                                          "lock_status": lock_status})
+    
+    def handle_command_response(self, connection, opcode, payload):
+        """设备对远程命令的响应：按流水号（或命令字）匹配等待中的命令"""
+        if connection.serial and self.commands.match_response(connection.serial, opcode.code, payload):
+            logger.info(f"Received {opcode.name} response from device {binascii.hexlify(connection.serial)}")
+        else:
+            logger.warning(f"Unmatched 0x{opcode.code:02X} response from {connection.address}: {binascii.hexlify(payload)}")
     
     def send_command_to_device(self, device_serial, command, payload=b''):
         """向特定设备发送命令"""
-        with device_lock:
-            if device_serial not in connected_devices:
-                logger.error(f"Device {binascii.hexlify(device_serial)} not connected")
-                return False
-            
-            socket = connected_devices[device_serial]["socket"]
+        entry = self.registry.get(device_serial)
+        if entry is None:
+            # 命令可能随后进入发件箱，是否记录错误由调用方决定
+            logger.debug(f"Device {binascii.hexlify(device_serial)} not connected")
+            return False
         
         try:
             frame = ParkingLockProtocol.build_frame(command, payload)
             
-            # 获取命令名称
-            command_name = ""
-            if command == 0x70:
-                command_name = "远程开锁"
-            elif command == 0x71:
-                command_name = "远程关锁"
-            elif command == 0x8E:
-                command_name = "设置锁状态"
-            elif command == 0x86:
-                command_name = "同步时间"
-            elif command == 0x8F:
-                command_name = "远程重启"
-            
             # 记录发送的完整帧
-            ParkingLockProtocol.log_frame(frame, "SEND", command_name)
+            command_name = self.opcodes.name(command, entry.connection.device_type)
+            ParkingLockProtocol.log_frame(frame, "SEND", command_name, device_serial)
             
-            socket.send(frame)
+            with COMMAND_SEND_SECONDS.time(COMMAND_LABELS[command]):
+                accepted = entry.connection.send(frame)
+            if not accepted:
+                logger.warning(f"Send queue of device {binascii.hexlify(device_serial)} is congested, "
+                               f"command 0x{command:02X} not sent")
+                return False
             logger.info(f"Sent command 0x{command:02X} to device {binascii.hexlify(device_serial)}")
             return True
         except Exception as e:
             logger.error(f"Error sending command to device {binascii.hexlify(device_serial)}: {e}")
             return False
     
+    def build_command_payload(self, device_serial, command, flow_number, state=None):
+        """按命令字表中的载荷布局构建远程命令载荷（设备已登录时使用其设备类型的命令字表）"""
+        entry = self.registry.get(device_serial)
+        opcode = self.opcodes.get(command, entry.connection.device_type if entry is not None else None)
+        if opcode is None:
+            return b''
+        return opcode.pack(serial=device_serial, flow_number=flow_number, state=state, timestamp=int(time.time()))
+    
+    def submit_command(self, device_serial, command, state=None, timeout=COMMAND_TIMEOUT):
+        """发送远程命令并登记待响应项
+        
+        返回 PendingCommand，设备未连接时返回 None。其 future 在设备响应、超时或断开时完成，
+        异步调用方可以 await asyncio.wrap_future(pending.future)。
+        """
+        if device_serial not in self.registry:
+            # 命令可能随后进入发件箱，是否记录错误由调用方决定
+            logger.debug(f"Device {binascii.hexlify(device_serial)} not connected")
+            return None
+        
+        # 先登记再发送，避免设备响应比登记更早到达
+        pending = self.commands.register(device_serial, command, timeout, state)
+        payload = self.build_command_payload(device_serial, command, pending.flow_number, state)
+        if not self.send_command_to_device(device_serial, command, payload):
+            self.commands.resolve(pending, "send_failed", False)
+        return pending
+    
+    def queue_command(self, device_serial, command, state=None, ttl=None, timeout=COMMAND_TIMEOUT, wait=False):
+        """设备未连接时把命令放入发件箱，设备登录后补发
+        
+        ttl 为命令在发件箱中的有效秒数（None 使用 LOCK_OUTBOX_TTL，默认 0；<=0 表示不排队）。
+        返回 QueuedCommand；不排队、发件箱未启用或已满时返回 None。
+        """
+        ttl = queue_ttl(ttl)
+        if ttl <= 0 or outbox_kind(command) is None:
+            return None
+        queued = self.outbox.enqueue(device_serial, command, state, ttl, timeout, wait)
+        if queued is not None and device_serial in self.registry:
+            # 入队时设备恰好登录，登录处理可能已经查过发件箱
+            self.flush_outbox(device_serial)
+        return queued
+    
+    def flush_outbox(self, device_serial):
+        """补发设备在发件箱中积压的命令（发件箱中没有该设备的命令时不访问数据库）"""
+        if self.outbox.has_pending(device_serial):
+            self.replay_outbox(device_serial)
+    
+    def replay_outbox(self, device_serial):
+        """按入队顺序补发设备在发件箱中积压的命令"""
+        for queued in self.outbox.take(device_serial):
+            pending = self.submit_command(device_serial, queued.command, queued.state, queued.timeout or COMMAND_TIMEOUT)
+            self.outbox.replayed(queued, pending)
+            logger.info(f"Replayed queued command 0x{queued.command:02X} to device {binascii.hexlify(device_serial)} "
+                        f"after {time.time() - queued.created:.1f}s")
+    
+    def execute_command(self, device_serial, command, state=None, wait=False, timeout=COMMAND_TIMEOUT, ttl=None):
+        """执行远程命令，返回结果字典
+        
+        wait=False 时发送成功即返回 status="sent"；wait=True 时阻塞等待设备响应，
+        最多 timeout 秒，status 见 PendingCommand。
+        设备未连接且 ttl 允许排队时命令进入发件箱（见 queue_command），返回 status="queued"、success=False；
+        wait=True 且设备在 timeout 内登录时返回补发命令的结果。
+        """
+        timeout = min(max(float(timeout), 0.1), COMMAND_MAX_TIMEOUT)
+        pending = self.submit_command(device_serial, command, state, timeout)
+        if pending is None:
+            queued = self.queue_command(device_serial, command, state, ttl, timeout, wait)
+            if queued is None:
+                logger.error(f"Device {binascii.hexlify(device_serial)} not connected, command 0x{command:02X} not sent")
+                return unsent_result(command, "not_connected")
+            if not wait:
+                return queued.result()
+            try:
+                return queued.future.result(timeout=timeout)
+            except TimeoutError:
+                return queued.result()
+            finally:
+                self.outbox.forget(queued)
+        if wait or pending.future.done():
+            # 时间轮按 tick 回收超时命令，这里多留一点余量
+            return pending.future.result(timeout=timeout + 1)
+        return pending.result("sent", True)
+    
+    def execute_batch(self, commands, wait=False, timeout=COMMAND_TIMEOUT, ttl=None):
+        """批量执行远程命令
+        
+        commands 为 [(设备序列号, 命令字, 状态参数), ...]。先为所有命令分配流水号并构建帧，
+        按连接分组后经令牌桶限速，放入各连接的写队列（同一连接的多个帧合并为一次写，不阻塞）。
+        返回与输入一一对应的结果字典列表；wait=True 时所有命令共用一个截止时间等待设备响应。
+        未连接设备的命令在 ttl 允许排队时进入发件箱，结果 status 为 queued（不等待补发）。
+        """
+        timeout = min(max(float(timeout), 0.1), COMMAND_MAX_TIMEOUT)
+        results = [None] * len(commands)
+        pendings = [None] * len(commands)
+        groups = {}  # DeviceConnection -> [(下标, 帧), ...]
+        
+        for index, (device_serial, command, state) in enumerate(commands):
+            entry = self.registry.get(device_serial)
+            if entry is None:
+                queued = self.queue_command(device_serial, command, state, ttl, timeout)
+                results[index] = queued.result() if queued is not None else unsent_result(command, "not_connected")
+                continue
+            pending = self.commands.register(device_serial, command, timeout, state)
+            payload = self.build_command_payload(device_serial, command, pending.flow_number, state)
+            frame = ParkingLockProtocol.build_frame(command, payload)
+            ParkingLockProtocol.log_frame(frame, "SEND", self.opcodes.name(command, entry.connection.device_type),
+                                          device_serial)
+            pendings[index] = pending
+            groups.setdefault(entry.connection, []).append((index, frame))
+        
+        for connection, frames in groups.items():
+            self.batch_limiter.acquire(len(frames))
+            data = b''.join(bytes(frame) for _, frame in frames)
+            try:
+                self.send_batch_frames(connection, data)
+            except Exception as e:
+                logger.error(f"Error sending batch commands to {connection.address}: {e}")
+                for index, _ in frames:
+                    self.commands.resolve(pendings[index], "send_failed", False)
+        
+        deadline = time.monotonic() + timeout + 1
+        for index, pending in enumerate(pendings):
+            if pending is None:
+                continue
+            if wait or pending.future.done():
+                try:
+                    results[index] = pending.future.result(timeout=max(0, deadline - time.monotonic()))
+                except TimeoutError:
+                    results[index] = pending.result("timeout", False)
+            else:
+                results[index] = pending.result("sent", True)
+        
+        sent = sum(1 for pending in pendings if pending is not None)
+        logger.info(f"Batch of {len(commands)} commands: {sent} sent over {len(groups)} connections")
+        return results
+    
+    @staticmethod
+    def send_batch_frames(connection, data):
+        """一次写入同一连接的多条命令帧"""
+        with COMMAND_SEND_SECONDS.time("batch"):
+            connection.sendall(data)
+    
     def remote_open_lock(self, device_serial):
         """远程开锁"""
-        # 构建流水号（4字节）
-        flow_number = struct.pack("<I", int(time.time()) % 10000)
-        payload = device_serial + flow_number
-        return self.send_command_to_device(device_serial, 0x70, payload)
+        return self.execute_command(device_serial, 0x70)["success"]
     
     def remote_close_lock(self, device_serial):
         """远程关锁"""
-        # 构建流水号（4字节）
-        flow_number = struct.pack("<I", int(time.time()) % 10000)
-        payload = device_serial + flow_number
-        return self.send_command_to_device(device_serial, 0x71, payload)
+        return self.execute_command(device_serial, 0x71)["success"]
     
     def set_lock_state(self, device_serial, state):
         """设置锁状态（0:正常, 1:保持开, 2:保持关）"""
-        # 构建流水号（4字节）
-        flow_number = struct.pack("<I", int(time.time()) % 10000)
-        payload = device_serial + flow_number + bytes([state])
-        return self.send_command_to_device(device_serial, 0x8E, payload)
+        return self.execute_command(device_serial, 0x8E, state)["success"]
     
     def sync_time(self, device_serial):
         """同步时间"""
-        payload = device_serial + struct.pack("<I", int(time.time()))
-        return self.send_command_to_device(device_serial, 0x86, payload)
+        return self.execute_command(device_serial, 0x86)["success"]
     
     def remote_restart(self, device_serial):
         """远程重启设备"""
-        return self.send_command_to_device(device_serial, 0x8F)
+        return self.execute_command(device_serial, 0x8F)["success"]
     
     def get_connected_devices(self):
         """获取当前连接的设备列表"""
-        with device_lock:
-            devices = []
-            current_time = time.time()
-            for serial, info in connected_devices.items():
-                devices.append({
-                    "serial": binascii.hexlify(serial).decode('utf-8'),
-                    "address": info["address"],
-                    "last_heartbeat": datetime.fromtimestamp(info["last_heartbeat"]).strftime('%Y-%m-%d %H:%M:%S'),
-                    "last_heartbeat_seconds_ago": int(current_time - info["last_heartbeat"])
-                })
+        devices = []
+        current_time = time.time()
+        for entry in self.registry.snapshot():
+            devices.append({
+                "serial": binascii.hexlify(entry.serial).decode('utf-8'),
+                "address": entry.address,
+                "last_heartbeat": datetime.fromtimestamp(entry.last_heartbeat).strftime('%Y-%m-%d %H:%M:%S'),
+                "last_heartbeat_seconds_ago": int(current_time - entry.last_heartbeat),
+                "degraded": entry.connection.degraded
+            })
         return devices
         
     def get_device_status(self, device_serial):
-        """获取设备详细状态"""
-        with device_lock:
-            if device_serial in connected_devices and "heartbeat_data" in connected_devices[device_serial]:
-                return connected_devices[device_serial]["heartbeat_data"]
+        """获取设备详细状态（stale 为 True 表示重启前的快照数据，设备尚未重新登录）"""
+        entry = self.registry.get(device_serial)
+        stale = entry is None
+        if stale:
+            entry = self.stale.get(device_serial)
+        if entry is not None and entry.heartbeat is not None:
+            status_data = entry.heartbeat.to_dict()
+            status_data["stale"] = stale
+            return status_data
         return None
     
     def get_all_device_statuses(self):
-        """获取所有设备的详细状态"""
+        """获取所有设备的详细状态，包括尚未重新登录的快照设备（stale 为 True）"""
         device_statuses = []
-        with device_lock:
-            for serial, info in connected_devices.items():
-                if "heartbeat_data" in info:
-                    status_data = info["heartbeat_data"].copy()  # Make a copy to avoid reference issues
-                    status_data["address"] = info["address"]
-                    status_data["last_heartbeat"] = info["last_heartbeat"]
+        for stale, entries in ((False, self.registry.snapshot()), (True, list(self.stale.values()))):
+            for entry in entries:
+                if entry.heartbeat is not None:
+                    status_data = entry.heartbeat.to_dict()
+                    status_data["address"] = entry.address
+                    status_data["last_heartbeat"] = entry.last_heartbeat
+                    status_data["stale"] = stale
                     device_statuses.append(status_data)
         return device_statuses
+    
+    def get_status_etag(self):
+        """获取设备状态快照的当前 ETag（不加锁）"""
+        return self.status_cache.etag
+    
+    def get_status_snapshot(self):
+        """获取所有设备状态的 JSON 快照，返回 (etag, 响应体 bytes)"""
+        return self.status_cache.snapshot()
+    
+    def get_webhook_stats(self):
+        """获取 Webhook 投递统计和推送策略计数"""
+        stats = self.webhook.get_stats()
+        stats["emission"] = self.emission_policy.get_stats()
+        return stats
+    
+    def get_command_stats(self):
+        """获取远程命令结果计数"""
+        return self.commands.get_stats()
+    
+    def subscribe_events(self, serials=None, types=None):
+        """订阅设备事件，返回 Subscription；订阅者过多时抛出 RuntimeError"""
+        return self.events.subscribe(serials, types)
+    
+    def unsubscribe_events(self, subscription):
+        self.events.unsubscribe(subscription)
+    
+    def get_offline_devices(self):
+        """获取离线设备列表（断开或超时后尚未重新登录的设备），最近离线的在前"""
+        return self.liveness.get_offline_devices()
+    
+    def get_outbox(self, device_serial=None):
+        """获取发件箱中等待设备登录的命令（按入队顺序），可按设备过滤"""
+        return self.outbox.list_commands(device_serial)
+    
+    def get_device_history(self, serial_number, start, end, fields=None, resolution="auto"):
+        """查询设备心跳历史，返回 (精度, 点列表)"""
+        return self.history.query(serial_number, start, end, fields, resolution)
+    
+    def get_metrics(self):
+        """获取 /metrics 指标族：进程内注册的指标，加上从当前状态生成的连接数、队列深度等"""
+        families = metrics.collect()
+        families.append(gauge_family("lock_connected_devices", "Devices currently logged in", len(self.registry)))
+        families.append(gauge_family("lock_event_subscribers", "Clients subscribed to the device event stream",
+                                     len(self.events.subscribers)))
+        families.append(gauge_family("lock_offline_devices", "Devices that went offline and have not logged in again",
+                                     len(self.liveness)))
+        families.append(gauge_family("lock_stale_devices", "Devices restored from the registry snapshot "
+                                     "that have not logged in again", len(self.stale)))
+        families.append(gauge_family("lock_open_connections", "Open device TCP connections", len(self.connections)))
+        connections = list(self.connections)
+        families.append(gauge_family("lock_degraded_connections", "Connections whose send queue is stalled",
+                                     sum(1 for connection in connections if connection.degraded)))
+        families.append(gauge_family("lock_outbound_queued_bytes", "Bytes waiting in connection send queues",
+                                     sum(connection.outbound.pending() for connection in connections)))
+        
+        webhook = self.webhook.get_stats()
+        families.append(counter_family("lock_webhook_messages_total", "Webhook messages by outcome",
+                                       {key: webhook[key] for key in ("enqueued", "dropped", "delivered", "failed")},
+                                       "result"))
+        families.append(gauge_family("lock_webhook_queue_depth", "Messages waiting in the webhook queue",
+                                     webhook["queue_depth"]))
+        emission = self.emission_policy.get_stats()
+        families.append(counter_family("lock_webhook_emission_total", "Heartbeat webhook emission decisions",
+                                       {key[len("emitted_"):] if key.startswith("emitted_") else key: value
+                                        for key, value in emission.items()
+                                        if key.startswith("emitted_") or key in ("suppressed", "dropped")},
+                                       "decision"))
+        
+        commands = self.commands.get_stats()
+        pending = commands.pop("pending")
+        families.append(counter_family("lock_commands_submitted_total", "Remote commands submitted",
+                                       commands.pop("submitted")))
+        families.append(counter_family("lock_command_results_total", "Remote command results by status",
+                                       commands, "status"))
+        families.append(gauge_family("lock_commands_pending", "Remote commands waiting for a device response",
+                                     pending))
+        families.append(gauge_family("lock_outbox_depth", "Commands queued for offline devices",
+                                     self.outbox.count()))
+        families.append(gauge_family("lock_timer_wheel_timers", "Timers scheduled on the timer wheel",
+                                     self.timer_wheel.pending()))
+        
+        history = self.history.get_stats()
+        families.append(counter_family("lock_history_heartbeats_total", "Heartbeats handed to the history store",
+                                       {key: history[key] for key in ("recorded", "dropped", "written")}, "result"))
+        families.append(gauge_family("lock_history_queue_depth", "Heartbeats waiting to be written to history",
+                                     history["queue_depth"]))
+        return families
+
+
+def create_lock_server(host, port, mode=None):
+    """根据运行模式创建车位锁服务器实例"""
+    mode = mode or LOCK_SERVER_MODE
+    if mode == 'thread':
+        return ParkingLockServer(host, port)
+    if mode == 'async':
+        # 延迟导入，避免循环依赖
+        from parking_lock_async_server import AsyncParkingLockServer
+        return AsyncParkingLockServer(host, port)
+    if mode == 'cluster':
+        from parking_lock_cluster import ClusterLockServer
+        return ClusterLockServer(host, port)
+    raise ValueError(f"Unknown lock server mode: {mode}")
 
 
 def main():
@@ -758,8 +1473,8 @@ def main():
     HOST = '0.0.0.0'
     PORT = 11457
     
-    # 创建并启动服务器
-    server = ParkingLockServer(HOST, PORT)
+    # 创建并启动服务器（通过 LOCK_SERVER_MODE 选择线程、异步或多进程模式）
+    server = create_lock_server(HOST, PORT)
     if server.start():
         logger.info("Server started successfully")
         
@@ -805,36 +1520,35 @@ def main():
                         # 使用bytes类型作为字典键
                         device_serial = bytes(device_serial)
                         
-                        with device_lock:
-                            if device_serial in connected_devices and "heartbeat_data" in connected_devices[device_serial]:
-                                hb = connected_devices[device_serial]["heartbeat_data"]
-                                print("\n设备详细状态:")
-                                print(f"  序列号: {binascii.hexlify(hb['serial_number']).decode('utf-8')}")
-                                print(f"  设备状态: {hb['device_status']} ({hb['device_status_description']})")
-                                print(f"  车辆状态: {hb['car_status']} ({hb['car_status_description']})")
-                                print(f"  常控状态: {hb['control_status']} ({hb['control_status_description']})")
-                                print(f"  3.7V电池: {hb['battery_3_7v']}V")
-                                print(f"  12V电池: {hb['battery_12v']:.1f}V")
-                                print(f"  4G信号强度: {hb['signal_strength']}")
-                                print(f"  流水号: {hb['flow_number']}")
-                                
-                                if hb['error_code'] > 0:
-                                    print(f"  错误码: 0x{hb['error_code']:04X}")
-                                    print(f"  错误描述: {', '.join(hb['error_descriptions'])}")
-                                else:
-                                    print("  设备正常，无错误")
-                                
-                                print(f"  当前地感频率: {hb['current_frequency']}")
-                                print(f"  无车基准: {hb['no_car_base']}")
-                                print(f"  有车基准: {hb['car_base']}")
-                                print(f"  有车万分比: {hb['car_ratio']}")
-                                print(f"  无车万分比: {hb['no_car_ratio']}")
-                                
-                                # 显示水浸检测状态
-                                water_status = "有水" if hb['water_detection'] == 1 else "无水"
-                                print(f"  进水检测: {water_status}")
+                        hb = server.get_device_status(device_serial)
+                        if hb:
+                            print("\n设备详细状态:")
+                            print(f"  序列号: {binascii.hexlify(hb['serial_number']).decode('utf-8')}")
+                            print(f"  设备状态: {hb['device_status']} ({hb['device_status_description']})")
+                            print(f"  车辆状态: {hb['car_status']} ({hb['car_status_description']})")
+                            print(f"  常控状态: {hb['control_status']} ({hb['control_status_description']})")
+                            print(f"  3.7V电池: {hb['battery_3_7v']}V")
+                            print(f"  12V电池: {hb['battery_12v']:.1f}V")
+                            print(f"  4G信号强度: {hb['signal_strength']}")
+                            print(f"  流水号: {hb['flow_number']}")
+                            
+                            if hb['error_code'] > 0:
+                                print(f"  错误码: 0x{hb['error_code']:04X}")
+                                print(f"  错误描述: {', '.join(hb['error_descriptions'])}")
                             else:
-                                print(f"No heartbeat data available for device {device['serial']}")
+                                print("  设备正常，无错误")
+                            
+                            print(f"  当前地感频率: {hb['current_frequency']}")
+                            print(f"  无车基准: {hb['no_car_base']}")
+                            print(f"  有车基准: {hb['car_base']}")
+                            print(f"  有车万分比: {hb['car_ratio']}")
+                            print(f"  无车万分比: {hb['no_car_ratio']}")
+                            
+                            # 显示水浸检测状态
+                            water_status = "有水" if hb['water_detection'] == 1 else "无水"
+                            print(f"  进水检测: {water_status}")
+                        else:
+                            print(f"No heartbeat data available for device {device['serial']}")
                     except ValueError:
                         print("Invalid input. Please enter a number.")
                 elif cmd in ["open", "close", "hold_open", "hold_close", "normal", "restart"]:
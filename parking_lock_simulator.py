@@ -0,0 +1,540 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""车位锁设备模拟器 / 负载生成工具
+
+在一个 asyncio 事件循环中模拟大量设备连接服务器：每台设备登录 (0x80) 后按间隔
+发送 39 字节的心跳 (0x81)，随机产生车状态改变 (0x60)，并应答服务器下发的
+开锁/关锁/设置状态/同步时间/重启命令（状态到位后立即上报一次心跳）。
+可以按比例制造异常：分片写入、CRC 错误、周期性的全体断线重连（重连风暴）。
+
+结束时输出客户端测得的请求-响应往返延迟分位数；使用 --serve 在子进程中启动服务器，
+或用 --metrics-url 指定 API 的 /metrics 地址时，同时输出服务器端每种命令字的处理耗时分位数。
+
+用法:
+    python parking_lock_simulator.py --devices 1000 --heartbeat-interval 5 --duration 60
+    python parking_lock_simulator.py --serve async --devices 5000 --heartbeat-interval 10 --json
+    python parking_lock_simulator.py --port 11457 --metrics-url http://127.0.0.1:5000/metrics \\
+        --fragment-rate 0.05 --corrupt-rate 0.01 --storm-interval 30
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import struct
+import asyncio
+import logging
+import argparse
+import binascii
+import subprocess
+from collections import deque
+
+import requests
+
+from parking_lock_logging import configure_logging
+
+# 模拟器自己的日志文件；必须在导入服务器模块之前配置，否则会沿用服务器的日志文件
+configure_logging("parking_lock_simulator.log")
+
+from parking_lock_server import ParkingLockProtocol, FrameDecoder, HEARTBEAT_STRUCT
+from parking_lock_opcodes import OPCODES, DOWNLINK
+from parking_lock_metrics import histogram_delta, histogram_quantile
+
+logger = logging.getLogger("ParkingLockSimulator")
+
+# 模拟设备发送、等待服务器应答的上报命令字，名称取自命令字表
+REPORT_KINDS = {command: OPCODES.get(command).api_name for command in (0x80, 0x81, 0x60)}
+
+# 服务器下发的远程命令（命令字表中的下行命令）
+REMOTE_COMMANDS = {opcode.code: opcode.api_name for opcode in OPCODES if opcode.direction == DOWNLINK}
+
+RESULT_SUCCESS = 0x01
+RESULT_FAILURE = 0x02
+
+PERCENTILES = (0.5, 0.9, 0.99)
+
+
+class SimulatorStats:
+    """模拟器统计：各类请求的往返延迟样本和事件计数"""
+
+    def __init__(self):
+        self.latencies = {kind: [] for kind in REPORT_KINDS.values()}
+        self.counters = {}
+
+    def count(self, key, amount=1):
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, kind, seconds):
+        self.latencies[kind].append(seconds)
+
+    def summary(self):
+        """各类请求的样本数和延迟分位数（毫秒）"""
+        result = {}
+        for kind, samples in self.latencies.items():
+            if not samples:
+                continue
+            samples = sorted(samples)
+            entry = {"count": len(samples)}
+            for q in PERCENTILES:
+                entry[f"p{int(q * 100)}"] = round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 3)
+            entry["max"] = round(samples[-1] * 1000, 3)
+            result[kind] = entry
+        return result
+
+
+class SimulatedDevice:
+    """一台模拟设备
+
+    连接断开（服务器关闭、重连风暴、远程重启）后自动重新连接并登录。
+    设备上报帧按命令字排队等待服务器应答，服务器的应答按发送顺序匹配。
+    """
+
+    def __init__(self, simulator, index):
+        self.simulator = simulator
+        self.config = simulator.config
+        self.stats = simulator.stats
+        self.serial = struct.pack("<Q", self.config.serial_base + index)
+        self.rng = random.Random(self.config.seed * 1000003 + index)
+        self.flow_number = 0
+        self.device_status = 1  # 车位锁上升到位
+        self.car_status = 2     # 无车
+        self.control_status = 0
+        self.reader = None
+        self.writer = None
+        self.waiters = {command: deque() for command in REPORT_KINDS}
+        self.restart_delay = None  # 收到重启命令后，断开并在该秒数后重新登录
+        self.reconnect_now = False  # 重连风暴中被断开，立即重连
+        self.tasks = []
+
+    @property
+    def serial_hex(self):
+        return binascii.hexlify(self.serial).decode('utf-8')
+
+    def heartbeat_payload(self):
+        """构建 39 字节心跳载荷：38 字节固定结构 + 常控状态"""
+        self.flow_number = (self.flow_number + 1) & 0xFFFFFFFF
+        rng = self.rng
+        car_present = self.car_status == 1
+        return HEARTBEAT_STRUCT.pack(
+            self.serial,
+            0,                                   # 动作步骤
+            0,                                   # 进水检测
+            rng.randint(80, 100),                # 3.7V 电量
+            rng.randint(15, 31),                 # 4G 信号
+            self.flow_number,
+            1,                                   # 设备类型
+            rng.randint(120, 130),               # 12V 电量 (x10)
+            self.device_status,
+            self.car_status,
+            0,                                   # 错误号
+            rng.randint(54000, 56000) if car_present else rng.randint(44000, 46000),  # 当前地感频率
+            45000,                               # 无车基准
+            55000,                               # 有车基准
+            rng.randint(9000, 10000) if car_present else rng.randint(0, 500),
+            rng.randint(0, 500) if car_present else rng.randint(9000, 10000)
+        ) + bytes([self.control_status])
+
+    async def run(self, stop):
+        """设备主循环：连接、登录、会话，断开后重连，直到 stop 被设置"""
+        backoff = self.config.reconnect_delay
+        while not stop.is_set():
+            try:
+                async with self.simulator.connect_slots:
+                    self.reader, self.writer = await asyncio.open_connection(self.config.host, self.config.port)
+            except OSError:
+                self.stats.count("connect_failed")
+                await asyncio.sleep(self.rng.uniform(0, backoff))
+                backoff = min(backoff * 2, 30)
+                continue
+
+            backoff = self.config.reconnect_delay
+            self.stats.count("connections")
+            try:
+                await self.session(stop)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                pass
+            finally:
+                await self.disconnect()
+
+            if self.restart_delay is not None:
+                await asyncio.sleep(self.restart_delay)
+                self.restart_delay = None
+            elif self.reconnect_now:
+                self.reconnect_now = False
+            elif not stop.is_set():
+                await asyncio.sleep(self.rng.uniform(0, backoff))
+
+    async def session(self, stop):
+        reader_task = asyncio.create_task(self.read_loop())
+        self.tasks = [reader_task]
+        try:
+            if await self.report(0x80, self.serial) is None:
+                return
+            self.stats.count("logins")
+            self.tasks.append(asyncio.create_task(self.heartbeat_loop()))
+            if self.config.car_interval > 0:
+                self.tasks.append(asyncio.create_task(self.car_loop()))
+            stop_task = asyncio.create_task(stop.wait())
+            try:
+                # 连接断开（读循环结束）或模拟结束时退出会话
+                await asyncio.wait(self.tasks + [stop_task], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                stop_task.cancel()
+        finally:
+            for task in self.tasks:
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+            self.tasks = []
+
+    async def disconnect(self):
+        for waiters in self.waiters.values():
+            while waiters:
+                waiters.popleft()[1].cancel()
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (OSError, asyncio.CancelledError):
+                pass
+            self.writer = None
+
+    def drop(self):
+        """重连风暴：直接关闭连接，由 run 立即重连"""
+        if self.writer is not None:
+            self.reconnect_now = True
+            self.writer.transport.abort()
+
+    async def write_frame(self, frame):
+        """写出一帧，按 --fragment-rate 的概率拆成几段分别写入"""
+        if self.rng.random() < self.config.fragment_rate and len(frame) > 2:
+            cuts = sorted(self.rng.sample(range(1, len(frame)), min(3, len(frame) - 1)))
+            start = 0
+            for cut in cuts + [len(frame)]:
+                self.writer.write(frame[start:cut])
+                await self.writer.drain()
+                await asyncio.sleep(0.001)
+                start = cut
+            self.stats.count("fragmented_frames")
+        else:
+            self.writer.write(frame)
+            await self.writer.drain()
+
+    async def report(self, command, payload):
+        """发送上报帧并等待服务器应答，返回往返秒数；超时返回 None"""
+        frame = bytes(ParkingLockProtocol.build_frame(command, payload))
+        kind = REPORT_KINDS[command]
+
+        if command == 0x81 and self.rng.random() < self.config.corrupt_rate:
+            # 破坏 CRC，服务器会丢弃该帧且不应答
+            corrupted = bytearray(frame)
+            corrupted[-3] ^= 0xFF
+            await self.write_frame(bytes(corrupted))
+            self.stats.count("corrupted_frames")
+            return None
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (time.perf_counter(), future)
+        self.waiters[command].append(entry)
+        await self.write_frame(frame)
+        self.stats.count(f"{kind}_sent")
+        try:
+            sent_at = await asyncio.wait_for(future, self.config.response_timeout)
+        except asyncio.TimeoutError:
+            if entry in self.waiters[command]:
+                self.waiters[command].remove(entry)
+            self.stats.count(f"{kind}_timeout")
+            return None
+        elapsed = sent_at - entry[0]
+        self.stats.observe(kind, elapsed)
+        return elapsed
+
+    async def read_loop(self):
+        decoder = FrameDecoder()
+        while True:
+            data = await self.reader.read(4096)
+            if not data:
+                return
+            for frame in decoder.feed(data):
+                parsed = ParkingLockProtocol.parse_frame(bytes(frame))
+                if parsed is None:
+                    self.stats.count("invalid_server_frames")
+                    continue
+                command = parsed["command"]
+                if command in REPORT_KINDS:
+                    waiters = self.waiters[command]
+                    if waiters:
+                        _, future = waiters.popleft()
+                        if not future.done():
+                            future.set_result(time.perf_counter())
+                    else:
+                        self.stats.count("unexpected_responses")
+                elif command in REMOTE_COMMANDS:
+                    await self.handle_command(command, bytes(parsed["payload"]))
+                else:
+                    self.stats.count("unknown_server_frames")
+
+    async def handle_command(self, command, payload):
+        """应答服务器下发的远程命令，并模拟锁的动作"""
+        self.stats.count(f"command_{REMOTE_COMMANDS[command]}")
+        rejected = self.rng.random() < self.config.reject_rate
+        result = RESULT_FAILURE if rejected else RESULT_SUCCESS
+
+        opcode = OPCODES.get(command)
+        if opcode.flow_number:
+            # 载荷为 序列号(8) + 流水号(4) [+ 状态]，应答带回流水号和结果码
+            await self.write_frame(bytes(ParkingLockProtocol.build_frame(command, payload[:12] + bytes([result]))))
+            if rejected:
+                return
+            if command == 0x8E and len(payload) > 12:
+                self.control_status = payload[12]
+                asyncio.create_task(self.send_heartbeat())
+            elif opcode.target_status is not None:
+                asyncio.create_task(self.move_lock(command))
+        elif command == 0x86:
+            await self.write_frame(bytes(ParkingLockProtocol.build_frame(command, bytes([result]))))
+        elif command == 0x8F:
+            # 重启：不应答，断开后按 --restart-delay 重新登录
+            self.restart_delay = self.config.restart_delay
+            self.writer.transport.abort()
+
+    async def move_lock(self, command):
+        """开锁（下降）/关锁（上升）：动作中上报状态 5，到位后上报目标状态；有车时关锁失败"""
+        self.device_status = 5
+        await asyncio.sleep(self.config.action_time)
+        if command == 0x71 and self.car_status == 1:
+            self.device_status = 9  # 设备上有车，无法上升
+        else:
+            self.device_status = OPCODES.get(command).target_status
+        await self.send_heartbeat()
+
+    async def send_heartbeat(self):
+        try:
+            await self.report(0x81, self.heartbeat_payload())
+        except (OSError, AttributeError):
+            pass
+
+    async def heartbeat_loop(self):
+        interval = self.config.heartbeat_interval
+        # 首个心跳在一个间隔内随机分布，避免所有设备同时发送
+        await asyncio.sleep(self.rng.uniform(0, interval))
+        while True:
+            await self.report(0x81, self.heartbeat_payload())
+            await asyncio.sleep(interval * self.rng.uniform(0.9, 1.1))
+
+    async def car_loop(self):
+        while True:
+            await asyncio.sleep(self.rng.expovariate(1 / self.config.car_interval))
+            self.car_status = 2 if self.car_status == 1 else 1
+            # 车离开后，因有车而未能上升的锁恢复为下降到位
+            if self.car_status == 2 and self.device_status == 9:
+                self.device_status = 2
+            payload = self.serial + bytes([1 if self.car_status == 1 else 0, self.device_status])
+            await self.report(0x60, payload)
+
+
+class DeviceSimulator:
+    """管理所有模拟设备、重连风暴和统计"""
+
+    def __init__(self, config):
+        self.config = config
+        self.stats = SimulatorStats()
+        self.devices = [SimulatedDevice(self, index) for index in range(config.devices)]
+        self.connect_slots = None
+
+    async def storm_loop(self, stop):
+        """每隔 storm_interval 秒让所有设备同时断线并立即重连"""
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), self.config.storm_interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            logger.info(f"Reconnect storm: dropping {len(self.devices)} connections")
+            self.stats.count("storms")
+            for device in self.devices:
+                device.drop()
+
+    async def run(self):
+        stop = asyncio.Event()
+        self.connect_slots = asyncio.Semaphore(self.config.connect_concurrency)
+        tasks = []
+        ramp = self.config.ramp / max(1, len(self.devices))
+        for device in self.devices:
+            tasks.append(asyncio.create_task(device.run(stop)))
+            if ramp:
+                await asyncio.sleep(ramp)
+        if self.config.storm_interval > 0:
+            tasks.append(asyncio.create_task(self.storm_loop(stop)))
+
+        started = time.monotonic()
+        try:
+            await asyncio.sleep(max(0, self.config.duration - self.config.ramp))
+        finally:
+            elapsed = time.monotonic() - started + self.config.ramp
+            stop.set()
+            await asyncio.wait(tasks, timeout=1)
+            for task in tasks:
+                task.cancel()
+        return elapsed
+
+
+def fetch_metrics(url):
+    """从 API 的 /metrics 获取 JSON 格式的指标族"""
+    try:
+        response = requests.get(url, params={"format": "json"}, timeout=10)
+        response.raise_for_status()
+        return response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.error(f"Failed to fetch metrics from {url}: {e}")
+        return None
+
+
+def server_latency_summary(after, before=None):
+    """由服务器的 lock_frame_processing_seconds 直方图计算每种命令字的处理耗时分位数（毫秒）"""
+    def find(families):
+        for family in families or ():
+            if family["name"] == "lock_frame_processing_seconds":
+                return family
+        return None
+
+    family = find(after)
+    if family is None:
+        return {}
+    summary = {}
+    for labels, (counts, total) in sorted(histogram_delta(family, find(before)).items()):
+        entry = {"count": sum(counts), "mean": round(total / sum(counts) * 1000, 3)}
+        for q in PERCENTILES:
+            value = histogram_quantile(q, family["buckets"], counts)
+            entry[f"p{int(q * 100)}"] = round(value * 1000, 3) if value is not None else None
+        summary[labels[0]] = entry
+    return summary
+
+
+def serve(mode, host, port):
+    """--serve 子进程入口：启动服务器，标准输入关闭后输出指标 JSON 并退出
+
+    服务器日志只写入 parking_lock_server.log（子进程的标准错误被丢弃）。
+    """
+    from parking_lock_server import create_lock_server
+    configure_logging("parking_lock_server.log", level=logging.WARNING, force=True)
+    server = create_lock_server(host, port, mode)
+    if not server.start():
+        sys.exit(1)
+    print("READY", flush=True)
+    sys.stdin.read()
+    print(json.dumps(server.get_metrics()), flush=True)
+    server.stop()
+
+
+def start_server_process(mode, host, port):
+    env = dict(os.environ, NODE_WEBHOOK_URL=os.environ.get('NODE_WEBHOOK_URL', ''))
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve-child", mode,
+                                "--host", host, "--port", str(port)],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                               env=env, text=True)
+    if process.stdout.readline().strip() != "READY":
+        process.kill()
+        raise RuntimeError(f"Failed to start {mode} server on {host}:{port}, see parking_lock_server.log")
+    return process
+
+
+def stop_server_process(process):
+    """关闭子进程服务器的标准输入，读取它输出的指标"""
+    output, _ = process.communicate(timeout=60)
+    try:
+        return json.loads(output.strip().splitlines()[-1])
+    except (ValueError, IndexError):
+        return None
+
+
+def print_report(report):
+    print(f"{report['devices']} devices, {report['duration']:.1f}s, "
+          f"server {report['server']} at {report['host']}:{report['port']}")
+    print("client round trip (ms):")
+    print(f"  {'kind':<12}{'count':>9}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for kind, entry in report["client_latency"].items():
+        print(f"  {kind:<12}{entry['count']:>9}{entry['p50']:>10.2f}{entry['p90']:>10.2f}"
+              f"{entry['p99']:>10.2f}{entry['max']:>10.2f}")
+    if report["server_latency"]:
+        print("server frame processing (ms, estimated from histogram buckets):")
+        print(f"  {'command':<12}{'count':>9}{'p50':>10}{'p90':>10}{'p99':>10}{'mean':>10}")
+        for command, entry in report["server_latency"].items():
+            values = [entry[key] if entry[key] is not None else float('nan') for key in ("p50", "p90", "p99")]
+            print(f"  {command:<12}{entry['count']:>9}{values[0]:>10.3f}{values[1]:>10.3f}"
+                  f"{values[2]:>10.3f}{entry['mean']:>10.3f}")
+    print("counters:")
+    for key, value in sorted(report["counters"].items()):
+        print(f"  {key}: {value}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11457)
+    parser.add_argument("--devices", type=int, default=100, help="模拟设备数")
+    parser.add_argument("--duration", type=float, default=30, help="运行秒数（含登录爬坡时间）")
+    parser.add_argument("--heartbeat-interval", type=float, default=30, help="每台设备的心跳间隔（秒）")
+    parser.add_argument("--car-interval", type=float, default=300, help="每台设备车状态改变的平均间隔（秒），0 关闭")
+    parser.add_argument("--ramp", type=float, default=0, help="在该秒数内均匀地启动所有设备")
+    parser.add_argument("--connect-concurrency", type=int, default=200, help="同时进行中的连接数上限")
+    parser.add_argument("--response-timeout", type=float, default=5, help="等待服务器应答的超时（秒）")
+    parser.add_argument("--reconnect-delay", type=float, default=1, help="断线后重连的初始随机退避上限（秒）")
+    parser.add_argument("--action-time", type=float, default=0.5, help="开锁/关锁动作耗时（秒）")
+    parser.add_argument("--restart-delay", type=float, default=2, help="收到重启命令后重新登录前的秒数")
+    parser.add_argument("--fragment-rate", type=float, default=0, help="帧被拆成多段写入的概率")
+    parser.add_argument("--corrupt-rate", type=float, default=0, help="心跳帧 CRC 被破坏的概率")
+    parser.add_argument("--reject-rate", type=float, default=0, help="远程命令以失败结果码应答的概率")
+    parser.add_argument("--storm-interval", type=float, default=0, help="每隔该秒数所有设备同时断线重连，0 关闭")
+    parser.add_argument("--serial-base", type=lambda value: int(value, 0), default=0x5000000000,
+                        help="第一台设备的序列号（整数，按小端序 8 字节编码）")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--serve", choices=("thread", "async", "cluster"),
+                        help="在子进程中以该模式启动服务器，结束时输出服务器端处理耗时")
+    parser.add_argument("--metrics-url", help="API 的 /metrics 地址，用于获取服务器端处理耗时")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出报告")
+    parser.add_argument("--serve-child", help=argparse.SUPPRESS)
+    return parser
+
+
+def main():
+    parser = build_parser()
+    config = parser.parse_args()
+    if config.serve_child:
+        serve(config.serve_child, config.host, config.port)
+        return
+
+    logging.getLogger().setLevel(logging.WARNING)
+    process = start_server_process(config.serve, config.host, config.port) if config.serve else None
+    before = fetch_metrics(config.metrics_url) if config.metrics_url else None
+
+    simulator = DeviceSimulator(config)
+    try:
+        duration = asyncio.run(simulator.run())
+    except KeyboardInterrupt:
+        duration = config.duration
+
+    after = None
+    if config.metrics_url:
+        after = fetch_metrics(config.metrics_url)
+    if process is not None:
+        after, before = stop_server_process(process), None
+
+    report = {
+        "devices": config.devices,
+        "duration": duration,
+        "server": config.serve or "external",
+        "host": config.host,
+        "port": config.port,
+        "client_latency": simulator.stats.summary(),
+        "server_latency": server_latency_summary(after, before) if after else {},
+        "counters": simulator.stats.counters
+    }
+    if config.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
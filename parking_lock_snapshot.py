@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import zlib
+import struct
+import logging
+import threading
+
+from parking_lock_metrics import metrics
+
+logger = logging.getLogger("ParkingLockServer")
+
+# 设备登记表快照配置（LOCK_SNAPSHOT_FILE 设为空字符串可关闭）
+LOCK_SNAPSHOT_FILE = os.environ.get('LOCK_SNAPSHOT_FILE', 'parking_lock_registry.snap')
+LOCK_SNAPSHOT_INTERVAL = float(os.environ.get('LOCK_SNAPSHOT_INTERVAL', '5'))    # 写出变化记录的间隔（秒）
+LOCK_SNAPSHOT_MAX_AGE = float(os.environ.get('LOCK_SNAPSHOT_MAX_AGE', '3600'))   # 启动时不再加载更早的心跳（秒）
+
+# 文件头：魔数、格式版本、记录长度；之后是定长记录，每台设备占一个槽位
+HEADER = struct.Struct('<4sHH')
+MAGIC = b'PLRS'
+VERSION = 1
+# 记录：序列号、是否占用、登录时间、最后心跳时间、端口、地址（UTF-8，补零）、心跳载荷长度、心跳载荷，
+# 末尾为前面所有字节的 CRC32，补齐到 128 字节
+RECORD_BODY = struct.Struct('<8sBddH46sB40s')
+RECORD_SIZE = 128
+RECORD_PADDING = bytes(RECORD_SIZE - RECORD_BODY.size - 4)
+FREE_RECORD = bytes(RECORD_SIZE)
+
+SNAPSHOT_WRITES = metrics.counter("lock_snapshot_records_written_total",
+                                  "Registry snapshot records written", ("kind",))
+
+
+def encode_record(entry):
+    """把登记项（需已有心跳）编码为一条定长记录"""
+    address = entry.address or ("", 0)
+    payload = entry.heartbeat.raw[:40]
+    body = RECORD_BODY.pack(entry.serial, 1, entry.login_time, entry.last_heartbeat, address[1],
+                            str(address[0]).encode('utf-8')[:46], len(payload), payload)
+    return body + struct.pack('<I', zlib.crc32(body)) + RECORD_PADDING
+
+
+def decode_record(record):
+    """解码一条记录，返回 (序列号, 地址, 登录时间, 最后心跳时间, 心跳载荷)；空槽位或损坏的记录返回 None"""
+    if record == FREE_RECORD:
+        return None
+    body = record[:RECORD_BODY.size]
+    (crc,) = struct.unpack_from('<I', record, RECORD_BODY.size)
+    if zlib.crc32(body) != crc:
+        return None
+    serial, used, login_time, last_heartbeat, port, host, length, payload = RECORD_BODY.unpack(body)
+    if not used:
+        return None
+    return serial, (host.rstrip(b'\0').decode('utf-8'), port), login_time, last_heartbeat, payload[:length]
+
+
+class RegistrySnapshot:
+    """已登录设备最后已知状态的二进制快照，用于进程重启后立即回答状态查询
+
+    文件由定长记录组成，每台设备占一个槽位（序列号 -> 槽位号只保存在内存中）。
+    心跳处理只把序列号放入变化集合（O(1)，不做编码和 I/O）；后台线程每隔 interval 秒
+    取出变化的设备，按当前登记项重新编码，用 pwrite 覆盖各自的槽位——只写变化的记录。
+    设备断开后槽位清零并复用。每条记录带 CRC32，进程在写入中途被杀死时只丢失那一条记录。
+    启动时 load() 读出上次的记录，start() 把仍要保留的记录紧凑地写入新文件后继续增量写入。
+    """
+
+    def __init__(self, path=LOCK_SNAPSHOT_FILE, interval=LOCK_SNAPSHOT_INTERVAL, max_age=LOCK_SNAPSHOT_MAX_AGE):
+        self.path = path
+        self.interval = interval
+        self.max_age = max_age
+        self.lookup = None    # 序列号 -> 当前登记项（设备已断开时为 None），由 start() 设置
+        self.dirty = set()    # 状态变化、等待写出的序列号
+        self.slots = {}       # 序列号 -> 槽位号
+        self.free = []        # 已清零可复用的槽位号
+        self.next_slot = 0
+        self.fd = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def load(self):
+        """读取上次运行留下的快照，返回记录列表（跳过空槽位、损坏的记录和超过 max_age 的心跳）"""
+        if not self.enabled:
+            return []
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        except OSError as e:
+            logger.error(f"Failed to read registry snapshot {self.path}: {e}")
+            return []
+        if len(data) < HEADER.size or HEADER.unpack_from(data) != (MAGIC, VERSION, RECORD_SIZE):
+            logger.warning(f"Ignoring registry snapshot {self.path} with unknown format")
+            return []
+
+        oldest = time.time() - self.max_age
+        records = {}
+        for offset in range(HEADER.size, len(data) - RECORD_SIZE + 1, RECORD_SIZE):
+            record = decode_record(data[offset:offset + RECORD_SIZE])
+            if record is not None and record[3] >= oldest:
+                current = records.get(record[0])
+                if current is None or record[3] > current[3]:
+                    records[record[0]] = record
+        return list(records.values())
+
+    def start(self, lookup, entries=()):
+        """重写快照文件（只含 entries 中仍要保留的登记项），然后启动后台写线程"""
+        if not self.enabled or self.thread is not None:
+            return
+        self.lookup = lookup
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, VERSION, RECORD_SIZE))
+                for slot, entry in enumerate(entries):
+                    f.write(encode_record(entry))
+                    self.slots[entry.serial] = slot
+            os.replace(temp_path, self.path)
+            self.fd = os.open(self.path, os.O_RDWR)
+        except OSError as e:
+            logger.error(f"Failed to create registry snapshot {self.path}: {e}")
+            self.slots.clear()
+            return
+        self.next_slot = len(self.slots)
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, name="registry-snapshot", daemon=True)
+        self.thread.start()
+        logger.info(f"Registry snapshot enabled: {self.path} ({len(self.slots)} devices carried over)")
+
+    def stop(self):
+        """停止写线程，写出剩余的变化并落盘"""
+        if self.thread is None:
+            return
+        self.stopped.set()
+        self.thread.join(timeout=10)
+        self.thread = None
+        try:
+            self.flush()
+            os.fsync(self.fd)
+        except OSError as e:
+            logger.error(f"Failed to write registry snapshot: {e}")
+        os.close(self.fd)
+        self.fd = None
+
+    def touch(self, serial):
+        """设备状态变化（新心跳、断开）：只记录序列号，由写线程写出"""
+        if self.fd is not None:
+            self.dirty.add(serial)
+
+    def flush(self):
+        """写出所有变化的记录，返回写出的记录数"""
+        dirty = self.dirty
+        written = 0
+        while dirty:
+            serial = dirty.pop()
+            entry = self.lookup(serial)
+            slot = self.slots.get(serial)
+            if entry is None:
+                if slot is not None:
+                    del self.slots[serial]
+                    self.free.append(slot)
+                    os.pwrite(self.fd, FREE_RECORD, HEADER.size + slot * RECORD_SIZE)
+                    SNAPSHOT_WRITES.inc("cleared")
+                    written += 1
+                continue
+            if entry.heartbeat is None:
+                continue  # 重新登录后还没有心跳：保留上次的记录
+            if slot is None:
+                slot = self.slots[serial] = self.free.pop() if self.free else self._next_slot()
+            os.pwrite(self.fd, encode_record(entry), HEADER.size + slot * RECORD_SIZE)
+            SNAPSHOT_WRITES.inc("updated")
+            written += 1
+        return written
+
+    def _next_slot(self):
+        slot = self.next_slot
+        self.next_slot += 1
+        return slot
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Failed to write registry snapshot {self.path}: {e}")
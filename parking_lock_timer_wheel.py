@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import logging
+import threading
+
+logger = logging.getLogger("ParkingLockServer")
+
+
+class Timer:
+    """时间轮上的一个定时项，cancel() 只做标记，到期时跳过"""
+
+    __slots__ = ('rounds', 'callback', 'args', 'cancelled')
+
+    def __init__(self, rounds, callback, args):
+        self.rounds = rounds
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    """哈希时间轮
+
+    定时项按到期刻度放入 slots 个槽位之一，添加和取消都是 O(1)；
+    后台线程每个 tick 只处理当前槽位，不扫描全部定时项。
+    超过一圈的定时项记录剩余圈数，每经过一次减一。
+    回调在时间轮线程中执行，应当尽快返回。
+    """
+
+    def __init__(self, tick=0.1, slots=512):
+        self.tick = tick
+        self.slot_count = slots
+        self.slots = [[] for _ in range(slots)]
+        self.cursor = 0  # 下一个要处理的槽位
+        self.lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.ticks_done = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """启动时间轮线程"""
+        if self.thread is not None:
+            return
+        self.stopped.clear()
+        self.started_at = time.monotonic()
+        self.ticks_done = 0
+        self.thread = threading.Thread(target=self._run, name="timer-wheel")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """停止时间轮线程，未到期的定时项被丢弃"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+            self.thread = None
+        with self.lock:
+            self.slots = [[] for _ in range(self.slot_count)]
+
+    def schedule(self, delay, callback, *args):
+        """delay 秒后调用 callback(*args)，返回可取消的 Timer
+
+        不会早于 delay 触发，最多晚一个 tick：当前 tick 已经过去一部分，下一个处理的槽位（cursor）
+        不到一个 tick 就会到期，因此定时项放在其后第 ticks 个槽位。
+        """
+        ticks = max(1, int(-(-delay // self.tick)))  # 向上取整，至少一个 tick
+        with self.lock:
+            timer = Timer(ticks // self.slot_count, callback, args)
+            self.slots[(self.cursor + ticks) % self.slot_count].append(timer)
+        return timer
+
+    def advance(self):
+        """处理一个 tick 的到期定时项，返回执行的回调数"""
+        with self.lock:
+            slot = self.slots[self.cursor]
+            due = []
+            remaining = []
+            for timer in slot:
+                if timer.cancelled:
+                    continue
+                if timer.rounds > 0:
+                    timer.rounds -= 1
+                    remaining.append(timer)
+                else:
+                    due.append(timer)
+            self.slots[self.cursor] = remaining
+            self.cursor = (self.cursor + 1) % self.slot_count
+
+        for timer in due:
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                logger.error(f"Timer callback failed: {e}")
+        return len(due)
+
+    def pending(self):
+        """当前挂在时间轮上的定时项数（含已取消但尚未清除的）"""
+        with self.lock:
+            return sum(len(slot) for slot in self.slots)
+
+    def _run(self):
+        while not self.stopped.is_set():
+            # 按绝对时间补齐落后的 tick，避免回调耗时导致时间轮越走越慢
+            due_ticks = int((time.monotonic() - self.started_at) / self.tick)
+            while self.ticks_done < due_ticks and not self.stopped.is_set():
+                self.advance()
+                self.ticks_done += 1
+            next_tick = self.started_at + (self.ticks_done + 1) * self.tick
+            self.stopped.wait(max(0, next_tick - time.monotonic()))
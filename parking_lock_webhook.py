@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import queue
+import logging
+import binascii
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from parking_lock_metrics import metrics
+
+logger = logging.getLogger("ParkingLockWebhook")
+
+# Webhook 投递配置
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', '10000'))  # 待发送队列上限，满了直接丢弃
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', '2'))  # 固定的发送线程数
+# 每次 POST 携带的心跳数，<=1 表示不批量（逐条发送对象，兼容旧版 Node 接口）
+# Node 端 express.json() 默认限制 100kb 请求体，单条心跳约 700 字节，批量不宜超过 100
+WEBHOOK_BATCH_SIZE = int(os.environ.get('WEBHOOK_BATCH_SIZE', '0'))
+WEBHOOK_FLUSH_INTERVAL = float(os.environ.get('WEBHOOK_FLUSH_INTERVAL', '1.0'))  # 批量未满时最长等待秒数
+WEBHOOK_TIMEOUT = float(os.environ.get('WEBHOOK_TIMEOUT', '5'))
+# 推送策略: always 每个心跳都推送; change 状态变化立即推送，否则按保活间隔推送快照
+WEBHOOK_EMIT_MODE = os.environ.get('WEBHOOK_EMIT_MODE', 'change')
+WEBHOOK_KEEPALIVE_INTERVAL = float(os.environ.get('WEBHOOK_KEEPALIVE_INTERVAL', '300'))  # 每台设备的保活推送间隔（秒）
+
+# Webhook 请求耗时（含失败的请求）
+WEBHOOK_REQUEST_SECONDS = metrics.histogram("lock_webhook_request_seconds",
+                                            "Webhook POST latency by outcome", ("result",))
+
+
+def build_webhook_payload(hb, last_heartbeat=None):
+    """将心跳数据格式化为与 Node.js 后端一致的驼峰命名法"""
+    return {
+        "serialNumber": binascii.hexlify(hb['serial_number']).decode('utf-8'),
+        "deviceStatus": {
+            "code": hb['device_status'],
+            "description": hb['device_status_description']
+        },
+        "carStatus": {
+            "code": hb['car_status'],
+            "description": hb['car_status_description']
+        },
+        "controlStatus": {
+            "code": hb['control_status'],
+            "description": hb['control_status_description']
+        },
+        "battery": {
+            "3.7v": hb['battery_3_7v'],
+            "12v": hb['battery_12v']
+        },
+        "signalStrength": hb['signal_strength'],
+        "flowNumber": hb['flow_number'],
+        "error": {
+            "code": hb['error_code'],
+            "descriptions": hb.get('error_descriptions', []),
+            "hasError": hb['error_code'] > 0
+        },
+        "groundSensor": {
+            "currentFrequency": hb['current_frequency'],
+            "noCarBase": hb['no_car_base'],
+            "carBase": hb['car_base'],
+            "carRatio": hb['car_ratio'],
+            "noCarRatio": hb['no_car_ratio']
+        },
+        "waterDetection": {
+            "code": hb['water_detection'],
+            "description": "有水" if hb['water_detection'] == 1 else "无水"
+        },
+        "lastHeartbeat": last_heartbeat or hb.get("last_heartbeat", time.time())
+    }
+
+
+def build_offline_payload(record):
+    """设备离线事件（与心跳消息通过同一队列投递，Node 端按 event 字段区分）"""
+    return {
+        "event": "offline",
+        "serialNumber": record["serial"],
+        "reason": record["reason"],
+        "lastHeartbeat": record["last_heartbeat"],
+        "offlineSince": record["offline_since"]
+    }
+
+
+class HeartbeatEmissionPolicy:
+    """心跳推送策略，按设备比较状态决定是否需要推送 Webhook
+
+    change 模式下，device_status / car_status / control_status / error_code
+    任一发生变化时立即推送；状态不变时，每台设备每隔 keepalive_interval 秒
+    推送一次最新快照，其余心跳被抑制。
+    """
+
+    TRACKED_FIELDS = ('device_status', 'car_status', 'control_status', 'error_code')
+
+    def __init__(self, mode=WEBHOOK_EMIT_MODE, keepalive_interval=WEBHOOK_KEEPALIVE_INTERVAL):
+        if mode not in ('always', 'change'):
+            raise ValueError(f"Unknown webhook emit mode: {mode}")
+        self.mode = mode
+        self.keepalive_interval = keepalive_interval
+        self.devices = {}  # 序列号 -> (上次推送的状态, 上次推送时间)
+        self.lock = threading.Lock()
+        self.counters = {
+            "emitted_first": 0,      # 设备登录后的首个心跳
+            "emitted_change": 0,     # 状态变化
+            "emitted_keepalive": 0,  # 保活快照
+            "emitted_always": 0,     # always 模式下的推送
+            "suppressed": 0,         # 被抑制的心跳
+            "dropped": 0             # 需要推送但没能入队（下一个心跳重新判断）
+        }
+
+    def decide(self, hb, now=None):
+        """判断该心跳是否需要推送，返回推送决定 (原因, 序列号, 状态, 时间)；不需要推送时返回 None
+
+        只做判断，不修改设备记录：消息成功入队后调用 commit()，入队失败时调用 reject()，
+        这样被丢弃的状态变化不会被当作已推送，下一个心跳会重新推送。
+        """
+        if self.mode == 'always':
+            return ("always", None, None, None)
+
+        now = now if now is not None else time.monotonic()
+        state = tuple(hb[field] for field in self.TRACKED_FIELDS)
+        serial = hb['serial_number']
+
+        with self.lock:
+            previous = self.devices.get(serial)
+            if previous is None:
+                reason = "first"
+            elif previous[0] != state:
+                reason = "change"
+            elif now - previous[1] >= self.keepalive_interval:
+                reason = "keepalive"
+            else:
+                self.counters["suppressed"] += 1
+                return None
+        return (reason, serial, state, now)
+
+    def commit(self, decision):
+        """消息已入队：记入本次推送的状态和时间"""
+        reason, serial, state, now = decision
+        with self.lock:
+            if serial is not None:
+                self.devices[serial] = (state, now)
+            self.counters["emitted_" + reason] += 1
+
+    def reject(self, decision):
+        """消息没有入队（队列满或投递未启动）：不记入，只计数"""
+        with self.lock:
+            self.counters["dropped"] += 1
+
+    def forget(self, serial):
+        """设备断开后清除状态，重新登录后的首个心跳会立即推送"""
+        with self.lock:
+            self.devices.pop(serial, None)
+
+    def get_stats(self):
+        """获取推送/抑制计数"""
+        with self.lock:
+            stats = dict(self.counters)
+        stats["mode"] = self.mode
+        stats["keepalive_interval"] = self.keepalive_interval
+        stats["tracked_devices"] = len(self.devices)
+        return stats
+
+
+class WebhookDispatcher:
+    """Webhook 投递子系统
+
+    心跳处理线程只负责把消息放入有界队列（不阻塞），由固定数量的发送线程
+    通过保持长连接的 requests.Session 投递。开启批量后，一次 POST 发送一个
+    JSON 数组，数量达到 batch_size 或等待超过 flush_interval 时发送。
+    队列满时丢弃新消息并计数，避免 Node 端变慢时拖垮设备连接处理。
+    """
+
+    _STOP = object()
+
+    def __init__(self, url, secret, queue_size=WEBHOOK_QUEUE_SIZE, workers=WEBHOOK_WORKERS,
+                 batch_size=WEBHOOK_BATCH_SIZE, flush_interval=WEBHOOK_FLUSH_INTERVAL, timeout=WEBHOOK_TIMEOUT):
+        self.url = url
+        self.secret = secret
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.worker_count = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.workers = []
+        self.stats_lock = threading.Lock()
+        self.counters = {
+            "enqueued": 0,       # 成功入队的消息数
+            "dropped": 0,        # 队列满被丢弃的消息数
+            "delivered": 0,      # 投递成功的消息数
+            "failed": 0,         # 投递失败的消息数
+            "requests": 0,       # 发出的 HTTP 请求数
+            "high_watermark": 0  # 队列历史最大长度
+        }
+
+    @property
+    def enabled(self):
+        return bool(self.url)
+
+    def start(self):
+        """启动发送线程"""
+        if not self.enabled or self.workers:
+            return
+        for i in range(self.worker_count):
+            worker = threading.Thread(target=self._run, name=f"webhook-{i}")
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+        logger.info(f"Webhook dispatcher started: workers={self.worker_count}, batch_size={self.batch_size}, "
+                    f"queue_size={self.queue.maxsize}")
+
+    def stop(self, timeout=5):
+        """停止发送线程，尽量发送完队列中剩余的消息"""
+        workers, self.workers = self.workers, []
+        for _ in workers:
+            try:
+                self.queue.put(self._STOP, timeout=timeout)
+            except queue.Full:
+                break
+        for worker in workers:
+            worker.join(timeout=timeout)
+
+    def submit(self, payload):
+        """提交一条消息，不阻塞调用方；队列满或未启用时返回 False"""
+        if not self.workers:
+            return False
+        try:
+            self.queue.put_nowait(payload)
+        except queue.Full:
+            with self.stats_lock:
+                self.counters["dropped"] += 1
+            return False
+
+        depth = self.queue.qsize()
+        with self.stats_lock:
+            self.counters["enqueued"] += 1
+            if depth > self.counters["high_watermark"]:
+                self.counters["high_watermark"] = depth
+        return True
+
+    def get_stats(self):
+        """获取投递统计（含队列背压信息）"""
+        with self.stats_lock:
+            stats = dict(self.counters)
+        stats["queue_depth"] = self.queue.qsize()
+        stats["queue_capacity"] = self.queue.maxsize
+        stats["workers"] = len(self.workers)
+        stats["batch_size"] = self.batch_size
+        return stats
+
+    def _run(self):
+        session = requests.Session()
+        # 每个发送线程独占一个 Session 和一条保持的连接
+        session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        session.headers.update({
+            'Content-Type': 'application/json',
+            'X-Webhook-Secret': self.secret
+        })
+
+        try:
+            while True:
+                item = self.queue.get()
+                if item is self._STOP:
+                    break
+
+                if self.batch_size <= 1:
+                    self._post(session, item, 1)
+                    continue
+
+                batch = [item]
+                deadline = time.monotonic() + self.flush_interval
+                stopping = False
+                while len(batch) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self.queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if item is self._STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+
+                self._post(session, batch, len(batch))
+                if stopping:
+                    break
+        finally:
+            session.close()
+
+    def _post(self, session, body, count):
+        started = time.perf_counter()
+        try:
+            response = session.post(self.url, data=json.dumps(body), timeout=self.timeout)
+            ok = response.status_code == 202
+            if ok:
+                logger.debug(f"成功发送 {count} 条心跳到Webhook")
+            else:
+                logger.error(f"发送心跳到Webhook失败: {response.status_code} {response.text}")
+        except requests.exceptions.RequestException as e:
+            ok = False
+            logger.error(f"发送心跳到Webhook异常: {e}")
+
+        WEBHOOK_REQUEST_SECONDS.observe(time.perf_counter() - started, "delivered" if ok else "failed")
+        with self.stats_lock:
+            self.counters["requests"] += 1
+            self.counters["delivered" if ok else "failed"] += count
@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+"""测试公共配置：把仓库根目录加入导入路径，服务器模块的日志写到临时目录"""
+
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ['NODE_WEBHOOK_URL'] = ''
+
+from parking_lock_logging import configure_logging
+configure_logging(os.path.join(tempfile.gettempdir(), "parking_lock_tests.log"))
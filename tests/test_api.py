@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""REST API：Flask 与异步 API 共用的请求解析和响应构建，以及 Flask 路由"""
+
+import pytest
+
+import parking_lock_api
+from parking_lock_api import command_response, parse_batch_commands, parse_event_filters, parse_history_query
+from parking_lock_commands import unsent_result
+
+SERIAL_HEX = "0102030405060708"
+
+
+class FakeLockServer:
+    is_running = True
+
+    def __init__(self):
+        self.batches = []
+
+    def execute_command(self, device_serial, command, state, wait=False, timeout=None, ttl=None):
+        if ttl:
+            return {"success": False, "queued": True, "status": "queued", "flowNumber": None,
+                    "command": f"0x{command:02X}", "resultCode": None, "elapsed": 0}
+        return unsent_result(command, "not_connected")
+
+    def execute_batch(self, commands, wait=False, timeout=None, ttl=None):
+        self.batches.append(commands)
+        return [{"success": True, "status": "sent", "command": f"0x{command:02X}"} for _, command, _ in commands]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(parking_lock_api, "lock_server", FakeLockServer())
+    return parking_lock_api.app.test_client()
+
+
+def test_routes_report_a_stopped_server(monkeypatch):
+    monkeypatch.setattr(parking_lock_api, "lock_server", None)
+    client = parking_lock_api.app.test_client()
+    assert client.get("/api/status").get_json() == {"status": "stopped"}
+    assert client.post("/api/open_lock", json={"deviceSerial": SERIAL_HEX}).get_json() == {
+        "success": False, "message": "Server not running"}
+
+
+def test_batch_commands_keep_request_order(client):
+    items = [{"deviceSerial": SERIAL_HEX, "command": "open_lock"},
+             {"deviceSerial": "zz", "command": "open_lock"},
+             {"deviceSerial": SERIAL_HEX, "command": "set_state", "args": {"state": 2}},
+             {"deviceSerial": SERIAL_HEX, "command": "explode"}]
+    data = client.post("/api/batch_commands", json={"commands": items}).get_json()
+    assert [result["status"] for result in data["results"]] == ["sent", "invalid", "sent", "invalid"]
+    assert [result["deviceSerial"] for result in data["results"]] == [item["deviceSerial"] for item in items]
+    assert (data["success"], data["succeeded"], data["failed"]) == (False, 2, 2)
+    assert data["message"] == "2/4 commands succeeded"
+    assert parking_lock_api.lock_server.batches == [[(bytes.fromhex(SERIAL_HEX), 0x70, None),
+                                                     (bytes.fromhex(SERIAL_HEX), 0x8E, 2)]]
+
+
+def test_command_for_offline_device(client):
+    data = client.post("/api/open_lock", json={"deviceSerial": SERIAL_HEX}).get_json()
+    assert (data["success"], data["status"]) == (False, "not_connected")
+    assert data["message"] == "Failed to send open lock command"
+    data = client.post("/api/open_lock", json={"deviceSerial": SERIAL_HEX, "ttl": 60}).get_json()
+    assert (data["queued"], data["status"]) == (True, "queued")
+    assert data["message"] == "Device not connected, command queued until it logs in"
+
+
+def test_command_response_messages():
+    sent = {"success": True, "status": "acknowledged"}
+    assert command_response(sent, "sent", "failed")["message"] == "sent"
+    timeout = {"success": False, "status": "timeout"}
+    assert command_response(timeout, "sent", "failed")["message"] == "sent, but device result is timeout"
+
+
+def test_parse_batch_commands_without_items():
+    assert parse_batch_commands([]) == ([], [], [])
+
+
+def test_parse_event_filters():
+    assert parse_event_filters({}) == (None, None)
+    assert parse_event_filters({"serials": f"{SERIAL_HEX}, ", "types": "login,heartbeat"}) == (
+        [bytes.fromhex(SERIAL_HEX)], ["login", "heartbeat"])
+    with pytest.raises(ValueError):
+        parse_event_filters({"types": "login,reboot"})
+
+
+def test_parse_history_query():
+    assert parse_history_query({"from": "100", "to": "200", "fields": "battery_12v, signal_strength",
+                                "resolution": "1m"}) == (100.0, 200.0, ["battery_12v", "signal_strength"], "1m")
+    start, end, fields, resolution = parse_history_query({"to": "2026-10-18T08:00:00"})
+    assert end - start == 3600
+    assert (fields, resolution) == (None, "auto")
+    with pytest.raises(ValueError):
+        parse_history_query({"from": "200", "to": "100"})
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""基准测试套件：用例能运行、基线覆盖所有用例、回退判断"""
+
+import os
+import json
+import importlib.util
+
+import pytest
+
+SUITE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "run_suite.py")
+
+
+@pytest.fixture(scope="module")
+def suite():
+    spec = importlib.util.spec_from_file_location("run_suite", SUITE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="module")
+def cases(suite):
+    return suite.build_cases()
+
+
+def test_every_case_runs(cases):
+    for function in cases.values():
+        function()
+
+
+def test_baseline_covers_every_case(suite, cases):
+    with open(suite.DEFAULT_BASELINE, encoding="utf-8") as f:
+        baseline = json.load(f)
+    # 没有基线的用例只会被报告为 new，永远不会被判为回退
+    assert sorted(cases) == sorted(baseline["results"])
+
+
+def test_compare(suite):
+    baseline = {"results": {"same": {"relative": 1.0}, "slower": {"relative": 1.0}, "faster": {"relative": 1.0}}}
+    results = {"same": {"relative": 1.2}, "slower": {"relative": 1.3}, "faster": {"relative": 0.7},
+               "added": {"relative": 1.0}}
+    rows = {name: status for name, _, status in suite.compare(results, baseline, 0.25)}
+    assert rows == {"same": "ok", "slower": "REGRESSION", "faster": "faster", "added": "new"}
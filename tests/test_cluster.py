@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""多进程模式主进程：按设备转发到所属 worker、设备换 worker 后重新定位、合并各 worker 的状态"""
+
+import json
+
+import pytest
+
+from parking_lock_cluster import ClusterLockServer
+
+SERIAL = bytes.fromhex("0102030405060708")
+SERIAL_HEX = "0102030405060708"
+
+
+class FakeWorker:
+    """按方法名应答的 worker 控制通道，记录收到的调用"""
+
+    def __init__(self, index, devices=(), statuses=(), etag="1-0"):
+        self.index = index
+        self.devices = set(devices)
+        self.statuses = list(statuses)
+        self.etag = etag
+        self.calls = []
+        self.reachable = True
+
+    def call(self, method, *args, timeout=None):
+        if not self.reachable:
+            raise ConnectionError("worker unreachable")
+        self.calls.append(method)
+        if method == "has_device":
+            return args[0] in self.devices
+        if method == "remote_open_lock":
+            return args[0] in self.devices
+        if method == "get_all_device_statuses":
+            return [dict(status) for status in self.statuses]
+        if method == "get_status_snapshot":
+            devices = [{"serialNumber": s["serial_number"], "stale": s.get("stale", False)} for s in self.statuses]
+            return self.etag, json.dumps({"devices": devices})
+        raise AssertionError(f"unexpected call {method}")
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def cluster():
+    return ClusterLockServer("127.0.0.1", 0, workers=2)
+
+
+def test_command_is_forwarded_to_the_owner_only(cluster):
+    cluster.workers = [FakeWorker(0), FakeWorker(1, devices=[SERIAL_HEX])]
+    assert cluster.remote_open_lock(SERIAL)
+    assert cluster.owners == {SERIAL: 1}
+    cluster.workers[0].calls.clear()
+    cluster.workers[1].calls.clear()
+
+    assert cluster.remote_open_lock(SERIAL)
+    assert cluster.workers[0].calls == []
+    assert cluster.workers[1].calls == ["remote_open_lock"]
+
+
+def test_device_moved_to_another_worker_is_relocated(cluster):
+    cluster.workers = [FakeWorker(0, devices=[SERIAL_HEX]), FakeWorker(1)]
+    cluster.owners[SERIAL] = 1  # 设备重连前所在的 worker
+    assert cluster.remote_open_lock(SERIAL)
+    assert cluster.owners == {SERIAL: 0}
+
+
+def test_device_not_connected_anywhere(cluster):
+    cluster.workers = [FakeWorker(0), FakeWorker(1)]
+    cluster.owners[SERIAL] = 0
+    assert cluster.remote_open_lock(SERIAL) is False
+    assert cluster.owners == {}
+
+
+def test_unreachable_worker_is_skipped(cluster):
+    cluster.workers = [FakeWorker(0, devices=[SERIAL_HEX]), FakeWorker(1, devices=[SERIAL_HEX])]
+    cluster.workers[0].reachable = False
+    assert cluster.locate(SERIAL) == 1
+
+
+def test_statuses_drop_stale_copies_of_online_devices(cluster):
+    other = "1112131415161718"
+    cluster.workers = [
+        FakeWorker(0, statuses=[{"serial_number": SERIAL_HEX, "stale": True}, {"serial_number": other, "stale": True}]),
+        FakeWorker(1, statuses=[{"serial_number": SERIAL_HEX, "stale": False}])
+    ]
+    statuses = cluster.get_all_device_statuses()
+    assert sorted((status["serial_number"], status["stale"]) for status in statuses) == [
+        (SERIAL, False), (bytes.fromhex(other), True)]
+
+    etag, body = cluster.get_status_snapshot()
+    assert json.loads(body)["deviceCount"] == 2
+    assert cluster.get_status_snapshot()[1] is body
+    cluster.workers[1].etag = "1-1"
+    assert cluster.get_status_snapshot()[0] != etag
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""远程命令跟踪：流水号分配、按发送顺序匹配、时间轮超时、断开和重新登录，以及令牌桶限速"""
+
+import struct
+
+import pytest
+
+from parking_lock_commands import CommandTracker, TokenBucket
+from parking_lock_timer_wheel import TimerWheel
+
+SERIAL = bytes.fromhex("0102030405060708")
+
+
+@pytest.fixture
+def wheel():
+    return TimerWheel(tick=0.1, slots=8)
+
+
+@pytest.fixture
+def tracker(wheel):
+    return CommandTracker(wheel)
+
+
+def test_flow_numbers_increase_per_device_and_wrap(tracker):
+    first = tracker.next_flow_number(SERIAL)
+    assert tracker.next_flow_number(SERIAL) == first + 1
+    tracker.flow_numbers[SERIAL] = 0xFFFFFFFF
+    assert tracker.next_flow_number(SERIAL) == 0
+
+
+def test_response_without_flow_number_matches_oldest(tracker):
+    first = tracker.register(SERIAL, 0x86)
+    second = tracker.register(SERIAL, 0x86)
+    assert tracker.match_response(SERIAL, 0x86, b"\x01")
+    assert first.future.result(0)["status"] == "acknowledged"
+    assert not second.future.done()
+    assert tracker.match_response(SERIAL, 0x86, b"\x02")
+    assert second.future.result(0)["status"] == "rejected"
+    assert second.future.result(0)["resultCode"] == 2
+    assert not tracker.match_response(SERIAL, 0x86, b"\x01")
+
+
+def test_unknown_flow_number_is_not_matched(tracker):
+    pending = tracker.register(SERIAL, 0x71)
+    payload = SERIAL + struct.pack("<I", (pending.flow_number + 1) & 0xFFFFFFFF) + b"\x01"
+    assert not tracker.match_response(SERIAL, 0x71, payload)
+    assert not pending.future.done()
+
+
+def test_timeout_fires_from_the_timer_wheel(tracker, wheel):
+    pending = tracker.register(SERIAL, 0x70, timeout=0.2)
+    wheel.advance()
+    wheel.advance()
+    assert not pending.future.done()
+    wheel.advance()
+    assert pending.future.result(0)["status"] == "timeout"
+    assert tracker.get_stats()["pending"] == 0
+
+
+def test_resolved_command_cancels_its_timer(tracker, wheel):
+    pending = tracker.register(SERIAL, 0x86, timeout=0.1)
+    tracker.match_response(SERIAL, 0x86, b"\x01")
+    assert pending.timer.cancelled
+    assert wheel.advance() == 0
+    assert wheel.advance() == 0
+    assert tracker.get_stats()["timeout"] == 0
+
+
+def test_disconnect_fails_all_but_restart(tracker):
+    opened = tracker.register(SERIAL, 0x70)
+    restart = tracker.register(SERIAL, 0x8F)
+    tracker.fail_device(SERIAL)
+    assert opened.future.result(0)["status"] == "disconnected"
+    assert not restart.future.done()
+    tracker.match_login(SERIAL)
+    assert restart.future.result(0)["status"] == "completed"
+    stats = tracker.get_stats()
+    assert (stats["submitted"], stats["disconnected"], stats["completed"], stats["pending"]) == (2, 1, 1, 0)
+
+
+def test_set_state_completes_on_control_status(tracker):
+    pending = tracker.register(SERIAL, 0x8E, state=2)
+    tracker.match_heartbeat(SERIAL, {"device_status": 1, "control_status": 1})
+    assert not pending.future.done()
+    tracker.match_heartbeat(SERIAL, {"device_status": 1, "control_status": 2})
+    assert pending.future.result(0)["status"] == "completed"
+
+
+def test_token_bucket_allows_burst_then_paces():
+    bucket = TokenBucket(rate=1000, burst=3)
+    assert [bucket.acquire() for _ in range(3)] == [0, 0, 0]
+    assert bucket.acquire() > 0
+    assert TokenBucket(rate=0, burst=1).acquire(100) == 0
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""CRC16 查表实现与原逐位实现的等价性，以及 crc16_many 批量校验"""
+
+import random
+
+import pytest
+
+from parking_lock_server import ParkingLockProtocol
+
+
+def random_buffers(rounds=2000, seed=1234):
+    rng = random.Random(seed)
+    samples = [b"", b"\x00", b"\xff" * 64, bytes(range(256))]
+    samples += [bytes(rng.getrandbits(8) for _ in range(rng.randint(0, 300))) for _ in range(rounds)]
+    return samples
+
+
+@pytest.mark.parametrize("wrap", [bytes, bytearray, memoryview], ids=["bytes", "bytearray", "memoryview"])
+def test_table_matches_bitwise(wrap):
+    for data in random_buffers():
+        buf = wrap(data)
+        expected = ParkingLockProtocol.calculate_crc16_bitwise(buf)
+        actual = ParkingLockProtocol.calculate_crc16(buf)
+        assert actual == expected, f"CRC mismatch for {data.hex()}: {actual:04X} != {expected:04X}"
+
+
+def test_crc16_continues_from_intermediate_value():
+    data = bytes(range(200))
+    for cut in (0, 1, 6, 100, 199, 200):
+        partial = ParkingLockProtocol.calculate_crc16(data[:cut])
+        continued = ParkingLockProtocol.calculate_crc16(data[cut:], partial)
+        assert continued == ParkingLockProtocol.calculate_crc16(data), f"continuation from offset {cut} differs"
+
+
+def test_crc16_many_accepts_valid_frames():
+    rng = random.Random(99)
+    frames = [ParkingLockProtocol.build_frame(0x81, bytes(rng.getrandbits(8) for _ in range(39)))
+              for _ in range(200)]
+    results = ParkingLockProtocol.crc16_many(frames)
+    assert [i for i, ok in enumerate(results) if not ok] == []
+
+
+def test_crc16_many_rejects_corrupted_frames():
+    rng = random.Random(100)
+    frames = [bytearray(ParkingLockProtocol.build_frame(0x81, bytes(rng.getrandbits(8) for _ in range(39))))
+              for _ in range(200)]
+    for frame in frames:
+        frame[rng.randrange(0, len(frame) - 3)] ^= 0x01
+    results = ParkingLockProtocol.crc16_many(frames)
+    assert [i for i, ok in enumerate(results) if ok] == []
+
+
+def test_crc16_many_rejects_short_buffers():
+    results = ParkingLockProtocol.crc16_many([b"", b"\xdd"])
+    assert results == [False, False]
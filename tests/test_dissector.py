@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""协议分析工具：原始字节流和日志输入的帧提取、序列号归属、CRC 校验和设备汇总"""
+
+import binascii
+
+import pytest
+
+from parking_lock_dissector import DissectorStats, decode_frames, read_segments
+from parking_lock_server import HEARTBEAT_STRUCT, ParkingLockProtocol
+
+SERIAL = bytes.fromhex("0102030405060708")
+
+
+def frame(command, payload):
+    return bytes(ParkingLockProtocol.build_frame(command, payload))
+
+
+def heartbeat(device_status):
+    return frame(0x81, HEARTBEAT_STRUCT.pack(SERIAL, 3, 0, 90, 25, 1, 1, 121, device_status, 1, 0,
+                                             5000, 4000, 6000, 150, 50))
+
+
+def dissect(path, fmt="auto"):
+    stats = DissectorStats()
+    frames = [f for f in decode_frames(read_segments(str(path), fmt, stats=stats), stats) if f.data is not None]
+    return frames, stats
+
+
+def test_raw_stream(tmp_path):
+    corrupted = bytearray(frame(0x87, b"\x01"))
+    corrupted[6] ^= 0xFF
+    path = tmp_path / "device.bin"
+    path.write_bytes(frame(0x80, SERIAL + bytes(4)) + b"\x00\x01garbage" + heartbeat(1) + bytes(corrupted)
+                     + heartbeat(2))
+
+    frames, stats = dissect(path)
+    assert [(f.command, f.crc_ok) for f in frames] == [(0x80, True), (0x81, True), (0x87, False), (0x81, True)]
+    # 不带序列号的帧归属到所在连接最近登录的设备
+    assert {f.serial for f in frames} == {"0102030405060708"}
+    assert frames[1].heartbeat.device_status == 1
+    device = stats.devices["0102030405060708"]
+    assert (device.frames, device.logins, device.heartbeats, device.device_status) == (4, 1, 2, 2)
+    assert stats.counters["frames"] == 4
+    assert stats.counters["resync_bytes"] == 9
+    rows = {row["command"]: row for row in stats.command_rows()}
+    assert rows["0x87"]["crc_errors"] == 1
+    assert rows["0x81"]["frames"] == 2
+
+
+def test_log_lines(tmp_path):
+    login = binascii.hexlify(frame(0x80, SERIAL + bytes(4))).decode()
+    ack = binascii.hexlify(frame(0x80, bytes(4))).decode()
+    path = tmp_path / "parking_lock_server.log"
+    path.write_text(f"2026-10-18 08:00:00,100 - ParkingLockServer - INFO - RECV FULL FRAME [0x80]: {login}\n"
+                    f"2026-10-18 08:00:00,150 - ParkingLockServer - INFO - SEND FULL FRAME [0x80]: {ack}\n"
+                    f"2026-10-18 08:00:01,000 - ParkingLockServer - INFO - RECV FULL FRAME [0x81]: {login[:-1]}\n"
+                    "2026-10-18 08:00:02,000 - ParkingLockServer - INFO - Server started\n")
+
+    frames, stats = dissect(path)
+    assert [(f.direction, f.command) for f in frames] == [("RECV", 0x80), ("SEND", 0x80)]
+    assert frames[0].serial == "0102030405060708"
+    assert frames[1].ts - frames[0].ts == pytest.approx(0.05, abs=1e-3)
+    assert stats.counters["bad_log_lines"] == 1  # 截断的十六进制行
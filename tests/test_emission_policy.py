@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""心跳推送策略：只有成功入队的推送才记入设备状态，入队失败的状态变化由下一个心跳重新推送"""
+
+from parking_lock_webhook import HeartbeatEmissionPolicy
+
+
+def heartbeat(device_status=1, car_status=2):
+    return {"serial_number": "0102030405060708", "device_status": device_status, "car_status": car_status,
+            "control_status": 0, "error_code": 0}
+
+
+def test_rejected_change_is_retried():
+    policy = HeartbeatEmissionPolicy(mode='change', keepalive_interval=60)
+    policy.commit(policy.decide(heartbeat(), now=0))
+
+    decision = policy.decide(heartbeat(device_status=2), now=1)
+    assert decision[0] == "change"
+    policy.reject(decision)
+
+    retry = policy.decide(heartbeat(device_status=2), now=2)
+    assert retry[0] == "change"
+    policy.commit(retry)
+    assert policy.decide(heartbeat(device_status=2), now=3) is None
+
+    stats = policy.get_stats()
+    assert stats["dropped"] == 1
+    assert stats["emitted_change"] == 1
+    assert stats["suppressed"] == 1
+
+
+def test_keepalive_uses_committed_time():
+    policy = HeartbeatEmissionPolicy(mode='change', keepalive_interval=10)
+    policy.commit(policy.decide(heartbeat(), now=0))
+    policy.reject(policy.decide(heartbeat(), now=10))
+    decision = policy.decide(heartbeat(), now=11)
+    assert decision[0] == "keepalive"
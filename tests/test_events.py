@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""设备事件推送：按设备和类型过滤、队列溢出通知、关闭慢订阅者和 SSE 输出"""
+
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from parking_lock_events import EventBroker, heartbeat_changes, stream_events
+
+SERIAL = bytes.fromhex("0102030405060708")
+OTHER = bytes.fromhex("1112131415161718")
+
+
+def decode(message):
+    """SSE 消息 -> 事件字典"""
+    lines = dict(line.split(": ", 1) for line in message.decode("utf-8").strip().split("\n"))
+    return json.loads(lines["data"])
+
+
+def test_publish_without_subscribers_is_a_no_op():
+    broker = EventBroker()
+    assert not broker.active
+    broker.publish("login", SERIAL, {})
+    assert next(broker.sequence) == 1  # 没有订阅者时不构建事件
+
+
+def test_subscribers_only_get_matching_events():
+    broker = EventBroker()
+    everything = broker.subscribe()
+    device = broker.subscribe(serials=[SERIAL])
+    logins = broker.subscribe(types=["login"])
+    broker.publish("login", SERIAL, {"address": "10.0.0.1"})
+    broker.publish("heartbeat", OTHER, {"changes": {}})
+
+    assert [decode(everything.get(0))["type"] for _ in range(2)] == ["login", "heartbeat"]
+    event = decode(device.get(0))
+    assert (event["serial"], event["data"]) == ("0102030405060708", {"address": "10.0.0.1"})
+    assert device.get(0) is None
+    assert decode(logins.get(0))["id"] == event["id"]
+    assert logins.get(0) is None
+
+
+def test_subscriber_limit():
+    broker = EventBroker(max_subscribers=1)
+    subscription = broker.subscribe()
+    with pytest.raises(RuntimeError):
+        broker.subscribe()
+    broker.unsubscribe(subscription)
+    assert subscription.closed
+    assert not broker.active
+    broker.subscribe()
+
+
+def test_overflow_is_reported_in_the_stream():
+    broker = EventBroker()
+    subscription = broker.subscribe(queue_size=2)
+    for i in range(3):
+        broker.publish("car_status", SERIAL, {"car_status": i})
+    assert broker.get_stats() == {"subscribers": 1, "queued": 2, "dropped": 1}
+
+    stream = stream_events(subscription, broker.unsubscribe, keepalive=0)
+    assert next(stream) == b"retry: 3000\n\n"
+    assert next(stream) == b'event: overflow\ndata: {"dropped": 1}\n\n'
+    assert decode(next(stream))["data"] == {"car_status": 0}
+    assert decode(next(stream))["data"] == {"car_status": 1}
+    assert next(stream) == b": keepalive\n\n"
+    stream.close()
+    assert not broker.active  # 客户端断开后退订
+
+
+def test_slow_subscriber_is_closed():
+    broker = EventBroker(slow_timeout=30)
+    subscription = broker.subscribe(queue_size=1)
+    broker.publish("login", SERIAL, {})
+    broker.publish("login", SERIAL, {})
+    assert not subscription.closed
+    subscription.full_since = time.monotonic() - 31  # 队列已经满了 31 秒
+    broker.publish("login", SERIAL, {})
+    assert subscription.closed
+
+    # 被关闭的订阅者的事件流立即结束并退订，客户端重连后重新拉取完整状态
+    assert list(stream_events(subscription, broker.unsubscribe, keepalive=0)) == [b"retry: 3000\n\n"]
+    assert not broker.active
+
+
+def test_heartbeat_changes():
+    fields = ("device_status", "car_status")
+    previous = SimpleNamespace(device_status=1, car_status=0)
+    current = SimpleNamespace(device_status=2, car_status=0)
+    assert heartbeat_changes(previous, current, fields) == {"device_status": [1, 2]}
+    assert heartbeat_changes(None, current, fields) == {"device_status": [None, 2], "car_status": [None, 0]}
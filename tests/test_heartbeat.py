@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""Heartbeat 记录：字段解析、旧版 21 键字典和字典式读取"""
+
+import pytest
+
+from parking_lock_server import Heartbeat, HEARTBEAT_STRUCT
+
+SERIAL = bytes.fromhex("0102030405060708")
+
+
+def heartbeat_payload(device_status=2, car_status=1, error_code=0x0005, control_status=None):
+    payload = HEARTBEAT_STRUCT.pack(SERIAL, 3, 0, 90, 25, 1234, 1, 121, device_status, car_status, error_code,
+                                    5000, 4000, 6000, 150, 50)
+    return payload if control_status is None else payload + bytes([control_status])
+
+
+def test_fields_are_parsed():
+    hb = Heartbeat(heartbeat_payload(control_status=2))
+    assert hb.serial_number == SERIAL
+    assert hb.flow_number == 1234
+    assert hb.battery_12v == 12.1
+    assert hb.device_status == 2
+    assert hb.control_status == 2
+    assert len(hb.error_descriptions) == 2
+
+
+def test_control_status_is_optional():
+    assert Heartbeat(heartbeat_payload()).control_status == 0
+
+
+def test_to_dict_has_the_legacy_keys():
+    data = Heartbeat(heartbeat_payload()).to_dict()
+    assert len(data) == 21
+    assert tuple(data) == Heartbeat.FIELDS
+    assert data["car_status_description"] == "有车"
+
+
+def test_mapping_access_only_accepts_fields():
+    hb = Heartbeat(heartbeat_payload())
+    assert hb["device_status"] == 2
+    assert hb.get("battery_12v") == 12.1
+    assert "car_status" in hb
+    for key in ("raw", "battery_12v_raw", "to_dict", "FIELDS", "__slots__"):
+        assert key not in hb
+        assert hb.get(key, "missing") == "missing"
+        with pytest.raises(KeyError):
+            hb[key]
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""心跳历史：跨分区查询、聚合、保留期删除分区和停止时关闭查询连接"""
+
+import time
+import sqlite3
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from parking_lock_history import DAY, HeartbeatHistory, partition_start, partition_table
+
+SERIAL = bytes.fromhex("0102030405060708")
+MIDNIGHT = partition_start("raw", time.time())  # 今天 UTC 零点，跨越它的数据落在两个分区
+
+
+def heartbeat(battery):
+    return SimpleNamespace(battery_12v=battery, battery_3_7v=3.7, signal_strength=20, current_frequency=433,
+                           device_status=1, car_status=0, error_code=0)
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = HeartbeatHistory(str(tmp_path / "history.db"), flush_interval=0.05)
+    history.start()
+    yield history
+    history.stop()
+
+
+def record_around_midnight(history):
+    """零点前后各 3 条心跳，间隔 20 秒，然后停止写线程使数据和聚合桶全部落盘"""
+    for i in range(-3, 3):
+        assert history.record(SERIAL, heartbeat(12.0 + i), MIDNIGHT + i * 20)
+    history.stop()
+
+
+def test_raw_query_spans_day_partitions(history):
+    record_around_midnight(history)
+    resolution, points = history.query(SERIAL, MIDNIGHT - 60, MIDNIGHT + 60, ["battery_12v"], "raw")
+    assert resolution == "raw"
+    assert [point["ts"] for point in points] == [MIDNIGHT + i * 20 for i in range(-3, 3)]
+    assert [point["battery_12v"] for point in points] == [9.0, 10.0, 11.0, 12.0, 13.0, 14.0]
+    assert history.query(bytes(8), MIDNIGHT - 60, MIDNIGHT + 60, resolution="raw")[1] == []
+    assert history.get_stats()["written"] == 6
+
+
+def test_minute_rollups(history):
+    record_around_midnight(history)
+    _, points = history.query(SERIAL, MIDNIGHT - 30, MIDNIGHT + 30, ["battery_12v"], "1m")
+    assert [(point["ts"], point["samples"]) for point in points] == [(MIDNIGHT - 60, 3), (MIDNIGHT, 3)]
+    assert points[0]["battery_12v"] == 10.0
+    assert (points[1]["battery_12v_min"], points[1]["battery_12v_max"]) == (12.0, 14.0)
+
+
+def test_retention_drops_whole_expired_partitions(history):
+    record_around_midnight(history)
+    history.retention["raw"] = DAY
+    connection = sqlite3.connect(history.path, isolation_level=None)
+    try:
+        # 当前时间刚过后一天的结束：前一天的分区整个过期，后一天的分区还有数据在保留期内
+        history._apply_retention(connection, MIDNIGHT + DAY + 1)
+        tables = {name for (name,) in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    finally:
+        connection.close()
+    assert partition_table("raw", MIDNIGHT - DAY) not in tables
+    assert partition_table("raw", MIDNIGHT) in tables
+    _, points = history.query(SERIAL, MIDNIGHT - 60, MIDNIGHT + 60, resolution="raw")
+    assert [point["ts"] for point in points] == [MIDNIGHT, MIDNIGHT + 20, MIDNIGHT + 40]
+
+
+def test_stop_closes_query_connections(history):
+    record_around_midnight(history)
+    history.query(SERIAL, MIDNIGHT - 60, MIDNIGHT + 60, resolution="raw")
+    thread = threading.Thread(target=history.query, args=(SERIAL, MIDNIGHT - 60, MIDNIGHT + 60),
+                              kwargs={"resolution": "raw"})
+    thread.start()
+    thread.join()
+    readers = list(history.readers)
+    assert len(readers) == 2
+
+    history.stop()
+    assert history.readers == []
+    for connection in readers:
+        with pytest.raises(sqlite3.ProgrammingError):
+            connection.execute("SELECT 1")
+    # 停止后再次查询会重新打开连接
+    assert len(history.query(SERIAL, MIDNIGHT - 60, MIDNIGHT + 60, resolution="raw")[1]) == 6
+    assert len(history.readers) == 1
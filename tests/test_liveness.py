@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""连接存活检测：登录超时、心跳超时、有活动时惰性重排，以及离线设备列表"""
+
+import time
+
+import pytest
+
+from parking_lock_liveness import LivenessMonitor
+from parking_lock_registry import DeviceEntry
+from parking_lock_timer_wheel import TimerWheel
+
+SERIAL = bytes.fromhex("0102030405060708")
+
+
+class FakeConnection:
+    def __init__(self, serial=None):
+        self.serial = serial
+        self.address = ("10.0.0.1", 5000)
+        self.last_seen = None
+        self.liveness_timer = None
+        self.close_reason = None
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def wheel():
+    return TimerWheel(tick=0.1, slots=8)
+
+
+@pytest.fixture
+def monitor(wheel):
+    return LivenessMonitor(wheel, device_timeout=0.5, login_timeout=0.2, max_offline=2)
+
+
+def run_ticks(wheel, count):
+    for _ in range(count):
+        wheel.advance()
+
+
+def test_connection_without_login_is_closed(monitor, wheel):
+    connection = FakeConnection()
+    monitor.watch(connection)
+    connection.last_seen -= 1  # 连接之后再也没有收到帧
+    run_ticks(wheel, 3)
+    assert connection.closed
+    assert connection.close_reason == "login_timeout"
+    assert connection.liveness_timer is None
+
+
+def test_activity_reschedules_instead_of_closing(monitor, wheel):
+    connection = FakeConnection(SERIAL)
+    monitor.watch(connection)
+    first = connection.liveness_timer
+    run_ticks(wheel, 3)  # 登录超时的检查到期，但连接刚刚有过活动
+    assert not connection.closed
+    assert connection.liveness_timer is not first
+
+    connection.last_seen = time.monotonic() - 1  # 超过 device_timeout 没有心跳
+    run_ticks(wheel, 8)
+    assert connection.closed
+    assert connection.close_reason == "heartbeat_timeout"
+
+
+def test_unwatch_cancels_the_check(monitor, wheel):
+    connection = FakeConnection()
+    monitor.watch(connection)
+    connection.last_seen -= 1
+    monitor.unwatch(connection)
+    run_ticks(wheel, 8)
+    assert not connection.closed
+
+
+def test_offline_list_is_bounded_and_most_recent_first(monitor):
+    entries = [DeviceEntry(bytes([i]) * 8, None, ("10.0.0.1", 5000 + i)) for i in range(3)]
+    for entry in entries:
+        monitor.mark_offline(entry, "heartbeat_timeout")
+    assert [record["serial"] for record in monitor.get_offline_devices()] == ["0202020202020202",
+                                                                              "0101010101010101"]
+    record = monitor.mark_offline(entries[1], "closed")
+    assert record["device_status"] is None
+    assert [r["serial"] for r in monitor.get_offline_devices()] == ["0101010101010101", "0202020202020202"]
+
+    monitor.mark_online(entries[1].serial)
+    assert len(monitor) == 1
+    assert monitor.get_offline_devices()[0]["reason"] == "heartbeat_timeout"
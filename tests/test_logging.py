@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""日志：帧日志采样、LOCK_LOG_SERIALS 解析和 JSON 格式"""
+
+import json
+import logging
+
+from parking_lock_logging import FrameLogSampler, JsonFormatter, parse_log_serials
+
+SERIAL = bytes.fromhex("0102030405060708")
+
+
+def test_sampler_allows_one_frame_per_key_per_interval():
+    sampler = FrameLogSampler(interval=60)
+    assert sampler.should_log(SERIAL, 0x81, "RECV")
+    assert not sampler.should_log(SERIAL, 0x81, "RECV")
+    assert sampler.should_log(SERIAL, 0x81, "SEND")
+    assert sampler.should_log(SERIAL, 0x80, "RECV")
+    assert sampler.suppressed == 1
+
+    sampler.last_logged[SERIAL][(0x81, "RECV")] -= 61
+    assert sampler.should_log(SERIAL, 0x81, "RECV")
+    sampler.forget(SERIAL)
+    assert sampler.should_log(SERIAL, 0x80, "RECV")
+
+
+def test_sampler_disabled():
+    sampler = FrameLogSampler(interval=0)
+    assert all(sampler.should_log(SERIAL, 0x81, "RECV") for _ in range(3))
+    assert sampler.last_logged == {}
+
+
+def test_parse_log_serials_skips_invalid_entries():
+    text = " 0102030405060708, ,zz,0102, 1112131415161718"
+    assert parse_log_serials(text) == {SERIAL, bytes.fromhex("1112131415161718")}
+    assert parse_log_serials("") == set()
+
+
+def test_json_formatter_includes_extra_fields():
+    record = logging.LogRecord("ParkingLockServer", logging.INFO, __file__, 1, "RECV FULL FRAME: %s", ("da00",), None)
+    record.serial = "0102030405060708"
+    record.command = "0x81"
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["msg"] == "RECV FULL FRAME: da00"
+    assert (entry["level"], entry["logger"]) == ("INFO", "ParkingLockServer")
+    assert (entry["serial"], entry["command"]) == ("0102030405060708", "0x81")
+    assert "direction" not in entry
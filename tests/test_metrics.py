@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""指标注册表：计数器/直方图、Prometheus 文本输出、多进程合并和分位数估计"""
+
+import pytest
+
+from parking_lock_metrics import (MetricsRegistry, counter_family, gauge_family, histogram_delta, histogram_quantile,
+                                 merge_metrics, render_metrics)
+
+
+@pytest.fixture
+def registry():
+    return MetricsRegistry()
+
+
+def test_registration_is_idempotent(registry):
+    counter = registry.counter("frames_total", "Frames", ("command",))
+    assert registry.counter("frames_total", "Frames", ("command",)) is counter
+    with pytest.raises(ValueError):
+        registry.gauge("frames_total", "Frames")
+
+
+def test_render_counter_and_gauge(registry):
+    frames = registry.counter("frames_total", "Frames received", ("command",))
+    frames.inc("0x81")
+    frames.inc("0x81", amount=2)
+    frames.inc("0x80")
+    registry.gauge("devices", "Connected devices").set(5)
+    assert render_metrics(registry.collect()) == (
+        "# HELP devices Connected devices\n"
+        "# TYPE devices gauge\n"
+        "devices 5\n"
+        "# HELP frames_total Frames received\n"
+        "# TYPE frames_total counter\n"
+        'frames_total{command="0x80"} 1\n'
+        'frames_total{command="0x81"} 3\n')
+
+
+def test_render_histogram_with_cumulative_buckets(registry):
+    latency = registry.histogram("latency_seconds", "Latency", ("status",), (0.1, 1))
+    for value in (0.05, 0.1, 0.5, 5):
+        latency.observe(value, "ok")
+    assert render_metrics(registry.collect()) == (
+        "# HELP latency_seconds Latency\n"
+        "# TYPE latency_seconds histogram\n"
+        'latency_seconds_bucket{status="ok",le="0.1"} 2\n'
+        'latency_seconds_bucket{status="ok",le="1.0"} 3\n'
+        'latency_seconds_bucket{status="ok",le="+Inf"} 4\n'
+        'latency_seconds_sum{status="ok"} 5.65\n'
+        'latency_seconds_count{status="ok"} 4\n')
+
+
+def test_label_values_are_escaped():
+    family = counter_family("errors_total", "Errors", {'say "hi"\n': 1}, label="message")
+    assert render_metrics([family]).splitlines()[-1] == 'errors_total{message="say \\"hi\\"\\n"} 1'
+
+
+def test_merge_adds_samples_from_each_process():
+    workers = []
+    for devices in (3, 4):
+        registry = MetricsRegistry()
+        registry.counter("frames_total", "Frames", ("command",)).inc("0x81", amount=devices)
+        registry.histogram("latency_seconds", "Latency", (), (1,)).observe(0.5)
+        workers.append(registry.collect() + [gauge_family("devices", "Devices", devices)])
+
+    merged = {family["name"]: family["samples"] for family in merge_metrics(workers)}
+    assert merged["frames_total"] == [[["0x81"], 7]]
+    assert merged["devices"] == [[[], 7]]
+    assert merged["latency_seconds"] == [[[], [[2, 0], 1.0]]]
+
+
+def test_histogram_delta_and_quantile(registry):
+    latency = registry.histogram("latency_seconds", "Latency", (), (0.1, 0.2))
+    latency.observe(0.05)
+    before = latency.collect()
+    for value in (0.15, 0.15, 0.15, 0.15):
+        latency.observe(value)
+    counts, total = histogram_delta(latency.collect(), before)[()]
+    assert counts == [0, 4, 0]
+    assert total == pytest.approx(0.6)
+    assert histogram_quantile(0.5, (0.1, 0.2), counts) == pytest.approx(0.15)
+    assert histogram_quantile(0.5, (0.1, 0.2), [0, 0, 3]) == 0.2  # 落在 +Inf 桶时只能给出下界
+    assert histogram_quantile(0.5, (0.1, 0.2), [0, 0, 0]) is None
+    assert histogram_delta(latency.collect(), latency.collect()) == {}
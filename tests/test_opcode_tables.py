@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""命令相关的表（流水号匹配、心跳目标状态、发件箱类别、批量命令名）从命令字表得出，运行时登记的命令字同样生效"""
+
+import struct
+
+import pytest
+
+from parking_lock_commands import CommandTracker
+from parking_lock_opcodes import OPCODES, OpcodeTable, Opcode, DOWNLINK, default_opcodes
+from parking_lock_outbox import outbox_kind
+from parking_lock_timer_wheel import TimerWheel
+
+SERIAL = bytes.fromhex("0102030405060708")
+
+
+@pytest.fixture
+def opcodes():
+    return default_opcodes()
+
+
+def test_flow_number_response_matches_by_flow(opcodes):
+    tracker = CommandTracker(TimerWheel(), opcodes)
+    first = tracker.register(SERIAL, 0x70)
+    second = tracker.register(SERIAL, 0x70)
+    payload = SERIAL + struct.pack("<I", second.flow_number) + b"\x01"
+    assert tracker.match_response(SERIAL, 0x70, payload)
+    assert second.future.done()
+    assert not first.future.done()
+
+
+def test_heartbeat_target_status(opcodes):
+    tracker = CommandTracker(TimerWheel(), opcodes)
+    opened = tracker.register(SERIAL, 0x70)
+    closed = tracker.register(SERIAL, 0x71)
+    tracker.match_heartbeat(SERIAL, {"device_status": opcodes.get(0x70).target_status, "control_status": 0})
+    assert opened.future.result(0)["status"] == "completed"
+    tracker.match_heartbeat(SERIAL, {"device_status": 9, "control_status": 0})
+    assert closed.future.result(0)["status"] == "failed"
+
+
+def test_registered_opcode_is_queued_and_named():
+    opcode = Opcode(0x72, "远程升降测试", DOWNLINK, '<8sI', ('serial', 'flow_number'),
+                    "handle_command_response", api_name="test_lift", outbox_kind="lift")
+    OPCODES.register(opcode)
+    try:
+        assert outbox_kind(0x72) == "lift"
+        assert OPCODES.named("test_lift") is opcode
+        assert opcode.serial_prefixed
+        assert opcode.flow_number
+    finally:
+        OPCODES.unregister(0x72)
+    assert outbox_kind(0x72) is None
+    assert OPCODES.named("test_lift") is None
+
+
+def test_named_only_finds_downlink():
+    table = OpcodeTable()
+    table.register(Opcode(0x80, "设备登录", api_name="login"))
+    assert table.named("login") is None
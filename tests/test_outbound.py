@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""设备连接下行写队列：空闲直写、高/低水位、无进展标记 degraded 和关闭"""
+
+import socket
+
+import pytest
+
+from parking_lock_outbound import OutboundWriter, SocketOutbound
+from parking_lock_timer_wheel import TimerWheel
+
+FRAME = b"\x5a" * 1000  # 不整除高水位，最后一帧使积压越过高水位
+
+
+@pytest.fixture
+def pair():
+    local, peer = socket.socketpair()
+    local.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    peer.setblocking(False)
+    yield local, peer
+    local.close()
+    peer.close()
+
+
+@pytest.fixture
+def wheel():
+    return TimerWheel(tick=0.1, slots=8)
+
+
+def outbound(sock, wheel, writer=None):
+    # 写线程未启动时 watch() 只登记变化，积压由测试调用 flush_ready() 写出
+    return SocketOutbound(sock, "peer", writer or OutboundWriter(), wheel,
+                          high_water=8192, low_water=2048, send_timeout=0.1)
+
+
+def fill(queue):
+    """一直写到被拒绝，返回接受的帧数"""
+    for count in range(10000):
+        if not queue.write(FRAME):
+            return count
+    raise AssertionError("send queue never became congested")
+
+
+def drain(peer):
+    received = 0
+    try:
+        while True:
+            chunk = peer.recv(65536)
+            if not chunk:
+                break
+            received += len(chunk)
+    except BlockingIOError:
+        pass
+    return received
+
+
+def test_idle_write_goes_straight_to_the_socket(pair, wheel):
+    local, peer = pair
+    queue = outbound(local, wheel)
+    assert queue.write(b"frame")
+    assert queue.pending() == 0
+    assert not queue.waiting
+    assert peer.recv(16) == b"frame"
+    assert wheel.pending() == 0
+
+
+def test_high_water_pauses_until_drained_below_low_water(pair, wheel):
+    local, peer = pair
+    queue = outbound(local, wheel)
+    accepted = fill(queue)
+    assert queue.paused
+    assert queue.pending() > queue.high_water
+    assert queue.waiting
+
+    received = 0
+    while not queue.flush_ready():
+        received += drain(peer)
+    received += drain(peer)
+    assert received == accepted * len(FRAME)
+    assert not queue.paused
+    assert queue.write(FRAME)
+
+
+def test_no_progress_marks_degraded_until_data_moves(pair, wheel):
+    local, peer = pair
+    queue = outbound(local, wheel)
+    fill(queue)
+    for _ in range(6):
+        wheel.advance()
+    assert queue.degraded
+    queue.paused = False  # 只剩 degraded 一个拒绝原因
+    assert not queue.write(FRAME)
+
+    while not queue.flush_ready():
+        drain(peer)
+    assert not queue.degraded
+    assert queue.stall_timer is None
+
+
+def test_writer_thread_flushes_the_backlog(pair, wheel):
+    local, peer = pair
+    writer = OutboundWriter()
+    writer.start()
+    try:
+        queue = outbound(local, wheel, writer)
+        accepted = fill(queue)
+        received = 0
+        peer.setblocking(True)
+        peer.settimeout(5)
+        while received < accepted * len(FRAME):
+            received += len(peer.recv(65536))
+    finally:
+        writer.stop()
+    assert queue.pending() == 0
+
+
+def test_closed_queue_drops_the_backlog(pair, wheel):
+    local, peer = pair
+    queue = outbound(local, wheel)
+    fill(queue)
+    queue.close()
+    assert queue.pending() == 0
+    assert not queue.waiting
+    with pytest.raises(ConnectionError):
+        queue.write(FRAME)
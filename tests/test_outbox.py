@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""离线设备命令发件箱：同类命令去重、有效期、总条数上限和登录时取出"""
+
+import time
+
+import pytest
+
+from parking_lock_outbox import CommandOutbox
+
+SERIAL = bytes.fromhex("0102030405060708")
+OTHER = bytes.fromhex("1112131415161718")
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    outbox = CommandOutbox(str(tmp_path / "outbox.db"))
+    outbox.start()
+    yield outbox
+    outbox.stop()
+
+
+def test_same_kind_replaces_queued_command(outbox):
+    opened = outbox.enqueue(SERIAL, 0x70, ttl=60, wait=True)
+    closed = outbox.enqueue(SERIAL, 0x71, ttl=60)  # 开锁和关锁同属 lock 类别
+    outbox.enqueue(SERIAL, 0x86, ttl=60)
+    assert opened.future.result(0)["status"] == "superseded"
+    assert [row["id"] for row in outbox.list_commands(SERIAL)][0] == closed.id
+    assert outbox.count() == 2
+    assert [command.command for command in outbox.take(SERIAL)] == [0x71, 0x86]
+    assert outbox.count() == 0
+
+
+def test_take_skips_devices_without_commands(outbox):
+    outbox.enqueue(SERIAL, 0x70, ttl=60)
+    assert outbox.has_pending(SERIAL)
+    assert not outbox.has_pending(OTHER)
+    assert outbox.take(OTHER) == []
+    assert len(outbox.take(SERIAL)) == 1
+    assert not outbox.has_pending(SERIAL)
+    assert outbox.take(SERIAL) == []
+
+
+def test_expired_commands_are_not_replayed(outbox):
+    queued = outbox.enqueue(SERIAL, 0x70, ttl=0.01, wait=True)
+    outbox.enqueue(SERIAL, 0x86, ttl=60)
+    time.sleep(0.02)
+    assert [command.command for command in outbox.take(SERIAL)] == [0x86]
+    assert queued.future.result(0)["status"] == "expired"
+
+
+def test_full_outbox_still_accepts_replacements(tmp_path):
+    outbox = CommandOutbox(str(tmp_path / "outbox.db"), max_commands=1)
+    outbox.start()
+    try:
+        assert outbox.enqueue(SERIAL, 0x70, ttl=60) is not None
+        assert outbox.enqueue(OTHER, 0x70, ttl=60) is None
+        assert outbox.enqueue(SERIAL, 0x71, ttl=60) is not None
+        assert [command.command for command in outbox.take(SERIAL)] == [0x71]
+    finally:
+        outbox.stop()
+
+
+def test_queue_survives_restart(tmp_path):
+    path = str(tmp_path / "outbox.db")
+    outbox = CommandOutbox(path)
+    outbox.start()
+    outbox.enqueue(SERIAL, 0x8E, state=1, ttl=60)
+    outbox.stop()
+
+    reopened = CommandOutbox(path)
+    reopened.start()
+    try:
+        assert reopened.has_pending(SERIAL)
+        assert [(command.command, command.state) for command in reopened.take(SERIAL)] == [(0x8E, 1)]
+    finally:
+        reopened.stop()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""分片设备登记表：登记/替换/按连接移除和写时复制发布"""
+
+import pytest
+
+from parking_lock_registry import DeviceRegistry
+
+SERIALS = [bytes([i]) * 8 for i in range(64)]
+
+
+def test_shard_count_must_be_a_power_of_two():
+    with pytest.raises(ValueError):
+        DeviceRegistry(shard_count=12)
+    assert len(DeviceRegistry(shard_count=1).shards) == 1
+
+
+def test_register_spreads_devices_over_shards():
+    registry = DeviceRegistry(shard_count=8)
+    for serial in SERIALS:
+        registry.register(serial, object(), ("10.0.0.1", 5000))
+    assert len(registry) == len(SERIALS)
+    assert sorted(entry.serial for entry in registry.snapshot()) == SERIALS
+    assert sum(1 for shard in registry.shards if shard.devices) > 1
+    assert SERIALS[5] in registry
+    assert b"\xff" * 8 not in registry
+
+
+def test_register_replaces_previous_connection():
+    registry = DeviceRegistry()
+    first, previous = registry.register(SERIALS[0], "old", ("10.0.0.1", 5000))
+    assert previous is None
+    second, previous = registry.register(SERIALS[0], "new", ("10.0.0.2", 5001))
+    assert previous is first
+    assert registry.get(SERIALS[0]) is second
+    assert len(registry) == 1
+
+
+def test_unregister_ignores_a_replaced_connection():
+    registry = DeviceRegistry()
+    registry.register(SERIALS[0], "old", None)
+    entry, _ = registry.register(SERIALS[0], "new", None)
+    # 旧连接的处理线程退出时不能把新连接的登记项移除
+    assert registry.unregister(SERIALS[0], "old") is None
+    assert registry.get(SERIALS[0]) is entry
+    assert registry.unregister(SERIALS[0], "new") is entry
+    assert registry.get(SERIALS[0]) is None
+    assert registry.unregister(SERIALS[0]) is None
+
+
+def test_published_dicts_are_never_mutated():
+    registry = DeviceRegistry(shard_count=1)
+    registry.register(SERIALS[0], None, None)
+    published = registry.shards[0].devices
+    registry.register(SERIALS[1], None, None)
+    registry.unregister(SERIALS[0])
+    # 读者拿到的旧字典保持不变，新的成员关系只出现在重新发布的字典中
+    assert list(published) == [SERIALS[0]]
+    assert list(registry.shards[0].devices) == [SERIALS[1]]
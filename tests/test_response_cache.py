@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""应答帧缓存：缓存的帧与 build_frame 逐字节一致，同一秒内复用同一个对象"""
+
+import random
+import struct
+
+from parking_lock_opcodes import default_opcodes
+from parking_lock_server import ParkingLockProtocol, ResponseFrameCache
+
+
+def test_ack_frames_match_build_frame():
+    cache = ResponseFrameCache()
+    for command in (0x87, 0x88, 0x89, 0x60):
+        assert cache.acks[command] == bytes(ParkingLockProtocol.build_frame(command, b"\x01"))
+        assert cache.ack(command) is cache.acks[command]
+
+
+def test_timestamped_frames_match_build_frame():
+    cache = ResponseFrameCache()
+    rng = random.Random(22)
+    for command in (0x80, 0x81):
+        for timestamp in [0, 0xFFFFFFFF] + [rng.getrandbits(32) for _ in range(500)]:
+            expected = bytes(ParkingLockProtocol.build_frame(command, struct.pack("<I", timestamp)))
+            assert cache.build_timestamped(command, timestamp) == expected
+
+
+def test_frame_is_reused_within_one_second():
+    cache = ResponseFrameCache()
+    frame = cache.timestamped(0x81, 1_700_000_000)
+    assert cache.timestamped(0x81, 1_700_000_000) is frame
+    assert cache.timestamped(0x80, 1_700_000_000) is not frame
+    assert cache.timestamped(0x81, 1_700_000_001) != frame
+
+
+def test_unknown_command_is_built_on_first_use():
+    cache = ResponseFrameCache(default_opcodes())
+    assert 0x72 not in cache.acks
+    assert cache.ack(0x72) == bytes(ParkingLockProtocol.build_frame(0x72, b"\x01"))
+    assert cache.timestamped(0x72, 5) == bytes(ParkingLockProtocol.build_frame(0x72, struct.pack("<I", 5)))
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""设备登记表快照：增量写出、重启后读回、槽位复用、max_age 和损坏记录"""
+
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from parking_lock_registry import DeviceRegistry
+from parking_lock_snapshot import HEADER, RECORD_SIZE, RegistrySnapshot
+
+SERIAL = bytes.fromhex("0102030405060708")
+OTHER = bytes.fromhex("1112131415161718")
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "registry.snap")
+
+
+def login(registry, serial, payload, host="10.0.0.1"):
+    entry, _ = registry.register(serial, None, (host, 5000))
+    entry.heartbeat = SimpleNamespace(raw=payload)
+    entry.last_heartbeat = time.time()
+    return entry
+
+
+def run(path, registry, entries=(), changed=()):
+    """启动快照，标记变化的设备，停止时写出"""
+    snapshot = RegistrySnapshot(path, interval=60)
+    snapshot.start(registry.get, entries)
+    for serial in changed:
+        snapshot.touch(serial)
+    snapshot.stop()
+    return snapshot
+
+
+def test_round_trip(path):
+    registry = DeviceRegistry()
+    entry = login(registry, SERIAL, b"heartbeat-1")
+    run(path, registry, changed=[SERIAL])
+
+    records = RegistrySnapshot(path).load()
+    assert records == [(SERIAL, ("10.0.0.1", 5000), entry.login_time, entry.last_heartbeat, b"heartbeat-1")]
+
+
+def test_only_the_latest_state_is_written(path):
+    registry = DeviceRegistry()
+    snapshot = RegistrySnapshot(path, interval=60)
+    snapshot.start(registry.get)
+    login(registry, SERIAL, b"first")
+    snapshot.touch(SERIAL)
+    registry.get(SERIAL).heartbeat.raw = b"second"
+    snapshot.touch(SERIAL)
+    assert snapshot.flush() == 1
+    snapshot.stop()
+    assert [record[4] for record in RegistrySnapshot(path).load()] == [b"second"]
+
+
+def test_disconnect_clears_and_reuses_the_slot(path):
+    registry = DeviceRegistry()
+    snapshot = RegistrySnapshot(path, interval=60)
+    snapshot.start(registry.get)
+    login(registry, SERIAL, b"serial")
+    snapshot.touch(SERIAL)
+    snapshot.flush()
+    registry.unregister(SERIAL)
+    snapshot.touch(SERIAL)
+    snapshot.flush()
+    assert RegistrySnapshot(path).load() == []
+
+    login(registry, OTHER, b"other")
+    snapshot.touch(OTHER)
+    snapshot.stop()
+    assert snapshot.slots == {OTHER: 0}
+    with open(path, "rb") as f:
+        assert len(f.read()) == HEADER.size + RECORD_SIZE
+    assert [record[0] for record in RegistrySnapshot(path).load()] == [OTHER]
+
+
+def test_load_skips_heartbeats_older_than_max_age(path):
+    registry = DeviceRegistry()
+    login(registry, SERIAL, b"fresh")
+    login(registry, OTHER, b"old").last_heartbeat = time.time() - 120
+    run(path, registry, changed=[SERIAL, OTHER])
+    assert [record[0] for record in RegistrySnapshot(path, max_age=60).load()] == [SERIAL]
+    assert len(RegistrySnapshot(path, max_age=3600).load()) == 2
+
+
+def test_load_skips_corrupted_records(path):
+    registry = DeviceRegistry()
+    login(registry, SERIAL, b"serial")
+    run(path, registry, changed=[SERIAL])
+    with open(path, "r+b") as f:
+        f.seek(HEADER.size + 20)
+        f.write(b"\xff")
+    assert RegistrySnapshot(path).load() == []
+
+
+def test_restart_carries_entries_over(path):
+    registry = DeviceRegistry()
+    entry = login(registry, SERIAL, b"serial")
+    run(path, registry, changed=[SERIAL])
+
+    # 重启：只保留传给 start() 的登记项，文件被紧凑重写
+    assert run(path, DeviceRegistry(), entries=[entry]).slots == {SERIAL: 0}
+    assert [record[4] for record in RegistrySnapshot(path).load()] == [b"serial"]
+    run(path, DeviceRegistry(), entries=[])
+    assert RegistrySnapshot(path).load() == []
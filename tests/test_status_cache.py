@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""设备状态快照缓存：版本号/ETag、只重新序列化变化的设备和移除"""
+
+import json
+
+import pytest
+
+from parking_lock_server import DeviceStatusCache, Heartbeat, HEARTBEAT_STRUCT
+
+SERIAL = bytes.fromhex("0102030405060708")
+OTHER = bytes.fromhex("1112131415161718")
+ADDRESS = ("10.0.0.1", 5000)
+
+
+def heartbeat(serial, device_status=1):
+    return Heartbeat(HEARTBEAT_STRUCT.pack(serial, 3, 0, 90, 25, 1, 1, 121, device_status, 0, 0,
+                                           5000, 4000, 6000, 150, 50))
+
+
+@pytest.fixture
+def cache():
+    cache = DeviceStatusCache()
+    cache.update(SERIAL, heartbeat(SERIAL), ADDRESS, 1000.0)
+    cache.update(OTHER, heartbeat(OTHER), ADDRESS, 1000.0, stale=True)
+    return cache
+
+
+def test_snapshot_body(cache):
+    _, body = cache.snapshot()
+    data = json.loads(body)
+    assert (data["success"], data["deviceCount"]) == (True, 2)
+    devices = {device["serialNumber"]: device for device in data["devices"]}
+    assert devices["0102030405060708"]["address"] == "10.0.0.1:5000"
+    assert devices["0102030405060708"]["lastHeartbeat"] == 1000.0
+    assert devices["1112131415161718"]["stale"] is True
+
+
+def test_unchanged_cache_returns_the_same_body(cache):
+    etag, body = cache.snapshot()
+    assert cache.snapshot() == (etag, body)
+    assert cache.snapshot()[1] is body
+    assert cache.etag == etag
+
+
+def test_update_only_reserializes_the_changed_device(cache):
+    etag, _ = cache.snapshot()
+    unchanged = cache.fragments[OTHER]
+    cache.update(SERIAL, heartbeat(SERIAL, device_status=2), ADDRESS, 1001.0)
+    assert SERIAL not in cache.fragments
+    new_etag, body = cache.snapshot()
+    assert new_etag != etag
+    assert cache.fragments[OTHER] is unchanged
+    devices = {device["serialNumber"]: device for device in json.loads(body)["devices"]}
+    assert devices["0102030405060708"]["deviceStatus"]["code"] == 2
+
+
+def test_remove(cache):
+    etag, _ = cache.snapshot()
+    cache.remove(OTHER)
+    cache.remove(OTHER)  # 已移除的设备不改变版本
+    assert cache.version == 3
+    new_etag, body = cache.snapshot()
+    assert new_etag != etag
+    assert json.loads(body)["deviceCount"] == 1
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""时间轮：定时项不早于请求的延迟触发，最多晚一个 tick；取消的定时项不触发"""
+
+import threading
+import time
+
+from parking_lock_timer_wheel import TimerWheel
+
+
+def advances_until_fired(wheel, delay, limit=10000):
+    fired = []
+    wheel.schedule(delay, fired.append, True)
+    for count in range(1, limit + 1):
+        wheel.advance()
+        if fired:
+            return count
+    return None
+
+
+def test_timer_fires_after_the_requested_ticks():
+    # 第一次 advance 在不到一个 tick 后发生，第 n 次在 (n-1, n] 个 tick 后，
+    # 因此 0.35 秒（向上取整为 4 个 tick）的定时项在第 5 次 advance 时触发
+    assert advances_until_fired(TimerWheel(tick=0.1, slots=16), 0.35) == 5
+    assert advances_until_fired(TimerWheel(tick=0.1, slots=16), 0.4) == 5
+    assert advances_until_fired(TimerWheel(tick=0.1, slots=16), 0) == 2
+
+
+def test_timer_longer_than_one_revolution():
+    assert advances_until_fired(TimerWheel(tick=1, slots=8), 8) == 9
+    assert advances_until_fired(TimerWheel(tick=1, slots=8), 20) == 21
+
+
+def test_timer_after_cursor_moved():
+    wheel = TimerWheel(tick=1, slots=8)
+    for _ in range(5):
+        wheel.advance()
+    assert advances_until_fired(wheel, 6) == 7
+
+
+def test_cancelled_timer_does_not_fire():
+    wheel = TimerWheel(tick=1, slots=8)
+    fired = []
+    timer = wheel.schedule(2, fired.append, True)
+    timer.cancel()
+    for _ in range(20):
+        wheel.advance()
+    assert fired == []
+    assert wheel.pending() == 0
+
+
+def test_timer_thread_never_fires_early():
+    wheel = TimerWheel(tick=0.01, slots=64)
+    wheel.start()
+    try:
+        done = threading.Event()
+        elapsed = []
+        started = time.monotonic()
+        wheel.schedule(0.05, lambda: (elapsed.append(time.monotonic() - started), done.set()))
+        assert done.wait(2)
+        assert elapsed[0] >= 0.05
+    finally:
+        wheel.stop()
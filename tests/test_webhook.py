@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Webhook 投递：逐条和批量发送、失败计数、队列满时丢弃"""
+
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from parking_lock_webhook import WebhookDispatcher
+
+
+class WebhookReceiver(ThreadingHTTPServer):
+    """记录收到的请求体，按 status 应答；release 未设置时请求一直挂起"""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.bodies = []
+        self.secrets = []
+        self.status = 202
+        self.release = threading.Event()
+        self.release.set()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/webhook/status-update"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.release.wait(5)
+        self.server.bodies.append(body)
+        self.server.secrets.append(self.headers["X-Webhook-Secret"])
+        self.send_response(self.server.status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def receiver():
+    receiver = WebhookReceiver()
+    thread = threading.Thread(target=receiver.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield receiver
+    receiver.release.set()
+    receiver.shutdown()
+    receiver.server_close()
+
+
+def dispatch(receiver, payloads, **kwargs):
+    dispatcher = WebhookDispatcher(receiver.url, "secret", **kwargs)
+    dispatcher.start()
+    for payload in payloads:
+        assert dispatcher.submit(payload)
+    dispatcher.stop()
+    return dispatcher.get_stats()
+
+
+def test_single_payloads_are_posted_as_objects(receiver):
+    stats = dispatch(receiver, [{"n": 1}, {"n": 2}], workers=1)
+    assert receiver.bodies == [{"n": 1}, {"n": 2}]
+    assert receiver.secrets == ["secret", "secret"]
+    assert (stats["enqueued"], stats["delivered"], stats["requests"]) == (2, 2, 2)
+
+
+def test_batches_are_posted_as_arrays(receiver):
+    stats = dispatch(receiver, [{"n": i} for i in range(5)], workers=1, batch_size=3, flush_interval=5)
+    # 满 3 条立即发送，其余的在停止时发送，不等 flush_interval
+    assert receiver.bodies == [[{"n": 0}, {"n": 1}, {"n": 2}], [{"n": 3}, {"n": 4}]]
+    assert (stats["delivered"], stats["requests"]) == (5, 2)
+
+
+def test_rejected_requests_are_counted_as_failed(receiver):
+    receiver.status = 500
+    stats = dispatch(receiver, [{"n": 1}, {"n": 2}], workers=1, batch_size=2, flush_interval=5)
+    assert (stats["delivered"], stats["failed"], stats["requests"]) == (0, 2, 1)
+
+
+def test_full_queue_drops_instead_of_blocking(receiver):
+    assert not WebhookDispatcher(receiver.url, "secret").submit({"n": 0})  # 未启动时不接受
+
+    receiver.release.clear()
+    dispatcher = WebhookDispatcher(receiver.url, "secret", queue_size=1, workers=1)
+    dispatcher.start()
+    try:
+        assert dispatcher.submit({"n": 1})
+        while dispatcher.queue.qsize():  # 等发送线程取走第一条并挂在请求上
+            time.sleep(0.01)
+        assert dispatcher.submit({"n": 2})
+        assert not dispatcher.submit({"n": 3})
+        stats = dispatcher.get_stats()
+        assert (stats["enqueued"], stats["dropped"], stats["high_watermark"]) == (2, 1, 1)
+    finally:
+        receiver.release.set()
+        dispatcher.stop()
+    assert receiver.bodies == [{"n": 1}, {"n": 2}]